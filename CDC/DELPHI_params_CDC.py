@@ -32,6 +32,19 @@ future_policies = [
 default_maxT_policies = datetime(2020, 11, 15)  # Maximum timespan of prediction under different policy scenarios
 future_times = [0, 7, 14, 28, 42]
 
+# States of the DELPHI model and reported outputs, each output being the sum of some of these states
+DELPHI_STATES = [
+    "S", "E", "I", "AR", "DHR", "DQR", "AD", "DHD", "DQD", "R", "D", "TH", "DVR", "DVD", "DD", "DT",
+]
+MAPPING_OUTPUT_TO_STATES = {
+    "Total Detected": ["DT"],
+    "Active": ["DHR", "DQR", "DHD", "DQD"],
+    "Active Hospitalized": ["DHR", "DHD"],
+    "Cumulative Hospitalized": ["TH"],
+    "Total Detected Deaths": ["DD"],
+    "Active Ventilated": ["DVR", "DVD"],
+}
+
 # Additional utils inputs
 TIME_DICT = {0: "Now", 7: "One Week", 14: "Two Weeks", 28: "Four Weeks", 42: "Six Weeks"}
 MAPPING_STATE_CODE_TO_STATE_NAME ={
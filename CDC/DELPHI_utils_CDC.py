@@ -6,8 +6,10 @@ from typing import Union
 from copy import deepcopy
 from itertools import compress
 import json
+from DELPHI_utils_V3_registry import DELPHIAreaRegistry
 from DELPHI_params_CDC import (TIME_DICT, MAPPING_STATE_CODE_TO_STATE_NAME, default_policy,
-                           default_policy_enaction_time, future_policies)
+                           default_policy_enaction_time, future_policies, DELPHI_STATES,
+                           MAPPING_OUTPUT_TO_STATES)
 
 
 class DELPHIDataSaver:
@@ -136,6 +138,10 @@ class DELPHIDataCreator:
         self.province = province
         self.testing_data_included = testing_data_included
 
+    def get_predicted_outputs(self) -> dict:
+        predicted_outputs = project_states_to_outputs(self.x_sol_final)
+        return {output: predicted_outputs[i, :].tolist() for i, output in enumerate(MAPPING_OUTPUT_TO_STATES.keys())}
+
     def create_dataset_parameters(self, mape) -> pd.DataFrame:
         if self.testing_data_included:
             print(f"Parameters dataset created without the testing data parameters" +
@@ -235,32 +241,17 @@ class DELPHIDataCreator:
             for i in range(n_days_since_today)
         ]
         # Predictions
-        total_detected = self.x_sol_final[15, :]  # DT
-        total_detected = [int(round(x, 0)) for x in total_detected]
-        active_cases = (
-                self.x_sol_final[4, :] + self.x_sol_final[5, :] + self.x_sol_final[7, :] + self.x_sol_final[8, :]
-        )  # DHR + DQR + DHD + DQD
-        active_cases = [int(round(x, 0)) for x in active_cases]
-        active_hospitalized = self.x_sol_final[4, :] + self.x_sol_final[7, :]  # DHR + DHD
-        active_hospitalized = [int(round(x, 0)) for x in active_hospitalized]
-        cumulative_hospitalized = self.x_sol_final[11, :]  # TH
-        cumulative_hospitalized = [int(round(x, 0)) for x in cumulative_hospitalized]
-        total_detected_deaths = self.x_sol_final[14, :]  # DD
-        total_detected_deaths = [int(round(x, 0)) for x in total_detected_deaths]
-        active_ventilated = self.x_sol_final[12, :] + self.x_sol_final[13, :]  # DVR + DVD
-        active_ventilated = [int(round(x, 0)) for x in active_ventilated]
+        dict_predicted_outputs = self.get_predicted_outputs()
         # Generation of the dataframe since today
         df_predictions_since_today_cont_country_prov = pd.DataFrame({
             "Continent": [self.continent for _ in range(n_days_since_today)],
             "Country": [self.country for _ in range(n_days_since_today)],
             "Province": [self.province for _ in range(n_days_since_today)],
             "Day": all_dates_since_today,
-            "Total Detected": total_detected[n_days_btw_today_since_100:],
-            "Active": active_cases[n_days_btw_today_since_100:],
-            "Active Hospitalized": active_hospitalized[n_days_btw_today_since_100:],
-            "Cumulative Hospitalized": cumulative_hospitalized[n_days_btw_today_since_100:],
-            "Total Detected Deaths": total_detected_deaths[n_days_btw_today_since_100:],
-            "Active Ventilated": active_ventilated[n_days_btw_today_since_100:],
+            **{
+                output: predicted_values[n_days_btw_today_since_100:]
+                for output, predicted_values in dict_predicted_outputs.items()
+            },
         })
 
         # Generation of the dataframe from the day since 100th case
@@ -273,12 +264,7 @@ class DELPHIDataCreator:
             "Country": [self.country for _ in range(len(all_dates_since_100))],
             "Province": [self.province for _ in range(len(all_dates_since_100))],
             "Day": all_dates_since_100,
-            "Total Detected": total_detected,
-            "Active": active_cases,
-            "Active Hospitalized": active_hospitalized,
-            "Cumulative Hospitalized": cumulative_hospitalized,
-            "Total Detected Deaths": total_detected_deaths,
-            "Active Ventilated": active_ventilated,
+            **dict_predicted_outputs,
         })
         return df_predictions_since_today_cont_country_prov, df_predictions_since_100_cont_country_prov
 
@@ -292,20 +278,7 @@ class DELPHIDataCreator:
             for i in range(n_days_since_today)
         ]
         # Predictions
-        total_detected = self.x_sol_final[15, :]  # DT
-        total_detected = [int(round(x, 0)) for x in total_detected]
-        active_cases = (
-                self.x_sol_final[4, :] + self.x_sol_final[5, :] + self.x_sol_final[7, :] + self.x_sol_final[8, :]
-        )  # DHR + DQR + DHD + DQD
-        active_cases = [int(round(x, 0)) for x in active_cases]
-        active_hospitalized = self.x_sol_final[4, :] + self.x_sol_final[7, :]  # DHR + DHD
-        active_hospitalized = [int(round(x, 0)) for x in active_hospitalized]
-        cumulative_hospitalized = self.x_sol_final[11, :]  # TH
-        cumulative_hospitalized = [int(round(x, 0)) for x in cumulative_hospitalized]
-        total_detected_deaths = self.x_sol_final[14, :]  # DD
-        total_detected_deaths = [int(round(x, 0)) for x in total_detected_deaths]
-        active_ventilated = self.x_sol_final[12, :] + self.x_sol_final[13, :]  # DVR + DVD
-        active_ventilated = [int(round(x, 0)) for x in active_ventilated]
+        dict_predicted_outputs = self.get_predicted_outputs()
         # Generation of the dataframe since today
         df_predictions_since_today_cont_country_prov = pd.DataFrame({
             "Policy": [policy for _ in range(n_days_since_today)],
@@ -314,12 +287,10 @@ class DELPHIDataCreator:
             "Country": [self.country for _ in range(n_days_since_today)],
             "Province": [self.province for _ in range(n_days_since_today)],
             "Day": all_dates_since_today,
-            "Total Detected": total_detected[n_days_btw_today_since_100:],
-            "Active": active_cases[n_days_btw_today_since_100:],
-            "Active Hospitalized": active_hospitalized[n_days_btw_today_since_100:],
-            "Cumulative Hospitalized": cumulative_hospitalized[n_days_btw_today_since_100:],
-            "Total Detected Deaths": total_detected_deaths[n_days_btw_today_since_100:],
-            "Active Ventilated": active_ventilated[n_days_btw_today_since_100:],
+            **{
+                output: predicted_values[n_days_btw_today_since_100:]
+                for output, predicted_values in dict_predicted_outputs.items()
+            },
         })
 
         # Generation of the dataframe from the day since 100th case
@@ -334,12 +305,7 @@ class DELPHIDataCreator:
             "Country": [self.country for _ in range(len(all_dates_since_100))],
             "Province": [self.province for _ in range(len(all_dates_since_100))],
             "Day": all_dates_since_100,
-            "Total Detected": total_detected,
-            "Active": active_cases,
-            "Active Hospitalized": active_hospitalized,
-            "Cumulative Hospitalized": cumulative_hospitalized,
-            "Total Detected Deaths": total_detected_deaths,
-            "Active Ventilated": active_ventilated,
+            **dict_predicted_outputs,
         })
         if totalcases is not None:  # Merging the historical values to both dataframes when available
             df_predictions_since_today_cont_country_prov = df_predictions_since_today_cont_country_prov.merge(
@@ -467,6 +433,30 @@ class DELPHIAggregationsPolicies:
         return df
 
 
+def get_output_projection_matrix(mapping_output_to_states=MAPPING_OUTPUT_TO_STATES):
+    """
+    :return: a (number of outputs x 16) matrix with 1 where a DELPHI state is summed into a reported output
+    """
+    projection_matrix = np.zeros((len(mapping_output_to_states), len(DELPHI_STATES)))
+    for i, states in enumerate(mapping_output_to_states.values()):
+        projection_matrix[i, [DELPHI_STATES.index(state) for state in states]] = 1
+    return projection_matrix
+
+
+OUTPUT_PROJECTION_MATRIX = get_output_projection_matrix()
+
+
+def project_states_to_outputs(x_sol, projection_matrix=OUTPUT_PROJECTION_MATRIX, rounded=True):
+    """
+    :param x_sol: array of shape (16 x days) or (areas x 16 x days)
+    :return: reported outputs of shape (outputs x days) or (areas x outputs x days)
+    """
+    predicted_outputs = np.matmul(projection_matrix, x_sol)
+    if rounded:
+        predicted_outputs = np.round(predicted_outputs, 0).astype(int)
+    return predicted_outputs
+
+
 def get_initial_conditions(params_fitted, global_params_fixed):
     alpha, days, r_s, r_dth, p_dth, r_dthdecay, k1, k2 = params_fitted[:8]
     N, PopulationCI, PopulationR, PopulationD, PopulationI, p_d, p_h, p_v = global_params_fixed
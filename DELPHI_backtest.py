@@ -1,71 +1,138 @@
 # Authors: Hamza Tazi Bouardi (htazi@mit.edu), Michael L. Li (mlli@mit.edu), Omar Skali Lami (oskali@mit.edu)
 import os
 import yaml
+import psutil
 import argparse
 import logging
+import logging.handlers
+import traceback
 import pandas as pd
+import multiprocessing as mp
 from datetime import datetime
+from functools import partial
 from DELPHI_utils_V3_static import DELPHIBacktest
 
-## Initializing Global Variables ##########################################################################
-with open("config.yml", "r") as ymlfile:
-    CONFIG = yaml.load(ymlfile, Loader=yaml.BaseLoader)
-CONFIG_FILEPATHS = CONFIG["filepaths"]
-parser = argparse.ArgumentParser()
-parser.add_argument(
-    '--user', '-u', type=str, required=True,
-    choices=["omar", "hamza", "michael", "michael2", "ali", "mohammad", "server", "saksham"],
-    help="Who is the user running? User needs to be referenced in config.yml for the filepaths (e.g. hamza, michael): "
-)
-parser.add_argument(
-    '--prediction_date', '-pd', type=str, required=True,
-    help="What prediction date would you like to backtest? Input format should be 'YYYY-MM-DD'"
-)
-parser.add_argument(
-    '--n_days', '-n_days', type=int, required=True,
-    help=(
-        "How many days of prediction do you want to backtest? (e.g. if prediction date is 2020-08-01 and you want " +
-        "to backtest until 2020-08-31 then input 30)"
-    )
-)
-parser.add_argument(
-    '--mse', '-mse', type=int, required=True, choices=[0, 1],
-    help="Generate Mean Squared Error as well? Reply 0 or 1 (for False or True)."
-)
-parser.add_argument(
-    '--mae', '-mae', type=int, required=True, choices=[0, 1],
-    help="Generate Mean Absolute Error as well? Reply 0 or 1 (for False or True)."
-)
-arguments = parser.parse_args()
-USER_RUNNING = arguments.user
-PREDICTION_DATE = arguments.prediction_date
-N_DAYS_BACKTEST = arguments.n_days
-GET_MSE = bool(arguments.mse)
-GET_MAE = bool(arguments.mae)
-PATH_TO_FOLDER_DANGER_MAP = CONFIG_FILEPATHS["danger_map"][USER_RUNNING]
-PATH_TO_DATA_SANDBOX = CONFIG_FILEPATHS["data_sandbox"][USER_RUNNING]
-assert USER_RUNNING in CONFIG_FILEPATHS["delphi_repo"].keys(), f"User {USER_RUNNING} not referenced in config.yml"
-if not os.path.exists(CONFIG_FILEPATHS["logs"][USER_RUNNING] + "model_fitting/"):
-    os.mkdir(CONFIG_FILEPATHS["logs"][USER_RUNNING] + "model_fitting/")
-
-logger_filename_date = "".join(
-    (str(datetime.now().date()) + f"_{datetime.now().hour}H{datetime.now().minute}M").split("-")
-)
-logger_filename = (
-        CONFIG_FILEPATHS["logs"][USER_RUNNING] +
-        f"backtest/{logger_filename_date}_delphi_backtest_prediction_date" +
-        f"_{PREDICTION_DATE}_n_days_{N_DAYS_BACKTEST}.log"
-)
-logging.basicConfig(
-    filename=logger_filename,
-    level=logging.DEBUG,
-    format="%(asctime)s | %(levelname)s | %(message)s",
-    datefmt="%m-%d-%Y %I:%M:%S %p",
-)
-logger = logging.getLogger("BacktestLogger")
+## Command line & run configuration ######################################################################
+def parse_arguments(args: list = None) -> argparse.Namespace:
+    """
+    Parses the command line arguments of the backtest, only called when running this file as a script
+    :param args: list of arguments to parse, None to parse sys.argv
+    :return: namespace with the user, prediction date, number of days and metrics flags of the backtest
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--user', '-u', type=str, required=True,
+        choices=["omar", "hamza", "michael", "michael2", "ali", "mohammad", "server", "saksham"],
+        help=(
+            "Who is the user running? User needs to be referenced in config.yml for the filepaths " +
+            "(e.g. hamza, michael): "
+        )
+    )
+    parser.add_argument(
+        '--prediction_date', '-pd', type=str, required=True,
+        help="What prediction date would you like to backtest? Input format should be 'YYYY-MM-DD'"
+    )
+    parser.add_argument(
+        '--n_days', '-n_days', type=int, required=True, nargs="+",
+        help=(
+            "How many days of prediction do you want to backtest? (e.g. if prediction date is 2020-08-01 and you " +
+            "want to backtest until 2020-08-31 then input 30). Several values (e.g. 7 14 28) run a sweep"
+        )
+    )
+    parser.add_argument(
+        '--prediction_date_end', '-pde', type=str, required=False, default=None,
+        help=(
+            "Last prediction date of a sweep, format 'YYYY-MM-DD': all the prediction dates between prediction_date " +
+            "and this one (every step_days days) with a prediction file are backtested"
+        )
+    )
+    parser.add_argument(
+        '--step_days', '-step', type=int, required=False, default=1,
+        help="Number of days between two prediction dates of a sweep (e.g. 7 for a weekly report)",
+    )
+    parser.add_argument(
+        '--mse', '-mse', type=int, required=True, choices=[0, 1],
+        help="Generate Mean Squared Error as well? Reply 0 or 1 (for False or True)."
+    )
+    parser.add_argument(
+        '--mae', '-mae', type=int, required=True, choices=[0, 1],
+        help="Generate Mean Absolute Error as well? Reply 0 or 1 (for False or True)."
+    )
+    return parser.parse_args(args)
 
-if __name__ == "__main__":
+
+def get_run_config(arguments: argparse.Namespace, path_config_file: str = "config.yml") -> dict:
+    """
+    Reads config.yml and gathers everything a backtest depends on
+    :param arguments: namespace returned by parse_arguments, or any object with the same attributes
+    :param path_config_file: path to the config.yml file with the filepaths of each user
+    :return: dictionary with the configuration of the backtest, to be passed to run
+    """
+    with open(path_config_file, "r") as ymlfile:
+        CONFIG = yaml.load(ymlfile, Loader=yaml.BaseLoader)
+    CONFIG_FILEPATHS = CONFIG["filepaths"]
+    USER_RUNNING = arguments.user
     assert USER_RUNNING in CONFIG_FILEPATHS["delphi_repo"].keys(), f"User {USER_RUNNING} not referenced in config.yml"
+    return {
+        "user_running": USER_RUNNING,
+        "prediction_date": arguments.prediction_date,
+        "list_n_days_backtest": sorted(set(arguments.n_days)),
+        "prediction_date_end": getattr(arguments, "prediction_date_end", None),
+        "step_days": getattr(arguments, "step_days", 1),
+        "get_mse": bool(arguments.mse),
+        "get_mae": bool(arguments.mae),
+        "path_to_folder_danger_map": CONFIG_FILEPATHS["danger_map"][USER_RUNNING],
+        "path_to_data_sandbox": CONFIG_FILEPATHS["data_sandbox"][USER_RUNNING],
+        "path_to_folder_logs": CONFIG_FILEPATHS["logs"][USER_RUNNING],
+    }
+#############################################################################################################
+
+
+def get_backtest_logger(path_to_folder_logs: str, prediction_date: str, n_days_backtest) -> logging.Logger:
+    """
+    Sets up the log file of a backtest in the backtest folder of the logs
+    :param path_to_folder_logs: path to the logs folder of the user
+    :param prediction_date: prediction date (or range of prediction dates) of the backtest, used in the filename
+    :param n_days_backtest: number of days (or horizons) of the backtest, used in the filename
+    :return: the logger of the backtest
+    """
+    logger_filename_date = "".join(
+        (str(datetime.now().date()) + f"_{datetime.now().hour}H{datetime.now().minute}M").split("-")
+    )
+    logger_filename = (
+            path_to_folder_logs +
+            f"backtest/{logger_filename_date}_delphi_backtest_prediction_date" +
+            f"_{prediction_date}_n_days_{n_days_backtest}.log"
+    )
+    logging.basicConfig(
+        filename=logger_filename,
+        level=logging.DEBUG,
+        format="%(asctime)s | %(levelname)s | %(message)s",
+        datefmt="%m-%d-%Y %I:%M:%S %p",
+    )
+    return logging.getLogger("BacktestLogger")
+
+
+def run(config: dict) -> pd.DataFrame:
+    """
+    Backtests the predictions made on the prediction date against the historical data of the following days, and
+    saves the metrics per area into data_sandbox/backtest_outputs
+    :param config: configuration of the backtest, as returned by get_run_config
+    :return: dataframe with the backtest metrics of each area
+    """
+    PREDICTION_DATE = config["prediction_date"]
+    N_DAYS_BACKTEST = config["list_n_days_backtest"][0]
+    GET_MSE = config["get_mse"]
+    GET_MAE = config["get_mae"]
+    PATH_TO_FOLDER_DANGER_MAP = config["path_to_folder_danger_map"]
+    PATH_TO_DATA_SANDBOX = config["path_to_data_sandbox"]
+    PATH_TO_FOLDER_LOGS = config["path_to_folder_logs"]
+    if not os.path.exists(PATH_TO_FOLDER_LOGS + "model_fitting/"):
+        os.mkdir(PATH_TO_FOLDER_LOGS + "model_fitting/")
+
+    logger = get_backtest_logger(
+        path_to_folder_logs=PATH_TO_FOLDER_LOGS, prediction_date=PREDICTION_DATE, n_days_backtest=N_DAYS_BACKTEST
+    )
     try:
         PREDICTION_DATE_DATETIME = pd.to_datetime(PREDICTION_DATE, format="%Y-%M-%d")
     except ValueError:
@@ -89,22 +156,196 @@ if __name__ == "__main__":
         df_historical=df_historical,
         df_prediction=df_prediction
     )
-    df_backtest = df_prediction.merge(
-        df_historical,
-        on=["Country", "Province", "Day"],
-    )
-    assert df_backtest.Day.min() == PREDICTION_DATE,\
-        f"Minimum date in backtest df is {df_backtest.Day.min()} and different from prediction date {PREDICTION_DATE}"
-    df_backtest["tuple_complete"] = list(zip(df_backtest.Continent, df_backtest.Country, df_backtest.Province))
-    dict_df_backtest_metrics = backtest_instance.generate_empty_metrics_dict()
-    for tuple_area in df_backtest.tuple_complete.unique():
-        logger.info(f"Computing backtest metrics for {tuple_area}")
-        dict_df_backtest_metrics = backtest_instance.get_backtest_metrics_area(
-            df_backtest=df_backtest, tuple_area=tuple_area, dict_df_backtest_metrics=dict_df_backtest_metrics,
-        )
+    df_backtest = backtest_instance.merge_prediction_historical(
+        df_prediction=df_prediction, df_historical=df_historical
+    )
+    assert df_backtest.Day.min() == pd.to_datetime(PREDICTION_DATE),\
+        f"Minimum date in backtest df is {df_backtest.Day.min().date()} and different from prediction date {PREDICTION_DATE}"
+    dict_df_backtest_metrics = backtest_instance.get_backtest_metrics_all_areas(df_backtest=df_backtest)
+    logger.info(f"Computed backtest metrics for {len(dict_df_backtest_metrics['tuple_area'])} areas")
 
     logger.info("Finished backtesting, saving file into data_sandbox/backtest_outputs")
     df_backtest_metrics = pd.DataFrame(dict_df_backtest_metrics).round(3)
     df_backtest_metrics.to_csv(
         PATH_TO_DATA_SANDBOX + f"backtest_outputs/backtest_pd_{PREDICTION_DATE}_n_days_{N_DAYS_BACKTEST}.csv", index=False
     )
+    return df_backtest_metrics
+
+
+def get_backtest_metrics_prediction_date(
+        prediction_date_: str,
+        list_n_days_backtest_: list,
+        df_historical_: pd.DataFrame,
+        path_to_folder_danger_map_: str,
+        get_mae_: bool,
+        get_mse_: bool,
+) -> (pd.DataFrame, list):
+    """
+    Backtests the predictions made on one prediction date for all the horizons of a sweep, this function is called
+    with multiprocessing: the log records of the worker are sent back to the parent, which writes them in the log file
+    of the sweep (the logging of the workers isn't configured when they are spawned)
+    :param prediction_date_: prediction date to backtest, format 'YYYY-MM-DD'
+    :param list_n_days_backtest_: list of the numbers of days (horizons) to backtest
+    :param df_historical_: historical data of all areas since the first prediction date of the sweep, read once
+    :param path_to_folder_danger_map_: path to the danger_map repository with the prediction files
+    :param get_mae_: compute the Mean Absolute Error as well?
+    :param get_mse_: compute the Mean Squared Error as well?
+    :return: a tuple with None if that date couldn't be backtested (e.g. no usable prediction file or an error),
+    otherwise a dataframe with the backtest metrics of each area for each feasible horizon, and the list of the
+    (level, message) log records of that date
+    """
+    logger = logging.getLogger(f"BacktestLogger.{prediction_date_}")
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    handler_records = logging.handlers.BufferingHandler(capacity=10 ** 6)
+    logger.addHandler(handler_records)
+    try:
+        df_backtest_metrics = get_backtest_metrics_prediction_date_logged(
+            prediction_date_=prediction_date_,
+            list_n_days_backtest_=list_n_days_backtest_,
+            df_historical_=df_historical_,
+            path_to_folder_danger_map_=path_to_folder_danger_map_,
+            get_mae_=get_mae_,
+            get_mse_=get_mse_,
+            logger=logger,
+        )
+    except Exception:
+        logger.error(f"Skipping prediction date {prediction_date_} after an error:\n{traceback.format_exc()}")
+        df_backtest_metrics = None
+    finally:
+        logger.removeHandler(handler_records)
+    list_log_records = [(record.levelno, record.getMessage()) for record in handler_records.buffer]
+    return df_backtest_metrics, list_log_records
+
+
+def get_backtest_metrics_prediction_date_logged(
+        prediction_date_: str,
+        list_n_days_backtest_: list,
+        df_historical_: pd.DataFrame,
+        path_to_folder_danger_map_: str,
+        get_mae_: bool,
+        get_mse_: bool,
+        logger: logging.Logger,
+) -> pd.DataFrame:
+    """
+    Backtests the predictions made on one prediction date for all the horizons of a sweep, cf.
+    get_backtest_metrics_prediction_date for the parameters other than the logger
+    :param logger: logger of that prediction date
+    :return: None if there is no usable prediction file on that date, otherwise a dataframe with the backtest metrics
+    of each area for each feasible horizon
+    """
+    backtest_instance = DELPHIBacktest(
+        path_to_folder_danger_map=path_to_folder_danger_map_,
+        prediction_date=prediction_date_,
+        n_days_backtest=max(list_n_days_backtest_),
+        get_mae=get_mae_,
+        get_mse=get_mse_,
+        logger=logger,
+    )
+    try:
+        df_prediction = backtest_instance.get_prediction_data()
+    except ValueError:
+        logger.info(f"Skipping prediction date {prediction_date_} as no prediction file is available")
+        return None
+    df_backtest = backtest_instance.merge_prediction_historical(
+        df_prediction=df_prediction,
+        df_historical=df_historical_[df_historical_.Day >= pd.to_datetime(prediction_date_)],
+    )
+    if len(df_backtest) == 0 or df_backtest.Day.min() != pd.to_datetime(prediction_date_):
+        logger.warning(f"Skipping prediction date {prediction_date_} as its predictions don't start on that date")
+        return None
+    list_df_backtest_metrics = []
+    for n_days_backtest in list_n_days_backtest_:
+        backtest_instance.n_days_backtest = n_days_backtest
+        try:
+            backtest_instance.get_feasibility_flag(df_historical=df_historical_, df_prediction=df_prediction)
+        except ValueError:
+            continue
+        list_df_backtest_metrics.append(
+            pd.DataFrame(backtest_instance.get_backtest_metrics_all_areas(df_backtest=df_backtest))
+        )
+    if len(list_df_backtest_metrics) == 0:
+        return None
+    return pd.concat(list_df_backtest_metrics)
+
+
+def run_sweep(config: dict) -> pd.DataFrame:
+    """
+    Backtests all the prediction dates between prediction_date and prediction_date_end for all the horizons in one
+    job: the historical data is read once, each prediction file once, and the prediction dates are backtested in
+    parallel. The (prediction date x horizon x area) metrics are saved in long format into
+    data_sandbox/backtest_outputs
+    :param config: configuration of the backtest, as returned by get_run_config
+    :return: dataframe with the backtest metrics of each area for each prediction date and horizon
+    """
+    PREDICTION_DATE = config["prediction_date"]
+    PREDICTION_DATE_END = (
+        config["prediction_date_end"] if config["prediction_date_end"] is not None else PREDICTION_DATE
+    )
+    LIST_N_DAYS_BACKTEST = config["list_n_days_backtest"]
+    PATH_TO_FOLDER_DANGER_MAP = config["path_to_folder_danger_map"]
+    PATH_TO_DATA_SANDBOX = config["path_to_data_sandbox"]
+    n_days_sweep = "-".join([str(n_days_backtest) for n_days_backtest in LIST_N_DAYS_BACKTEST])
+    logger = get_backtest_logger(
+        path_to_folder_logs=config["path_to_folder_logs"],
+        prediction_date=f"{PREDICTION_DATE}_{PREDICTION_DATE_END}",
+        n_days_backtest=n_days_sweep,
+    )
+    list_prediction_dates = [
+        str(prediction_date.date())
+        for prediction_date in pd.date_range(PREDICTION_DATE, PREDICTION_DATE_END, freq=f"{config['step_days']}D")
+    ]
+    logger.info(
+        f"Starting backtest sweep on {len(list_prediction_dates)} prediction dates from {PREDICTION_DATE} to " +
+        f"{PREDICTION_DATE_END} with horizons {LIST_N_DAYS_BACKTEST}. MSE flag is {config['get_mse']} and MAE flag " +
+        f"is {config['get_mae']}"
+    )
+    df_historical = DELPHIBacktest(
+        path_to_folder_danger_map=PATH_TO_FOLDER_DANGER_MAP,
+        prediction_date=PREDICTION_DATE,
+        n_days_backtest=max(LIST_N_DAYS_BACKTEST),
+        get_mae=config["get_mae"],
+        get_mse=config["get_mse"],
+        logger=logger,
+    ).get_historical_data_df()
+    get_backtest_metrics_prediction_date_partial = partial(
+        get_backtest_metrics_prediction_date,
+        list_n_days_backtest_=LIST_N_DAYS_BACKTEST,
+        df_historical_=df_historical,
+        path_to_folder_danger_map_=PATH_TO_FOLDER_DANGER_MAP,
+        get_mae_=config["get_mae"],
+        get_mse_=config["get_mse"],
+    )
+    n_cpu = min(psutil.cpu_count(logical=False), len(list_prediction_dates))
+    with mp.Pool(n_cpu) as pool:
+        list_results_prediction_dates = pool.map(get_backtest_metrics_prediction_date_partial, list_prediction_dates)
+    list_df_backtest_metrics = []
+    for df_backtest_metrics, list_log_records in list_results_prediction_dates:
+        for level, message in list_log_records:
+            logger.log(level, message)
+        if df_backtest_metrics is not None:
+            list_df_backtest_metrics.append(df_backtest_metrics)
+    if len(list_df_backtest_metrics) == 0:
+        error_message = f"No prediction date between {PREDICTION_DATE} and {PREDICTION_DATE_END} could be backtested"
+        logger.warning(error_message)
+        raise ValueError(error_message)
+
+    df_backtest_metrics = pd.concat(list_df_backtest_metrics).reset_index(drop=True).round(3)
+    logger.info(
+        f"Finished backtest sweep on {df_backtest_metrics.prediction_date.nunique()} prediction dates, saving file " +
+        "into data_sandbox/backtest_outputs"
+    )
+    df_backtest_metrics.to_csv(
+        PATH_TO_DATA_SANDBOX +
+        f"backtest_outputs/backtest_sweep_pd_{PREDICTION_DATE}_{PREDICTION_DATE_END}_n_days_{n_days_sweep}.csv",
+        index=False,
+    )
+    return df_backtest_metrics
+
+
+if __name__ == "__main__":
+    config = get_run_config(parse_arguments())
+    if config["prediction_date_end"] is not None or len(config["list_n_days_backtest"]) > 1:
+        run_sweep(config)
+    else:
+        run(config)
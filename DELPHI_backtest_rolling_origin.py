@@ -0,0 +1,346 @@
+# Authors: Hamza Tazi Bouardi (htazi@mit.edu), Michael L. Li (mlli@mit.edu), Omar Skali Lami (oskali@mit.edu)
+import os
+import yaml
+import psutil
+import argparse
+import logging
+import pandas as pd
+import numpy as np
+import multiprocessing as mp
+from datetime import datetime, timedelta
+from functools import partial
+from DELPHI_utils_V3_static import (
+    project_states_to_outputs, compute_mae_and_mape, compute_mse, read_dataframe_prefer_columnar,
+)
+from DELPHI_utils_V3_registry import DELPHIAreaRegistry
+from DELPHI_model_V3 import solve_and_predict_area
+from DELPHI_model_V3_with_policies import get_subname_parameters_file
+from DELPHI_params_V3 import MAPPING_OUTPUT_TO_STATES
+
+columns_parameters = [
+    "Continent", "Country", "Province", "Data Start Date", "MAPE", "Infection Rate", "Median Day of Action",
+    "Rate of Action", "Rate of Death", "Mortality Rate", "Rate of Mortality Rate Decay", "Internal Parameter 1",
+    "Internal Parameter 2", "Jump Magnitude", "Jump Time", "Jump Decay",
+]
+
+
+## Command line & run configuration ######################################################################
+def parse_arguments(args: list = None) -> argparse.Namespace:
+    """
+    Parses the command line arguments of the rolling-origin backtest, only called when running this file as a script
+    :param args: list of arguments to parse, None to parse sys.argv
+    :return: namespace with the user, optimizer, origin dates, horizons and metrics flags of the backtest
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--user', '-u', type=str, required=True,
+        choices=["omar", "hamza", "michael", "michael2", "ali", "mohammad", "server", "saksham"],
+        help=(
+            "Who is the user running? User needs to be referenced in config.yml for the filepaths " +
+            "(e.g. hamza, michael): "
+        )
+    )
+    parser.add_argument(
+        '--optimizer', '-o', type=str, required=True, choices=["tnc", "trust-constr", "annealing"],
+        help="Which optimizer among 'tnc', 'trust-constr' or 'annealing' would you like to use for the refits?",
+    )
+    parser.add_argument(
+        '--origin_start', '-os', type=str, required=True,
+        help="First origin date, i.e. last day of data of the first refit, format 'YYYY-MM-DD'",
+    )
+    parser.add_argument(
+        '--origin_end', '-oe', type=str, required=True,
+        help="Last origin date, format 'YYYY-MM-DD'",
+    )
+    parser.add_argument(
+        '--step_days', '-step', type=int, required=False, default=7,
+        help="Number of days between two origin dates",
+    )
+    parser.add_argument(
+        '--n_days', '-n_days', type=int, required=True, nargs="+",
+        help="Horizons (numbers of days after each origin date) on which the refits are scored, e.g. 7 14 28",
+    )
+    parser.add_argument(
+        '--mse', '-mse', type=int, required=True, choices=[0, 1],
+        help="Generate Mean Squared Error as well? Reply 0 or 1 (for False or True)."
+    )
+    parser.add_argument(
+        '--mae', '-mae', type=int, required=True, choices=[0, 1],
+        help="Generate Mean Absolute Error as well? Reply 0 or 1 (for False or True)."
+    )
+    parser.add_argument(
+        '--countries', '-c', type=str, required=False, default=None, nargs="+",
+        help="Only refit the areas of these countries (all areas by default)",
+    )
+    return parser.parse_args(args)
+
+
+def get_run_config(arguments: argparse.Namespace, path_config_file: str = "config.yml") -> dict:
+    """
+    Reads config.yml and gathers everything a rolling-origin backtest depends on
+    :param arguments: namespace returned by parse_arguments, or any object with the same attributes
+    :param path_config_file: path to the config.yml file with the filepaths of each user
+    :return: dictionary with the configuration of the backtest, to be passed to run
+    """
+    with open(path_config_file, "r") as ymlfile:
+        CONFIG = yaml.load(ymlfile, Loader=yaml.BaseLoader)
+    CONFIG_FILEPATHS = CONFIG["filepaths"]
+    USER_RUNNING = arguments.user
+    assert USER_RUNNING in CONFIG_FILEPATHS["delphi_repo"].keys(), f"User {USER_RUNNING} not referenced in config.yml"
+    return {
+        "user_running": USER_RUNNING,
+        "optimizer": arguments.optimizer,
+        "list_origin_dates": [
+            str(origin_date.date()) for origin_date in pd.date_range(
+                arguments.origin_start, arguments.origin_end, freq=f"{arguments.step_days}D"
+            )
+        ],
+        "list_n_days_backtest": sorted(set(arguments.n_days)),
+        "get_mse": bool(arguments.mse),
+        "get_mae": bool(arguments.mae),
+        "list_countries": arguments.countries,
+        "path_to_folder_danger_map": CONFIG_FILEPATHS["danger_map"][USER_RUNNING],
+        "path_to_data_sandbox": CONFIG_FILEPATHS["data_sandbox"][USER_RUNNING],
+        "path_to_folder_logs": CONFIG_FILEPATHS["logs"][USER_RUNNING],
+    }
+#############################################################################################################
+
+
+def get_path_cached_fit(path_to_folder_cache: str, tuple_area: tuple, origin_date: str, optimizer: str) -> str:
+    """
+    :param path_to_folder_cache: folder where the refits are cached
+    :param tuple_area: tuple corresponding to (continent, country, province)
+    :param origin_date: last day of data of the refit, format 'YYYY-MM-DD'
+    :param optimizer: optimizer used for the refit
+    :return: path of the cached refit of that area, origin date and optimizer
+    """
+    continent, country, province = tuple_area
+    return (
+        path_to_folder_cache
+        + f"{optimizer}/{origin_date}/{country.replace(' ', '_')}_{province.replace(' ', '_')}.npz"
+    )
+
+
+def save_cached_fit(path_cached_fit: str, fit: dict) -> None:
+    """
+    Saves a refit (fitted parameters and predicted cases & deaths) so that scoring more horizons doesn't refit
+    :param path_cached_fit: path returned by get_path_cached_fit
+    :param fit: dictionary with the parameters line, date with 100 cases and predicted cases & deaths of the refit
+    """
+    os.makedirs(os.path.dirname(path_cached_fit), exist_ok=True)
+    path_cached_fit_temp = path_cached_fit + ".tmp"
+    with open(path_cached_fit_temp, "wb") as file_cached_fit:
+        np.savez(
+            file_cached_fit,
+            best_params=np.asarray(fit["parameters_line"][5:], dtype=float),
+            mape=np.float64(fit["parameters_line"][4]),
+            date_day_since100=np.str_(str(fit["date_day_since100"].date())),
+            total_detected=fit["total_detected"],
+            total_detected_deaths=fit["total_detected_deaths"],
+        )
+    os.replace(path_cached_fit_temp, path_cached_fit)
+
+
+def read_cached_fit(path_cached_fit: str, tuple_area: tuple):
+    """
+    :param path_cached_fit: path returned by get_path_cached_fit
+    :param tuple_area: tuple corresponding to (continent, country, province)
+    :return: the refit in the format of save_cached_fit, or None if it hasn't been cached yet
+    """
+    if not os.path.exists(path_cached_fit):
+        return None
+    with np.load(path_cached_fit) as cached_fit:
+        date_day_since100 = pd.to_datetime(str(cached_fit["date_day_since100"]))
+        return {
+            "parameters_line": [
+                *tuple_area, date_day_since100, float(cached_fit["mape"]), *cached_fit["best_params"].tolist()
+            ],
+            "date_day_since100": date_day_since100,
+            "total_detected": cached_fit["total_detected"],
+            "total_detected_deaths": cached_fit["total_detected_deaths"],
+        }
+
+
+def refit_and_score_area_rolling_origin(
+        tuple_area_: tuple,
+        list_origin_dates_: list,
+        list_n_days_backtest_: list,
+        area_registry_: DELPHIAreaRegistry,
+        optimizer_: str,
+        path_to_folder_danger_map_: str,
+        path_to_folder_cache_: str,
+) -> list:
+    """
+    Refits an area as of each origin date with the data up to that date only, each refit being warm-started from the
+    parameters of the previous origin date, then scores each refit out-of-sample on all the horizons; this function
+    is called with multiprocessing (one area per task, the origin dates of an area being sequential)
+    :param tuple_area_: tuple corresponding to (continent, country, province)
+    :param list_origin_dates_: sorted list of origin dates, format 'YYYY-MM-DD'
+    :param list_n_days_backtest_: list of horizons in days after each origin date
+    :param area_registry_: population of all areas and parameters from the day before the first origin date (used as a
+    starting point for the first refit)
+    :param optimizer_: optimizer used for the refits, among 'tnc', 'trust-constr' or 'annealing'
+    :param path_to_folder_danger_map_: path to the danger_map repository with the processed case files
+    :param path_to_folder_cache_: folder where the refits are cached, keyed by (area, origin date, optimizer)
+    :return: list of dictionaries with the backtest metrics of that area for each origin date and feasible horizon
+    """
+    continent, country, province = tuple_area_
+    path_cases = (
+        path_to_folder_danger_map_
+        + f"processed/Global/Cases_{country.replace(' ', '_')}_{province.replace(' ', '_')}.csv"
+    )
+    if not os.path.exists(path_cases):
+        return []
+    totalcases = pd.read_csv(path_cases, usecols=["date", "case_cnt", "death_cnt"])
+    dict_cases = dict(zip(pd.to_datetime(totalcases.date), zip(totalcases.case_cnt, totalcases.death_cnt)))
+    past_parameters_line = area_registry_.get_past_parameters_line(country, province)
+    list_metrics_area = []
+    for origin_date in list_origin_dates_:
+        path_cached_fit = get_path_cached_fit(path_to_folder_cache_, tuple_area_, origin_date, optimizer_)
+        fit = read_cached_fit(path_cached_fit, tuple_area_)
+        if fit is None:
+            area_registry_origin = DELPHIAreaRegistry(
+                popcountries=area_registry_.popcountries,
+                past_parameters=(
+                    pd.DataFrame([past_parameters_line], columns=columns_parameters)
+                    if past_parameters_line is not None else None
+                ),
+            )
+            # The model keeps the data up to the day after yesterday_, i.e. up to the origin date
+            result_area = solve_and_predict_area(
+                tuple_area_=tuple_area_,
+                area_index_=0,
+                totalcases_=None,
+                yesterday_="".join(str((pd.to_datetime(origin_date) - timedelta(days=1)).date()).split("-")),
+                area_registry_=area_registry_origin,
+                optimizer_=optimizer_,
+                path_to_folder_danger_map_=path_to_folder_danger_map_,
+            )
+            if result_area is None:
+                continue
+            predicted_outputs = project_states_to_outputs(result_area.trajectory)
+            list_outputs = list(MAPPING_OUTPUT_TO_STATES.keys())
+            fit = {
+                "parameters_line": [
+                    continent, country, province, result_area.date_day_since100, result_area.mape,
+                    *result_area.best_params.tolist(),
+                ],
+                "date_day_since100": result_area.date_day_since100,
+                "total_detected": predicted_outputs[list_outputs.index("Total Detected"), :],
+                "total_detected_deaths": predicted_outputs[list_outputs.index("Total Detected Deaths"), :],
+            }
+            save_cached_fit(path_cached_fit, fit)
+        past_parameters_line = fit["parameters_line"]
+        n_days_origin_since_100 = (pd.to_datetime(origin_date) - fit["date_day_since100"]).days
+        for n_days_backtest in list_n_days_backtest_:
+            days_backtest = [pd.to_datetime(origin_date) + timedelta(days=i) for i in range(1, n_days_backtest + 1)]
+            index_end = n_days_origin_since_100 + n_days_backtest + 1
+            if not all([day in dict_cases for day in days_backtest]) or index_end > len(fit["total_detected"]):
+                continue
+            cases_true, deaths_true = zip(*[dict_cases[day] for day in days_backtest])
+            cases_pred = fit["total_detected"][n_days_origin_since_100 + 1:index_end]
+            deaths_pred = fit["total_detected_deaths"][n_days_origin_since_100 + 1:index_end]
+            mae_cases, mape_cases = compute_mae_and_mape(y_true=list(cases_true), y_pred=cases_pred.tolist())
+            mae_deaths, mape_deaths = compute_mae_and_mape(y_true=list(deaths_true), y_pred=deaths_pred.tolist())
+            list_metrics_area.append({
+                "origin_date": origin_date,
+                "n_days_backtest": n_days_backtest,
+                "tuple_area": tuple_area_,
+                "mape_cases": mape_cases,
+                "mape_deaths": mape_deaths,
+                "mae_cases": mae_cases,
+                "mae_deaths": mae_deaths,
+                "mse_cases": compute_mse(y_true=list(cases_true), y_pred=cases_pred.tolist()),
+                "mse_deaths": compute_mse(y_true=list(deaths_true), y_pred=deaths_pred.tolist()),
+            })
+    return list_metrics_area
+
+
+def run(config: dict) -> pd.DataFrame:
+    """
+    Rolling-origin backtest of DELPHI V3: refits all areas as of each origin date in a process pool and saves the
+    out-of-sample metrics of each (origin date, horizon, area) into data_sandbox/backtest_outputs
+    :param config: configuration of the backtest, as returned by get_run_config
+    :return: dataframe with the backtest metrics of each area for each origin date and horizon
+    """
+    OPTIMIZER = config["optimizer"]
+    LIST_ORIGIN_DATES = config["list_origin_dates"]
+    LIST_N_DAYS_BACKTEST = config["list_n_days_backtest"]
+    PATH_TO_FOLDER_DANGER_MAP = config["path_to_folder_danger_map"]
+    PATH_TO_DATA_SANDBOX = config["path_to_data_sandbox"]
+    PATH_TO_FOLDER_LOGS = config["path_to_folder_logs"]
+    n_days_backtest_str = "-".join([str(n_days_backtest) for n_days_backtest in LIST_N_DAYS_BACKTEST])
+    if not os.path.exists(PATH_TO_FOLDER_LOGS + "backtest/"):
+        os.mkdir(PATH_TO_FOLDER_LOGS + "backtest/")
+    logger_filename_date = "".join(
+        (str(datetime.now().date()) + f"_{datetime.now().hour}H{datetime.now().minute}M").split("-")
+    )
+    logging.basicConfig(
+        filename=(
+            PATH_TO_FOLDER_LOGS + f"backtest/{logger_filename_date}_delphi_backtest_rolling_origin" +
+            f"_{LIST_ORIGIN_DATES[0]}_{LIST_ORIGIN_DATES[-1]}_n_days_{n_days_backtest_str}_{OPTIMIZER}.log"
+        ),
+        level=logging.DEBUG,
+        format="%(asctime)s | %(levelname)s | %(message)s",
+        datefmt="%m-%d-%Y %I:%M:%S %p",
+    )
+    # The first refit of each area is warm-started from the parameters fitted with the same optimizer the day before
+    # the first origin date
+    day_before_first_origin = "".join(
+        str((pd.to_datetime(LIST_ORIGIN_DATES[0]) - timedelta(days=1)).date()).split("-")
+    )
+    area_registry = DELPHIAreaRegistry.from_files(
+        path_population_file=PATH_TO_FOLDER_DANGER_MAP + f"processed/Global/Population_Global.csv",
+        path_past_parameters_file=(
+            PATH_TO_FOLDER_DANGER_MAP
+            + f"predicted/Parameters_{get_subname_parameters_file(OPTIMIZER)}_{day_before_first_origin}.csv"
+        ),
+        read_past_parameters=read_dataframe_prefer_columnar,
+    )
+    list_tuples = area_registry.get_list_tuples_areas()
+    if config["list_countries"] is not None:
+        list_tuples = [tuple_area for tuple_area in list_tuples if tuple_area[1] in config["list_countries"]]
+    logging.info(
+        f"Starting rolling-origin backtest of {len(list_tuples)} areas on {len(LIST_ORIGIN_DATES)} origin dates from " +
+        f"{LIST_ORIGIN_DATES[0]} to {LIST_ORIGIN_DATES[-1]} with horizons {LIST_N_DAYS_BACKTEST} and optimizer " +
+        f"{OPTIMIZER}"
+    )
+    refit_and_score_area_rolling_origin_partial = partial(
+        refit_and_score_area_rolling_origin,
+        list_origin_dates_=LIST_ORIGIN_DATES,
+        list_n_days_backtest_=LIST_N_DAYS_BACKTEST,
+        area_registry_=area_registry,
+        optimizer_=OPTIMIZER,
+        path_to_folder_danger_map_=PATH_TO_FOLDER_DANGER_MAP,
+        path_to_folder_cache_=PATH_TO_DATA_SANDBOX + "backtest_outputs/rolling_origin_fits/",
+    )
+    n_cpu = psutil.cpu_count(logical=False)
+    with mp.Pool(n_cpu) as pool:
+        list_metrics_areas = pool.map(refit_and_score_area_rolling_origin_partial, list_tuples, chunksize=1)
+    df_backtest_metrics = pd.DataFrame(
+        [metrics_area for list_metrics_area in list_metrics_areas for metrics_area in list_metrics_area]
+    )
+    if len(df_backtest_metrics) == 0:
+        error_message = "No area could be refitted and scored on these origin dates and horizons"
+        logging.warning(error_message)
+        raise ValueError(error_message)
+
+    columns_metrics = ["origin_date", "n_days_backtest", "tuple_area", "mape_cases", "mape_deaths"]
+    if config["get_mae"]:
+        columns_metrics.extend(["mae_cases", "mae_deaths"])
+    if config["get_mse"]:
+        columns_metrics.extend(["mse_cases", "mse_deaths"])
+    df_backtest_metrics = df_backtest_metrics.sort_values(
+        ["origin_date", "n_days_backtest"], kind="stable"
+    )[columns_metrics].reset_index(drop=True).round(3)
+    logging.info("Finished rolling-origin backtest, saving file into data_sandbox/backtest_outputs")
+    df_backtest_metrics.to_csv(
+        PATH_TO_DATA_SANDBOX + f"backtest_outputs/backtest_rolling_origin_{LIST_ORIGIN_DATES[0]}_" +
+        f"{LIST_ORIGIN_DATES[-1]}_n_days_{n_days_backtest_str}_{OPTIMIZER}.csv",
+        index=False,
+    )
+    return df_backtest_metrics
+
+
+if __name__ == "__main__":
+    run(get_run_config(parse_arguments()))
@@ -11,14 +11,18 @@ import multiprocessing as mp
 from scipy.integrate import solve_ivp
 from scipy.optimize import minimize
 from datetime import datetime, timedelta
-from functools import partial
+from functools import partial, lru_cache
+from typing import Union
 from tqdm import tqdm_notebook as tqdm
 from scipy.optimize import dual_annealing
 from DELPHI_utils_V3_static import (
-    DELPHIDataCreator, DELPHIAggregations, DELPHIDataSaver, get_initial_conditions,
-    get_mape_data_fitting, create_fitting_data_from_validcases, get_residuals_value
+    DELPHIAreaResult, DELPHITrajectoryBuffer, DELPHIAggregations, DELPHIDataSaver, DELPHIPastPredictionsIndex,
+    DELPHIFittingTelemetry, DELPHICaseStore,
+    get_initial_conditions, get_mape_data_fitting, create_fitting_data_from_validcases, get_residuals_value,
+    read_dataframe_prefer_columnar, compact_dataframe, shared_memory,
 )
-from DELPHI_utils_V3_dynamic import get_bounds_params_from_pastparams
+from DELPHI_utils_V3_dynamic import get_bounds_params_from_pastparams, get_bounds_params_from_pastparams_all_areas
+from DELPHI_utils_V3_registry import DELPHIAreaRegistry
 from DELPHI_params_V3 import (
     default_parameter_list,
     dict_default_reinit_parameters,
@@ -44,116 +48,200 @@ from DELPHI_params_V3 import (
     DetectD,
     VentilatedD,
     default_maxT,
+    date_earliest_day_since100,
     p_v,
     p_d,
     p_h,
     max_iter,
+    max_size_residuals_cache,
 )
 
-## Initializing Global Variables ##########################################################################
-with open("config.yml", "r") as ymlfile:
-    CONFIG = yaml.load(ymlfile, Loader=yaml.BaseLoader)
-CONFIG_FILEPATHS = CONFIG["filepaths"]
-time_beginning = time.time()
-yesterday = "".join(str(datetime.now().date() - timedelta(days=1)).split("-"))
-yesterday_logs_filename = "".join(
-    (str(datetime.now().date() - timedelta(days=1)) + f"_{datetime.now().hour}H{datetime.now().minute}M").split("-")
-)
-parser = argparse.ArgumentParser()
-parser.add_argument(
-    '--user', '-u', type=str, required=True,
-    choices=["omar", "hamza", "michael", "michael2", "ali", "mohammad", "server", "saksham"],
-    help="Who is the user running? User needs to be referenced in config.yml for the filepaths (e.g. hamza, michael): "
-)
-parser.add_argument(
-    '--optimizer', '-o', type=str, required=True, choices=["tnc", "trust-constr", "annealing"],
-    help=(
-            "Which optimizer among 'tnc', 'trust-constr' or 'annealing' would you like to use ? " +
-            "Note that 'tnc' and 'trust-constr' lead to local optima, while 'annealing' is a " +
-            "method for global optimization: "
+## Command line & run configuration ######################################################################
+def parse_arguments(args: list = None) -> argparse.Namespace:
+    """
+    Parses the command line arguments of DELPHI V3, only called when running this file as a script
+    :param args: list of arguments to parse, None to parse sys.argv
+    :return: namespace with the user, optimizer and the saving flags of the run
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--user', '-u', type=str, required=True,
+        choices=["omar", "hamza", "michael", "michael2", "ali", "mohammad", "server", "saksham"],
+        help=(
+            "Who is the user running? User needs to be referenced in config.yml for the filepaths " +
+            "(e.g. hamza, michael): "
+        )
     )
-)
-parser.add_argument(
-    '--confidence_intervals', '-ci', type=int, required=True, choices=[0, 1],
-    help="Generate Confidence Intervals? Reply 0 or 1 for False or True.",
-)
-parser.add_argument(
-    '--since100case', '-s100', type=int, required=True, choices=[0, 1],
-    help="Save all history (since 100 cases)? Reply 0 or 1 for False or True.",
-)
-parser.add_argument(
-    '--website', '-w', type=int, required=True, choices=[0, 1],
-    help="Save to website? Reply 0 or 1 for False or True.",
-)
-arguments = parser.parse_args()
-USER_RUNNING = arguments.user
-OPTIMIZER = arguments.optimizer
-GET_CONFIDENCE_INTERVALS = bool(arguments.confidence_intervals)
-SAVE_TO_WEBSITE = bool(arguments.website)
-SAVE_SINCE100_CASES = bool(arguments.since100case)
-PATH_TO_FOLDER_DANGER_MAP = CONFIG_FILEPATHS["danger_map"][USER_RUNNING]
-PATH_TO_WEBSITE_PREDICTED = CONFIG_FILEPATHS["website"][USER_RUNNING]
-past_prediction_date = "".join(str(datetime.now().date() - timedelta(days=14)).split("-"))
+    parser.add_argument(
+        '--optimizer', '-o', type=str, required=True, choices=["tnc", "trust-constr", "annealing"],
+        help=(
+                "Which optimizer among 'tnc', 'trust-constr' or 'annealing' would you like to use ? " +
+                "Note that 'tnc' and 'trust-constr' lead to local optima, while 'annealing' is a " +
+                "method for global optimization: "
+        )
+    )
+    parser.add_argument(
+        '--confidence_intervals', '-ci', type=int, required=True, choices=[0, 1],
+        help="Generate Confidence Intervals? Reply 0 or 1 for False or True.",
+    )
+    parser.add_argument(
+        '--since100case', '-s100', type=int, required=True, choices=[0, 1],
+        help="Save all history (since 100 cases)? Reply 0 or 1 for False or True.",
+    )
+    parser.add_argument(
+        '--website', '-w', type=int, required=True, choices=[0, 1],
+        help="Save to website? Reply 0 or 1 for False or True.",
+    )
+    parser.add_argument(
+        '--shards', '-sh', type=int, required=False, default=0, choices=[0, 1],
+        help="Also save the predictions as one JSON file per country with an index? Reply 0 or 1 for False or True.",
+    )
+    return parser.parse_args(args)
+
+
+def get_run_config(arguments: argparse.Namespace, path_config_file: str = "config.yml") -> dict:
+    """
+    Reads config.yml and gathers everything a run of DELPHI V3 depends on, dates being computed when this is called
+    :param arguments: namespace returned by parse_arguments, or any object with the same attributes
+    :param path_config_file: path to the config.yml file with the filepaths of each user
+    :return: dictionary with the configuration of the run, to be passed to run
+    """
+    with open(path_config_file, "r") as ymlfile:
+        CONFIG = yaml.load(ymlfile, Loader=yaml.BaseLoader)
+    CONFIG_FILEPATHS = CONFIG["filepaths"]
+    USER_RUNNING = arguments.user
+    assert USER_RUNNING in CONFIG_FILEPATHS["delphi_repo"].keys(), f"User {USER_RUNNING} not referenced in config.yml"
+    return {
+        "user_running": USER_RUNNING,
+        "optimizer": arguments.optimizer,
+        "get_confidence_intervals": bool(arguments.confidence_intervals),
+        "save_to_website": bool(arguments.website),
+        "save_shards": bool(getattr(arguments, "shards", 0)),
+        "save_since100_cases": bool(arguments.since100case),
+        "path_to_folder_danger_map": CONFIG_FILEPATHS["danger_map"][USER_RUNNING],
+        "path_to_website_predicted": CONFIG_FILEPATHS["website"][USER_RUNNING],
+        "path_to_folder_logs": CONFIG_FILEPATHS["logs"][USER_RUNNING],
+        "yesterday": "".join(str(datetime.now().date() - timedelta(days=1)).split("-")),
+        "yesterday_logs_filename": "".join(
+            (
+                str(datetime.now().date() - timedelta(days=1)) + f"_{datetime.now().hour}H{datetime.now().minute}M"
+            ).split("-")
+        ),
+        "past_prediction_date": "".join(str(datetime.now().date() - timedelta(days=14)).split("-")),
+    }
 #############################################################################################################
 
+def get_bounds_params_areas(list_tuples_areas: list, area_registry: DELPHIAreaRegistry, optimizer: str) -> dict:
+    """
+    Computes the bounds of the parameters of all the areas with past parameters at once, in the parent process
+    :param list_tuples_areas: list of the (continent, country, province) areas fitted in this run
+    :param area_registry: population and parameters from yesterday of all areas
+    :param optimizer: optimizer used for the fitting, among 'tnc', 'trust-constr' or 'annealing'
+    :return: dictionary {(country, province): bounds} for the areas with past parameters, the bounds being a tuple of
+    11 (lower, upper) tuples as expected by the optimizers
+    """
+    list_areas = [
+        (country, province) for _, country, province in list_tuples_areas
+        if area_registry.has_past_parameters(country, province)
+    ]
+    array_bounds_params = get_bounds_params_from_pastparams_all_areas(
+        optimizer=optimizer,
+        array_parameters=area_registry.get_past_parameters_array(list_areas),
+        dict_default_reinit_parameters=dict_default_reinit_parameters,
+        percentage_drift_lower_bound=percentage_drift_lower_bound,
+        default_lower_bound=default_lower_bound,
+        dict_default_reinit_lower_bounds=dict_default_reinit_lower_bounds,
+        percentage_drift_upper_bound=percentage_drift_upper_bound,
+        default_upper_bound=default_upper_bound,
+        dict_default_reinit_upper_bounds=dict_default_reinit_upper_bounds,
+        percentage_drift_lower_bound_annealing=percentage_drift_lower_bound_annealing,
+        default_lower_bound_annealing=default_lower_bound_annealing,
+        percentage_drift_upper_bound_annealing=percentage_drift_upper_bound_annealing,
+        default_upper_bound_annealing=default_upper_bound_annealing,
+        default_lower_bound_jump=default_lower_bound_jump,
+        default_upper_bound_jump=default_upper_bound_jump,
+        default_lower_bound_std_normal=default_lower_bound_std_normal,
+        default_upper_bound_std_normal=default_upper_bound_std_normal,
+    )
+    return {
+        area: tuple(tuple(bounds_param) for bounds_param in bounds_params_area)
+        for area, bounds_params_area in zip(list_areas, array_bounds_params.tolist())
+    }
+
+
 def solve_and_predict_area(
         tuple_area_: tuple,
+        area_index_: int,
+        totalcases_: Union[pd.DataFrame, None],
         yesterday_: str,
-        past_parameters_: pd.DataFrame,
-        popcountries: pd.DataFrame,
+        area_registry_: DELPHIAreaRegistry,
+        optimizer_: str,
+        path_to_folder_danger_map_: str,
+        trajectory_buffer_name_: str = None,
+        trajectory_buffer_shape_: tuple = None,
+        dict_bounds_params_: dict = None,
 ):
     """
     Parallelizable version of the fitting & solving process for DELPHI V3, this function is called with multiprocessing
     :param tuple_area_: tuple corresponding to (continent, country, province)
+    :param area_index_: index of tuple_area_ in the list of areas fitted in this run, i.e. its slot in the trajectory
+    buffer
+    :param totalcases_: case data of the area read by the parent (cf. DELPHICaseStore.read_cases_per_area), if None
+    it is read from the processed case file of the area
     :param yesterday_: string corresponding to the date from which the model will read the previous parameters. The
     format has to be 'YYYYMMDD'
-    :param past_parameters_: Parameters from yesterday_ used as a starting point for the fitting process
-    :return: either None if can't optimize (either less than 100 cases or less than 7 days with 100 cases) or a tuple
-    with 3 dataframes related to that tuple_area_ (parameters df, predictions since yesterday_+1, predictions since
-    first day with 100 cases) and a scipy.optimize object (OptimizeResult) that contains the predictions for all
-    16 states of the model (and some other information that isn't used)
+    :param area_registry_: population and parameters from yesterday_ (used as a starting point for the fitting process)
+    of all areas
+    :param optimizer_: optimizer used for the fitting, among 'tnc', 'trust-constr' or 'annealing'
+    :param path_to_folder_danger_map_: path to the danger_map repository with the processed case files
+    :param trajectory_buffer_name_: name of the shared DELPHITrajectoryBuffer where the trajectory is written, if None
+    the trajectory is sent back in the result
+    :param trajectory_buffer_shape_: shape (n_areas, 16, n_days) of the shared DELPHITrajectoryBuffer
+    :param dict_bounds_params_: bounds of the parameters of the areas with past parameters computed by the parent, cf.
+    get_bounds_params_areas, if None (or if tuple_area_ isn't in it) they are computed here
+    :return: either None if can't optimize (either less than 100 cases or less than 7 days with 100 cases) or a
+    DELPHIAreaResult with the fitted parameters, loss, status & timings of that tuple_area_, from which the parent
+    creates the parameters & predictions datasets
     """
     time_entering = time.time()
     continent, country, province = tuple_area_
     country_sub = country.replace(" ", "_")
     province_sub = province.replace(" ", "_")
-    if os.path.exists(PATH_TO_FOLDER_DANGER_MAP + f"processed/Global/Cases_{country_sub}_{province_sub}.csv"):
-        totalcases = pd.read_csv(
-            PATH_TO_FOLDER_DANGER_MAP + f"processed/Global/Cases_{country_sub}_{province_sub}.csv"
-        )
+    path_case_file = path_to_folder_danger_map_ + f"processed/Global/Cases_{country_sub}_{province_sub}.csv"
+    if (totalcases_ is not None) or os.path.exists(path_case_file):
+        totalcases = totalcases_ if totalcases_ is not None else pd.read_csv(path_case_file)
         if totalcases.day_since100.max() < 0:
             logging.warning(
                 f"Not enough cases (less than 100) for Continent={continent}, Country={country} and Province={province}"
             )
             return None
 
-        if past_parameters_ is not None:
-            parameter_list_total = past_parameters_[
-                (past_parameters_.Country == country)
-                & (past_parameters_.Province == province)
-            ].reset_index(drop=True)
-            if len(parameter_list_total) > 0:
-                parameter_list_line = parameter_list_total.iloc[-1, :].values.tolist()
+        if area_registry_.past_parameters is not None:
+            if area_registry_.has_past_parameters(country, province):
+                parameter_list_line = area_registry_.get_past_parameters_line(country, province)
                 parameter_list = parameter_list_line[5:]
-                bounds_params = get_bounds_params_from_pastparams(
-                    optimizer=OPTIMIZER,
-                    parameter_list=parameter_list,
-                    dict_default_reinit_parameters=dict_default_reinit_parameters,
-                    percentage_drift_lower_bound=percentage_drift_lower_bound,
-                    default_lower_bound=default_lower_bound,
-                    dict_default_reinit_lower_bounds=dict_default_reinit_lower_bounds,
-                    percentage_drift_upper_bound=percentage_drift_upper_bound,
-                    default_upper_bound=default_upper_bound,
-                    dict_default_reinit_upper_bounds=dict_default_reinit_upper_bounds,
-                    percentage_drift_lower_bound_annealing=percentage_drift_lower_bound_annealing,
-                    default_lower_bound_annealing=default_lower_bound_annealing,
-                    percentage_drift_upper_bound_annealing=percentage_drift_upper_bound_annealing,
-                    default_upper_bound_annealing=default_upper_bound_annealing,
-                    default_lower_bound_jump=default_lower_bound_jump,
-                    default_upper_bound_jump=default_upper_bound_jump,
-                    default_lower_bound_std_normal=default_lower_bound_std_normal,
-                    default_upper_bound_std_normal=default_upper_bound_std_normal,
-                )
+                if (dict_bounds_params_ is not None) and ((country, province) in dict_bounds_params_):
+                    bounds_params = dict_bounds_params_[(country, province)]
+                else:
+                    bounds_params = get_bounds_params_from_pastparams(
+                        optimizer=optimizer_,
+                        parameter_list=parameter_list,
+                        dict_default_reinit_parameters=dict_default_reinit_parameters,
+                        percentage_drift_lower_bound=percentage_drift_lower_bound,
+                        default_lower_bound=default_lower_bound,
+                        dict_default_reinit_lower_bounds=dict_default_reinit_lower_bounds,
+                        percentage_drift_upper_bound=percentage_drift_upper_bound,
+                        default_upper_bound=default_upper_bound,
+                        dict_default_reinit_upper_bounds=dict_default_reinit_upper_bounds,
+                        percentage_drift_lower_bound_annealing=percentage_drift_lower_bound_annealing,
+                        default_lower_bound_annealing=default_lower_bound_annealing,
+                        percentage_drift_upper_bound_annealing=percentage_drift_upper_bound_annealing,
+                        default_upper_bound_annealing=default_upper_bound_annealing,
+                        default_lower_bound_jump=default_lower_bound_jump,
+                        default_upper_bound_jump=default_upper_bound_jump,
+                        default_lower_bound_std_normal=default_lower_bound_std_normal,
+                        default_upper_bound_std_normal=default_upper_bound_std_normal,
+                    )
                 date_day_since100 = pd.to_datetime(parameter_list_line[3])
                 validcases = totalcases[
                     (totalcases.day_since100 >= 0)
@@ -186,9 +274,7 @@ def solve_and_predict_area(
             )
             return None
         else:
-            PopulationT = popcountries[
-                (popcountries.Country == country) & (popcountries.Province == province)
-            ].pop2016.iloc[-1]
+            PopulationT = area_registry_.get_population(country, province)
             N = PopulationT
             PopulationI = validcases.loc[0, "case_cnt"]
             PopulationR = validcases.loc[0, "death_cnt"] * 5
@@ -210,6 +296,9 @@ def solve_and_predict_area(
             maxT = (default_maxT - date_day_since100).days + 1
             t_cases = validcases["day_since100"].tolist() - validcases.loc[0, "day_since100"]
             balance, cases_data_fit, deaths_data_fit = create_fitting_data_from_validcases(validcases)
+            time_reading_data = time.time() - time_entering
+            # Telemetry of the fitting, the calls & cache hits of the loss function being read from its cache
+            dict_telemetry_counters = {"n_rhs_evaluations": 0, "time_ode": 0}
             GLOBAL_PARAMS_FIXED = (N, PopulationCI, PopulationR, PopulationD, PopulationI, p_d, p_h, p_v)
 
             def model_covid(
@@ -272,7 +361,9 @@ def solve_and_predict_area(
                     dDQDdt, dRdt, dDdt, dTHdt, dDVRdt, dDVDdt, dDDdt, dDTdt,
                 ]
 
-            def residuals_totalcases(params) -> float:
+            # Optimizers can evaluate the loss function twice at a point, so its last points are memoized
+            @lru_cache(maxsize=max_size_residuals_cache)
+            def residuals_totalcases_cached(params: tuple) -> float:
                 """
                 Function that makes sure the parameters are in the right range during the fitting process and computes
                 the loss function depending on the optimizer that has been chosen for this run as a global variable
@@ -298,16 +389,20 @@ def solve_and_predict_area(
                 x_0_cases = get_initial_conditions(
                     params_fitted=params, global_params_fixed=GLOBAL_PARAMS_FIXED
                 )
-                x_sol = solve_ivp(
+                time_entering_ode = time.time()
+                output_ode = solve_ivp(
                     fun=model_covid,
                     y0=x_0_cases,
                     t_span=[t_cases[0], t_cases[-1]],
                     t_eval=t_cases,
                     args=tuple(params),
-                ).y
+                )
+                dict_telemetry_counters["time_ode"] += time.time() - time_entering_ode
+                dict_telemetry_counters["n_rhs_evaluations"] += output_ode.nfev
+                x_sol = output_ode.y
                 weights = list(range(1, len(cases_data_fit) + 1))
                 residuals_value = get_residuals_value(
-                    optimizer=OPTIMIZER,
+                    optimizer=optimizer_,
                     balance=balance,
                     x_sol=x_sol,
                     cases_data_fit=cases_data_fit,
@@ -316,27 +411,36 @@ def solve_and_predict_area(
                 )
                 return residuals_value
 
-            if OPTIMIZER in ["tnc", "trust-constr"]:
+            def residuals_totalcases(params) -> float:
+                return residuals_totalcases_cached(tuple(params))
+
+            # Past parameters are bounded after being re-initialized, so the starting point is brought back in the bounds
+            parameter_list = np.clip(
+                parameter_list, [bound[0] for bound in bounds_params], [bound[1] for bound in bounds_params]
+            )
+            time_entering_fitting = time.time()
+            if optimizer_ in ["tnc", "trust-constr"]:
                 output = minimize(
                     residuals_totalcases,
                     parameter_list,
-                    method=OPTIMIZER,
+                    method=optimizer_,
                     bounds=bounds_params,
                     options={"maxiter": max_iter},
                 )
-            elif OPTIMIZER == "annealing":
+            elif optimizer_ == "annealing":
                 output = dual_annealing(
                     residuals_totalcases, x0=parameter_list, bounds=bounds_params
                 )
             else:
                 raise ValueError("Optimizer not in 'tnc', 'trust-constr' or 'annealing' so not supported")
 
+            time_fitting = time.time() - time_entering_fitting
             best_params = output.x
             t_predictions = [i for i in range(maxT)]
 
             def solve_best_params_and_predict(optimal_params):
                 # Variables Initialization for the ODE system
-                if OPTIMIZER in ["tnc", "trust-constr"]:
+                if optimizer_ in ["tnc", "trust-constr"]:
                     alpha, days, r_s, r_dth, p_dth, r_dthdecay, k1, k2, jump, t_jump, std_normal = optimal_params
                     optimal_params = [
                         max(alpha, dict_default_reinit_parameters["alpha"]),
@@ -355,52 +459,79 @@ def solve_and_predict_area(
                     params_fitted=optimal_params,
                     global_params_fixed=GLOBAL_PARAMS_FIXED,
                 )
-                x_sol_best = solve_ivp(
+                output_ode_best = solve_ivp(
                     fun=model_covid,
                     y0=x_0_cases,
                     t_span=[t_predictions[0], t_predictions[-1]],
                     t_eval=t_predictions,
                     args=tuple(optimal_params),
-                ).y
-                return x_sol_best
+                )
+                dict_telemetry_counters["n_rhs_evaluations"] += output_ode_best.nfev
+                return output_ode_best.y
 
+            time_entering_prediction = time.time()
             x_sol_final = solve_best_params_and_predict(best_params)
-            data_creator = DELPHIDataCreator(
-                x_sol_final=x_sol_final,
-                date_day_since100=date_day_since100,
-                best_params=best_params,
-                continent=continent,
-                country=country,
-                province=province,
-                testing_data_included=False,
-            )
+            time_prediction = time.time() - time_entering_prediction
             mape_data = get_mape_data_fitting(
                 cases_data_fit=cases_data_fit, deaths_data_fit=deaths_data_fit, x_sol_final=x_sol_final
             )
             logging.info(f"In-Sample MAPE Last 15 Days {country, province}: {round(mape_data, 3)} %")
             logging.debug(f"Best fitted parameters for {country, province}: {best_params}")
-            df_parameters_area = data_creator.create_dataset_parameters(mape_data)
-            # Creating the datasets for predictions of this area
-            if GET_CONFIDENCE_INTERVALS:
-               df_predictions_since_today_area, df_predictions_since_100_area = (
-                   data_creator.create_datasets_with_confidence_intervals(
-                       cases_data_fit, deaths_data_fit,
-                       past_prediction_file=PATH_TO_FOLDER_DANGER_MAP + f"predicted/Global_V2_{past_prediction_date}.csv",
-                       past_prediction_date=str(pd.to_datetime(past_prediction_date).date()))
-               )
-            else:
-                df_predictions_since_today_area, df_predictions_since_100_area = data_creator.create_datasets_predictions()
-
+            trajectory_written = False
+            if trajectory_buffer_name_ is not None:
+                n_areas, n_states, n_days = trajectory_buffer_shape_
+                trajectory_buffer = DELPHITrajectoryBuffer(
+                    n_areas=n_areas, n_days=n_days, n_states=n_states, name=trajectory_buffer_name_
+                )
+                trajectory_written = trajectory_buffer.write(area_index_, x_sol_final)
+                trajectory_buffer.close()
             logging.info(
                 f"Finished predicting for Continent={continent}, Country={country} and Province={province} in "
                 + f"{round(time.time() - time_entering, 2)} seconds"
             )
             logging.info("--------------------------------------------------------------------------------------------")
-            return (
-                df_parameters_area,
-                df_predictions_since_today_area,
-                df_predictions_since_100_area,
-                output,
+            time_total = time.time() - time_entering
+            info_residuals_cache = residuals_totalcases_cached.cache_info()
+            telemetry = {
+                "continent": continent,
+                "country": country,
+                "province": province,
+                "optimizer": optimizer_,
+                "solver_method": "RK45",
+                "worker_id": os.getpid(),
+                "n_iterations": int(getattr(output, "nit", -1)),
+                "n_residuals_calls": info_residuals_cache.hits + info_residuals_cache.misses,
+                "n_cache_hits": info_residuals_cache.hits,
+                "n_rhs_evaluations": int(dict_telemetry_counters["n_rhs_evaluations"]),
+                "time_reading_data": time_reading_data,
+                "time_ode_fitting": dict_telemetry_counters["time_ode"],
+                "time_optimizer_overhead": time_fitting - dict_telemetry_counters["time_ode"],
+                "time_prediction": time_prediction,
+                "time_total": time_total,
+                "loss": float(output.fun),
+                "mape": float(mape_data),
+                "success": bool(output.success),
+                "status": int(getattr(output, "status", -1)),
+            }
+            return DELPHIAreaResult(
+                continent=continent,
+                country=country,
+                province=province,
+                area_index=area_index_,
+                best_params=np.asarray(best_params, dtype=float),
+                loss=float(output.fun),
+                success=bool(output.success),
+                status=int(getattr(output, "status", -1)),
+                n_function_evaluations=int(getattr(output, "nfev", 0)),
+                time_fitting=time_fitting,
+                time_total=time_total,
+                date_day_since100=date_day_since100,
+                mape=mape_data,
+                cases_data_fit=cases_data_fit,
+                deaths_data_fit=deaths_data_fit,
+                n_days_trajectory=x_sol_final.shape[1],
+                trajectory=None if trajectory_written else x_sol_final,
+                telemetry=telemetry,
             )
     else:  # file for that tuple (continent, country, province) doesn't exist in processed files
         logging.info(
@@ -409,13 +540,30 @@ def solve_and_predict_area(
         return None
 
 
-if __name__ == "__main__":
-    assert USER_RUNNING in CONFIG_FILEPATHS["delphi_repo"].keys(), f"User {USER_RUNNING} not referenced in config.yml"
-    if not os.path.exists(CONFIG_FILEPATHS["logs"][USER_RUNNING] + "model_fitting/"):
-        os.mkdir(CONFIG_FILEPATHS["logs"][USER_RUNNING] + "model_fitting/")
+def run(config: dict):
+    """
+    Fits DELPHI V3 on all the areas that can be fitted, then computes the aggregations and saves the parameters and
+    predictions datasets
+    :param config: configuration of the run, as returned by get_run_config
+    """
+    time_beginning = time.time()
+    USER_RUNNING = config["user_running"]
+    OPTIMIZER = config["optimizer"]
+    GET_CONFIDENCE_INTERVALS = config["get_confidence_intervals"]
+    SAVE_TO_WEBSITE = config["save_to_website"]
+    SAVE_SHARDS = config["save_shards"]
+    SAVE_SINCE100_CASES = config["save_since100_cases"]
+    PATH_TO_FOLDER_DANGER_MAP = config["path_to_folder_danger_map"]
+    PATH_TO_WEBSITE_PREDICTED = config["path_to_website_predicted"]
+    PATH_TO_FOLDER_LOGS = config["path_to_folder_logs"]
+    yesterday = config["yesterday"]
+    yesterday_logs_filename = config["yesterday_logs_filename"]
+    past_prediction_date = config["past_prediction_date"]
+    if not os.path.exists(PATH_TO_FOLDER_LOGS + "model_fitting/"):
+        os.mkdir(PATH_TO_FOLDER_LOGS + "model_fitting/")
 
     logger_filename = (
-            CONFIG_FILEPATHS["logs"][USER_RUNNING] +
+            PATH_TO_FOLDER_LOGS +
             f"model_fitting/delphi_model_V3_{yesterday_logs_filename}_{OPTIMIZER}.log"
     )
     logging.basicConfig(
@@ -428,57 +576,126 @@ if __name__ == "__main__":
         f"The user is {USER_RUNNING}, the chosen optimizer for this run was {OPTIMIZER} and " +
         f"generation of Confidence Intervals' flag is {GET_CONFIDENCE_INTERVALS}"
     )
-    popcountries = pd.read_csv(
-        PATH_TO_FOLDER_DANGER_MAP + f"processed/Global/Population_Global.csv"
+    area_registry = DELPHIAreaRegistry.from_files(
+        path_population_file=PATH_TO_FOLDER_DANGER_MAP + f"processed/Global/Population_Global.csv",
+        path_past_parameters_file=PATH_TO_FOLDER_DANGER_MAP + f"predicted/Parameters_Global_V2_{yesterday}.csv",
+        read_past_parameters=read_dataframe_prefer_columnar,
     )
-    popcountries["tuple_area"] = list(zip(popcountries.Continent, popcountries.Country, popcountries.Province))
-    try:
-        past_parameters = pd.read_csv(
-            PATH_TO_FOLDER_DANGER_MAP
-            + f"predicted/Parameters_Global_V2_{yesterday}.csv"
-        )
-    except:
-        past_parameters = None
 
     # Initalizing lists of the different dataframes that will be concatenated in the end
     list_df_global_predictions_since_today = []
     list_df_global_predictions_since_100_cases = []
     list_df_global_parameters = []
+    fitting_telemetry = DELPHIFittingTelemetry()
     obj_value = 0
-    solve_and_predict_area_partial = partial(
-        solve_and_predict_area,
-        yesterday_=yesterday,
-        past_parameters_=past_parameters,
-        popcountries=popcountries,
-    )
+    if GET_CONFIDENCE_INTERVALS:
+        # Past predictions are read once, the Confidence Intervals being computed by the parent for all areas
+        past_predictions_index = DELPHIPastPredictionsIndex.from_file(
+            past_prediction_file=PATH_TO_FOLDER_DANGER_MAP + f"predicted/Global_V2_{past_prediction_date}.csv",
+            past_prediction_date=str(pd.to_datetime(past_prediction_date).date()),
+        )
+    else:
+        past_predictions_index = None
     n_cpu = psutil.cpu_count(logical = False)
     logging.info(f"Number of CPUs found and used in this run: {n_cpu}")
 
-    list_tuples = popcountries.tuple_area.tolist()
+    # Case files are read once from the consolidated case store: areas that can't be fitted (no case file, less than
+    # 100 cases or not enough days) are skipped up front and the others are sent to the workers with their case data
+    dict_cases_areas = DELPHICaseStore(
+        path_to_folder_cases=PATH_TO_FOLDER_DANGER_MAP + "processed/Global/"
+    ).read_cases_per_area()
+    df_eligibility = area_registry.get_areas_eligibility(
+        dict_cases_areas=dict_cases_areas,
+        yesterday=yesterday,
+        validcases_threshold=validcases_threshold,
+    )
+    df_skipped_areas = df_eligibility[~df_eligibility.Eligible].reset_index(drop=True)
+    logging.info(
+        f"Skipping {len(df_skipped_areas)} areas out of {len(df_eligibility)}: "
+        + ", ".join([
+            f"{skip_reason} ({n_areas})"
+            for skip_reason, n_areas in df_skipped_areas["Skip Reason"].value_counts().items()
+        ])
+    )
+    df_skipped_areas.to_csv(
+        PATH_TO_FOLDER_LOGS
+        + f"model_fitting/skipped_areas_V3_{yesterday_logs_filename}_{OPTIMIZER}.csv",
+        index=False,
+    )
+    list_tuples = [
+        tuple(x) for x in df_eligibility.loc[df_eligibility.Eligible, ["Continent", "Country", "Province"]].values
+    ]
 #    list_tuples = [x for x in list_tuples if x[0] == "Oceania"]
     logging.info(f"Number of areas to be fitted in this run: {len(list_tuples)}")
-    with mp.Pool(n_cpu) as pool:
-        for result_area in tqdm(
-            pool.map_async(solve_and_predict_area_partial, list_tuples).get(),
-            total=len(list_tuples),
-        ):
+    # Bounds of all the areas with past parameters are computed here at once and shipped to the workers by area
+    dict_bounds_params = get_bounds_params_areas(
+        list_tuples_areas=list_tuples, area_registry=area_registry, optimizer=OPTIMIZER
+    )
+    # Workers write the trajectories of the 16 states in shared memory and only send back a compact record per area
+    if shared_memory is not None:
+        trajectory_buffer = DELPHITrajectoryBuffer(
+            n_areas=len(list_tuples), n_days=(default_maxT - date_earliest_day_since100).days + 1
+        )
+        trajectory_buffer_name, trajectory_buffer_shape = trajectory_buffer.name, trajectory_buffer.shape
+    else:
+        trajectory_buffer, trajectory_buffer_name, trajectory_buffer_shape = None, None, None
+    solve_and_predict_area_partial = partial(
+        solve_and_predict_area,
+        yesterday_=yesterday,
+        area_registry_=area_registry,
+        optimizer_=OPTIMIZER,
+        path_to_folder_danger_map_=PATH_TO_FOLDER_DANGER_MAP,
+        trajectory_buffer_name_=trajectory_buffer_name,
+        trajectory_buffer_shape_=trajectory_buffer_shape,
+        dict_bounds_params_=dict_bounds_params,
+    )
+    try:
+        with mp.Pool(n_cpu) as pool:
+            list_results_areas = pool.starmap_async(
+                solve_and_predict_area_partial,
+                [
+                    (tuple_area, i, dict_cases_areas[(tuple_area[1], tuple_area[2])])
+                    for i, tuple_area in enumerate(list_tuples)
+                ],
+            ).get()
+            logging.info("Finished the Multiprocessing for all areas")
+            pool.close()
+            pool.join()
+        for result_area in tqdm(list_results_areas, total=len(list_tuples)):
             if result_area is not None:
-                (
-                    df_parameters_area,
-                    df_predictions_since_today_area,
-                    df_predictions_since_100_area,
-                    output,
-                ) = result_area
-                obj_value = obj_value + output.fun
+                obj_value = obj_value + result_area.loss
+                fitting_telemetry.add(result_area.telemetry)
+                if result_area.trajectory is not None:
+                    x_sol_final = result_area.trajectory
+                else:
+                    x_sol_final = trajectory_buffer.read(result_area.area_index, result_area.n_days_trajectory)
+                data_creator = result_area.get_data_creator(x_sol_final)
+                df_parameters_area = data_creator.create_dataset_parameters(result_area.mape)
+                # Creating the datasets for predictions of this area
+                if GET_CONFIDENCE_INTERVALS:
+                    df_predictions_since_today_area, df_predictions_since_100_area = (
+                        data_creator.create_datasets_with_confidence_intervals(
+                            result_area.cases_data_fit, result_area.deaths_data_fit,
+                            past_prediction_file=(
+                                PATH_TO_FOLDER_DANGER_MAP + f"predicted/Global_V2_{past_prediction_date}.csv"
+                            ),
+                            past_prediction_date=str(pd.to_datetime(past_prediction_date).date()),
+                            past_predictions_index=past_predictions_index,
+                        )
+                    )
+                else:
+                    df_predictions_since_today_area, df_predictions_since_100_area = (
+                        data_creator.create_datasets_predictions()
+                    )
                 # Then we add it to the list of df to be concatenated to update the tracking df
                 list_df_global_parameters.append(df_parameters_area)
                 list_df_global_predictions_since_today.append(df_predictions_since_today_area)
                 list_df_global_predictions_since_100_cases.append(df_predictions_since_100_area)
             else:
                 continue
-        logging.info("Finished the Multiprocessing for all areas")
-        pool.close()
-        pool.join()
+    finally:
+        if trajectory_buffer is not None:
+            trajectory_buffer.unlink()
 
     # Appending parameters, aggregations per country, per continent, and for the world
     # for predictions today & since 100
@@ -486,16 +703,18 @@ if __name__ == "__main__":
     df_global_parameters = pd.concat(list_df_global_parameters).sort_values(
         ["Country", "Province"]
     ).reset_index(drop=True)
-    df_global_predictions_since_today = pd.concat(list_df_global_predictions_since_today)
+    # Predictions are kept with compact dtypes (categorical areas, datetime64 days) until they are saved
+    df_global_predictions_since_today = compact_dataframe(pd.concat(list_df_global_predictions_since_today))
     df_global_predictions_since_today = DELPHIAggregations.append_all_aggregations(
         df_global_predictions_since_today
     )
-    df_global_predictions_since_100_cases = pd.concat(list_df_global_predictions_since_100_cases)
+    df_global_predictions_since_100_cases = compact_dataframe(pd.concat(list_df_global_predictions_since_100_cases))
     if GET_CONFIDENCE_INTERVALS:
         df_global_predictions_since_today, df_global_predictions_since_100_cases = DELPHIAggregations.append_all_aggregations_cf(
             df_global_predictions_since_100_cases,
             past_prediction_file=PATH_TO_FOLDER_DANGER_MAP + f"predicted/Global_V2_{past_prediction_date}.csv",
-            past_prediction_date=str(pd.to_datetime(past_prediction_date).date())
+            past_prediction_date=str(pd.to_datetime(past_prediction_date).date()),
+            past_predictions_index=past_predictions_index,
         )
     else:
         df_global_predictions_since_100_cases = DELPHIAggregations.append_all_aggregations(
@@ -510,7 +729,23 @@ if __name__ == "__main__":
         df_global_predictions_since_100_cases=df_global_predictions_since_100_cases,
     )
     delphi_data_saver.save_all_datasets(optimizer=OPTIMIZER, save_since_100_cases=SAVE_SINCE100_CASES, website=SAVE_TO_WEBSITE)
+    if SAVE_SHARDS:
+        delphi_data_saver.save_predictions_to_json_shards(optimizer=OPTIMIZER, website=SAVE_TO_WEBSITE)
+    path_fitting_telemetry = fitting_telemetry.save(
+        path_to_folder_danger_map=PATH_TO_FOLDER_DANGER_MAP, optimizer=OPTIMIZER
+    )
+    fitting_telemetry_summary = fitting_telemetry.get_summary_report()
+    path_fitting_telemetry_summary = (
+        PATH_TO_FOLDER_LOGS + f"model_fitting/fitting_telemetry_summary_V3_{yesterday_logs_filename}_{OPTIMIZER}.txt"
+    )
+    with open(path_fitting_telemetry_summary, "w") as handle:
+        handle.write(fitting_telemetry_summary + "\n")
+    logging.info(f"Saved the fitting telemetry of all areas in {path_fitting_telemetry}\n" + fitting_telemetry_summary)
     logging.info(
         f"Exported all 3 datasets to website & danger_map repositories, "
         + f"total runtime was {round((time.time() - time_beginning)/60, 2)} minutes"
     )
+
+
+if __name__ == "__main__":
+    run(get_run_config(parse_arguments()))
@@ -3,11 +3,15 @@ import pandas as pd
 import numpy as np
 from scipy.integrate import solve_ivp
 from datetime import datetime, timedelta
-from DELPHI_utils_V3_static import DELPHIDataCreator, DELPHIDataSaver, get_initial_conditions, compute_mape
+from DELPHI_utils_V3_static import (
+    DELPHIDataCreator, DELPHIDataSaver, DELPHIScenarioStreamWriter, get_initial_conditions, compute_mape,
+    read_dataframe_prefer_columnar, compact_dataframe,
+)
 from DELPHI_utils_V3_dynamic import (
     read_oxford_international_policy_data, get_normalized_policy_shifts_and_current_policy_all_countries,
     get_normalized_policy_shifts_and_current_policy_us_only, read_policy_data_us_only
 )
+from DELPHI_utils_V3_registry import DELPHIAreaRegistry
 from DELPHI_params_V3 import (
     date_MATHEMATICA, validcases_threshold_policy, default_dict_normalized_policy_gamma,
     IncubeD, RecoverID, RecoverHD, DetectD, VentilatedD,
@@ -16,116 +20,285 @@ from DELPHI_params_V3 import (
 import yaml
 import os
 import argparse
+from typing import Union
+from contextlib import ExitStack
 
 
-with open("config.yml", "r") as ymlfile:
-    CONFIG = yaml.load(ymlfile, Loader=yaml.BaseLoader)
-CONFIG_FILEPATHS = CONFIG["filepaths"]
-parser = argparse.ArgumentParser()
-parser.add_argument(
-    '--user', '-u', type=str, required=True,
-    choices=["omar", "hamza", "michael", "michael2", "ali", "mohammad", "server", "saksham"],
-    help="Who is the user running? User needs to be referenced in config.yml for the filepaths (e.g. hamza, michael): "
-)
-parser.add_argument(
-    '--optimizer', '-o', type=str, required=True, choices=["tnc", "trust-constr", "annealing"],
-    help=(
-            "Which optimizer among 'tnc', 'trust-constr' or 'annealing' would you like to use ? " +
-            "Note that 'tnc' and 'trust-constr' lead to local optima, while 'annealing' is a " +
-            "method for global optimization: "
+def parse_arguments(args: list = None) -> argparse.Namespace:
+    """
+    Parses the command line arguments of the policy scenarios run, only called when running this file as a script
+    :param args: list of arguments to parse, None to parse sys.argv
+    :return: namespace with the user, optimizer and the saving flags of the run
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--user', '-u', type=str, required=True,
+        choices=["omar", "hamza", "michael", "michael2", "ali", "mohammad", "server", "saksham"],
+        help=(
+            "Who is the user running? User needs to be referenced in config.yml for the filepaths " +
+            "(e.g. hamza, michael): "
+        )
     )
-)
-parser.add_argument(
-    '--website', '-w', type=int, required=True, choices=[0, 1],
-    help="Save to website? Reply 0 or 1 for False or True.",
-)
-arguments = parser.parse_args()
-USER_RUNNING = arguments.user
-OPTIMIZER = arguments.optimizer
-SAVE_TO_WEBSITE = bool(arguments.website)
-yesterday = "".join(str(datetime.now().date() - timedelta(days=1)).split("-"))
-PATH_TO_FOLDER_DANGER_MAP = CONFIG_FILEPATHS["danger_map"][USER_RUNNING]
-PATH_TO_WEBSITE_PREDICTED = CONFIG_FILEPATHS["website"][USER_RUNNING]
-policy_data_countries = read_oxford_international_policy_data(yesterday=yesterday)
-policy_data_us_only = read_policy_data_us_only(filepath_data_sandbox=CONFIG_FILEPATHS["data_sandbox"][USER_RUNNING])
-popcountries = pd.read_csv(PATH_TO_FOLDER_DANGER_MAP + f"processed/Global/Population_Global.csv")
-subname_parameters_file = None
-if OPTIMIZER == "tnc":
-    subname_parameters_file = "Global_V2"
-elif OPTIMIZER == "annealing":
-    subname_parameters_file = "Global_V2_annealing"
-elif OPTIMIZER == "trust-constr":
-    subname_parameters_file = "Global_V2_trust"
-else:
-    raise ValueError("Optimizer not supported in this implementation")
-past_parameters = pd.read_csv(
-    PATH_TO_FOLDER_DANGER_MAP + f"predicted/Parameters_{subname_parameters_file}_{yesterday}.csv"
-)
-if pd.to_datetime(yesterday) < pd.to_datetime(date_MATHEMATICA):
-    param_MATHEMATICA = True
-else:
-    param_MATHEMATICA = False
-# True if we use the Mathematica run parameters, False if we use those from Python runs
-# This is because the past_parameters dataframe's columns are not in the same order in both cases
-
-# Get the policies shifts from the CART tree to compute different values of gamma(t)
-# Depending on the policy in place in the future to affect predictions
-dict_normalized_policy_gamma_countries, dict_current_policy_countries = (
-    get_normalized_policy_shifts_and_current_policy_all_countries(
-        policy_data_countries=policy_data_countries,
-        past_parameters=past_parameters,
+    parser.add_argument(
+        '--optimizer', '-o', type=str, required=True, choices=["tnc", "trust-constr", "annealing"],
+        help=(
+                "Which optimizer among 'tnc', 'trust-constr' or 'annealing' would you like to use ? " +
+                "Note that 'tnc' and 'trust-constr' lead to local optima, while 'annealing' is a " +
+                "method for global optimization: "
+        )
     )
-)
-# Setting same value for these 2 policies because of the inherent structure of the tree
-dict_normalized_policy_gamma_countries[future_policies[3]] = dict_normalized_policy_gamma_countries[future_policies[5]]
-# US Only Policies
-dict_normalized_policy_gamma_us_only, dict_current_policy_us_only = (
-    get_normalized_policy_shifts_and_current_policy_us_only(
-        policy_data_us_only=policy_data_us_only,
-        past_parameters=past_parameters,
+    parser.add_argument(
+        '--website', '-w', type=int, required=True, choices=[0, 1],
+        help="Save to website? Reply 0 or 1 for False or True.",
     )
-)
-dict_current_policy_international = dict_current_policy_countries.copy()
-dict_current_policy_international.update(dict_current_policy_us_only)
+    parser.add_argument(
+        '--shards', '-sh', type=int, required=False, default=0, choices=[0, 1],
+        help="Also save the predictions as one JSON file per country with an index? Reply 0 or 1 for False or True.",
+    )
+    parser.add_argument(
+        '--streaming', '-st', type=int, required=False, default=0, choices=[0, 1],
+        help=(
+                "Write the scenario predictions area by area to the CSV files and build the JSON files from them " +
+                "(bounded memory) instead of concatenating all of them in memory? Reply 0 or 1 for False or True."
+        ),
+    )
+    parser.add_argument(
+        '--offline', '-off', type=int, required=False, default=0, choices=[0, 1],
+        help=(
+                "Read the Oxford policy data from the latest snapshot in data_sandbox/OxCGRT_snapshots instead of " +
+                "downloading it when there is no snapshot of the day? Reply 0 or 1 for False or True."
+        ),
+    )
+    return parser.parse_args(args)
 
-dict_normalized_policy_gamma_us_only = default_dict_normalized_policy_gamma
-dict_normalized_policy_gamma_countries = default_dict_normalized_policy_gamma
 
-# Initalizing lists of the different dataframes that will be concatenated in the end
-list_df_global_predictions_since_today_scenarios = []
-list_df_global_predictions_since_100_cases_scenarios = []
-obj_value = 0
-for continent, country, province in zip(
-        popcountries.Continent.tolist(),
-        popcountries.Country.tolist(),
-        popcountries.Province.tolist(),
-):
-    if country == "US":  # This line is necessary because the keys are the same in both cases
-        dict_normalized_policy_gamma_international = dict_normalized_policy_gamma_us_only.copy()
+def get_run_config(arguments: argparse.Namespace, path_config_file: str = "config.yml") -> dict:
+    """
+    Reads config.yml and gathers everything a policy scenarios run depends on, dates being computed when this is called
+    :param arguments: namespace returned by parse_arguments, or any object with the same attributes
+    :param path_config_file: path to the config.yml file with the filepaths of each user
+    :return: dictionary with the configuration of the run, to be passed to run
+    """
+    with open(path_config_file, "r") as ymlfile:
+        CONFIG = yaml.load(ymlfile, Loader=yaml.BaseLoader)
+    CONFIG_FILEPATHS = CONFIG["filepaths"]
+    USER_RUNNING = arguments.user
+    return {
+        "user_running": USER_RUNNING,
+        "optimizer": arguments.optimizer,
+        "save_to_website": bool(arguments.website),
+        "save_shards": bool(getattr(arguments, "shards", 0)),
+        "streaming": bool(getattr(arguments, "streaming", 0)),
+        "offline_policy_data": bool(getattr(arguments, "offline", 0)),
+        "yesterday": "".join(str(datetime.now().date() - timedelta(days=1)).split("-")),
+        "path_to_folder_danger_map": CONFIG_FILEPATHS["danger_map"][USER_RUNNING],
+        "path_to_website_predicted": CONFIG_FILEPATHS["website"][USER_RUNNING],
+        "path_to_data_sandbox": CONFIG_FILEPATHS["data_sandbox"][USER_RUNNING],
+    }
+
+
+def get_subname_parameters_file(optimizer: str) -> str:
+    """
+    :param optimizer: optimizer used for the fitting, among 'tnc', 'trust-constr' or 'annealing'
+    :return: subname of the parameters file fitted with that optimizer, e.g. Global_V2 for tnc
+    """
+    if optimizer == "tnc":
+        subname_parameters_file = "Global_V2"
+    elif optimizer == "annealing":
+        subname_parameters_file = "Global_V2_annealing"
+    elif optimizer == "trust-constr":
+        subname_parameters_file = "Global_V2_trust"
     else:
-        dict_normalized_policy_gamma_international = dict_normalized_policy_gamma_countries.copy()
+        raise ValueError("Optimizer not supported in this implementation")
+    return subname_parameters_file
+
+
+def get_current_policies_international(
+        yesterday: str, path_to_data_sandbox: str, past_parameters: pd.DataFrame, offline_policy_data: bool = False,
+) -> dict:
+    """
+    Reads (from a snapshot when possible, cf. get_oxford_policy_data_raw) and processes the Oxford policy data and the
+    US policy data, only when a run needs them, to get the policy currently in place in each area
+    :param yesterday: string corresponding to the date of the run, format 'YYYYMMDD'
+    :param path_to_data_sandbox: path to the data_sandbox repository with the US policy data and the snapshots of
+    the Oxford policy data
+    :param past_parameters: parameters of the areas, fitted on yesterday
+    :param offline_policy_data: read the latest snapshot of the Oxford policy data without ever downloading it?
+    :return: dictionary {(country, province): current policy} for all countries and the US states
+    """
+    policy_data_countries = read_oxford_international_policy_data(
+        yesterday=yesterday, path_to_data_sandbox=path_to_data_sandbox, offline=offline_policy_data,
+    )
+    policy_data_us_only = read_policy_data_us_only(filepath_data_sandbox=path_to_data_sandbox)
+    # Get the policies shifts from the CART tree to compute different values of gamma(t)
+    # Depending on the policy in place in the future to affect predictions
+    dict_normalized_policy_gamma_countries, dict_current_policy_countries = (
+        get_normalized_policy_shifts_and_current_policy_all_countries(
+            policy_data_countries=policy_data_countries,
+            past_parameters=past_parameters,
+        )
+    )
+    # US Only Policies
+    dict_normalized_policy_gamma_us_only, dict_current_policy_us_only = (
+        get_normalized_policy_shifts_and_current_policy_us_only(
+            policy_data_us_only=policy_data_us_only,
+            past_parameters=past_parameters,
+        )
+    )
+    dict_current_policy_international = dict_current_policy_countries.copy()
+    dict_current_policy_international.update(dict_current_policy_us_only)
+    return dict_current_policy_international
+
+
+def model_covid_predictions_scenario(
+        t, x, alpha, days, r_s, r_dth, p_dth, r_dthdecay, k1, k2, jump, t_jump, std_normal,
+        N, t_last_case, future_time, normalized_gamma_future_policy, normalized_gamma_current_policy,
+) -> list:
+    """
+    SEIR based model with 16 distinct states, taking into account undetected, deaths, hospitalized and recovered, and
+    using an ArcTan government response curve, corrected with a Gaussian jump in case of a resurgence in cases, and
+    shifted after t_last_case + future_time to the level of the future policy
+    :param t: time step
+    :param x: set of all the states in the model (here, 16 of them)
+    :param alpha: Infection rate
+    :param days: Median day of action (used in the arctan governmental response)
+    :param r_s: Median rate of action (used in the arctan governmental response)
+    :param r_dth: Rate of death
+    :param p_dth: Initial mortality percentage
+    :param r_dthdecay: Rate of decay of mortality percentage
+    :param k1: Internal parameter 1 (used for initial conditions)
+    :param k2: Internal parameter 2 (used for initial conditions)
+    :param jump: Amplitude of the Gaussian jump modeling the resurgence in cases
+    :param t_jump: Time where the Gaussian jump will reach its maximum value
+    :param std_normal: Standard Deviation of the Gaussian jump (~ time span of resurgence in cases)
+    :param N: population of the area
+    :param t_last_case: time step of the last historical data point
+    :param future_time: number of days after t_last_case when the future policy is enacted
+    :param normalized_gamma_future_policy: normalized gamma of the future policy, None to keep the current one
+    :param normalized_gamma_current_policy: normalized gamma of the policy currently in place in the area
+    :return: predictions for all 16 states, which are the following
+    [0 S, 1 E, 2 I, 3 UR, 4 DHR, 5 DQR, 6 UD, 7 DHD, 8 DQD, 9 R, 10 D, 11 TH, 12 DVR,13 DVD, 14 DD, 15 DT]
+    """
+    r_i = np.log(2) / IncubeD  # Rate of infection leaving incubation phase
+    r_d = np.log(2) / DetectD  # Rate of detection
+    r_ri = np.log(2) / RecoverID  # Rate of recovery not under infection
+    r_rh = np.log(2) / RecoverHD  # Rate of recovery under hospitalization
+    r_rv = np.log(2) / VentilatedD  # Rate of recovery under ventilation
+    gamma_t = (
+          (2 / np.pi) * np.arctan(-(t - days) / 20 * r_s) + 1 +
+          jump * np.exp(-(t - t_jump)**2 /(2 * std_normal ** 2))
+    )
+    gamma_t_future = (
+          (2 / np.pi) * np.arctan(-(t_last_case + future_time - days) / 20 * r_s) + 1 +
+          jump * np.exp(-(t_last_case + future_time - t_jump)**2 / (2 * std_normal ** 2))
+    )
+    p_dth_mod = (2 / np.pi) * (p_dth - 0.01) * (np.arctan(- t / 20 * r_dthdecay) + np.pi / 2) + 0.01
+    if normalized_gamma_future_policy is not None and t > t_last_case + future_time:
+        epsilon = 1e-4
+        gamma_t = gamma_t + min(
+            (2 - gamma_t_future) / (1 - normalized_gamma_future_policy + epsilon),
+            (gamma_t_future / normalized_gamma_current_policy) *
+            (normalized_gamma_future_policy - normalized_gamma_current_policy)
+        )
+
+    assert len(x) == 16, f"Too many input variables, got {len(x)}, expected 16"
+    S, E, I, AR, DHR, DQR, AD, DHD, DQD, R, D, TH, DVR, DVD, DD, DT = x
+    # Equations on main variables
+    dSdt = -alpha * gamma_t * S * I / N
+    dEdt = alpha * gamma_t * S * I / N - r_i * E
+    dIdt = r_i * E - r_d * I
+    dARdt = r_d * (1 - p_dth_mod) * (1 - p_d) * I - r_ri * AR
+    dDHRdt = r_d * (1 - p_dth_mod) * p_d * p_h * I - r_rh * DHR
+    dDQRdt = r_d * (1 - p_dth_mod) * p_d * (1 - p_h) * I - r_ri * DQR
+    dADdt = r_d * p_dth_mod * (1 - p_d) * I - r_dth * AD
+    dDHDdt = r_d * p_dth_mod * p_d * p_h * I - r_dth * DHD
+    dDQDdt = r_d * p_dth_mod * p_d * (1 - p_h) * I - r_dth * DQD
+    dRdt = r_ri * (AR + DQR) + r_rh * DHR
+    dDdt = r_dth * (AD + DQD + DHD)
+    # Helper states (usually important for some kind of output)
+    dTHdt = r_d * p_d * p_h * I
+    dDVRdt = r_d * (1 - p_dth_mod) * p_d * p_h * p_v * I - r_rv * DVR
+    dDVDdt = r_d * p_dth_mod * p_d * p_h * p_v * I - r_dth * DVD
+    dDDdt = r_dth * (DHD + DQD)
+    dDTdt = r_d * p_d * I
+    return [
+        dSdt, dEdt, dIdt, dARdt, dDHRdt, dDQRdt, dADdt, dDHDdt, dDQDdt,
+        dRdt, dDdt, dTHdt, dDVRdt, dDVDdt, dDDdt, dDTdt
+    ]
+
+
+def solve_area_scenario(
+        best_params: list, global_params_fixed: tuple, maxT: int, t_last_case: int, future_time: int,
+        normalized_gamma_future_policy: Union[float, None], normalized_gamma_current_policy: float,
+) -> np.ndarray:
+    """
+    Solves the DELPHI model of an area with its fitted parameters under a policy scenario
+    :param best_params: fitted parameters of the area
+    :param global_params_fixed: (N, PopulationCI, PopulationR, PopulationD, PopulationI, p_d, p_h, p_v) of the area
+    :param maxT: number of days predicted since the day with 100 cases
+    :param t_last_case: time step of the last historical data point
+    :param future_time: number of days after t_last_case when the future policy is enacted
+    :param normalized_gamma_future_policy: normalized gamma of the future policy, None to keep the current one
+    :param normalized_gamma_current_policy: normalized gamma of the policy currently in place in the area
+    :return: array of shape (16, maxT) with the predicted states of the area
+    """
+    t_predictions = [i for i in range(maxT)]
+    x_0_cases = get_initial_conditions(
+        params_fitted=best_params,
+        global_params_fixed=global_params_fixed
+    )
+    x_sol_best = solve_ivp(
+        fun=model_covid_predictions_scenario,
+        y0=x_0_cases,
+        t_span=[t_predictions[0], t_predictions[-1]],
+        t_eval=t_predictions,
+        args=(
+            *best_params, global_params_fixed[0], t_last_case, future_time,
+            normalized_gamma_future_policy, normalized_gamma_current_policy,
+        ),
+    ).y
+    return x_sol_best
 
+
+def solve_and_predict_area_scenarios(
+        tuple_area_: tuple,
+        yesterday_: str,
+        area_registry_: DELPHIAreaRegistry,
+        dict_current_policy_international_: dict,
+        dict_normalized_policy_gamma_: dict,
+        param_MATHEMATICA_: bool,
+        path_to_folder_danger_map_: str,
+):
+    """
+    Solves DELPHI V3 with the past parameters of an area for all the future policies and times of the scenarios
+    :param tuple_area_: tuple corresponding to (continent, country, province)
+    :param yesterday_: string corresponding to the date of the past parameters, format 'YYYYMMDD'
+    :param area_registry_: population and parameters from yesterday_ of all areas
+    :param dict_current_policy_international_: dictionary {(country, province): current policy}
+    :param dict_normalized_policy_gamma_: normalized value of gamma for each policy
+    :param param_MATHEMATICA_: True if the past parameters come from a Mathematica run (different column order)
+    :param path_to_folder_danger_map_: path to the danger_map repository with the processed case files
+    :return: None if the area can't be predicted, otherwise a tuple with the lists of scenario predictions datasets
+    since today and since 100 cases of that area
+    """
+    continent, country, province = tuple_area_
     country_sub = country.replace(" ", "_")
     province_sub = province.replace(" ", "_")
     if (
-            (os.path.exists(PATH_TO_FOLDER_DANGER_MAP + f"processed/Global/Cases_{country_sub}_{province_sub}.csv"))
-            and ((country, province) in dict_current_policy_international.keys())
+            (os.path.exists(path_to_folder_danger_map_ + f"processed/Global/Cases_{country_sub}_{province_sub}.csv"))
+            and ((country, province) in dict_current_policy_international_.keys())
     ):
         totalcases = pd.read_csv(
-            PATH_TO_FOLDER_DANGER_MAP + f"processed/Global/Cases_{country_sub}_{province_sub}.csv"
+            path_to_folder_danger_map_ + f"processed/Global/Cases_{country_sub}_{province_sub}.csv"
         )
         if totalcases.day_since100.max() < 0:
             print(f"Not enough cases for Continent={continent}, Country={country} and Province={province}")
-            continue
+            return None
         print(country + " " + province)
-        if past_parameters is not None:
-            parameter_list_total = past_parameters[
-                (past_parameters.Country == country) &
-                (past_parameters.Province == province)
-                ]
-            if len(parameter_list_total) > 0:
-                parameter_list_line = parameter_list_total.iloc[-1, :].values.tolist()
-                if param_MATHEMATICA:
+        if area_registry_.past_parameters is not None:
+            if area_registry_.has_past_parameters(country, province):
+                parameter_list_line = area_registry_.get_past_parameters_line(country, province)
+                if param_MATHEMATICA_:
                     parameter_list = parameter_list_line[4:]
                     parameter_list[3] = np.log(2) / parameter_list[3]
                 else:
@@ -134,20 +307,18 @@ for continent, country, province in zip(
                 # Allowing a 5% drift for states with past predictions, starting in the 5th position are the parameters
                 validcases = totalcases[
                     (totalcases.day_since100 >= 0) &
-                    (totalcases.date <= str((pd.to_datetime(yesterday) + timedelta(days=1)).date()))
+                    (totalcases.date <= str((pd.to_datetime(yesterday_) + timedelta(days=1)).date()))
                     ][["day_since100", "case_cnt", "death_cnt"]].reset_index(drop=True)
             else:
                 print(f"Must have past parameters for {country} and {province}")
-                continue
+                return None
         else:
             print("Must have past parameters")
-            continue
+            return None
 
         # Now we start the modeling part:
         if len(validcases) > validcases_threshold_policy:
-            PopulationT = popcountries[
-                (popcountries.Country == country) & (popcountries.Province == province)
-                ].pop2016.item()
+            PopulationT = area_registry_.get_population(country, province)
             # We do not scale
             N = PopulationT
             PopulationI = validcases.loc[0, "case_cnt"]
@@ -180,101 +351,21 @@ for continent, country, province in zip(
             best_params = parameter_list
             t_predictions = [i for i in range(maxT)]
             #plt.figure(figsize=(20, 10))
+            list_df_area_predictions_since_today_scenarios = []
+            list_df_area_predictions_since_100_cases_scenarios = []
             for future_policy in future_policies:
                 for future_time in future_times:
-                    def model_covid_predictions(
-                            t, x, alpha, days, r_s, r_dth, p_dth, r_dthdecay, k1, k2, jump, t_jump, std_normal
-                    ):
-                        """
-                        SEIR based model with 16 distinct states, taking into account undetected, deaths, hospitalized
-                        and recovered, and using an ArcTan government response curve, corrected with a Gaussian jump in
-                        case of a resurgence in cases
-                        :param t: time step
-                        :param x: set of all the states in the model (here, 16 of them)
-                        :param alpha: Infection rate
-                        :param days: Median day of action (used in the arctan governmental response)
-                        :param r_s: Median rate of action (used in the arctan governmental response)
-                        :param r_dth: Rate of death
-                        :param p_dth: Initial mortality percentage
-                        :param r_dthdecay: Rate of decay of mortality percentage
-                        :param k1: Internal parameter 1 (used for initial conditions)
-                        :param k2: Internal parameter 2 (used for initial conditions)
-                        :param jump: Amplitude of the Gaussian jump modeling the resurgence in cases
-                        :param t_jump: Time where the Gaussian jump will reach its maximum value
-                        :param std_normal: Standard Deviation of the Gaussian jump (~ time span of resurgence in cases)
-                        :return: predictions for all 16 states, which are the following
-                        [0 S, 1 E, 2 I, 3 UR, 4 DHR, 5 DQR, 6 UD, 7 DHD, 8 DQD, 9 R, 10 D, 11 TH,
-                        12 DVR,13 DVD, 14 DD, 15 DT]
-                        """
-                        r_i = np.log(2) / IncubeD  # Rate of infection leaving incubation phase
-                        r_d = np.log(2) / DetectD  # Rate of detection
-                        r_ri = np.log(2) / RecoverID  # Rate of recovery not under infection
-                        r_rh = np.log(2) / RecoverHD  # Rate of recovery under hospitalization
-                        r_rv = np.log(2) / VentilatedD  # Rate of recovery under ventilation
-                        gamma_t = (
-                              (2 / np.pi) * np.arctan(-(t - days) / 20 * r_s) + 1 +
-                              jump * np.exp(-(t - t_jump)**2 /(2 * std_normal ** 2))
-                        )
-                        gamma_t_future = (
-                              (2 / np.pi) * np.arctan(-(t_cases[-1] + future_time - days) / 20 * r_s) + 1 +
-                              jump * np.exp(-(t_cases[-1] + future_time - t_jump)**2 / (2 * std_normal ** 2))
-                        )
-                        p_dth_mod = (2 / np.pi) * (p_dth - 0.01) * (np.arctan(- t / 20 * r_dthdecay) + np.pi / 2) + 0.01
-                        if t > t_cases[-1] + future_time:
-                            normalized_gamma_future_policy = dict_normalized_policy_gamma_countries[future_policy]
-                            normalized_gamma_current_policy = dict_normalized_policy_gamma_countries[
-                                dict_current_policy_international[(country, province)]
-                            ]
-                            epsilon = 1e-4
-                            gamma_t = gamma_t + min(
-                                (2 - gamma_t_future) / (1 - normalized_gamma_future_policy + epsilon),
-                                (gamma_t_future / normalized_gamma_current_policy) *
-                                (normalized_gamma_future_policy - normalized_gamma_current_policy)
-                            )
-
-                        assert len(x) == 16, f"Too many input variables, got {len(x)}, expected 16"
-                        S, E, I, AR, DHR, DQR, AD, DHD, DQD, R, D, TH, DVR, DVD, DD, DT = x
-                        # Equations on main variables
-                        dSdt = -alpha * gamma_t * S * I / N
-                        dEdt = alpha * gamma_t * S * I / N - r_i * E
-                        dIdt = r_i * E - r_d * I
-                        dARdt = r_d * (1 - p_dth_mod) * (1 - p_d) * I - r_ri * AR
-                        dDHRdt = r_d * (1 - p_dth_mod) * p_d * p_h * I - r_rh * DHR
-                        dDQRdt = r_d * (1 - p_dth_mod) * p_d * (1 - p_h) * I - r_ri * DQR
-                        dADdt = r_d * p_dth_mod * (1 - p_d) * I - r_dth * AD
-                        dDHDdt = r_d * p_dth_mod * p_d * p_h * I - r_dth * DHD
-                        dDQDdt = r_d * p_dth_mod * p_d * (1 - p_h) * I - r_dth * DQD
-                        dRdt = r_ri * (AR + DQR) + r_rh * DHR
-                        dDdt = r_dth * (AD + DQD + DHD)
-                        # Helper states (usually important for some kind of output)
-                        dTHdt = r_d * p_d * p_h * I
-                        dDVRdt = r_d * (1 - p_dth_mod) * p_d * p_h * p_v * I - r_rv * DVR
-                        dDVDdt = r_d * p_dth_mod * p_d * p_h * p_v * I - r_dth * DVD
-                        dDDdt = r_dth * (DHD + DQD)
-                        dDTdt = r_d * p_d * I
-                        return [
-                            dSdt, dEdt, dIdt, dARdt, dDHRdt, dDQRdt, dADdt, dDHDdt, dDQDdt,
-                            dRdt, dDdt, dTHdt, dDVRdt, dDVDdt, dDDdt, dDTdt
-                        ]
-
-
-                    def solve_best_params_and_predict(optimal_params):
-                        # Variables Initialization for the ODE system
-                        x_0_cases = get_initial_conditions(
-                            params_fitted=optimal_params,
-                            global_params_fixed=GLOBAL_PARAMS_FIXED
-                        )
-                        x_sol_best = solve_ivp(
-                            fun=model_covid_predictions,
-                            y0=x_0_cases,
-                            t_span=[t_predictions[0], t_predictions[-1]],
-                            t_eval=t_predictions,
-                            args=tuple(optimal_params),
-                        ).y
-                        return x_sol_best
-
-
-                    x_sol_final = solve_best_params_and_predict(best_params)
+                    x_sol_final = solve_area_scenario(
+                        best_params=best_params,
+                        global_params_fixed=GLOBAL_PARAMS_FIXED,
+                        maxT=maxT,
+                        t_last_case=t_cases[-1],
+                        future_time=future_time,
+                        normalized_gamma_future_policy=dict_normalized_policy_gamma_[future_policy],
+                        normalized_gamma_current_policy=dict_normalized_policy_gamma_[
+                            dict_current_policy_international_[(country, province)]
+                        ],
+                    )
                     data_creator = DELPHIDataCreator(
                         x_sol_final=x_sol_final, date_day_since100=date_day_since100, best_params=best_params,
                         continent=continent, country=country, province=province,
@@ -304,7 +395,7 @@ for continent, country, province in zip(
                     #     'Authorize_Schools_but_Restrict_Mass_Gatherings_and_Others', 'Lockdown'
                     # ]:
                     #     future_policy_lab = " ".join(future_policy.split("_"))
-                    #     n_points_to_leave = (pd.to_datetime(yesterday) - date_day_since100).days
+                    #     n_points_to_leave = (pd.to_datetime(yesterday_) - date_day_since100).days
                     #     plt.plot(t_predictions[n_points_to_leave:],
                     #              x_sol_final[15, n_points_to_leave:],
                     #              label=f"Future Policy: {future_policy_lab} in {future_time} days")
@@ -316,14 +407,14 @@ for continent, country, province in zip(
                             totalcases=totalcases,
                         )
                     )
-                    list_df_global_predictions_since_today_scenarios.append(
+                    list_df_area_predictions_since_today_scenarios.append(
                         df_predictions_since_today_cont_country_prov)
-                    list_df_global_predictions_since_100_cases_scenarios.append(
+                    list_df_area_predictions_since_100_cases_scenarios.append(
                         df_predictions_since_100_cont_country_prov)
             print(f"Finished predicting for Continent={continent}, Country={country} and Province={province}")
             # plt.plot(fitcasesnd, label="Historical Data")
             # dates_values = [
-            #     str((pd.to_datetime(yesterday)+timedelta(days=i)).date())[5:] if i % 10 == 0 else " "
+            #     str((pd.to_datetime(yesterday_)+timedelta(days=i)).date())[5:] if i % 10 == 0 else " "
             #     for i in range(len(x_sol_final[15, n_points_to_leave:]))
             # ]
             # plt.xticks(t_predictions[n_points_to_leave:], dates_values, rotation=90, fontsize=18)
@@ -332,30 +423,127 @@ for continent, country, province in zip(
             # plt.title(f"{country}, {province} Predictions & Historical for # Cases")
             # plt.savefig(country + "_" + province + "_prediction_cases.png", bpi=300)
             print("--------------------------------------------------------------------------")
+            return list_df_area_predictions_since_today_scenarios, list_df_area_predictions_since_100_cases_scenarios
         else:  # len(validcases) <= 7
             print(f"Not enough historical data (less than a week)" +
                   f"for Continent={continent}, Country={country} and Province={province}")
-            continue
+            return None
     else:  # file for that tuple (country, province) doesn't exist in processed files
-        continue
+        return None
+
+
+
+def run(config: dict):
+    """
+    Predicts all the policy scenarios for all areas with the parameters fitted yesterday, and saves them to the
+    danger_map repository (and to the website if required)
+    :param config: configuration of the run, as returned by get_run_config
+    """
+    OPTIMIZER = config["optimizer"]
+    SAVE_TO_WEBSITE = config["save_to_website"]
+    SAVE_SHARDS = config["save_shards"]
+    STREAMING = config["streaming"]
+    yesterday = config["yesterday"]
+    PATH_TO_FOLDER_DANGER_MAP = config["path_to_folder_danger_map"]
+    PATH_TO_WEBSITE_PREDICTED = config["path_to_website_predicted"]
+    subname_parameters_file = get_subname_parameters_file(OPTIMIZER)
+    past_parameters = read_dataframe_prefer_columnar(
+        PATH_TO_FOLDER_DANGER_MAP + f"predicted/Parameters_{subname_parameters_file}_{yesterday}.csv"
+    )
+    area_registry = DELPHIAreaRegistry(
+        popcountries=pd.read_csv(PATH_TO_FOLDER_DANGER_MAP + f"processed/Global/Population_Global.csv"),
+        past_parameters=past_parameters,
+    )
+    if pd.to_datetime(yesterday) < pd.to_datetime(date_MATHEMATICA):
+        param_MATHEMATICA = True
+    else:
+        param_MATHEMATICA = False
+    # True if we use the Mathematica run parameters, False if we use those from Python runs
+    # This is because the past_parameters dataframe's columns are not in the same order in both cases
+    dict_current_policy_international = get_current_policies_international(
+        yesterday=yesterday, path_to_data_sandbox=config["path_to_data_sandbox"], past_parameters=past_parameters,
+        offline_policy_data=config.get("offline_policy_data", False),
+    )
+    # The normalized gammas of the CART tree are not used, the default ones are the same for the US and other countries
+    dict_normalized_policy_gamma_countries = default_dict_normalized_policy_gamma
+
+    # Initalizing lists of the different dataframes that will be concatenated in the end, or the writer to which the
+    # predictions of each area are streamed
+    list_df_global_predictions_since_today_scenarios = []
+    list_df_global_predictions_since_100_cases_scenarios = []
+    with ExitStack() as stack:
+        if STREAMING:
+            # The writer's files are closed even if an area fails, and its truncated CSV files are then removed
+            scenario_stream_writer = stack.enter_context(DELPHIScenarioStreamWriter.from_danger_map(
+                path_to_folder_danger_map=PATH_TO_FOLDER_DANGER_MAP, optimizer=OPTIMIZER
+            ))
+        else:
+            scenario_stream_writer = None
+        for tuple_area in area_registry.get_list_tuples_areas():
+            predictions_area_scenarios = solve_and_predict_area_scenarios(
+                tuple_area_=tuple_area,
+                yesterday_=yesterday,
+                area_registry_=area_registry,
+                dict_current_policy_international_=dict_current_policy_international,
+                dict_normalized_policy_gamma_=dict_normalized_policy_gamma_countries,
+                param_MATHEMATICA_=param_MATHEMATICA,
+                path_to_folder_danger_map_=PATH_TO_FOLDER_DANGER_MAP,
+            )
+            if predictions_area_scenarios is None:
+                continue
+            list_df_area_predictions_since_today_scenarios, list_df_area_predictions_since_100_cases_scenarios = (
+                predictions_area_scenarios
+            )
+            if scenario_stream_writer is not None:
+                scenario_stream_writer.append_area(
+                    pd.concat(list_df_area_predictions_since_today_scenarios),
+                    pd.concat(list_df_area_predictions_since_100_cases_scenarios),
+                )
+            else:
+                list_df_global_predictions_since_today_scenarios.extend(
+                    list_df_area_predictions_since_today_scenarios
+                )
+                list_df_global_predictions_since_100_cases_scenarios.extend(
+                    list_df_area_predictions_since_100_cases_scenarios
+                )
+
+        # Appending parameters, aggregations per country, per continent, and for the world
+        # for predictions today & since 100
+        if scenario_stream_writer is not None:
+            scenario_stream_writer.close_csv_files()
+            delphi_data_saver = DELPHIDataSaver(
+                path_to_folder_danger_map=PATH_TO_FOLDER_DANGER_MAP,
+                path_to_website_predicted=PATH_TO_WEBSITE_PREDICTED,
+                df_global_parameters=None,
+                df_global_predictions_since_today=None,
+                df_global_predictions_since_100_cases=None,
+            )
+        else:
+            # Scenario predictions are kept with compact dtypes (categorical areas & scenarios, datetime64 days) until
+            # they are saved
+            df_global_predictions_since_today_scenarios = compact_dataframe(pd.concat(
+                list_df_global_predictions_since_today_scenarios
+            ).reset_index(drop=True))
+            df_global_predictions_since_100_cases_scenarios = compact_dataframe(pd.concat(
+                list_df_global_predictions_since_100_cases_scenarios
+            ).reset_index(drop=True))
+            delphi_data_saver = DELPHIDataSaver(
+                path_to_folder_danger_map=PATH_TO_FOLDER_DANGER_MAP,
+                path_to_website_predicted=PATH_TO_WEBSITE_PREDICTED,
+                df_global_parameters=None,
+                df_global_predictions_since_today=df_global_predictions_since_today_scenarios,
+                df_global_predictions_since_100_cases=df_global_predictions_since_100_cases_scenarios,
+            )
+        # df_global_predictions_since_100_cases_scenarios.to_csv('df_global_predictions_since_100_cases_scenarios_world.csv', index=False)
+        delphi_data_saver.save_policy_predictions_to_json(
+            website=SAVE_TO_WEBSITE, local_delphi=False, scenario_stream_writer=scenario_stream_writer
+        )
+        if SAVE_SHARDS:
+            delphi_data_saver.save_policy_predictions_to_json_shards(
+                website=SAVE_TO_WEBSITE, scenario_stream_writer=scenario_stream_writer
+            )
+    print("Exported all policy-dependent predictions for all countries to website & danger_map repositories")
 
-# Appending parameters, aggregations per country, per continent, and for the world
-# for predictions today & since 100
-today_date_str = "".join(str(datetime.now().date()).split("-"))
-df_global_predictions_since_today_scenarios = pd.concat(
-    list_df_global_predictions_since_today_scenarios
-).reset_index(drop=True)
-df_global_predictions_since_100_cases_scenarios = pd.concat(
-    list_df_global_predictions_since_100_cases_scenarios
-).reset_index(drop=True)
-delphi_data_saver = DELPHIDataSaver(
-    path_to_folder_danger_map=PATH_TO_FOLDER_DANGER_MAP,
-    path_to_website_predicted=PATH_TO_WEBSITE_PREDICTED,
-    df_global_parameters=None,
-    df_global_predictions_since_today=df_global_predictions_since_today_scenarios,
-    df_global_predictions_since_100_cases=df_global_predictions_since_100_cases_scenarios,
-)
-# df_global_predictions_since_100_cases_scenarios.to_csv('df_global_predictions_since_100_cases_scenarios_world.csv', index=False)
-delphi_data_saver.save_policy_predictions_to_json(website=SAVE_TO_WEBSITE, local_delphi=False)
-print("Exported all policy-dependent predictions for all countries to website & danger_map repositories")
 
+if __name__ == "__main__":
+    run(get_run_config(parse_arguments()))
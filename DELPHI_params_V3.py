@@ -26,6 +26,7 @@ default_bounds_params = (
 validcases_threshold = 7  # Minimum number of cases to fit the base-DELPHI
 validcases_threshold_policy = 15  # Minimum number of cases to train the country-level policy predictions
 max_iter = 500  # Maximum number of iterations for the algorithm
+max_size_residuals_cache = 64  # Number of last points of the loss function memoized during the fitting of an area
 
 # Default parameters - Annealing
 percentage_drift_upper_bound_annealing = 0.5
@@ -44,6 +45,7 @@ RecoverHD = 15
 DetectD = 2
 VentilatedD = 10  # Recovery Time when Ventilated
 default_maxT = datetime(2020, 12, 15)  # Maximum timespan of prediction
+date_earliest_day_since100 = datetime(2020, 1, 22)  # First day of historical data, bounds the length of predictions
 n_params_without_policy_params = 7  # alpha, r_dth, p_dth, a, b, k1, k2
 p_v = 0.25  # Percentage of ventilated
 p_d = 0.2  # Percentage of infection cases detected.
@@ -55,6 +57,20 @@ future_policies = [
     'Restrict_Mass_Gatherings_and_Schools', 'Authorize_Schools_but_Restrict_Mass_Gatherings_and_Others',
     'Restrict_Mass_Gatherings_and_Schools_and_Others', 'Lockdown'
 ]
+# Oxford policy data: threshold of each measure above which it is considered in place, and its flag (general scope)
+url_oxford_policy_data = "https://github.com/OxCGRT/covid-policy-tracker/raw/master/data/OxCGRT_latest.csv"
+dict_oxford_policy_thresholds = {
+    "C1_School closing": 2, "C2_Workplace closing": 2, "C3_Cancel public events": 2,
+    "C4_Restrictions on gatherings": 1, "C5_Close public transport": 2, "C6_Stay at home requirements": 2,
+    "C7_Restrictions on internal movement": 2, "C8_International travel controls": 3,
+    "H1_Public information campaigns": 1,
+}
+dict_oxford_policy_flags = {
+    "C1_School closing": "C1_Flag", "C2_Workplace closing": "C2_Flag", "C3_Cancel public events": "C3_Flag",
+    "C4_Restrictions on gatherings": "C4_Flag", "C5_Close public transport": "C5_Flag",
+    "C6_Stay at home requirements": "C6_Flag", "C7_Restrictions on internal movement": "C7_Flag",
+    "C8_International travel controls": None, "H1_Public information campaigns": "H1_Flag",
+}
 default_maxT_policies = datetime(2021, 3, 15) # Maximum timespan of prediction under different policy scenarios
 future_times = [0, 7, 14, 28, 42]
 
@@ -70,6 +86,29 @@ default_dict_normalized_policy_gamma = {
 }
 
 
+# States of the DELPHI model and reported outputs, each output being the sum of some of these states
+DELPHI_STATES = [
+    "S", "E", "I", "AR", "DHR", "DQR", "AD", "DHD", "DQD", "R", "D", "TH", "DVR", "DVD", "DD", "DT",
+]
+MAPPING_OUTPUT_TO_STATES = {
+    "Total Detected": ["DT"],
+    "Active": ["DHR", "DQR", "DHD", "DQD"],
+    "Active Hospitalized": ["DHR", "DHD"],
+    "Cumulative Hospitalized": ["TH"],
+    "Total Detected Deaths": ["DD"],
+    "Active Ventilated": ["DVR", "DVD"],
+}
+# Fitted output whose past residuals drive the Confidence Intervals of each output (scaled by their ratio if different)
+MAPPING_OUTPUT_TO_FITTED_OUTPUT = {
+    "Total Detected": "Total Detected",
+    "Active": "Total Detected",
+    "Active Hospitalized": "Total Detected",
+    "Cumulative Hospitalized": "Total Detected",
+    "Total Detected Deaths": "Total Detected Deaths",
+    "Active Ventilated": "Total Detected",
+}
+cumulative_outputs = ["Total Detected", "Cumulative Hospitalized", "Total Detected Deaths"]  # Increasing LB
+
 # Additional utils inputs
 TIME_DICT = {0: "Now", 7: "One Week", 14: "Two Weeks", 28: "Four Weeks", 42: "Six Weeks"}
 MAPPING_STATE_CODE_TO_STATE_NAME ={
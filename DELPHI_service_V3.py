@@ -0,0 +1,428 @@
+# Authors: Hamza Tazi Bouardi (htazi@mit.edu), Michael L. Li (mlli@mit.edu), Omar Skali Lami (oskali@mit.edu)
+import sys
+import json
+import time
+import yaml
+import logging
+import argparse
+import pandas as pd
+import numpy as np
+from datetime import datetime, timedelta
+from functools import lru_cache
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from DELPHI_utils_V3_static import read_dataframe_prefer_columnar, project_states_to_outputs, DELPHICaseStore
+from DELPHI_utils_V3_registry import DELPHIAreaRegistry
+from DELPHI_model_V3_with_policies import (
+    get_subname_parameters_file, get_current_policies_international, solve_area_scenario,
+)
+from DELPHI_params_V3 import (
+    date_MATHEMATICA, validcases_threshold_policy, default_dict_normalized_policy_gamma, default_maxT_policies,
+    MAPPING_OUTPUT_TO_STATES, TIME_DICT, p_v, p_d, p_h,
+)
+
+
+class DELPHIForecastService:
+    """
+    Answers forecast and policy scenario queries for single areas with the parameters fitted on a given day. The
+    population, past parameters, case data (from the case store) and current policies are read once at startup and
+    kept in memory, and the trajectories of the last queries are kept in an LRU cache so that repeated queries don't
+    solve the model again
+    """
+    def __init__(
+            self, path_to_folder_danger_map: str, yesterday: str, optimizer: str = "tnc",
+            path_to_data_sandbox: str = None, cache_size: int = 256, offline_policy_data: bool = False,
+    ):
+        """
+        :param path_to_folder_danger_map: path to the danger_map repository with the processed & predicted files
+        :param yesterday: string corresponding to the date of the fitted parameters, format 'YYYYMMDD'
+        :param optimizer: optimizer of the fitted parameters, among 'tnc', 'trust-constr' or 'annealing'
+        :param path_to_data_sandbox: path to the data_sandbox repository with the US policy data, only needed to get
+        the current policies of the areas when queries don't provide them, these policies being read at startup
+        :param cache_size: number of trajectories kept in the LRU cache
+        :param offline_policy_data: read the latest snapshot of the Oxford policy data without ever downloading it?
+        """
+        self.path_to_folder_danger_map = path_to_folder_danger_map
+        self.path_to_data_sandbox = path_to_data_sandbox
+        self.offline_policy_data = offline_policy_data
+        self.yesterday = yesterday
+        self.area_registry = DELPHIAreaRegistry.from_files(
+            path_population_file=path_to_folder_danger_map + f"processed/Global/Population_Global.csv",
+            path_past_parameters_file=(
+                path_to_folder_danger_map
+                + f"predicted/Parameters_{get_subname_parameters_file(optimizer)}_{yesterday}.csv"
+            ),
+            read_past_parameters=read_dataframe_prefer_columnar,
+        )
+        if self.area_registry.past_parameters is None:
+            raise ValueError(f"No parameters fitted with {optimizer} on {yesterday} in {path_to_folder_danger_map}")
+        # True if we use the Mathematica run parameters, False if we use those from Python runs
+        self.param_MATHEMATICA = pd.to_datetime(yesterday) < pd.to_datetime(date_MATHEMATICA)
+        self.dict_normalized_policy_gamma = default_dict_normalized_policy_gamma
+        self.dict_cases_areas = DELPHICaseStore(
+            path_to_folder_cases=path_to_folder_danger_map + "processed/Global/"
+        ).read_cases_per_area()
+        self.dict_area_inputs = {}
+        self.dict_current_policy_international = None
+        self.error_current_policies = None
+        if path_to_data_sandbox is not None:
+            self.load_current_policies()
+        self.get_trajectory = lru_cache(maxsize=cache_size)(self.solve_trajectory)
+
+    def load_current_policies(self) -> None:
+        """
+        Reads the Oxford & US policy data once to get the policy currently in place in each area; if it can't be read
+        (e.g. no network and no snapshot), the service still answers the queries that give their current policy
+        """
+        try:
+            self.dict_current_policy_international = get_current_policies_international(
+                yesterday=self.yesterday, path_to_data_sandbox=self.path_to_data_sandbox,
+                past_parameters=self.area_registry.past_parameters, offline_policy_data=self.offline_policy_data,
+            )
+        except OSError as e:
+            self.error_current_policies = str(e)
+            logging.warning(f"Couldn't read the current policies, queries will have to give them: {e}")
+
+    def preload_areas(self) -> int:
+        """
+        Prepares the inputs of all the areas with past parameters, so that the first query of each area is also fast
+        :return: number of areas that can be queried
+        """
+        for continent, country, province in self.area_registry.get_list_tuples_areas():
+            try:
+                self.get_area_inputs(country, province)
+            except (KeyError, ValueError):
+                continue
+        return len(self.dict_area_inputs)
+
+    def get_area_inputs(self, country: str, province: str) -> dict:
+        """
+        Prepares the inputs of an area from its case data the first time it is queried and keeps everything needed
+        to solve its model
+        :param country: country of the area
+        :param province: province of the area, "None" for countries
+        :return: dictionary with the continent, fitted parameters, fixed parameters, date with 100 cases, last
+        historical time step and number of days to predict of that area
+        """
+        if (country, province) in self.dict_area_inputs:
+            return self.dict_area_inputs[(country, province)]
+        parameter_list_line = self.area_registry.get_past_parameters_line(country, province)
+        if parameter_list_line is None:
+            raise KeyError(f"No past parameters for Country={country} and Province={province}")
+        if (country, province) not in self.dict_cases_areas:
+            raise KeyError(f"No processed case file for Country={country} and Province={province}")
+        totalcases = self.dict_cases_areas[(country, province)]
+        if self.param_MATHEMATICA:
+            parameter_list = parameter_list_line[4:]
+            parameter_list[3] = np.log(2) / parameter_list[3]
+        else:
+            parameter_list = parameter_list_line[5:]
+        date_day_since100 = pd.to_datetime(parameter_list_line[3])
+        validcases = totalcases[
+            (totalcases.day_since100 >= 0) &
+            (totalcases.date <= str((pd.to_datetime(self.yesterday) + timedelta(days=1)).date()))
+        ][["day_since100", "case_cnt", "death_cnt"]].reset_index(drop=True)
+        if len(validcases) <= validcases_threshold_policy:
+            raise ValueError(f"Not enough historical data for Country={country} and Province={province}")
+        PopulationI = validcases.loc[0, "case_cnt"]
+        PopulationR = validcases.loc[0, "death_cnt"] * 5
+        PopulationD = validcases.loc[0, "death_cnt"]
+        PopulationCI = PopulationI - PopulationD - PopulationR
+        area_inputs = {
+            "continent": parameter_list_line[0],
+            "best_params": tuple(parameter_list),
+            "global_params_fixed": (
+                self.area_registry.get_population(country, province), PopulationCI, PopulationR, PopulationD,
+                PopulationI, p_d, p_h, p_v,
+            ),
+            "date_day_since100": date_day_since100,
+            "t_last_case": validcases["day_since100"].iloc[-1] - validcases.loc[0, "day_since100"],
+            "maxT": (default_maxT_policies - date_day_since100).days + 1,
+        }
+        self.dict_area_inputs[(country, province)] = area_inputs
+        return area_inputs
+
+    def get_current_policy(self, country: str, province: str) -> str:
+        """
+        :param country: country of the area
+        :param province: province of the area, "None" for countries
+        :return: name of the policy currently in place in that area, as read at startup
+        """
+        if self.dict_current_policy_international is None:
+            if self.error_current_policies is not None:
+                raise OSError(
+                    f"The current policies couldn't be read ({self.error_current_policies}), give current_policy "
+                    + "in the query"
+                )
+            raise ValueError("The current policy must be given in the query when no data_sandbox path is set")
+        if (country, province) not in self.dict_current_policy_international:
+            raise KeyError(f"No current policy for Country={country} and Province={province}")
+        return self.dict_current_policy_international[(country, province)]
+
+    def solve_trajectory(
+            self, country: str, province: str, future_policy: str = None, future_time: int = 0,
+            current_policy: str = None,
+    ) -> np.ndarray:
+        """
+        Solves the model of an area, called through get_trajectory which caches the results
+        :param country: country of the area
+        :param province: province of the area, "None" for countries
+        :param future_policy: policy enacted future_time days after the last historical data point, None to forecast
+        without changing the current response
+        :param future_time: number of days after the last historical data point when the future policy is enacted
+        :param current_policy: policy currently in place in the area, only used with a future_policy
+        :return: read-only array of shape (16, maxT) with the predicted states since the day with 100 cases
+        """
+        area_inputs = self.get_area_inputs(country, province)
+        if future_policy is not None:
+            normalized_gamma_future_policy = self.dict_normalized_policy_gamma[future_policy]
+            normalized_gamma_current_policy = self.dict_normalized_policy_gamma[current_policy]
+        else:
+            normalized_gamma_future_policy, normalized_gamma_current_policy = None, None
+        x_sol_final = solve_area_scenario(
+            best_params=area_inputs["best_params"],
+            global_params_fixed=area_inputs["global_params_fixed"],
+            maxT=area_inputs["maxT"],
+            t_last_case=area_inputs["t_last_case"],
+            future_time=future_time,
+            normalized_gamma_future_policy=normalized_gamma_future_policy,
+            normalized_gamma_current_policy=normalized_gamma_current_policy,
+        )
+        x_sol_final.setflags(write=False)
+        return x_sol_final
+
+    def forecast(self, query: dict) -> dict:
+        """
+        Answers a forecast or policy scenario query
+        :param query: dictionary with the country, the province (default "None"), and optionally the future policy,
+        the time in days when it is enacted (one of the keys of TIME_DICT, default 0), the current policy of the area
+        and the first day of the forecast ('YYYY-MM-DD', default the day after the fitted parameters)
+        :return: dictionary with the area, the scenario, the days and the predicted values of each output
+        """
+        if "country" not in query:
+            raise ValueError("The query must contain a country")
+        country, province = str(query["country"]), str(query.get("province", "None"))
+        future_policy = query.get("policy")
+        future_time = int(query.get("time", 0))
+        current_policy = query.get("current_policy")
+        if future_policy is not None:
+            if future_policy not in self.dict_normalized_policy_gamma:
+                raise ValueError(
+                    f"Unknown policy {future_policy}, should be in {list(self.dict_normalized_policy_gamma)}"
+                )
+            if future_time not in TIME_DICT:
+                raise ValueError(f"Unknown time {future_time}, should be in {list(TIME_DICT)}")
+            if current_policy is None:
+                current_policy = self.get_current_policy(country, province)
+            elif current_policy not in self.dict_normalized_policy_gamma:
+                raise ValueError(f"Unknown current policy {current_policy}")
+        else:
+            current_policy = None
+        area_inputs = self.get_area_inputs(country, province)
+        x_sol_final = self.get_trajectory(country, province, future_policy, future_time, current_policy)
+        date_start = pd.to_datetime(
+            query.get("start_date", str((pd.to_datetime(self.yesterday) + timedelta(days=1)).date()))
+        )
+        n_days_btw_start_since_100 = max((date_start - area_inputs["date_day_since100"]).days, 0)
+        predicted_outputs = project_states_to_outputs(x_sol_final[:, n_days_btw_start_since_100:])
+        return {
+            "Continent": area_inputs["continent"],
+            "Country": country,
+            "Province": province,
+            "Policy": future_policy if future_policy is not None else "Current",
+            "Time": TIME_DICT[future_time] if future_policy is not None else None,
+            "Current Policy": current_policy,
+            "Day": [
+                str((area_inputs["date_day_since100"] + timedelta(days=i)).date())
+                for i in range(n_days_btw_start_since_100, x_sol_final.shape[1])
+            ],
+            **{
+                output: predicted_outputs[i, :].tolist() for i, output in enumerate(MAPPING_OUTPUT_TO_STATES.keys())
+            },
+        }
+
+    def answer(self, query: dict) -> (int, dict):
+        """
+        Answers a query and turns errors into a status code, as used by both the HTTP and stdin modes
+        :param query: see forecast
+        :return: tuple with an HTTP status code and the response (or the error message) as a dictionary
+        """
+        time_entering = time.time()
+        try:
+            response = self.forecast(query)
+            status = 200
+        except KeyError as e:
+            response, status = {"error": str(e.args[0]) if e.args else str(e)}, 404
+        except (ValueError, TypeError) as e:
+            response, status = {"error": str(e)}, 400
+        except OSError as e:
+            response, status = {"error": str(e)}, 503
+        except Exception as e:
+            # Any other failure of a query is answered instead of stopping the service
+            logging.exception(f"Failed to answer {query}")
+            response, status = {"error": f"Internal error: {e}"}, 500
+        response["Time Elapsed (ms)"] = round((time.time() - time_entering) * 1000, 3)
+        logging.info(f"Answered {query} with status {status} in {response['Time Elapsed (ms)']} ms")
+        return status, response
+
+
+class DELPHIServiceHandler(BaseHTTPRequestHandler):
+    """
+    HTTP handler of the forecast service: GET /forecast?country=...&province=...&policy=...&time=... or POST /forecast
+    with the query as a JSON body
+    """
+    service = None
+
+    def send_json(self, status: int, response: dict):
+        body = json.dumps(response).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != "/forecast":
+            self.send_json(404, {"error": f"Unknown path {url.path}, use /forecast"})
+            return
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        self.send_json(*self.service.answer(query))
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != "/forecast":
+            self.send_json(404, {"error": f"Unknown path {url.path}, use /forecast"})
+            return
+        try:
+            query = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        except ValueError:
+            self.send_json(400, {"error": "The body of the request should be a JSON query"})
+            return
+        self.send_json(*self.service.answer(query))
+
+    def log_message(self, format, *args):
+        logging.debug(format % args)
+
+
+def serve_http(service: DELPHIForecastService, host: str = "127.0.0.1", port: int = 8000):
+    """
+    Serves the queries over HTTP until interrupted
+    :param service: warm DELPHIForecastService answering the queries
+    :param host: host to bind, localhost by default
+    :param port: port to bind
+    """
+    DELPHIServiceHandler.service = service
+    http_server = HTTPServer((host, port), DELPHIServiceHandler)
+    logging.info(f"Serving DELPHI forecasts on http://{host}:{port}/forecast")
+    try:
+        http_server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        http_server.server_close()
+
+
+def serve_stdin(service: DELPHIForecastService, stream_in=sys.stdin, stream_out=sys.stdout):
+    """
+    Reads one JSON query per line and writes one JSON response per line (with its status), until the end of stream_in
+    :param service: warm DELPHIForecastService answering the queries
+    :param stream_in: stream from which the queries are read
+    :param stream_out: stream to which the responses are written
+    """
+    for line in stream_in:
+        if not line.strip():
+            continue
+        try:
+            query = json.loads(line)
+        except ValueError:
+            status, response = 400, {"error": "Each line should be a JSON query"}
+        else:
+            status, response = service.answer(query)
+        response["Status"] = status
+        stream_out.write(json.dumps(response) + "\n")
+        stream_out.flush()
+
+
+def parse_arguments(args: list = None) -> argparse.Namespace:
+    """
+    Parses the command line arguments of the forecast service, only called when running this file as a script
+    :param args: list of arguments to parse, None to parse sys.argv
+    :return: namespace with the user, optimizer, date of the parameters and serving options
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--user', '-u', type=str, required=True,
+        choices=["omar", "hamza", "michael", "michael2", "ali", "mohammad", "server", "saksham"],
+        help=(
+            "Who is the user running? User needs to be referenced in config.yml for the filepaths " +
+            "(e.g. hamza, michael): "
+        )
+    )
+    parser.add_argument(
+        '--optimizer', '-o', type=str, required=False, default="tnc", choices=["tnc", "trust-constr", "annealing"],
+        help="With which optimizer among 'tnc', 'trust-constr' or 'annealing' were the parameters fitted?",
+    )
+    parser.add_argument(
+        '--date', '-d', type=str, required=False, default=None,
+        help="Date of the fitted parameters, format 'YYYYMMDD' (default yesterday)",
+    )
+    parser.add_argument(
+        '--mode', '-m', type=str, required=False, default="http", choices=["http", "stdin"],
+        help="Serve the queries over HTTP on localhost or read one JSON query per line on stdin?",
+    )
+    parser.add_argument('--port', '-p', type=int, required=False, default=8000, help="Port of the HTTP mode")
+    parser.add_argument(
+        '--cache_size', '-cs', type=int, required=False, default=256,
+        help="Number of trajectories kept in memory by the LRU cache",
+    )
+    parser.add_argument(
+        '--preload', '-pl', type=int, required=False, default=1, choices=[0, 1],
+        help="Prepare the inputs of all areas at startup? Reply 0 or 1 for False or True.",
+    )
+    parser.add_argument(
+        '--offline', '-off', type=int, required=False, default=0, choices=[0, 1],
+        help="Never download the Oxford policy data (read its latest snapshot)? Reply 0 or 1 for False or True.",
+    )
+    return parser.parse_args(args)
+
+
+def run(arguments: argparse.Namespace, path_config_file: str = "config.yml"):
+    """
+    Starts the forecast service with the filepaths of the user in config.yml
+    :param arguments: namespace returned by parse_arguments
+    :param path_config_file: path to the config.yml file with the filepaths of each user
+    """
+    with open(path_config_file, "r") as ymlfile:
+        CONFIG = yaml.load(ymlfile, Loader=yaml.BaseLoader)
+    CONFIG_FILEPATHS = CONFIG["filepaths"]
+    USER_RUNNING = arguments.user
+    assert USER_RUNNING in CONFIG_FILEPATHS["delphi_repo"].keys(), f"User {USER_RUNNING} not referenced in config.yml"
+    logging.basicConfig(
+        stream=sys.stderr,
+        level=logging.INFO,
+        format="%(asctime)s | %(levelname)s | %(message)s",
+        datefmt="%m-%d-%Y %I:%M:%S %p",
+    )
+    yesterday = (
+        arguments.date if arguments.date is not None
+        else "".join(str(datetime.now().date() - timedelta(days=1)).split("-"))
+    )
+    service = DELPHIForecastService(
+        path_to_folder_danger_map=CONFIG_FILEPATHS["danger_map"][USER_RUNNING],
+        yesterday=yesterday,
+        optimizer=arguments.optimizer,
+        path_to_data_sandbox=CONFIG_FILEPATHS["data_sandbox"][USER_RUNNING],
+        cache_size=arguments.cache_size,
+        offline_policy_data=bool(arguments.offline),
+    )
+    if arguments.preload:
+        logging.info(f"Preloaded {service.preload_areas()} areas with parameters from {yesterday}")
+    if arguments.mode == "http":
+        serve_http(service, port=arguments.port)
+    else:
+        serve_stdin(service)
+
+
+if __name__ == "__main__":
+    run(parse_arguments())
@@ -1,11 +1,77 @@
 # Authors: Hamza Tazi Bouardi (htazi@mit.edu), Michael L. Li (mlli@mit.edu), Omar Skali Lami (oskali@mit.edu)
+import os
+import hashlib
+import logging
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
 from typing import Union
-from copy import deepcopy
-from itertools import compress
-from DELPHI_params_V3 import MAPPING_STATE_CODE_TO_STATE_NAME, future_policies
+import scipy.stats
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+from DELPHI_params_V3 import (
+    MAPPING_STATE_CODE_TO_STATE_NAME, future_policies, MAPPING_OUTPUT_TO_FITTED_OUTPUT, cumulative_outputs,
+    url_oxford_policy_data, dict_oxford_policy_thresholds, dict_oxford_policy_flags,
+)
+
+
+def get_bounds_params_from_pastparams_all_areas(
+        optimizer: str, array_parameters: np.ndarray, dict_default_reinit_parameters: dict,
+        percentage_drift_lower_bound: float, default_lower_bound: float, dict_default_reinit_lower_bounds: dict,
+        percentage_drift_upper_bound: float, default_upper_bound: float, dict_default_reinit_upper_bounds: dict,
+        percentage_drift_lower_bound_annealing: float, default_lower_bound_annealing: float,
+        percentage_drift_upper_bound_annealing: float, default_upper_bound_annealing: float,
+        default_lower_bound_jump: float, default_upper_bound_jump: float, default_lower_bound_std_normal: float,
+        default_upper_bound_std_normal: float,
+) -> np.ndarray:
+    """
+    Generates the lower and upper bounds of the past parameters of many areas at once, used as warm starts for the
+    optimization process to predict with DELPHI: the output depends on the optimizer used (annealing or other, i.e. tnc
+    or trust-constr), cf. get_bounds_params_from_pastparams for the parameters other than array_parameters
+    :param optimizer: optimizer used to obtain the DELPHI predictions
+    :param array_parameters: array (areas x 11) of all past parameter values for which we want to create bounds
+    :return: array (areas x 11 x 2) with the lower & upper bounds of all the optimized parameters of each area
+    """
+    array_parameters = np.asarray(array_parameters, dtype=float)
+    if optimizer in ["tnc", "trust-constr"]:
+        # Allowing a drift for parameters; days aren't reinitialized and r_dth & p_dth are capped at 1
+        parameter_names = [
+            "alpha", "days", "r_s", "r_dth", "p_dth", "r_dthdecay", "k1", "k2", "jump", "t_jump", "std_normal",
+        ]
+        array_caps = np.array([1 if name in ["r_dth", "p_dth"] else np.inf for name in parameter_names])
+
+        def reinitialize(array_values: np.ndarray, dict_default_reinit: dict) -> np.ndarray:
+            array_reinit = np.array([
+                -np.inf if dict_default_reinit[name] is None else dict_default_reinit[name] for name in parameter_names
+            ])
+            return np.maximum(np.minimum(array_values, array_caps), array_reinit)
+
+        array_parameters = reinitialize(array_parameters, dict_default_reinit_parameters)
+        array_lower = reinitialize(
+            array_parameters - np.maximum(percentage_drift_lower_bound * np.abs(array_parameters), default_lower_bound),
+            dict_default_reinit_lower_bounds,
+        )
+        array_upper = reinitialize(
+            array_parameters + np.maximum(percentage_drift_upper_bound * np.abs(array_parameters), default_upper_bound),
+            dict_default_reinit_upper_bounds,
+        )
+    elif optimizer == "annealing":  # Annealing procedure for global optimization
+        array_lower = array_parameters - np.maximum(
+            percentage_drift_lower_bound_annealing * np.abs(array_parameters), default_lower_bound_annealing
+        )
+        array_upper = array_parameters + np.maximum(
+            percentage_drift_upper_bound_annealing * np.abs(array_parameters), default_upper_bound_annealing
+        )
+        array_lower[:, 8] = default_lower_bound_jump  # jump lower bound
+        array_upper[:, 8] = default_upper_bound_jump  # jump upper bound
+        array_lower[:, 10] = default_lower_bound_std_normal  # std_normal lower bound
+        array_upper[:, 10] = default_upper_bound_std_normal  # std_normal upper bound
+    else:
+        raise ValueError(f"Optimizer {optimizer} not supported in this implementation so can't generate bounds")
+
+    return np.stack([array_lower, array_upper], axis=-1)
 
 
 def get_bounds_params_from_pastparams(
@@ -39,77 +105,26 @@ def get_bounds_params_from_pastparams(
     :param default_upper_bound_std_normal: default upper bound value for the normal standard deviation parameter
     :return: a list of bounds for all the optimized parameters based on the optimizer and pre-fixed parameters
     """
-    if optimizer in ["tnc", "trust-constr"]:
-        # Allowing a drift for parameters
-        alpha, days, r_s, r_dth, p_dth, r_dthdecay, k1, k2, jump, t_jump, std_normal = parameter_list
-        parameter_list = [
-            max(alpha, dict_default_reinit_parameters["alpha"]),
-            days,
-            max(r_s, dict_default_reinit_parameters["r_s"]),
-            max(min(r_dth, 1), dict_default_reinit_parameters["r_dth"]),
-            max(min(p_dth, 1), dict_default_reinit_parameters["p_dth"]),
-            max(r_dthdecay, dict_default_reinit_parameters["r_dthdecay"]),
-            max(k1, dict_default_reinit_parameters["k1"]),
-            max(k2, dict_default_reinit_parameters["k2"]),
-            max(jump, dict_default_reinit_parameters["jump"]),
-            max(t_jump, dict_default_reinit_parameters["t_jump"]),
-            max(std_normal, dict_default_reinit_parameters["std_normal"]),
-        ]
-        param_list_lower = [x - max(percentage_drift_lower_bound * abs(x), default_lower_bound) for x in parameter_list]
-        (
-            alpha_lower, days_lower, r_s_lower, r_dth_lower, p_dth_lower, r_dthdecay_lower,
-            k1_lower, k2_lower, jump_lower, t_jump_lower, std_normal_lower
-        ) = param_list_lower
-        param_list_lower = [
-            max(alpha_lower, dict_default_reinit_lower_bounds["alpha"]),
-            days_lower,
-            max(r_s_lower, dict_default_reinit_lower_bounds["r_s"]),
-            max(min(r_dth_lower, 1), dict_default_reinit_lower_bounds["r_dth"]),
-            max(min(p_dth_lower, 1), dict_default_reinit_lower_bounds["p_dth"]),
-            max(r_dthdecay_lower, dict_default_reinit_lower_bounds["r_dthdecay"]),
-            max(k1_lower, dict_default_reinit_lower_bounds["k1"]),
-            max(k2_lower, dict_default_reinit_lower_bounds["k2"]),
-            max(jump_lower, dict_default_reinit_lower_bounds["jump"]),
-            max(t_jump_lower, dict_default_reinit_lower_bounds["t_jump"]),
-            max(std_normal_lower, dict_default_reinit_lower_bounds["std_normal"]),
-        ]
-        param_list_upper = [
-            x + max(percentage_drift_upper_bound * abs(x), default_upper_bound) for x in parameter_list
-        ]
-        (
-            alpha_upper, days_upper, r_s_upper, r_dth_upper, p_dth_upper, r_dthdecay_upper,
-            k1_upper, k2_upper, jump_upper, t_jump_upper, std_normal_upper
-        ) = param_list_upper
-        param_list_upper = [
-            max(alpha_upper, dict_default_reinit_upper_bounds["alpha"]),
-            days_upper,
-            max(r_s_upper, dict_default_reinit_upper_bounds["r_s"]),
-            max(min(r_dth_upper, 1), dict_default_reinit_upper_bounds["r_dth"]),
-            max(min(p_dth_upper, 1), dict_default_reinit_upper_bounds["p_dth"]),
-            max(r_dthdecay_upper, dict_default_reinit_upper_bounds["r_dthdecay"]),
-            max(k1_upper, dict_default_reinit_upper_bounds["k1"]),
-            max(k2_upper, dict_default_reinit_upper_bounds["k2"]),
-            max(jump_upper, dict_default_reinit_upper_bounds["jump"]),
-            max(t_jump_upper, dict_default_reinit_upper_bounds["t_jump"]),
-            max(std_normal_upper, dict_default_reinit_upper_bounds["std_normal"]),
-        ]
-    elif optimizer == "annealing":  # Annealing procedure for global optimization
-        param_list_lower = [
-            x - max(percentage_drift_lower_bound_annealing * abs(x), default_lower_bound_annealing) for x in
-            parameter_list
-        ]
-        param_list_upper = [
-            x + max(percentage_drift_upper_bound_annealing * abs(x), default_upper_bound_annealing) for x in
-            parameter_list
-        ]
-        param_list_lower[8] = default_lower_bound_jump  # jump lower bound
-        param_list_upper[8] = default_upper_bound_jump  # jump upper bound
-        param_list_lower[10] = default_lower_bound_std_normal  # std_normal lower bound
-        param_list_upper[10] = default_upper_bound_std_normal  # std_normal upper bound
-    else:
-        raise ValueError(f"Optimizer {optimizer} not supported in this implementation so can't generate bounds")
-
-    bounds_params = [(lower, upper) for lower, upper in zip(param_list_lower, param_list_upper)]
+    array_bounds_params = get_bounds_params_from_pastparams_all_areas(
+        optimizer=optimizer,
+        array_parameters=np.array([parameter_list], dtype=float),
+        dict_default_reinit_parameters=dict_default_reinit_parameters,
+        percentage_drift_lower_bound=percentage_drift_lower_bound,
+        default_lower_bound=default_lower_bound,
+        dict_default_reinit_lower_bounds=dict_default_reinit_lower_bounds,
+        percentage_drift_upper_bound=percentage_drift_upper_bound,
+        default_upper_bound=default_upper_bound,
+        dict_default_reinit_upper_bounds=dict_default_reinit_upper_bounds,
+        percentage_drift_lower_bound_annealing=percentage_drift_lower_bound_annealing,
+        default_lower_bound_annealing=default_lower_bound_annealing,
+        percentage_drift_upper_bound_annealing=percentage_drift_upper_bound_annealing,
+        default_upper_bound_annealing=default_upper_bound_annealing,
+        default_lower_bound_jump=default_lower_bound_jump,
+        default_upper_bound_jump=default_upper_bound_jump,
+        default_lower_bound_std_normal=default_lower_bound_std_normal,
+        default_upper_bound_std_normal=default_upper_bound_std_normal,
+    )
+    bounds_params = [(lower, upper) for lower, upper in array_bounds_params[0].tolist()]
     return bounds_params
 
 
@@ -147,134 +162,57 @@ def check_us_policy_data_consistency(policies: list, df_policy_raw_us: pd.DataFr
         ), f"Problem in data, policy {policy} has no start date but has an end date"
 
 
-def create_intermediary_policy_features_us(
-    df_policy_raw_us: pd.DataFrame, dict_state_to_policy_dates: dict, policies: list
-) -> pd.DataFrame:
+def get_policy_array_us(df_policy_raw_us: pd.DataFrame, policies: list, date_range: pd.DatetimeIndex) -> np.ndarray:
     """
-    Processes the IHME policy data in the US to create the right intermediary features with the right names
-    :param df_policy_raw_us: raw dataframe with policies implemented in the US
-    :param dict_state_to_policy_dates: dictionary of the format {state: {policy: [start_date, end_date]}}
+    Expands the (state, policy, start date, end date) intervals of the IHME policy data in the US onto all the dates at
+    once: a policy is implemented from its start date to its end date (included), forever if it has no end date and
+    never if it has no start date
+    :param df_policy_raw_us: raw dataframe with policies implemented in the US, one row per state
     :param policies: list of policies under consideration
-    :return: an intermediary dataframe with processed columns containing binary variables as to whether or not a
-    policy is implemented in a given state at a given date
+    :param date_range: dates on which the policies are expanded
+    :return: boolean array (states x dates x policies) as to whether or not a policy is implemented in a given state
+    at a given date, states being in their order in df_policy_raw_us
     """
-    list_df_concat = []
-    n_dates = (datetime.now() - datetime(2020, 3, 1)).days + 1
-    date_range = [datetime(2020, 3, 1) + timedelta(days=i) for i in range(n_dates)]
-    for location in df_policy_raw_us.location_name.unique():
-        df_temp = pd.DataFrame(
-            {
-                "continent": ["North America" for _ in range(len(date_range))],
-                "country": ["US" for _ in range(len(date_range))],
-                "province": [location for _ in range(len(date_range))],
-                "date": date_range,
-            }
-        )
-        for policy in policies:
-            start_date_policy_location = dict_state_to_policy_dates[location][policy][0]
-            start_date_policy_location = (
-                start_date_policy_location
-                if start_date_policy_location is not np.nan
-                else "2030-01-02"
-            )
-            end_date_policy_location = dict_state_to_policy_dates[location][policy][1]
-            end_date_policy_location = (
-                end_date_policy_location
-                if end_date_policy_location is not np.nan
-                else "2030-01-01"
-            )
-            df_temp[policy] = 0
-            df_temp.loc[
-                (
-                    (df_temp.date >= start_date_policy_location)
-                    & (df_temp.date <= end_date_policy_location)
-                ),
-                policy,
-            ] = 1
-
-        list_df_concat.append(df_temp)
-
-    df_policies_US = pd.concat(list_df_concat).reset_index(drop=True)
-    df_policies_US.rename(
-        columns={
-            "travel_limit": "Travel_severely_limited",
-            "stay_home": "Stay_at_home_order",
-            "educational_fac": "Educational_Facilities_Closed",
-            "any_gathering_restrict": "Mass_Gathering_Restrictions",
-            "any_business": "Initial_Business_Closure",
-            "all_non-ess_business": "Non_Essential_Services_Closed",
-        },
-        inplace=True,
+    array_start_dates = np.stack(
+        [pd.to_datetime(df_policy_raw_us[f"{policy}_start_date"]).values for policy in policies], axis=1
+    )
+    array_end_dates = np.stack(
+        [pd.to_datetime(df_policy_raw_us[f"{policy}_end_date"]).values for policy in policies], axis=1
+    )
+    dates = date_range.values[np.newaxis, :, np.newaxis]
+    # Comparisons with missing dates (NaT) are always False
+    return (dates >= array_start_dates[:, np.newaxis, :]) & (
+        np.isnat(array_end_dates)[:, np.newaxis, :] | (dates <= array_end_dates[:, np.newaxis, :])
     )
-    return df_policies_US
 
 
-def create_final_policy_features_us(df_policies_US: pd.DataFrame) -> pd.DataFrame:
+def get_mece_policies_array_us(array_policies_us: np.ndarray, policies: list) -> np.ndarray:
     """
-    Creates the final MECE policies in the US from the intermediary policies dataframe
-    :param df_policies_US: intermediary dataframe with processed columns containing binary variables as to whether or 
-    not a policy is implemented in a given state at a given date
-    :return: dataframe with the final MECE policies in the US used for DELPHI policy predictions
+    Creates the final MECE policies in the US from the policies implemented in each state at each date
+    :param array_policies_us: boolean array (states x dates x policies), cf. get_policy_array_us
+    :param policies: list of policies under consideration, in the order of the last axis of array_policies_us
+    :return: boolean array (states x dates x MECE policies) with the final MECE policies in the order of future_policies
     """
-    df_policies_US_final = deepcopy(df_policies_US)
-    msr = future_policies
-    df_policies_US_final[msr[0]] = (df_policies_US.sum(axis=1) == 0).apply(
-        lambda x: int(x)
-    )
-    df_policies_US_final[msr[1]] = [
-        int(a and b)
-        for a, b in zip(
-            df_policies_US.sum(axis=1) == 1,
-            df_policies_US["Mass_Gathering_Restrictions"] == 1,
-        )
-    ]
-    df_policies_US_final[msr[2]] = [
-        int(a and b and c)
-        for a, b, c in zip(
-            df_policies_US.sum(axis=1) > 0,
-            df_policies_US["Mass_Gathering_Restrictions"] == 0,
-            df_policies_US["Stay_at_home_order"] == 0,
-        )
-    ]
-    df_policies_US_final[msr[3]] = [
-        int(a and b and c)
-        for a, b, c in zip(
-            df_policies_US.sum(axis=1) == 2,
-            df_policies_US["Educational_Facilities_Closed"] == 1,
-            df_policies_US["Mass_Gathering_Restrictions"] == 1,
-        )
-    ]
-    df_policies_US_final[msr[4]] = [
-        int(a and b and c and d)
-        for a, b, c, d in zip(
-            df_policies_US.sum(axis=1) > 1,
-            df_policies_US["Educational_Facilities_Closed"] == 0,
-            df_policies_US["Mass_Gathering_Restrictions"] == 1,
-            df_policies_US["Stay_at_home_order"] == 0,
-        )
-    ]
-    df_policies_US_final[msr[5]] = [
-        int(a and b and c and d)
-        for a, b, c, d in zip(
-            df_policies_US.sum(axis=1) > 2,
-            df_policies_US["Educational_Facilities_Closed"] == 1,
-            df_policies_US["Mass_Gathering_Restrictions"] == 1,
-            df_policies_US["Stay_at_home_order"] == 0,
-        )
-    ]
-    df_policies_US_final[msr[6]] = (df_policies_US["Stay_at_home_order"] == 1).apply(
-        lambda x: int(x)
-    )
-    df_policies_US_final["country"] = "US"
-    df_policies_US_final = df_policies_US_final.loc[
-        :, ["country", "province", "date"] + msr
-    ]
-    return df_policies_US_final
+    n_policies = array_policies_us.sum(axis=-1)
+    mass_gathering_restrictions = array_policies_us[..., policies.index("any_gathering_restrict")]
+    stay_at_home_order = array_policies_us[..., policies.index("stay_home")]
+    educational_facilities_closed = array_policies_us[..., policies.index("educational_fac")]
+    return np.stack([
+        n_policies == 0,
+        (n_policies == 1) & mass_gathering_restrictions,
+        (n_policies > 0) & (~mass_gathering_restrictions) & (~stay_at_home_order),
+        (n_policies == 2) & educational_facilities_closed & mass_gathering_restrictions,
+        (n_policies > 1) & (~educational_facilities_closed) & mass_gathering_restrictions & (~stay_at_home_order),
+        (n_policies > 2) & educational_facilities_closed & mass_gathering_restrictions & (~stay_at_home_order),
+        stay_at_home_order,
+    ], axis=-1)
 
 
 def read_policy_data_us_only(filepath_data_sandbox: str) -> pd.DataFrame:
     """
-    Reads and processes the policy data from IHME to obtain the MECE policies defined for DELPHI Policy Predictions
+    Reads and processes the policy data from IHME to obtain the MECE policies defined for DELPHI Policy Predictions;
+    the MECE policies are cached in data_sandbox/US_policy_data_cache/ under the hash of the raw IHME file, with the
+    date range they cover, so that they are only computed again when the raw file changes or the range is exceeded
     :param filepath_data_sandbox: string, path to the data sandbox drawn from the config.yml file in the main script
     :return: fully processed dataframe containing the MECE policies implemented in each state of the US for the full 
     time period necessary until the day when this function is called
@@ -292,173 +230,166 @@ def read_policy_data_us_only(filepath_data_sandbox: str) -> pd.DataFrame:
         "Rhode Island", "South Carolina", "South Dakota", "Tennessee", "Texas", "Utah", "Vermont", "Virginia",
         "Washington", "West Virginia", "Wisconsin", "Wyoming",
     ]
-    df = pd.read_csv(filepath_data_sandbox + "12062020_raw_policy_data_us_only.csv")
-    df = df[df.location_name.isin(list_US_states)][
-        [
-            "location_name", "travel_limit_start_date", "travel_limit_end_date", "stay_home_start_date",
-            "stay_home_end_date", "educational_fac_start_date", "educational_fac_end_date",
-            "any_gathering_restrict_start_date", "any_gathering_restrict_end_date", "any_business_start_date",
-            "any_business_end_date", "all_non-ess_business_start_date", "all_non-ess_business_end_date",
+    filepath_raw_policy_data = filepath_data_sandbox + "12062020_raw_policy_data_us_only.csv"
+    n_dates = (datetime.now() - datetime(2020, 3, 1)).days + 1
+    date_range = pd.date_range(datetime(2020, 3, 1), periods=n_dates)
+    with open(filepath_raw_policy_data, "rb") as raw_policy_data_file:
+        hash_raw_policy_data = hashlib.md5(raw_policy_data_file.read()).hexdigest()
+    path_to_folder_cache = filepath_data_sandbox + "US_policy_data_cache/"
+    path_cache = path_to_folder_cache + f"{hash_raw_policy_data}.npz"
+    array_mece_policies_us = None
+    if os.path.exists(path_cache):
+        with np.load(path_cache, allow_pickle=False) as cache:
+            # The cache is only used if its date range covers the dates needed today
+            if (str(cache["first_date"]) == date_range[0].strftime("%Y%m%d")) and (
+                    cache["array_mece_policies_us"].shape[1] >= n_dates
+            ):
+                states = cache["states"]
+                array_mece_policies_us = cache["array_mece_policies_us"][:, :n_dates]
+    if array_mece_policies_us is None:
+        df = pd.read_csv(filepath_raw_policy_data)
+        df = df[df.location_name.isin(list_US_states)][
+            ["location_name"] + [f"{policy}_{bound}_date" for policy in policies for bound in ["start", "end"]]
         ]
-    ]
-    dict_state_to_policy_dates = {}
-    for location in df.location_name.unique():
-        df_temp = df[df.location_name == location].reset_index(drop=True)
-        dict_state_to_policy_dates[location] = {
-            policy: [
-                df_temp.loc[0, f"{policy}_start_date"],
-                df_temp.loc[0, f"{policy}_end_date"],
-            ]
-            for policy in policies
-        }
-    check_us_policy_data_consistency(policies=policies, df_policy_raw_us=df)
-    df_policies_US = create_intermediary_policy_features_us(
-        df_policy_raw_us=df,
-        dict_state_to_policy_dates=dict_state_to_policy_dates,
-        policies=policies,
-    )
-    df_policies_US_final = create_final_policy_features_us(
-        df_policies_US=df_policies_US
-    )
+        check_us_policy_data_consistency(policies=policies, df_policy_raw_us=df)
+        # Only the first row of each state is used
+        df = df.drop_duplicates(subset="location_name").reset_index(drop=True)
+        states = df.location_name.to_numpy(dtype=str)
+        # The policies of each date only depend on that date, so they are cached a year ahead for the next runs
+        date_range_cache = pd.date_range(date_range[0], periods=n_dates + 365)
+        array_mece_policies_us_cache = get_mece_policies_array_us(
+            array_policies_us=get_policy_array_us(df_policy_raw_us=df, policies=policies, date_range=date_range_cache),
+            policies=policies,
+        )
+        os.makedirs(path_to_folder_cache, exist_ok=True)
+        with open(path_cache + ".tmp", "wb") as cache_file:
+            np.savez(
+                cache_file, states=states, first_date=date_range_cache[0].strftime("%Y%m%d"),
+                array_mece_policies_us=array_mece_policies_us_cache,
+            )
+        os.replace(path_cache + ".tmp", path_cache)
+        array_mece_policies_us = array_mece_policies_us_cache[:, :n_dates]
+
+    n_states = len(states)
+    df_policies_US_final = pd.DataFrame({
+        "country": "US",
+        "province": np.repeat(states, n_dates),
+        "date": np.tile(date_range.values, n_states),
+    })
+    array_mece_policies_us = array_mece_policies_us.reshape(n_states * n_dates, len(future_policies)).astype(int)
+    for i, policy in enumerate(future_policies):
+        df_policies_US_final[policy] = array_mece_policies_us[:, i]
     return df_policies_US_final
 
 
-def read_oxford_international_policy_data(yesterday: str) -> pd.DataFrame:
+def get_oxford_policy_data_raw(
+        yesterday: str, path_to_data_sandbox: Union[str, None] = None, offline: bool = False,
+) -> pd.DataFrame:
     """
-    Reads the policy data from the Oxford dataset online and processes it to obtain the MECE policies for all other
-    countries than the US
-    :param yesterday: string date used in the main script as the day for which we read past parameters used as warm 
-    starts for the optimization
-    :return: processed dataframe with MECE policies in each country of the world, used for policy predictions
+    Gets the raw Oxford policy data from a local snapshot when possible: the snapshot of the day in the data_sandbox
+    (OxCGRT_snapshots/OxCGRT_{yesterday}.parquet, or .csv if pyarrow isn't installed) if it exists, otherwise the data
+    is downloaded once and saved as that snapshot. In offline mode, or if the download fails, the most recent
+    snapshot until yesterday is read instead, which can also be a file pinned there by hand (e.g. OxCGRT_20201101.csv)
+    :param yesterday: string date used in the main script as the day for which we read past parameters, format
+    'YYYYMMDD'
+    :param path_to_data_sandbox: path to the data_sandbox repository where the snapshots are saved, None to always
+    download the data without saving it
+    :param offline: read a snapshot without ever downloading the data?
+    :return: raw Oxford policy data restricted to the columns used in read_oxford_international_policy_data
     """
-    measures = pd.read_csv("https://github.com/OxCGRT/covid-policy-tracker/raw/master/data/OxCGRT_latest.csv")
-    filtr = ["CountryName", "CountryCode", "Date"]
-    target = ["ConfirmedCases", "ConfirmedDeaths"]
-    msr = [
-        "C1_School closing",
-        "C2_Workplace closing",
-        "C3_Cancel public events",
-        "C4_Restrictions on gatherings",
-        "C5_Close public transport",
-        "C6_Stay at home requirements",
-        "C7_Restrictions on internal movement",
-        "C8_International travel controls",
-        "H1_Public information campaigns",
-    ]
-
-    flags = ["C" + str(i) + "_Flag" for i in range(1, 8)] + ["H1_Flag"]
-    measures = measures.loc[:, filtr + msr + flags + target]
-    measures["Date"] = measures["Date"].apply(
-        lambda x: datetime.strptime(str(x), "%Y%m%d")
+    columns_oxford = (
+        ["CountryName", "CountryCode", "Date"] + list(dict_oxford_policy_thresholds.keys())
+        + [column_flag for column_flag in dict_oxford_policy_flags.values() if column_flag is not None]
+        + ["ConfirmedCases", "ConfirmedDeaths"]
     )
-    for col in target:
-        # measures[col] = measures[col].fillna(0)
-        measures[col] = measures.groupby("CountryName")[col].ffill()
-
-    measures["C1_Flag"] = [
-        0 if x <= 0 else y
-        for (x, y) in zip(measures["C1_School closing"], measures["C1_Flag"])
-    ]
-    measures["C2_Flag"] = [
-        0 if x <= 0 else y
-        for (x, y) in zip(measures["C2_Workplace closing"], measures["C2_Flag"])
-    ]
-    measures["C3_Flag"] = [
-        0 if x <= 0 else y
-        for (x, y) in zip(measures["C3_Cancel public events"], measures["C3_Flag"])
-    ]
-    measures["C4_Flag"] = [
-        0 if x <= 0 else y
-        for (x, y) in zip(
-            measures["C4_Restrictions on gatherings"], measures["C4_Flag"]
+    if path_to_data_sandbox is None:
+        if offline:
+            raise ValueError("The data_sandbox path is required to read the Oxford policy data in offline mode")
+        return pd.read_csv(url_oxford_policy_data, usecols=columns_oxford, low_memory=False)[columns_oxford]
+
+    path_to_folder_snapshots = path_to_data_sandbox + "OxCGRT_snapshots/"
+    dict_date_to_snapshot = {}
+    if os.path.isdir(path_to_folder_snapshots):
+        # Parquet snapshots come last so that they are preferred to CSV snapshots of the same date
+        for filename in sorted(os.listdir(path_to_folder_snapshots), key=lambda x: x.endswith(".parquet")):
+            date_snapshot, extension_snapshot = os.path.splitext(filename[len("OxCGRT_"):])
+            if filename.startswith("OxCGRT_") and (
+                    (extension_snapshot == ".csv") or ((extension_snapshot == ".parquet") and (pyarrow is not None))
+            ):
+                dict_date_to_snapshot[date_snapshot] = path_to_folder_snapshots + filename
+    list_dates_snapshots = sorted([
+        date_snapshot for date_snapshot in dict_date_to_snapshot if date_snapshot <= yesterday
+    ])
+
+    def read_latest_snapshot() -> pd.DataFrame:
+        path_snapshot = dict_date_to_snapshot[list_dates_snapshots[-1]]
+        if path_snapshot.endswith(".parquet"):
+            return pd.read_parquet(path_snapshot, columns=columns_oxford)
+        return pd.read_csv(path_snapshot, usecols=columns_oxford, low_memory=False)[columns_oxford]
+
+    if (yesterday in dict_date_to_snapshot) or (offline and (len(list_dates_snapshots) > 0)):
+        return read_latest_snapshot()
+    if offline:
+        raise FileNotFoundError(
+            f"No Oxford policy data snapshot until {yesterday} in {path_to_folder_snapshots} for offline mode"
         )
-    ]
-    measures["C5_Flag"] = [
-        0 if x <= 0 else y
-        for (x, y) in zip(measures["C5_Close public transport"], measures["C5_Flag"])
-    ]
-    measures["C6_Flag"] = [
-        0 if x <= 0 else y
-        for (x, y) in zip(measures["C6_Stay at home requirements"], measures["C6_Flag"])
-    ]
-    measures["C7_Flag"] = [
-        0 if x <= 0 else y
-        for (x, y) in zip(
-            measures["C7_Restrictions on internal movement"], measures["C7_Flag"]
-        )
-    ]
-    measures["H1_Flag"] = [
-        0 if x <= 0 else y
-        for (x, y) in zip(
-            measures["H1_Public information campaigns"], measures["H1_Flag"]
-        )
-    ]
-
-    measures["C1_School closing"] = [
-        int(a and b)
-        for a, b in zip(measures["C1_School closing"] >= 2, measures["C1_Flag"] == 1)
-    ]
 
-    measures["C2_Workplace closing"] = [
-        int(a and b)
-        for a, b in zip(measures["C2_Workplace closing"] >= 2, measures["C2_Flag"] == 1)
-    ]
-
-    measures["C3_Cancel public events"] = [
-        int(a and b)
-        for a, b in zip(
-            measures["C3_Cancel public events"] >= 2, measures["C3_Flag"] == 1
-        )
-    ]
-
-    measures["C4_Restrictions on gatherings"] = [
-        int(a and b)
-        for a, b in zip(
-            measures["C4_Restrictions on gatherings"] >= 1, measures["C4_Flag"] == 1
+    try:
+        measures = pd.read_csv(url_oxford_policy_data, usecols=columns_oxford, low_memory=False)[columns_oxford]
+    except OSError as e:
+        if len(list_dates_snapshots) == 0:
+            raise
+        logging.warning(
+            f"Couldn't download the Oxford policy data ({e}), reading the snapshot of {list_dates_snapshots[-1]}"
         )
-    ]
-
-    measures["C5_Close public transport"] = [
-        int(a and b)
-        for a, b in zip(
-            measures["C5_Close public transport"] >= 2, measures["C5_Flag"] == 1
-        )
-    ]
-
-    measures["C6_Stay at home requirements"] = [
-        int(a and b)
-        for a, b in zip(
-            measures["C6_Stay at home requirements"] >= 2, measures["C6_Flag"] == 1
-        )
-    ]
-
-    measures["C7_Restrictions on internal movement"] = [
-        int(a and b)
-        for a, b in zip(
-            measures["C7_Restrictions on internal movement"] >= 2,
-            measures["C7_Flag"] == 1,
-        )
-    ]
-
-    measures["C8_International travel controls"] = [
-        int(a) for a in (measures["C8_International travel controls"] >= 3)
-    ]
+        return read_latest_snapshot()
+    os.makedirs(path_to_folder_snapshots, exist_ok=True)
+    path_snapshot = path_to_folder_snapshots + f"OxCGRT_{yesterday}" + (".parquet" if pyarrow is not None else ".csv")
+    if pyarrow is not None:
+        measures.to_parquet(path_snapshot + ".tmp", index=False)
+    else:
+        measures.to_csv(path_snapshot + ".tmp", index=False)
+    os.replace(path_snapshot + ".tmp", path_snapshot)
+    return measures
 
-    measures["H1_Public information campaigns"] = [
-        int(a and b)
-        for a, b in zip(
-            measures["H1_Public information campaigns"] >= 1, measures["H1_Flag"] == 1
-        )
-    ]
 
-    # measures = measures.loc[:, measures.isnull().mean() < 0.1]
-    msr = set(measures.columns).intersection(set(msr))
+def read_oxford_international_policy_data(
+        yesterday: str, path_to_data_sandbox: Union[str, None] = None, offline: bool = False,
+) -> pd.DataFrame:
+    """
+    Reads the policy data from the Oxford dataset (cf. get_oxford_policy_data_raw) and processes it to obtain the MECE
+    policies for all other countries than the US
+    :param yesterday: string date used in the main script as the day for which we read past parameters used as warm 
+    starts for the optimization
+    :param path_to_data_sandbox: path to the data_sandbox repository with the snapshots of the Oxford policy data,
+    None to download the data without saving it
+    :param offline: read a snapshot of the Oxford policy data without ever downloading it?
+    :return: processed dataframe with MECE policies in each country of the world, used for policy predictions
+    """
+    measures = get_oxford_policy_data_raw(
+        yesterday=yesterday, path_to_data_sandbox=path_to_data_sandbox, offline=offline
+    )
+    # Dates are parsed once per distinct date rather than once per row
+    dates_unique, dates_inverse = np.unique(measures["Date"].values, return_inverse=True)
+    measures["Date"] = pd.to_datetime(pd.Series(dates_unique).astype(str), format="%Y%m%d").values[dates_inverse]
+    for col in ["ConfirmedCases", "ConfirmedDeaths"]:
+        measures[col] = measures.groupby("CountryName")[col].ffill()
 
-    # measures = measures.fillna(0)
+    # A measure is in place when it reaches its threshold with a general scope (flag 1), flags being reset to 0 when
+    # the measure isn't in place at all; comparisons with missing values are False, as in the original definitions
+    for col, threshold in dict_oxford_policy_thresholds.items():
+        column_flag = dict_oxford_policy_flags[col]
+        is_above_threshold = (measures[col] >= threshold).values
+        if column_flag is None:
+            is_in_place = is_above_threshold
+        else:
+            measures[column_flag] = measures[column_flag].mask(measures[col] <= 0, 0)
+            is_in_place = is_above_threshold & (measures[column_flag] == 1).values
+        measures[col] = is_in_place.astype(int)
+
+    # Rows where a flag (or the cases & deaths before the first reported value) is still missing are removed
     measures = measures.dropna()
-    for col in msr:
-        measures[col] = measures[col].apply(lambda x: int(x > 0))
-    measures = measures[["CountryName", "Date"] + list(sorted(msr))]
+    measures = measures[["CountryName", "Date"] + list(sorted(dict_oxford_policy_thresholds.keys()))]
     measures["CountryName"] = measures.CountryName.replace(
         {
             "United States": "US",
@@ -469,82 +400,39 @@ def read_oxford_international_policy_data(yesterday: str) -> pd.DataFrame:
         }
     )
 
-    measures = measures.fillna(0)
-    msr = future_policies
-
-    measures["Restrict_Mass_Gatherings"] = [
-        int(a or b or c)
-        for a, b, c in zip(
-            measures["C3_Cancel public events"],
-            measures["C4_Restrictions on gatherings"],
-            measures["C5_Close public transport"],
-        )
-    ]
-    measures["Others"] = [
-        int(a or b or c)
-        for a, b, c in zip(
-            measures["C2_Workplace closing"],
-            measures["C7_Restrictions on internal movement"],
-            measures["C8_International travel controls"],
-        )
-    ]
-
-    del measures["C2_Workplace closing"]
-    del measures["C3_Cancel public events"]
-    del measures["C4_Restrictions on gatherings"]
-    del measures["C5_Close public transport"]
-    del measures["C7_Restrictions on internal movement"]
-    del measures["C8_International travel controls"]
-
-    output = deepcopy(measures)
-    output[msr[0]] = (measures.iloc[:, 2:].sum(axis=1) == 0).apply(lambda x: int(x))
-    output[msr[1]] = [
-        int(a and b)
-        for a, b in zip(
-            measures.iloc[:, 2:].sum(axis=1) == 1,
-            measures["Restrict_Mass_Gatherings"] == 1,
-        )
-    ]
-    output[msr[2]] = [
-        int(a and b and c)
-        for a, b, c in zip(
-            measures.iloc[:, 2:].sum(axis=1) > 0,
-            measures["Restrict_Mass_Gatherings"] == 0,
-            measures["C6_Stay at home requirements"] == 0,
-        )
-    ]
-    output[msr[3]] = [
-        int(a and b and c)
-        for a, b, c in zip(
-            measures.iloc[:, 2:].sum(axis=1) == 2,
-            measures["C1_School closing"] == 1,
-            measures["Restrict_Mass_Gatherings"] == 1,
-        )
-    ]
-    output[msr[4]] = [
-        int(a and b and c and d)
-        for a, b, c, d in zip(
-            measures.iloc[:, 2:].sum(axis=1) > 1,
-            measures["C1_School closing"] == 0,
-            measures["Restrict_Mass_Gatherings"] == 1,
-            measures["C6_Stay at home requirements"] == 0,
-        )
-    ]
-    output[msr[5]] = [
-        int(a and b and c and d)
-        for a, b, c, d in zip(
-            measures.iloc[:, 2:].sum(axis=1) > 2,
-            measures["C1_School closing"] == 1,
-            measures["Restrict_Mass_Gatherings"] == 1,
-            measures["C6_Stay at home requirements"] == 0,
-        )
-    ]
-    output[msr[6]] = (measures["C6_Stay at home requirements"] == 1).apply(
-        lambda x: int(x)
+    school_closing = measures["C1_School closing"].values == 1
+    stay_at_home = measures["C6_Stay at home requirements"].values == 1
+    restrict_mass_gatherings = (
+        (measures["C3_Cancel public events"].values == 1)
+        | (measures["C4_Restrictions on gatherings"].values == 1)
+        | (measures["C5_Close public transport"].values == 1)
+    )
+    others = (
+        (measures["C2_Workplace closing"].values == 1)
+        | (measures["C7_Restrictions on internal movement"].values == 1)
+        | (measures["C8_International travel controls"].values == 1)
+    )
+    n_measures = (
+        school_closing.astype(int) + stay_at_home.astype(int)
+        + (measures["H1_Public information campaigns"].values == 1).astype(int)
+        + restrict_mass_gatherings.astype(int) + others.astype(int)
     )
-    output.rename(columns={"CountryName": "country", "Date": "date"}, inplace=True)
-    output["province"] = "None"
-    output = output.loc[:, ["country", "province", "date"] + msr]
+    msr = future_policies
+    dict_mece_policies = {
+        msr[0]: n_measures == 0,
+        msr[1]: (n_measures == 1) & restrict_mass_gatherings,
+        msr[2]: (n_measures > 0) & (~restrict_mass_gatherings) & (~stay_at_home),
+        msr[3]: (n_measures == 2) & school_closing & restrict_mass_gatherings,
+        msr[4]: (n_measures > 1) & (~school_closing) & restrict_mass_gatherings & (~stay_at_home),
+        msr[5]: (n_measures > 2) & school_closing & restrict_mass_gatherings & (~stay_at_home),
+        msr[6]: stay_at_home,
+    }
+    output = pd.DataFrame({
+        "country": measures["CountryName"].values,
+        "province": "None",
+        "date": measures["Date"].values,
+        **{policy: is_policy.astype(int) for policy, is_policy in dict_mece_policies.items()},
+    })
     output = output[output.date <= yesterday].reset_index(drop=True)
     return output
 
@@ -566,15 +454,124 @@ def gamma_t(day: datetime, state: str, params_dict: dict) -> float:
     return gamma
 
 
-def make_increasing(sequence: list) -> list:
+def get_gamma_t_array(
+        days: np.ndarray, data_start_dates: np.ndarray, median_day_of_action: np.ndarray, rate_of_action: np.ndarray,
+) -> np.ndarray:
+    """
+    Computes the values of gamma(t) (cf. gamma_t) for many (area, day) rows at once
+    :param days: array of the days (datetime64) on which we want to compute the values of gamma(t)
+    :param data_start_dates: array of the data start dates (datetime64) of the area of each row
+    :param median_day_of_action: array of the median days of action of the area of each row
+    :param rate_of_action: array of the rates of action of the area of each row
+    :return: array with the value of gamma(t) of each row
+    """
+    t = (days.astype("datetime64[D]") - data_start_dates.astype("datetime64[D]")) // np.timedelta64(1, "D")
+    return (2 / np.pi) * np.arctan(-(t - median_day_of_action) / 20 * rate_of_action) + 1
+
+
+def get_current_policy_per_area(policy_data: pd.DataFrame, column_area: str) -> dict:
+    """
+    Finds the MECE policy in place in each area on its last date in the policy data, in a single grouped pass
+    :param policy_data: processed dataframe with the MECE policies implemented per area for every day
+    :param column_area: column of policy_data identifying the areas
+    :return: dictionary {area: current_policy}; when an area has several rows on its last date, the first one is used
+    """
+    is_last_date = (policy_data["date"] == policy_data.groupby(column_area)["date"].transform("max")).values
+    policy_data_last_date = policy_data[is_last_date]
+    index_current_policy = np.argmax(policy_data_last_date[future_policies].values == 1, axis=1)
+    return pd.Series(
+        np.array(future_policies)[index_current_policy], index=policy_data_last_date[column_area].values
+    ).groupby(level=0, sort=False).first().to_dict()
+
+
+def get_normalized_policy_shifts(policy_data: pd.DataFrame, gamma: np.ndarray) -> dict:
+    """
+    Computes the mean value of gamma(t) on the days where each MECE policy is in place, normalized by that of the days
+    without any measure
+    :param policy_data: processed dataframe with the MECE policies implemented per area for every day
+    :param gamma: array with the value of gamma(t) on each row of policy_data
+    :return: dictionary {policy: normalized_shift_float}
+    """
+    array_policies = (policy_data[future_policies].values == 1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean_gamma_policies = (gamma @ array_policies) / array_policies.sum(axis=0)
+    return {
+        policy: mean_gamma_policies[i] / mean_gamma_policies[0] for i, policy in enumerate(future_policies)
+    }
+
+
+def get_clean_area_names(area_names: pd.Series) -> pd.Series:
+    """
+    :param area_names: series of country or province names
+    :return: names without commas and in lower case, used to match the policy data with the past parameters
+    """
+    return area_names.astype(str).str.replace(",", "").str.strip().str.lower()
+
+
+def get_confidence_intervals_bounds(
+        dict_predicted_outputs: dict, dict_residuals_rmse: dict, n_days_btw_today_since_100: Union[int, np.array],
+        q: float = 0.5, group_ids: Union[np.array, None] = None,
+) -> dict:
     """
-    Used to force the Confidence Intervals generated for DELPHI to be always increasing
-    :param sequence: list, sequence of values
-    :return: list, forcefully increasing sequence of values
+    Computes the lower and upper bounds of the Confidence Intervals for all predicted outputs at once: the residual of
+    the fitted output (cf. MAPPING_OUTPUT_TO_FITTED_OUTPUT) grows as the square root of the number of days since today,
+    is scaled by the ratio output/fitted output for non fitted outputs, and the lower bounds of cumulative outputs
+    are forced to be increasing
+    :param dict_predicted_outputs: dictionary {output: sequence of predicted values}, all of the same length
+    :param dict_residuals_rmse: dictionary {fitted output: RMSE of the past predictions}, NaN if not available; the
+    RMSE can also be given for each value of the sequences when they contain several areas (cf. group_ids)
+    :param n_days_btw_today_since_100: number of days between the first day of the sequences and today, or for each
+    value of the sequences the number of days between the first day of its area and today (cf. group_ids)
+    :param q: quantile used for the CIs
+    :param group_ids: if the sequences contain several areas, identifier of the area of each value, each area being
+    consecutive and sorted by day; None if the sequences correspond to a single area
+    :return: dictionary {"<output> LB": array, ..., "<output> UB": array, ...} with bounds for all days of the
+    sequences, integers if all residuals are available, otherwise floats with NaN where they are not
     """
-    for i in range(len(sequence)):
-        sequence[i] = max(sequence[i], sequence[max(i-1, 0)])
-    return sequence
+    outputs = list(dict_predicted_outputs.keys())
+    predicted_values = np.array([dict_predicted_outputs[output] for output in outputs], dtype=float)
+    n_values = predicted_values.shape[1]
+    fitted_values = np.array(
+        [dict_predicted_outputs[MAPPING_OUTPUT_TO_FITTED_OUTPUT[output]] for output in outputs], dtype=float
+    )
+    is_fitted_output = np.array([MAPPING_OUTPUT_TO_FITTED_OUTPUT[output] == output for output in outputs])
+    ratio_to_fitted = np.divide(
+        predicted_values, fitted_values, out=np.zeros_like(predicted_values), where=fitted_values != 0
+    )
+    ratio_to_fitted[is_fitted_output] = 1
+    residuals = np.array([
+        np.broadcast_to(np.asarray(dict_residuals_rmse[MAPPING_OUTPUT_TO_FITTED_OUTPUT[output]], dtype=float), n_values)
+        for output in outputs
+    ])
+    if group_ids is None:
+        day_positions = np.arange(n_values)
+    else:
+        group_ids = np.asarray(group_ids)
+        group_starts = np.flatnonzero(np.append(True, group_ids[1:] != group_ids[:-1]))
+        day_positions = np.arange(n_values) - np.repeat(group_starts, np.diff(np.append(group_starts, n_values)))
+    scaling_days = np.sqrt(np.maximum(day_positions - np.asarray(n_days_btw_today_since_100), 0))
+    spread = residuals * scaling_days[None, :] * ratio_to_fitted
+    is_cumulative_output = np.array([output in cumulative_outputs for output in outputs])
+    all_residuals_available = not np.isnan(residuals).any()
+    dict_bounds = {}
+    for bound, quantile in [("LB", 0.5 - q / 2), ("UB", 0.5 + q / 2)]:
+        values_bound = np.maximum(
+            np.round(predicted_values + spread * scipy.stats.norm.ppf(quantile), 0), 0
+        )
+        if bound == "LB" and is_cumulative_output.any():
+            if group_ids is None:
+                values_bound[is_cumulative_output] = np.maximum.accumulate(
+                    values_bound[is_cumulative_output], axis=1
+                )
+            else:
+                values_bound[is_cumulative_output] = pd.DataFrame(
+                    values_bound[is_cumulative_output].T
+                ).groupby(group_ids).cummax().values.T
+        if all_residuals_available:
+            values_bound = values_bound.astype(int)
+        for i, output in enumerate(outputs):
+            dict_bounds[f"{output} {bound}"] = values_bound[i]
+    return dict_bounds
 
 
 def get_normalized_policy_shifts_and_current_policy_us_only(
@@ -587,59 +584,29 @@ def get_normalized_policy_shifts_and_current_policy_us_only(
     values in the process
     :return: a tuple of two dictionaries, {policy: normalized_shift_float_US} and {US_state: current_policy}
     """
-    dict_current_policy = {}
-    policy_list = future_policies
-    policy_data_us_only["province_cl"] = policy_data_us_only["province"].apply(
-        lambda x: x.replace(",", "").strip().lower()
-    )
-    states_upper_set = set(policy_data_us_only["province"])
-    for state in states_upper_set:
-        dict_current_policy[("US", state)] = list(
-            compress(
-                policy_list,
-                (
-                    policy_data_us_only.query("province == @state")[
-                        policy_data_us_only.query("province == @state")["date"]
-                        == policy_data_us_only.date.max()
-                    ][policy_list]
-                    == 1
-                )
-                .values.flatten()
-                .tolist(),
-            )
-        )[0]
-    states_set = set(policy_data_us_only["province_cl"])
-    past_parameters_copy = deepcopy(past_parameters)
-    past_parameters_copy["Province"] = past_parameters_copy["Province"].apply(
-        lambda x: str(x).replace(",", "").strip().lower()
-    )
-    params_dic = {}
-    for state in states_set:
-        params_dic[state] = past_parameters_copy.query("Province == @state")[
-            ["Data Start Date", "Median Day of Action", "Rate of Action"]
-        ].iloc[0]
-
-    policy_data_us_only["Gamma"] = [
-        gamma_t(day, state, params_dic)
-        for day, state in zip(
-            policy_data_us_only["date"], policy_data_us_only["province_cl"]
-        )
-    ]
-    n_measures = policy_data_us_only.iloc[:, 3:-2].shape[1]
-    dict_normalized_policy_gamma = {
-        policy_data_us_only.columns[3 + i]: policy_data_us_only[
-            policy_data_us_only.iloc[:, 3 + i] == 1
-        ]
-        .iloc[:, -1]
-        .mean()
-        for i in range(n_measures)
+    dict_current_policy = {
+        ("US", state): policy
+        for state, policy in get_current_policy_per_area(
+            policy_data=policy_data_us_only[policy_data_us_only.date == policy_data_us_only.date.max()],
+            column_area="province",
+        ).items()
     }
-    normalize_val = dict_normalized_policy_gamma[policy_list[0]]
-    for policy in dict_normalized_policy_gamma.keys():
-        dict_normalized_policy_gamma[policy] = (
-            dict_normalized_policy_gamma[policy] / normalize_val
-        )
-
+    # Parameters of the first area of the past parameters with the same (cleaned) province name as each state
+    params_states = past_parameters.assign(
+        province_cl=get_clean_area_names(past_parameters["Province"])
+    ).drop_duplicates(subset="province_cl").set_index("province_cl")
+    states_cl = get_clean_area_names(policy_data_us_only["province"])
+    states_missing = set(states_cl).difference(params_states.index)
+    if len(states_missing) > 0:
+        raise KeyError(f"No past parameters for the US states {sorted(states_missing)}")
+    index_params_states = params_states.index.get_indexer(states_cl)
+    gamma = get_gamma_t_array(
+        days=policy_data_us_only["date"].values.astype("datetime64[D]"),
+        data_start_dates=pd.to_datetime(params_states["Data Start Date"]).values[index_params_states],
+        median_day_of_action=params_states["Median Day of Action"].values[index_params_states],
+        rate_of_action=params_states["Rate of Action"].values[index_params_states],
+    )
+    dict_normalized_policy_gamma = get_normalized_policy_shifts(policy_data=policy_data_us_only, gamma=gamma)
     return dict_normalized_policy_gamma, dict_current_policy
 
 
@@ -654,84 +621,45 @@ def get_normalized_policy_shifts_and_current_policy_all_countries(
     values in the process
     :return: a tuple of two dictionaries, {policy: normalized_shift_float_international} and {area: current_policy}
     """
-    dict_current_policy = {}
-    policy_list = future_policies
-    policy_data_countries["country_cl"] = policy_data_countries["country"].apply(
-        lambda x: x.replace(",", "").strip().lower()
-    )
-    past_parameters_copy = deepcopy(past_parameters)
-    past_parameters_copy["Country"] = past_parameters_copy["Country"].apply(
-        lambda x: str(x).replace(",", "").strip().lower()
+    dict_current_policy_countries = get_current_policy_per_area(
+        policy_data=policy_data_countries[policy_data_countries.country != "US"], column_area="country",
     )
-    params_countries = past_parameters_copy["Country"]
-    params_countries = set(params_countries)
-    policy_data_countries_bis = policy_data_countries.query(
-        "country_cl in @params_countries"
+    dict_current_policy = {
+        (country, "None"): policy for country, policy in dict_current_policy_countries.items()
+    }
+    # The provinces of the countries of the policy data get the current policy of their country
+    dict_country_cl_to_country = {
+        country_cl: country for country, country_cl in zip(
+            dict_current_policy_countries.keys(), get_clean_area_names(pd.Series(list(dict_current_policy_countries)))
+        )
+    }
+    countries_cl_params = get_clean_area_names(past_parameters["Country"])
+    for country_cl, province in pd.DataFrame({
+        "country_cl": countries_cl_params, "province": past_parameters["Province"]
+    })[
+        countries_cl_params.isin(list(dict_country_cl_to_country.keys())) & (past_parameters["Province"] != "None")
+    ].drop_duplicates().itertuples(index=False):
+        country = dict_country_cl_to_country[country_cl]
+        dict_current_policy[(country, province)] = dict_current_policy[(country, "None")]
+
+    # Parameters of the first area of the past parameters in each country
+    params_countries = past_parameters.assign(country_cl=countries_cl_params).drop_duplicates(
+        subset="country_cl"
+    ).set_index("country_cl")
+    index_params_countries = params_countries.index.get_indexer(
+        get_clean_area_names(policy_data_countries["country"])
     )
-    countries_upper_set = set(
-        policy_data_countries[policy_data_countries.country != "US"]["country"]
+    has_params = index_params_countries >= 0
+    index_params_countries = index_params_countries[has_params]
+    gamma = get_gamma_t_array(
+        days=policy_data_countries["date"].values[has_params].astype("datetime64[D]"),
+        data_start_dates=pd.to_datetime(params_countries["Data Start Date"]).values[index_params_countries],
+        median_day_of_action=params_countries["Median Day of Action"].values[index_params_countries],
+        rate_of_action=params_countries["Rate of Action"].values[index_params_countries],
     )
-    # countries_in_oxford_and_params = params_countries.intersection(countries_upper_set)
-    for country in countries_upper_set:
-        dict_current_policy[(country, "None")] = list(
-            compress(
-                policy_list,
-                (
-                    policy_data_countries.query("country == @country")[
-                        policy_data_countries.query("country == @country")["date"]
-                        == policy_data_countries.query("country == @country").date.max()
-                    ][policy_list]
-                    == 1
-                )
-                .values.flatten()
-                .tolist(),
-            )
-        )[0]
-    countries_common = sorted([x.lower() for x in countries_upper_set])
-    pastparam_tuples_in_oxford = past_parameters_copy[
-        (past_parameters_copy.Country.isin(countries_common))
-        & (past_parameters_copy.Province != "None")
-    ].reset_index(drop=True)
-    pastparam_tuples_in_oxford["tuple_name"] = list(
-        zip(pastparam_tuples_in_oxford.Country, pastparam_tuples_in_oxford.Province)
+    dict_normalized_policy_gamma = get_normalized_policy_shifts(
+        policy_data=policy_data_countries[has_params], gamma=gamma
     )
-    for tuple in pastparam_tuples_in_oxford.tuple_name.unique():
-        country, province = tuple
-        country = country[0].upper() + country[1:]
-        dict_current_policy[(country, province)] = dict_current_policy[
-            (country, "None")
-        ]
-
-    countries_set = set(policy_data_countries["country_cl"])
-
-    params_dic = {}
-    countries_set = countries_set.intersection(params_countries)
-    for country in countries_set:
-        params_dic[country] = past_parameters_copy.query("Country == @country")[
-            ["Data Start Date", "Median Day of Action", "Rate of Action"]
-        ].iloc[0]
-
-    policy_data_countries_bis["Gamma"] = [
-        gamma_t(day, country, params_dic)
-        for day, country in zip(
-            policy_data_countries_bis["date"], policy_data_countries_bis["country_cl"]
-        )
-    ]
-    n_measures = policy_data_countries_bis.iloc[:, 3:-2].shape[1]
-    dict_normalized_policy_gamma = {
-        policy_data_countries_bis.columns[3 + i]: policy_data_countries_bis[
-            policy_data_countries_bis.iloc[:, 3 + i] == 1
-        ]
-        .iloc[:, -1]
-        .mean()
-        for i in range(n_measures)
-    }
-    normalize_val = dict_normalized_policy_gamma[policy_list[0]]
-    for policy in dict_normalized_policy_gamma.keys():
-        dict_normalized_policy_gamma[policy] = (
-            dict_normalized_policy_gamma[policy] / normalize_val
-        )
-
     return dict_normalized_policy_gamma, dict_current_policy
 
 
@@ -745,22 +673,59 @@ def get_testing_data_us() -> pd.DataFrame:
     df_test["country"] = "US"
     df_test["continent"] = "North America"
     df_test["province"] = df_test.state.map(MAPPING_STATE_CODE_TO_STATE_NAME)
-    df_test.drop("state", axis=1, inplace=True)
-    df_test["date"] = df_test.date.apply(
-        lambda x: str(x)[:4] + "-" + str(x)[4:6] + "-" + str(x)[6:]
-    )
-    df_test["date"] = pd.to_datetime(df_test.date)
-    df_test = df_test.sort_values(["province", "date"]).reset_index(drop=True)
+    df_test["date"] = pd.to_datetime(df_test.date.astype(str), format="%Y%m%d")
+    # Territories without a state name are left out
+    df_test = df_test[df_test.province.notnull()].sort_values(["province", "date"]).reset_index(drop=True)
     df_test = df_test[["continent", "country", "province", "date", "totalTestResults"]]
-    df_test.rename(columns={"totalTestResults": "testing_cnt"}, inplace=True)
-    list_df_concat = []
-    for state in df_test.province.unique():
-        df_temp = df_test[df_test.province == state].reset_index(drop=True)
-        df_temp["testing_cnt_shift"] = df_temp.testing_cnt.shift(1)
-        df_temp["testing_cnt_daily"] = df_temp.testing_cnt - df_temp.testing_cnt_shift
-        df_temp.loc[0, "testing_cnt_daily"] = df_temp.loc[0, "testing_cnt"]
-        list_df_concat.append(df_temp)
-
-    df_test_final = pd.concat(list_df_concat).reset_index(drop=True)
-    df_test_final.drop(["testing_cnt", "testing_cnt_shift"], axis=1, inplace=True)
+    # Daily tests are the differences of the total number of tests, except on the first day of each state
+    testing_cnt_daily = df_test.groupby("province", sort=False).totalTestResults.diff()
+    is_first_day = ~df_test.province.duplicated()
+    testing_cnt_daily[is_first_day] = df_test.totalTestResults[is_first_day]
+    df_test_final = df_test.drop("totalTestResults", axis=1)
+    df_test_final["testing_cnt_daily"] = testing_cnt_daily
     return df_test_final
+
+
+def get_testing_data_arrays_us(df_testing_us: pd.DataFrame) -> dict:
+    """
+    Converts the daily testing data of each state into a contiguous array over consecutive days, so that the models
+    can read it with get_testing_daily_value instead of building a dictionary {t: daily_tests} for each area
+    :param df_testing_us: dataframe with the daily tests of each state, cf. get_testing_data_us
+    :return: dictionary {state: (first date, array of the daily tests from that date)}, days missing in the data
+    having 0 tests since the tests of a gap are counted on the next day with data (difference of the total tests)
+    """
+    dict_testing_data_arrays = {}
+    for province, df_testing_province in df_testing_us.groupby("province", sort=False):
+        testing_cnt_daily = df_testing_province.set_index("date").testing_cnt_daily.asfreq("D", fill_value=0)
+        dict_testing_data_arrays[province] = (
+            testing_cnt_daily.index[0], np.ascontiguousarray(testing_cnt_daily.values, dtype=np.float64)
+        )
+    return dict_testing_data_arrays
+
+
+def get_testing_data_array_area(dict_testing_data_arrays: dict, province: str, date_start: datetime) -> np.ndarray:
+    """
+    :param dict_testing_data_arrays: dictionary of the testing data arrays, cf. get_testing_data_arrays_us
+    :param province: state of the area
+    :param date_start: date corresponding to t=0 in the model of the area, e.g. its 100th case
+    :return: contiguous array of the daily tests of the area from date_start, index t being the tests on day t
+    """
+    date_first, testing_cnt_daily = dict_testing_data_arrays[province]
+    return testing_cnt_daily[max((pd.to_datetime(date_start) - date_first).days, 0):]
+
+
+def get_testing_daily_value(t: float, testing_cnt_daily: np.ndarray) -> float:
+    """
+    Reads the number of daily tests at (continuous) time t of the model from the array of an area as a step function:
+    day int(t) is used within a day, the first/last day before/after the data. It only uses scalar operations and array
+    indexing so that it can be called from a compiled right-hand side of the model (e.g. with numba)
+    :param t: time in the model, in days since the first day of the array
+    :param testing_cnt_daily: array of the daily tests of the area, cf. get_testing_data_array_area
+    :return: number of daily tests at time t
+    """
+    index_day = int(t)
+    if index_day < 0:
+        index_day = 0
+    elif index_day > len(testing_cnt_daily) - 1:
+        index_day = len(testing_cnt_daily) - 1
+    return testing_cnt_daily[index_day]
@@ -0,0 +1,133 @@
+# Authors: Hamza Tazi Bouardi (htazi@mit.edu), Michael L. Li (mlli@mit.edu), Omar Skali Lami (oskali@mit.edu)
+import pandas as pd
+import numpy as np
+from datetime import timedelta
+from typing import Union
+
+
+class DELPHIAreaRegistry:
+    """
+    Population and past parameters of all areas, read once and indexed by (country, province) so that the fitting
+    of each area looks them up in a dictionary instead of filtering the full tables
+    """
+    def __init__(self, popcountries: pd.DataFrame, past_parameters: Union[pd.DataFrame, None] = None):
+        # pandas reads the "None" provinces of countries as NaN, they are kept as "None" to look up the areas
+        popcountries = popcountries.assign(Province=popcountries.Province.fillna("None"))
+        if past_parameters is not None:
+            past_parameters = past_parameters.assign(Province=past_parameters.Province.fillna("None"))
+        self.popcountries = popcountries
+        self.past_parameters = past_parameters
+        # Last row kept for duplicated areas, as with the .iloc[-1] on the filtered tables
+        self.dict_population = dict(zip(zip(popcountries.Country, popcountries.Province), popcountries.pop2016))
+        if past_parameters is not None:
+            self.past_parameters_values = past_parameters.values
+            self.dict_past_parameters_rows = {
+                area: i for i, area in enumerate(zip(past_parameters.Country, past_parameters.Province))
+            }
+        else:
+            self.past_parameters_values = None
+            self.dict_past_parameters_rows = {}
+
+    @classmethod
+    def from_files(
+            cls, path_population_file: str, path_past_parameters_file: Union[str, None] = None,
+            read_past_parameters=pd.read_csv,
+    ):
+        """
+        Reads the population file and the past parameters file (if it exists) and indexes them
+        :param path_population_file: path to Population_Global.csv
+        :param path_past_parameters_file: path to the parameters file of a previous run, None if not used
+        :param read_past_parameters: function used to read the past parameters file, e.g. read_dataframe_prefer_columnar
+        :return: a DELPHIAreaRegistry instance, without past parameters if their file couldn't be read
+        """
+        popcountries = pd.read_csv(path_population_file)
+        past_parameters = None
+        if path_past_parameters_file is not None:
+            try:
+                past_parameters = read_past_parameters(path_past_parameters_file)
+            except (OSError, ValueError):
+                past_parameters = None
+        return cls(popcountries=popcountries, past_parameters=past_parameters)
+
+    def get_list_tuples_areas(self) -> list:
+        """
+        :return: list of all the areas (continent, country, province) of the population file, in the same order
+        """
+        return list(zip(self.popcountries.Continent, self.popcountries.Country, self.popcountries.Province))
+
+    def get_areas_eligibility(
+            self, dict_cases_areas: dict, yesterday: str, validcases_threshold: int
+    ) -> pd.DataFrame:
+        """
+        Checks up front which areas can be fitted, so that only these are sent to the workers: the area must have case
+        data, have reached 100 cases and have more than validcases_threshold days of data since then (up to
+        yesterday + 1 day)
+        :param dict_cases_areas: case data of all areas read at once, cf. DELPHICaseStore.read_cases_per_area
+        :param yesterday: string corresponding to the date of the run, format 'YYYYMMDD'
+        :param validcases_threshold: minimum number of days (excluded) with at least 100 cases required to fit an area
+        :return: dataframe with one row per area (same order as the population file) with the last day_since100, the
+        number of valid days, whether the area is eligible and otherwise the reason why it is skipped
+        """
+        date_last_valid = str((pd.to_datetime(yesterday) + timedelta(days=1)).date())
+        dict_eligibility = {
+            "Continent": [], "Country": [], "Province": [], "Last Day Since 100": [], "Number Valid Days": [],
+            "Eligible": [], "Skip Reason": [],
+        }
+        for continent, country, province in self.get_list_tuples_areas():
+            last_day_since100, n_valid_days, skip_reason = None, 0, None
+            totalcases = dict_cases_areas.get((country, province))
+            if totalcases is None:
+                skip_reason = "No processed case file"
+            else:
+                last_day_since100 = totalcases.day_since100.max()
+                n_valid_days = int(((totalcases.day_since100 >= 0) & (totalcases.date <= date_last_valid)).sum())
+                if last_day_since100 < 0:
+                    skip_reason = "Not enough cases (less than 100)"
+                elif n_valid_days <= validcases_threshold:
+                    skip_reason = "Not enough historical data (less than a week)"
+            dict_eligibility["Continent"].append(continent)
+            dict_eligibility["Country"].append(country)
+            dict_eligibility["Province"].append(province)
+            dict_eligibility["Last Day Since 100"].append(last_day_since100)
+            dict_eligibility["Number Valid Days"].append(n_valid_days)
+            dict_eligibility["Eligible"].append(skip_reason is None)
+            dict_eligibility["Skip Reason"].append(skip_reason if skip_reason is not None else "None")
+        return pd.DataFrame(dict_eligibility)
+
+    def get_population(self, country: str, province: str) -> float:
+        """
+        :param country: country of the area
+        :param province: province of the area, "None" for countries
+        :return: population of the area, raises a KeyError if the area is not in the population file
+        """
+        try:
+            return self.dict_population[(country, province)]
+        except KeyError:
+            raise KeyError(f"No population available for Country={country} and Province={province}")
+
+    def has_past_parameters(self, country: str, province: str) -> bool:
+        return (country, province) in self.dict_past_parameters_rows
+
+    def get_past_parameters_line(self, country: str, province: str) -> Union[list, None]:
+        """
+        :param country: country of the area
+        :param province: province of the area, "None" for countries
+        :return: row of the past parameters file for that area as a list (Continent, Country, Province, Data Start
+        Date, MAPE and the fitted parameters), None if the area has no past parameters
+        """
+        row = self.dict_past_parameters_rows.get((country, province))
+        if row is None:
+            return None
+        return self.past_parameters_values[row].tolist()
+
+    def get_past_parameters_array(self, list_areas: list) -> np.ndarray:
+        """
+        :param list_areas: list of (country, province) areas
+        :return: array (areas x 11) of the fitted parameters of each area in the past parameters file, NaN for the
+        areas without past parameters
+        """
+        array_parameters = np.full((len(list_areas), 11), np.nan)
+        rows = np.array([self.dict_past_parameters_rows.get(area, -1) for area in list_areas], dtype=int)
+        if len(rows) > 0 and (rows >= 0).any():
+            array_parameters[rows >= 0] = self.past_parameters_values[rows[rows >= 0], 5:].astype(float)
+        return array_parameters
@@ -2,17 +2,39 @@
 import os
 import pandas as pd
 import numpy as np
-import scipy.stats
+import scipy.sparse
 from datetime import datetime, timedelta
-from typing import Union
+from typing import Union, NamedTuple, Iterable
 import json
+import gzip
+import tempfile
+from contextlib import ExitStack
 from logging import Logger
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # Python < 3.8, trajectories are then sent back with the results of each area
+    shared_memory = None
 from DELPHI_params_V3 import (
     TIME_DICT,
+    DELPHI_STATES,
+    MAPPING_OUTPUT_TO_STATES,
     default_policy,
     default_policy_enaction_time,
 )
-from DELPHI_utils_V3_dynamic import make_increasing
+from DELPHI_utils_V3_dynamic import get_confidence_intervals_bounds
+
+# Columns stored as categories & as integer days in the columnar (Parquet) files
+columns_categorical_columnar = ["Continent", "Country", "Province", "Policy", "Time"]
+columns_dates_columnar = ["Day", "Data Start Date"]
 
 
 class DELPHIDataSaver:
@@ -32,8 +54,25 @@ class DELPHIDataSaver:
             df_global_predictions_since_100_cases
         )
 
+    @staticmethod
+    def get_subname_file(optimizer: str) -> str:
+        """
+        Gets the name used in the predictions & parameters files depending on the optimizer used
+        :param optimizer: needs to be in (tnc, trust-constr, annealing)
+        :return: a string, the name used in the predicted files for that optimizer
+        """
+        if optimizer == "tnc":
+            subname_file = "Global_V2"
+        elif optimizer == "annealing":
+            subname_file = "Global_V2_annealing"
+        elif optimizer == "trust-constr":
+            subname_file = "Global_V2_trust"
+        else:
+            raise ValueError("Optimizer not supported in this implementation")
+        return subname_file
+
     def save_all_datasets(
-            self, optimizer: str, save_since_100_cases: bool = False, website: bool = False
+            self, optimizer: str, save_since_100_cases: bool = False, website: bool = False, columnar: bool = True,
     ):
         """
         Saves the parameters and predictions datasets (since 100 cases and since the day of running)
@@ -43,173 +82,769 @@ class DELPHIDataSaver:
         :param save_since_100_cases: boolean, whether or not we also want to save the predictions since 100 cases
         for all the areas (instead of since the day we actually ran the optimization)
         :param website: boolean, whether or not we want to save the files in the website repository as well
+        :param columnar: boolean, whether or not we also want to save the files of the danger_map folder in the typed
+        columnar format (Parquet, only if pyarrow is installed) which is then read in priority by the next runs
         :return:
         """
         today_date_str = "".join(str(datetime.now().date()).split("-"))
-        if optimizer == "tnc":
-            subname_file = "Global_V2"
-        elif optimizer == "annealing":
-            subname_file = "Global_V2_annealing"
-        elif optimizer == "trust-constr":
-            subname_file = "Global_V2_trust"
-        else:
-            raise ValueError("Optimizer not supported in this implementation")
+        subname_file = DELPHIDataSaver.get_subname_file(optimizer)
+        columnar = columnar and (pyarrow is not None)
+        # Predictions may have compact dtypes (cf. compact_dataframe), only converted to text for the CSV files
+        df_global_predictions_since_today_text = get_dataframe_as_text(self.df_global_predictions_since_today)
         # Save parameters
         self.df_global_parameters.to_csv(
             self.PATH_TO_FOLDER_DANGER_MAP + f"/predicted/Parameters_{subname_file}_{today_date_str}.csv",
             index=False,
             )
         # Save predictions since today
-        self.df_global_predictions_since_today.to_csv(
+        df_global_predictions_since_today_text.to_csv(
             self.PATH_TO_FOLDER_DANGER_MAP + f"/predicted/{subname_file}_{today_date_str}.csv",
             index=False,
             )
+        if columnar:
+            save_dataframe_columnar(
+                self.df_global_parameters,
+                self.PATH_TO_FOLDER_DANGER_MAP + f"/predicted/Parameters_{subname_file}_{today_date_str}.csv",
+            )
+            save_dataframe_columnar(
+                self.df_global_predictions_since_today,
+                self.PATH_TO_FOLDER_DANGER_MAP + f"/predicted/{subname_file}_{today_date_str}.csv",
+            )
         if website:
             self.df_global_parameters.to_csv(
                 self.PATH_TO_WEBSITE_PREDICTED + f"data/predicted/Parameters_{subname_file}_{today_date_str}.csv",
                 index=False,
                 )
-            self.df_global_predictions_since_today.to_csv(
+            df_global_predictions_since_today_text.to_csv(
                 self.PATH_TO_WEBSITE_PREDICTED
                 + f"data/predicted/{subname_file}_{today_date_str}.csv",
                 index=False,
                 )
-            self.df_global_predictions_since_today.to_csv(
+            df_global_predictions_since_today_text.to_csv(
                 self.PATH_TO_WEBSITE_PREDICTED + f"data/predicted/Global.csv",
                 index=False,
                 )
         if save_since_100_cases:
             # Save predictions since 100 cases
-            self.df_global_predictions_since_100_cases.to_csv(
+            df_global_predictions_since_100_cases_text = get_dataframe_as_text(
+                self.df_global_predictions_since_100_cases
+            )
+            df_global_predictions_since_100_cases_text.to_csv(
                 self.PATH_TO_FOLDER_DANGER_MAP + f"/predicted/{subname_file}_since100_{today_date_str}.csv",
                 index=False,
                 )
+            if columnar:
+                save_dataframe_columnar(
+                    self.df_global_predictions_since_100_cases,
+                    self.PATH_TO_FOLDER_DANGER_MAP + f"/predicted/{subname_file}_since100_{today_date_str}.csv",
+                )
             if website:
-                self.df_global_predictions_since_100_cases.to_csv(
+                df_global_predictions_since_100_cases_text.to_csv(
                     self.PATH_TO_WEBSITE_PREDICTED + f"data/predicted/{subname_file}_since100_{today_date_str}.csv",
                     index=False,
                     )
-                self.df_global_predictions_since_100_cases.to_csv(
+                df_global_predictions_since_100_cases_text.to_csv(
                     self.PATH_TO_WEBSITE_PREDICTED + f"data/predicted/{subname_file}_since100.csv",
                     index=False,
                     )
 
-    def save_policy_predictions_to_json(self, website: bool = False, local_delphi: bool = False):
+    def save_policy_predictions_to_json(
+            self, website: bool = False, local_delphi: bool = False, compression_formats: Union[list, None] = None,
+            scenario_stream_writer=None,
+    ):
         """
         Saves the policy predictions as a JSON file based on the different flags
         :param website: boolean, whether or not we want to save the JSON file in the website repository as well
         :param local_delphi: boolean, whether or not we want to save the JSON file in the DELPHI repository as well
+        :param compression_formats: list of precompressed variants also saved next to each JSON file, among "gzip"
+        (.json.gz) and "brotli" (.json.br, requires the brotli package)
+        :param scenario_stream_writer: DELPHIScenarioStreamWriter to which the policy predictions were streamed, in
+        which case the JSON file is assembled area by area (bounded memory) instead of from the predictions dataframe
         :return:
         """
         today_date_str = "".join(str(datetime.now().date()).split("-"))
-        dict_predictions_policies_world_since_100_cases = DELPHIDataSaver.create_nested_dict_from_final_dataframe(
-            self.df_global_predictions_since_100_cases
+        list_paths_json = [
+            self.PATH_TO_FOLDER_DANGER_MAP + f"/predicted/world_Python_{today_date_str}_Scenarios_since_100_cases.json",
+            self.PATH_TO_FOLDER_DANGER_MAP + f"/predicted/world_Python_Scenarios_since_100_cases.json",
+        ]
+        if local_delphi:
+            list_paths_json.append(f"./world_Python_{today_date_str}_Scenarios_since_100_cases.json")
+        if website:
+            list_paths_json.append(self.PATH_TO_WEBSITE_PREDICTED + f"assets/policies/World_Scenarios.json")
+        if scenario_stream_writer is not None:
+            DELPHIDataSaver.write_json_chunks_to_all_paths(
+                scenario_stream_writer.iterate_json_chunks(),
+                list_paths_json=list_paths_json,
+                compression_formats=compression_formats,
+            )
+        else:
+            dict_predictions_policies_world_since_100_cases = DELPHIDataSaver.create_nested_dict_from_final_dataframe(
+                self.df_global_predictions_since_100_cases
+            )
+            DELPHIDataSaver.write_json_to_all_paths(
+                dict_predictions_policies_world_since_100_cases,
+                list_paths_json=list_paths_json,
+                compression_formats=compression_formats,
+            )
+
+    @staticmethod
+    def write_json_to_all_paths(
+            dict_to_save: dict, list_paths_json: list, compression_formats: Union[list, None] = None,
+            chunk_size: int = 1 << 20, compact: bool = False,
+    ) -> None:
+        """
+        Serializes a dictionary as JSON only once, streaming the encoded chunks to all the destination files (and
+        their precompressed variants) at the same time; the JSON written is the same as with json.dump
+        :param dict_to_save: dictionary to save as JSON
+        :param list_paths_json: list of paths of the JSON files to write
+        :param compression_formats: list of precompressed variants also written for each path, among "gzip"
+        (path + ".gz") and "brotli" (path + ".br")
+        :param chunk_size: number of characters buffered before being written to the files
+        :param compact: whether to remove the whitespaces after the JSON separators
+        :return: None
+        """
+        json_encoder = json.JSONEncoder(separators=(",", ":")) if compact else json.JSONEncoder()
+        DELPHIDataSaver.write_json_chunks_to_all_paths(
+            json_encoder.iterencode(dict_to_save), list_paths_json=list_paths_json,
+            compression_formats=compression_formats, chunk_size=chunk_size,
         )
-        with open(
-                self.PATH_TO_FOLDER_DANGER_MAP
-                + f"/predicted/world_Python_{today_date_str}_Scenarios_since_100_cases.json",
-                "w",
-        ) as handle:
-            json.dump(dict_predictions_policies_world_since_100_cases, handle)
-
-        with open(
-                self.PATH_TO_FOLDER_DANGER_MAP
-                + f"/predicted/world_Python_Scenarios_since_100_cases.json",
-                "w",
-        ) as handle:
-            json.dump(dict_predictions_policies_world_since_100_cases, handle)
 
-        if local_delphi:
-            with open(
-                    f"./world_Python_{today_date_str}_Scenarios_since_100_cases.json", "w"
-            ) as handle:
-                json.dump(dict_predictions_policies_world_since_100_cases, handle)
+    @staticmethod
+    def write_json_chunks_to_all_paths(
+            json_chunks: Iterable, list_paths_json: list, compression_formats: Union[list, None] = None,
+            chunk_size: int = 1 << 20,
+    ) -> None:
+        """
+        Streams already encoded JSON chunks to all the destination files (and their precompressed variants)
+        :param json_chunks: iterable of strings which concatenated form the JSON document
+        :param list_paths_json: list of paths of the JSON files to write
+        :param compression_formats: list of precompressed variants also written for each path, among "gzip"
+        (path + ".gz") and "brotli" (path + ".br")
+        :param chunk_size: number of characters buffered before being written to the files
+        :return: None
+        """
+        compression_formats = compression_formats if compression_formats is not None else []
+        for compression_format in compression_formats:
+            if compression_format not in ["gzip", "brotli"]:
+                raise ValueError(f"Compression format {compression_format} not supported, use 'gzip' or 'brotli'")
+        if ("brotli" in compression_formats) and (brotli is None):
+            raise ImportError("The brotli package is required to save brotli-compressed JSON files")
+        with ExitStack() as stack:
+            list_handles, list_brotli_handles = [], []
+            for path_json in list_paths_json:
+                list_handles.append(stack.enter_context(open(path_json, "wb")))
+                if "gzip" in compression_formats:
+                    list_handles.append(stack.enter_context(gzip.open(path_json + ".gz", "wb")))
+                if "brotli" in compression_formats:
+                    list_brotli_handles.append((stack.enter_context(open(path_json + ".br", "wb")), brotli.Compressor()))
+
+            def write_to_all_handles(bytes_to_write: bytes):
+                for handle in list_handles:
+                    handle.write(bytes_to_write)
+                for handle, compressor in list_brotli_handles:
+                    handle.write(compressor.process(bytes_to_write))
+
+            list_chunks, n_characters = [], 0
+            for chunk in json_chunks:
+                list_chunks.append(chunk)
+                n_characters += len(chunk)
+                if n_characters >= chunk_size:
+                    write_to_all_handles("".join(list_chunks).encode("utf-8"))
+                    list_chunks, n_characters = [], 0
+            write_to_all_handles("".join(list_chunks).encode("utf-8"))
+            for handle, compressor in list_brotli_handles:
+                handle.write(compressor.finish())
+
+    def save_predictions_to_json_shards(
+            self, optimizer: str, website: bool = False, countries: Union[list, None] = None,
+            compression_formats: Union[list, None] = None,
+    ):
+        """
+        Saves the predictions since today as one compact JSON file per country along with a manifest (index.json),
+        so that only the countries displayed have to be fetched
+        :param optimizer: needs to be in (tnc, trust-constr, annealing), used in the name of the shards' folder
+        :param website: boolean, whether or not we want to save the shards in the website repository as well
+        :param countries: list of countries to (re)write, the manifest being updated for them only; None for all
+        :param compression_formats: list of precompressed variants also saved for each shard, cf. write_json_to_all_paths
+        :return:
+        """
+        subname_file = DELPHIDataSaver.get_subname_file(optimizer)
+        dict_shards = DELPHIDataSaver.create_dict_shards_from_predictions(self.df_global_predictions_since_today)
+        list_paths_folders = [self.PATH_TO_FOLDER_DANGER_MAP + f"/predicted/{subname_file}_shards/"]
+        if website:
+            list_paths_folders.append(self.PATH_TO_WEBSITE_PREDICTED + f"data/predicted/{subname_file}_shards/")
+        for path_to_folder in list_paths_folders:
+            DELPHIDataSaver.write_shards_per_country(
+                dict_shards, path_to_folder=path_to_folder, countries=countries,
+                compression_formats=compression_formats,
+            )
 
+    def save_policy_predictions_to_json_shards(
+            self, website: bool = False, countries: Union[list, None] = None,
+            compression_formats: Union[list, None] = None, scenario_stream_writer=None,
+    ):
+        """
+        Saves the policy predictions as one compact JSON file per country along with a manifest (index.json), with
+        the same nested structure per country as in the World_Scenarios JSON file
+        :param website: boolean, whether or not we want to save the shards in the website repository as well
+        :param countries: list of countries to (re)write, the manifest being updated for them only; None for all
+        :param compression_formats: list of precompressed variants also saved for each shard, cf. write_json_to_all_paths
+        :param scenario_stream_writer: DELPHIScenarioStreamWriter to which the policy predictions were streamed, in
+        which case the shards are loaded one country at a time instead of from the predictions dataframe
+        :return:
+        """
+        if scenario_stream_writer is None:
+            dict_predictions_policies_world_since_100_cases = DELPHIDataSaver.create_nested_dict_from_final_dataframe(
+                self.df_global_predictions_since_100_cases
+            )
+            dict_shards = {
+                (continent, country): dict_country
+                for continent, dict_continent in dict_predictions_policies_world_since_100_cases.items()
+                for country, dict_country in dict_continent.items()
+            }
+        list_paths_folders = [self.PATH_TO_FOLDER_DANGER_MAP + f"/predicted/World_Scenarios_shards/"]
         if website:
-            with open(
-                    self.PATH_TO_WEBSITE_PREDICTED
-                    + f"assets/policies/World_Scenarios.json",
-                    "w",
-            ) as handle:
-                json.dump(dict_predictions_policies_world_since_100_cases, handle)
+            list_paths_folders.append(self.PATH_TO_WEBSITE_PREDICTED + f"assets/policies/World_Scenarios_shards/")
+        for path_to_folder in list_paths_folders:
+            DELPHIDataSaver.write_shards_per_country(
+                scenario_stream_writer.iterate_shards() if scenario_stream_writer is not None else dict_shards,
+                path_to_folder=path_to_folder, countries=countries, compression_formats=compression_formats,
+            )
+
+    @staticmethod
+    def write_shards_per_country(
+            dict_shards: Union[dict, Iterable], path_to_folder: str, countries: Union[list, None] = None,
+            compression_formats: Union[list, None] = None,
+    ) -> dict:
+        """
+        Writes one compact JSON file per country in the folder {continent}/{country}.json and the manifest index.json
+        listing all shards; when only some countries are written, the existing manifest is updated for them only. The
+        continent and world aggregations (country "None") are written to aggregates/{continent}.json and
+        aggregates/World.json, listed in the "aggregates" of the manifest, and are always rewritten
+        :param dict_shards: dictionary {(continent, country): content of the shard, with the provinces as keys}, or an
+        iterable of ((continent, country), content of the shard) to write the shards one at a time
+        :param path_to_folder: path to the folder where the shards and the manifest are saved
+        :param countries: list of countries to (re)write; None for all
+        :param compression_formats: list of precompressed variants also saved for each shard, cf. write_json_to_all_paths
+        :return: the manifest saved, as a dictionary
+        """
+        today_date_str = str(datetime.now().date())
+        path_manifest = os.path.join(path_to_folder, "index.json")
+        if (countries is not None) and os.path.exists(path_manifest):
+            with open(path_manifest, "r") as handle:
+                dict_manifest = json.load(handle)
+        else:
+            dict_manifest = {"updated": today_date_str, "shards": {}}
+        shards = dict_shards.items() if isinstance(dict_shards, dict) else dict_shards
+        for (continent, country), dict_country in shards:
+            if country == "None":
+                name_aggregate = "World" if continent == "None" else continent
+                folder_shard, filename_shard = "aggregates", name_aggregate.replace(" ", "_") + ".json"
+                dict_manifest_shards = dict_manifest.setdefault("aggregates", {})
+                key_shard = name_aggregate
+            elif (countries is not None) and (country not in countries):
+                continue
+            else:
+                folder_shard, filename_shard = continent.replace(" ", "_"), country.replace(" ", "_") + ".json"
+                dict_manifest_shards = dict_manifest["shards"].setdefault(continent, {})
+                key_shard = country
+            if not os.path.exists(os.path.join(path_to_folder, folder_shard)):
+                os.makedirs(os.path.join(path_to_folder, folder_shard))
+            DELPHIDataSaver.write_json_to_all_paths(
+                dict_country,
+                list_paths_json=[os.path.join(path_to_folder, folder_shard, filename_shard)],
+                compression_formats=compression_formats,
+                compact=True,
+            )
+            dict_manifest_shards[key_shard] = {
+                "path": f"{folder_shard}/{filename_shard}",
+                "provinces": list(dict_country.keys()),
+                "compression_formats": compression_formats if compression_formats is not None else [],
+                "updated": today_date_str,
+            }
+        dict_manifest["updated"] = today_date_str
+        DELPHIDataSaver.write_json_to_all_paths(dict_manifest, list_paths_json=[path_manifest], compact=True)
+        return dict_manifest
+
+    @staticmethod
+    def create_dict_shards_from_predictions(df_predictions: pd.DataFrame) -> dict:
+        """
+        Splits the predictions per country in a single pass over the predictions sorted by area and day
+        :param df_predictions: dataframe with the predictions (raw and aggregated)
+        :return: dictionary {(continent, country): {province: {column: list of values sorted by day}}}
+        """
+        area_columns = ["Continent", "Country", "Province"]
+        df_predictions = get_dataframe_as_text(df_predictions).sort_values(area_columns + ["Day"], kind="mergesort")
+        area_keys = df_predictions[area_columns].values
+        is_new_area = np.append(True, (area_keys[1:] != area_keys[:-1]).any(axis=1))
+        area_starts = np.flatnonzero(is_new_area)
+        area_ends = np.append(area_starts[1:], len(df_predictions))
+        value_columns = [x for x in df_predictions.columns if x not in area_columns]
+        dict_values = {column: df_predictions[column].values for column in value_columns}
+        dict_shards = {}
+        for area_start, area_end in zip(area_starts, area_ends):
+            continent, country, province = area_keys[area_start]
+            dict_shards.setdefault((continent, country), {})[province] = {
+                column: dict_values[column][area_start:area_end].tolist() for column in value_columns
+            }
+        return dict_shards
 
     @staticmethod
     def create_nested_dict_from_final_dataframe(df_predictions: pd.DataFrame) -> dict:
         """
         Generates the nested dictionary with all the policy predictions which will then be saved as a JSON file
-        to be used on the website
+        to be used on the website; it is built in a single pass over the predictions sorted once by area, policy,
+        enaction time and day (keys keep their order of first appearance)
         :param df_predictions: dataframe with all policy predictions
         :return: dictionary with nested keys and policy predictions to be saved as a JSON file
         """
-        dict_all_results = {
-            continent: {} for continent in df_predictions.Continent.unique()
+        key_columns = ["Continent", "Country", "Province", "Policy", "Time"]
+        df_predictions = get_dataframe_as_text(df_predictions)
+        list_key_codes, dict_key_uniques = [], {}
+        for key_column in key_columns:
+            key_codes, key_uniques = pd.factorize(df_predictions[key_column])
+            list_key_codes.append(key_codes)
+            dict_key_uniques[key_column] = list(key_uniques)
+        day_codes = pd.factorize(df_predictions["Day"], sort=True)[0]
+        order = np.lexsort([day_codes] + list_key_codes[::-1])
+        key_codes = np.array(list_key_codes).T[order]
+        days = df_predictions["Day"].values[order]
+        dict_values = {
+            column: df_predictions[column].values[order]
+            for column in ["Total Detected True", "Total Detected Deaths True", "Total Detected", "Total Detected Deaths"]
         }
-        for continent in dict_all_results.keys():
-            countries_in_continent = list(
-                df_predictions[df_predictions.Continent == continent].Country.unique()
-            )
-            dict_all_results[continent] = {
-                country: {} for country in countries_in_continent
+        is_new_scenario = np.append(True, (key_codes[1:] != key_codes[:-1]).any(axis=1))
+        is_new_area = np.append(True, (key_codes[1:, :3] != key_codes[:-1, :3]).any(axis=1))
+        scenario_starts = np.flatnonzero(is_new_scenario)
+        scenario_ends = np.append(scenario_starts[1:], len(key_codes))
+        area_ends = np.append(np.flatnonzero(is_new_area)[1:], len(key_codes))
+        default_policy_code = (
+            dict_key_uniques["Policy"].index(default_policy) if default_policy in dict_key_uniques["Policy"] else -1
+        )
+        default_time_code = (
+            dict_key_uniques["Time"].index(default_policy_enaction_time)
+            if default_policy_enaction_time in dict_key_uniques["Time"] else -1
+        )
+        dict_all_results = {}
+        dict_area_results = {}
+        area_end = 0
+        for scenario_start, scenario_end in zip(scenario_starts, scenario_ends):
+            continent, country, province, policy, policy_enaction_time = [
+                dict_key_uniques[key_column][code] for key_column, code in zip(key_columns, key_codes[scenario_start])
+            ]
+            if scenario_start >= area_end:
+                # New area: the first part contains only ground truth value, so it doesn't matter which
+                # policy/enaction time we choose to report these values
+                area_end = area_ends[np.searchsorted(area_ends, scenario_start, side="right")]
+                dict_area_results = {
+                    "Day": sorted(set(days[scenario_start:area_end].tolist())),
+                    "Total Detected True": [],
+                    "Total Detected Deaths True": [],
+                }
+                area_times = sorted(set(key_codes[scenario_start:area_end, 4].tolist()))
+                for policy_code in sorted(set(key_codes[scenario_start:area_end, 3].tolist())):
+                    dict_area_results[dict_key_uniques["Policy"][policy_code]] = {
+                        dict_key_uniques["Time"][time_code]: {"Total Detected": [], "Total Detected Deaths": []}
+                        for time_code in area_times
+                    }
+                dict_all_results.setdefault(continent, {}).setdefault(country, {})[province] = dict_area_results
+            dict_area_results[policy][policy_enaction_time] = {
+                "Total Detected": dict_values["Total Detected"][scenario_start:scenario_end].tolist(),
+                "Total Detected Deaths": dict_values["Total Detected Deaths"][scenario_start:scenario_end].tolist(),
             }
+            if (key_codes[scenario_start, 3] == default_policy_code) and (
+                    key_codes[scenario_start, 4] == default_time_code
+            ):
+                for column in ["Total Detected True", "Total Detected Deaths True"]:
+                    dict_area_results[column] = dict_values[column][scenario_start:scenario_end].tolist()
 
-        keys_country_province = list(
-            set(
-                [
-                    (continent, country, province)
-                    for continent, country, province in zip(
-                    df_predictions.Continent.tolist(),
-                    df_predictions.Country.tolist(),
-                    df_predictions.Province.tolist(),
-                )
-                ]
-            )
+        return dict_all_results
+
+
+class DELPHIScenarioStreamWriter:
+    """
+    Writes the policy (scenario) predictions area by area as they are produced so that the predictions of all areas
+    are never held in memory at once: the block of each area is appended to the CSV files and its part of the nested
+    World_Scenarios JSON is encoded in a temporary file, from which the JSON file (or its shards) is assembled in the
+    same key order as with DELPHIDataSaver.create_nested_dict_from_final_dataframe
+    """
+    def __init__(self, path_file_since_today: str, path_file_since_100: str):
+        self.path_file_since_today = path_file_since_today
+        self.path_file_since_100 = path_file_since_100
+        self.handle_since_today = open(path_file_since_today, "w", newline="")
+        self.handle_since_100 = open(path_file_since_100, "w", newline="")
+        self.handle_fragments = tempfile.TemporaryFile()
+        self.list_fragments = []  # (continent, country, province, offset, length) of the JSON of each area
+        self.n_areas = 0
+
+    @classmethod
+    def from_danger_map(cls, path_to_folder_danger_map: str, optimizer: str):
+        """
+        Creates the writer of the scenario predictions files of today in the danger_map folder
+        :param path_to_folder_danger_map: path to the danger_map folder
+        :param optimizer: needs to be in (tnc, trust-constr, annealing), used in the name of the files
+        :return: a DELPHIScenarioStreamWriter instance
+        """
+        today_date_str = "".join(str(datetime.now().date()).split("-"))
+        subname_file = DELPHIDataSaver.get_subname_file(optimizer)
+        return cls(
+            path_file_since_today=(
+                path_to_folder_danger_map + f"/predicted/{subname_file}_Scenarios_{today_date_str}.csv"
+            ),
+            path_file_since_100=(
+                path_to_folder_danger_map + f"/predicted/{subname_file}_Scenarios_since100_{today_date_str}.csv"
+            ),
         )
-        for continent, country, province in keys_country_province:
-            df_predictions_province = df_predictions[
-                (df_predictions.Country == country)
-                & (df_predictions.Province == province)
-                ].reset_index(drop=True)
-            # The first part contains only ground truth value, so it doesn't matter which
-            # policy/enaction time we choose to report these values
-            dict_all_results[continent][country][province] = {
-                "Day": sorted(list(df_predictions_province.Day.unique())),
-                "Total Detected True": df_predictions_province[
-                    (df_predictions_province.Policy == default_policy)
-                    & (df_predictions_province.Time == default_policy_enaction_time)
-                    ]
-                    .sort_values("Day")["Total Detected True"]
-                    .tolist(),
-                "Total Detected Deaths True": df_predictions_province[
-                    (df_predictions_province.Policy == default_policy)
-                    & (df_predictions_province.Time == default_policy_enaction_time)
-                    ]
-                    .sort_values("Day")["Total Detected Deaths True"]
-                    .tolist(),
-            }
-            dict_all_results[continent][country][province].update(
-                {
-                    policy: {
-                        policy_enaction_time: {
-                            "Total Detected": df_predictions_province[
-                                (df_predictions_province.Policy == policy)
-                                & (df_predictions_province.Time == policy_enaction_time)
-                                ]
-                                .sort_values("Day")["Total Detected"]
-                                .tolist(),
-                            "Total Detected Deaths": df_predictions_province[
-                                (df_predictions_province.Policy == policy)
-                                & (df_predictions_province.Time == policy_enaction_time)
-                                ]
-                                .sort_values("Day")["Total Detected Deaths"]
-                                .tolist(),
-                        }
-                        for policy_enaction_time in df_predictions_province.Time.unique()
-                    }
-                    for policy in df_predictions_province.Policy.unique()
+
+    def append_area(self, df_since_today_area: pd.DataFrame, df_since_100_area: pd.DataFrame) -> None:
+        """
+        Appends the predictions of all the scenarios of one area to the CSV files and encodes its part of the JSON
+        :param df_since_today_area: predictions since today of all the scenarios of that area
+        :param df_since_100_area: predictions since 100 cases of all the scenarios of that area
+        :return: None
+        """
+        is_first_area = (self.n_areas == 0)
+        get_dataframe_as_text(df_since_today_area).to_csv(self.handle_since_today, index=False, header=is_first_area)
+        get_dataframe_as_text(df_since_100_area).to_csv(self.handle_since_100, index=False, header=is_first_area)
+        dict_area = DELPHIDataSaver.create_nested_dict_from_final_dataframe(df_since_100_area)
+        for continent, dict_continent in dict_area.items():
+            for country, dict_country in dict_continent.items():
+                for province, dict_province in dict_country.items():
+                    fragment = json.dumps(dict_province).encode("utf-8")
+                    offset = self.handle_fragments.seek(0, os.SEEK_END)
+                    self.handle_fragments.write(fragment)
+                    self.list_fragments.append((continent, country, province, offset, len(fragment)))
+        self.n_areas += 1
+
+    def get_fragments_per_country(self) -> dict:
+        """
+        Groups the encoded areas per continent and country, in order of first appearance
+        :return: dictionary {continent: {country: {province: (offset, length) of its JSON in the temporary file}}}
+        """
+        dict_fragments = {}
+        for continent, country, province, offset, length in self.list_fragments:
+            dict_fragments.setdefault(continent, {}).setdefault(country, {})[province] = (offset, length)
+        return dict_fragments
+
+    def read_fragment(self, offset: int, length: int) -> str:
+        self.handle_fragments.seek(offset)
+        return self.handle_fragments.read(length).decode("utf-8")
+
+    def iterate_json_chunks(self) -> Iterable:
+        """
+        Assembles the nested JSON of all areas, the same as the one encoded from the full predictions dataframe
+        :return: generator of strings which concatenated form the JSON document
+        """
+        yield "{"
+        for i_continent, (continent, dict_continent) in enumerate(self.get_fragments_per_country().items()):
+            yield (", " if i_continent > 0 else "") + json.dumps(continent) + ": {"
+            for i_country, (country, dict_country) in enumerate(dict_continent.items()):
+                yield (", " if i_country > 0 else "") + json.dumps(country) + ": {"
+                for i_province, (province, (offset, length)) in enumerate(dict_country.items()):
+                    yield (", " if i_province > 0 else "") + json.dumps(province) + ": "
+                    yield self.read_fragment(offset, length)
+                yield "}"
+            yield "}"
+        yield "}"
+
+    def iterate_shards(self) -> Iterable:
+        """
+        Loads the nested JSON of one country at a time, cf. DELPHIDataSaver.write_shards_per_country
+        :return: generator of ((continent, country), dictionary {province: nested predictions})
+        """
+        for continent, dict_continent in self.get_fragments_per_country().items():
+            for country, dict_country in dict_continent.items():
+                yield (continent, country), {
+                    province: json.loads(self.read_fragment(offset, length))
+                    for province, (offset, length) in dict_country.items()
                 }
+
+    def close_csv_files(self) -> None:
+        self.handle_since_today.close()
+        self.handle_since_100.close()
+
+    def close(self) -> None:
+        self.close_csv_files()
+        self.handle_fragments.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        """
+        Closes all the files, and removes the CSV files if an exception was raised as they would be truncated
+        """
+        self.close()
+        if exc_type is not None:
+            for path_file in [self.path_file_since_today, self.path_file_since_100]:
+                if os.path.exists(path_file):
+                    os.remove(path_file)
+
+
+class DELPHIPastPredictionsIndex:
+    """
+    Past predictions used for the Confidence Intervals, read once and stored in contiguous arrays sorted by area and
+    day, so that the past predictions of any area (continent, country, province) are a slice of these arrays. It is
+    built once by the parent, which computes the Confidence Intervals of all areas
+    """
+    columns_values = ["Total Detected", "Total Detected Deaths"]
+
+    def __init__(self, days: np.array, values: np.array, dict_area_to_offsets: dict):
+        self.days = days
+        self.values = values
+        self.dict_area_to_offsets = dict_area_to_offsets
+
+    @classmethod
+    def from_dataframe(cls, df_past_predictions: pd.DataFrame, past_prediction_date: str):
+        """
+        Creates the index from the past predictions, only keeping the days after the past prediction date
+        :param df_past_predictions: dataframe with the past predictions of all areas (raw and aggregated)
+        :param past_prediction_date: past prediction's date for CI generation, format 'YYYY-MM-DD'
+        :return: a DELPHIPastPredictionsIndex instance
+        """
+        df_past_predictions = df_past_predictions[
+            df_past_predictions["Day"] > past_prediction_date
+        ].sort_values(["Continent", "Country", "Province", "Day"], kind="mergesort").reset_index(drop=True)
+        is_new_area = (
+            df_past_predictions[["Continent", "Country", "Province"]].shift()
+            != df_past_predictions[["Continent", "Country", "Province"]]
+        ).any(axis=1).values
+        area_starts = np.flatnonzero(is_new_area)
+        area_ends = np.append(area_starts[1:], len(df_past_predictions))
+        dict_area_to_offsets = {
+            (continent, country, province): (int(start), int(end))
+            for continent, country, province, start, end in zip(
+                df_past_predictions["Continent"].values[area_starts],
+                df_past_predictions["Country"].values[area_starts],
+                df_past_predictions["Province"].values[area_starts],
+                area_starts,
+                area_ends,
             )
+        }
+        return cls(
+            days=pd.to_datetime(df_past_predictions["Day"]).values.astype("datetime64[D]"),
+            values=df_past_predictions[cls.columns_values].values.astype(float),
+            dict_area_to_offsets=dict_area_to_offsets,
+        )
 
-        return dict_all_results
+    @classmethod
+    def from_file(cls, past_prediction_file: str, past_prediction_date: str):
+        """
+        Reads the past prediction file once and creates the index from it
+        :param past_prediction_file: past prediction file's path for CI generation
+        :param past_prediction_date: past prediction's date for CI generation, format 'YYYY-MM-DD'
+        :return: a DELPHIPastPredictionsIndex instance
+        """
+        df_past_predictions = read_dataframe_prefer_columnar(
+            past_prediction_file, columns=["Continent", "Country", "Province", "Day"] + cls.columns_values
+        )
+        return cls.from_dataframe(df_past_predictions, past_prediction_date)
+
+    def get_past_predictions_area(self, continent: str, country: str, province: str) -> pd.DataFrame:
+        """
+        Retrieves the past predictions of an area after the past prediction date
+        :param continent: continent of the area, "None" for the world aggregation
+        :param country: country of the area, "None" for continent & world aggregations
+        :param province: province of the area, "None" for country, continent & world aggregations
+        :return: dataframe with the days & past predictions of that area sorted by day, empty if not available
+        """
+        start, end = self.dict_area_to_offsets.get((continent, country, province), (0, 0))
+        df_past_predictions_area = pd.DataFrame(
+            np.array(self.values[start:end]), columns=self.columns_values
+        )
+        df_past_predictions_area.insert(
+            0, "Day", np.datetime_as_string(self.days[start:end], unit="D").astype(object)
+        )
+        return df_past_predictions_area
+
+    def get_past_predictions_areas(self, list_areas: list) -> pd.DataFrame:
+        """
+        Retrieves the past predictions of several areas at once after the past prediction date
+        :param list_areas: list of tuples (continent, country, province)
+        :return: dataframe with the position of the area in list_areas ("Area Index"), the rank of the day in the past
+        predictions of that area ("Day Rank"), the day & past predictions, sorted by area index and day
+        """
+        offsets = np.array(
+            [self.dict_area_to_offsets.get(tuple(area), (0, 0)) for area in list_areas], dtype=int
+        ).reshape(-1, 2)
+        lengths = offsets[:, 1] - offsets[:, 0]
+        area_indices = np.repeat(np.arange(len(list_areas)), lengths)
+        day_ranks = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        row_indices = offsets[area_indices, 0] + day_ranks
+        df_past_predictions_areas = pd.DataFrame(
+            np.array(self.values[row_indices]).reshape(-1, len(self.columns_values)), columns=self.columns_values
+        )
+        df_past_predictions_areas.insert(0, "Area Index", area_indices)
+        df_past_predictions_areas.insert(1, "Day Rank", day_ranks)
+        df_past_predictions_areas.insert(
+            2, "Day", np.datetime_as_string(np.array(self.days[row_indices]), unit="D").astype(object)
+        )
+        return df_past_predictions_areas
+
+
+class DELPHIAreaResult(NamedTuple):
+    """
+    Compact result of the fitting process of one area sent back by the workers to the parent process, which creates
+    the parameters & predictions datasets from it; the trajectory of the 16 states is only included when it couldn't
+    be written in the shared DELPHITrajectoryBuffer
+    """
+    continent: str
+    country: str
+    province: str
+    area_index: int
+    best_params: np.array
+    loss: float
+    success: bool
+    status: int
+    n_function_evaluations: int
+    time_fitting: float
+    time_total: float
+    date_day_since100: datetime
+    mape: float
+    cases_data_fit: list
+    deaths_data_fit: list
+    n_days_trajectory: int
+    trajectory: Union[np.array, None] = None
+    telemetry: Union[dict, None] = None
+
+    def get_data_creator(self, x_sol_final: np.array):
+        """
+        Creates the DELPHIDataCreator of that area from its trajectory
+        :param x_sol_final: trajectory of the 16 states of the model for that area, of shape (16, n_days_trajectory)
+        :return: a DELPHIDataCreator instance
+        """
+        return DELPHIDataCreator(
+            x_sol_final=x_sol_final,
+            date_day_since100=self.date_day_since100,
+            best_params=self.best_params,
+            continent=self.continent,
+            country=self.country,
+            province=self.province,
+            testing_data_included=False,
+        )
+
+
+class DELPHIFittingTelemetry:
+    """
+    Per-area performance records of a fitting run (optimizer iterations, loss function calls & cache hits, evaluations
+    of the right-hand side of the model, time spent solving the ODE vs. in the optimizer, loss, MAPE, solver and
+    worker) sent back by the workers in DELPHIAreaResult.telemetry, saved as JSON lines next to the parameters file
+    and summarized in a report of the slowest areas and of where the time goes
+    """
+    columns_time = [
+        "time_reading_data", "time_ode_fitting", "time_optimizer_overhead", "time_prediction", "time_total",
+    ]
+
+    def __init__(self):
+        self.list_records = []
+
+    def add(self, telemetry_area: Union[dict, None]) -> None:
+        if telemetry_area is not None:
+            self.list_records.append(telemetry_area)
+
+    def get_dataframe(self) -> pd.DataFrame:
+        return pd.DataFrame(self.list_records)
+
+    def save(self, path_to_folder_danger_map: str, optimizer: str) -> str:
+        """
+        Saves the records of all areas as JSON lines next to the parameters file of today
+        :param path_to_folder_danger_map: path to the danger_map folder
+        :param optimizer: needs to be in (tnc, trust-constr, annealing), used in the name of the file
+        :return: path of the saved file
+        """
+        today_date_str = "".join(str(datetime.now().date()).split("-"))
+        subname_file = DELPHIDataSaver.get_subname_file(optimizer)
+        path_file = path_to_folder_danger_map + f"/predicted/Fitting_Telemetry_{subname_file}_{today_date_str}.jsonl"
+        with open(path_file, "w") as handle:
+            for record in self.list_records:
+                handle.write(json.dumps(record, default=str) + "\n")
+        return path_file
+
+    def get_summary_report(self, n_slowest_areas: int = 10) -> str:
+        """
+        :param n_slowest_areas: number of slowest areas listed in the report
+        :return: text report with the breakdown of the time spent by the workers and the slowest areas
+        """
+        df_telemetry = self.get_dataframe()
+        if len(df_telemetry) == 0:
+            return "Fitting telemetry: no area was fitted"
+        time_total = df_telemetry.time_total.sum()
+        list_lines = [
+            f"Fitting telemetry of {len(df_telemetry)} areas on {df_telemetry.worker_id.nunique()} workers: "
+            + f"{round(time_total, 1)} seconds in total",
+        ]
+        time_other = time_total
+        for column_time in self.columns_time[:-1]:
+            time_column = df_telemetry[column_time].sum()
+            time_other -= time_column
+            share_column = round(100 * time_column / time_total, 1)
+            list_lines.append(f"  {column_time[len('time_'):]}: {round(time_column, 1)} s ({share_column} %)")
+        list_lines.append(f"  other: {round(time_other, 1)} s ({round(100 * time_other / time_total, 1)} %)")
+        list_lines.append(
+            f"  {df_telemetry.n_iterations.sum()} optimizer iterations, {df_telemetry.n_residuals_calls.sum()} loss "
+            + f"function calls ({df_telemetry.n_cache_hits.sum()} cache hits), {df_telemetry.n_rhs_evaluations.sum()} "
+            + f"evaluations of the model"
+        )
+        list_lines.append(f"Slowest {min(n_slowest_areas, len(df_telemetry))} areas:")
+        for record in df_telemetry.nlargest(n_slowest_areas, "time_total").itertuples():
+            list_lines.append(
+                f"  {record.country}, {record.province}: {round(record.time_total, 2)} s (ODE "
+                + f"{round(record.time_ode_fitting, 2)} s, optimizer {round(record.time_optimizer_overhead, 2)} s), "
+                + f"{record.n_iterations} iterations, {record.n_residuals_calls} loss function calls, "
+                + f"{record.n_rhs_evaluations} evaluations of the model, loss {record.loss:.4g}, "
+                + f"MAPE {round(record.mape, 2)} %"
+            )
+        return "\n".join(list_lines)
+
+
+class DELPHITrajectoryBuffer:
+    """
+    Contiguous array of shape (n_areas, 16 states, n_days) in shared memory where the workers write the trajectory of
+    each area at its index, so that the parent reads them without the trajectories being pickled back with the results.
+    The parent creates the buffer (name=None) and unlinks it at the end, the workers attach to it with its name
+    """
+    def __init__(self, n_areas: int, n_days: int, n_states: int = len(DELPHI_STATES), name: Union[str, None] = None):
+        if shared_memory is None:
+            raise ImportError("multiprocessing.shared_memory requires Python 3.8 or higher")
+        self.shape = (n_areas, n_states, n_days)
+        if name is None:
+            self.shm = shared_memory.SharedMemory(
+                create=True, size=max(int(np.prod(self.shape)) * np.dtype(float).itemsize, 1)
+            )
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.name = self.shm.name
+        self.trajectories = np.ndarray(self.shape, dtype=float, buffer=self.shm.buf)
+
+    def write(self, area_index: int, x_sol_final: np.array) -> bool:
+        """
+        Writes the trajectory of an area at its index in the buffer
+        :param area_index: index of the area in the list of areas fitted in this run
+        :param x_sol_final: trajectory of the 16 states of the model for that area
+        :return: True if it was written, False if it doesn't fit in the buffer
+        """
+        n_states, n_days = x_sol_final.shape
+        if area_index >= self.shape[0] or n_states != self.shape[1] or n_days > self.shape[2]:
+            return False
+        self.trajectories[area_index, :, :n_days] = x_sol_final
+        return True
+
+    def read(self, area_index: int, n_days: int) -> np.array:
+        """
+        Reads (as a copy) the trajectory of an area written in the buffer
+        :param area_index: index of the area in the list of areas fitted in this run
+        :param n_days: number of days of the trajectory of that area
+        :return: the trajectory of the 16 states of the model for that area, of shape (16, n_days)
+        """
+        return self.trajectories[area_index, :, :n_days].copy()
+
+    def close(self) -> None:
+        self.trajectories = None
+        self.shm.close()
+
+    def unlink(self) -> None:
+        self.close()
+        self.shm.unlink()
 
 
 class DELPHIDataCreator:
@@ -239,6 +874,17 @@ class DELPHIDataCreator:
         self.province = province
         self.testing_data_included = testing_data_included
 
+    def get_predicted_outputs(self) -> dict:
+        """
+        Projects the 16 states predicted by the DELPHI model onto the reported outputs (Total Detected, Active, etc.)
+        :return: dictionary of the format {output_name: list of rounded predicted values since the day with 100 cases}
+        """
+        predicted_outputs = project_states_to_outputs(self.x_sol_final)
+        dict_predicted_outputs = {
+            output: predicted_outputs[i, :].tolist() for i, output in enumerate(MAPPING_OUTPUT_TO_STATES.keys())
+        }
+        return dict_predicted_outputs
+
     def create_dataset_parameters(self, mape: float) -> pd.DataFrame:
         """
         Creates the parameters dataset with the results from the optimization and the pre-computed MAPE
@@ -285,27 +931,7 @@ class DELPHIDataCreator:
             for i in range(n_days_since_today)
         ]
         # Predictions
-        total_detected = self.x_sol_final[15, :]  # DT
-        total_detected = [int(round(x, 0)) for x in total_detected]
-        active_cases = (
-                self.x_sol_final[4, :]
-                + self.x_sol_final[5, :]
-                + self.x_sol_final[7, :]
-                + self.x_sol_final[8, :]
-        )  # DHR + DQR + DHD + DQD
-        active_cases = [int(round(x, 0)) for x in active_cases]
-        active_hospitalized = (
-                self.x_sol_final[4, :] + self.x_sol_final[7, :]
-        )  # DHR + DHD
-        active_hospitalized = [int(round(x, 0)) for x in active_hospitalized]
-        cumulative_hospitalized = self.x_sol_final[11, :]  # TH
-        cumulative_hospitalized = [int(round(x, 0)) for x in cumulative_hospitalized]
-        total_detected_deaths = self.x_sol_final[14, :]  # DD
-        total_detected_deaths = [int(round(x, 0)) for x in total_detected_deaths]
-        active_ventilated = (
-                self.x_sol_final[12, :] + self.x_sol_final[13, :]
-        )  # DVR + DVD
-        active_ventilated = [int(round(x, 0)) for x in active_ventilated]
+        dict_predicted_outputs = self.get_predicted_outputs()
         # Generation of the dataframe since today
         df_predictions_since_today_cont_country_prov = pd.DataFrame(
             {
@@ -313,16 +939,10 @@ class DELPHIDataCreator:
                 "Country": [self.country for _ in range(n_days_since_today)],
                 "Province": [self.province for _ in range(n_days_since_today)],
                 "Day": all_dates_since_today,
-                "Total Detected": total_detected[n_days_btw_today_since_100:],
-                "Active": active_cases[n_days_btw_today_since_100:],
-                "Active Hospitalized": active_hospitalized[n_days_btw_today_since_100:],
-                "Cumulative Hospitalized": cumulative_hospitalized[
-                                           n_days_btw_today_since_100:
-                                           ],
-                "Total Detected Deaths": total_detected_deaths[
-                                         n_days_btw_today_since_100:
-                                         ],
-                "Active Ventilated": active_ventilated[n_days_btw_today_since_100:],
+                **{
+                    output: predicted_values[n_days_btw_today_since_100:]
+                    for output, predicted_values in dict_predicted_outputs.items()
+                },
             }
         )
 
@@ -337,12 +957,7 @@ class DELPHIDataCreator:
                 "Country": [self.country for _ in range(len(all_dates_since_100))],
                 "Province": [self.province for _ in range(len(all_dates_since_100))],
                 "Day": all_dates_since_100,
-                "Total Detected": total_detected,
-                "Active": active_cases,
-                "Active Hospitalized": active_hospitalized,
-                "Cumulative Hospitalized": cumulative_hospitalized,
-                "Total Detected Deaths": total_detected_deaths,
-                "Active Ventilated": active_ventilated,
+                **dict_predicted_outputs,
             }
         )
         return (
@@ -374,24 +989,7 @@ class DELPHIDataCreator:
         intr_since_today = pd.DataFrame(
             self.x_sol_final[:, n_days_btw_today_since_100:].transpose()
         )
-        intr_since_today.columns = [
-            "S",
-            "E",
-            "I",
-            "AR",
-            "DHR",
-            "DQR",
-            "AD",
-            "DHD",
-            "DQD",
-            "R",
-            "D",
-            "TH",
-            "DVR",
-            "DVD",
-            "DD",
-            "DT",
-        ]
+        intr_since_today.columns = DELPHI_STATES
         df_predictions_since_today_cont_country_prov = pd.concat(
             [df_predictions_since_today_cont_country_prov, intr_since_today], axis=1
         )
@@ -411,24 +1009,7 @@ class DELPHIDataCreator:
 
         intr_since_100 = pd.DataFrame(self.x_sol_final.transpose())
 
-        intr_since_100.columns = [
-            "S",
-            "E",
-            "I",
-            "AR",
-            "DHR",
-            "DQR",
-            "AD",
-            "DHD",
-            "DQD",
-            "R",
-            "D",
-            "TH",
-            "DVR",
-            "DVD",
-            "DD",
-            "DT",
-        ]
+        intr_since_100.columns = DELPHI_STATES
 
         df_predictions_since_100_cont_country_prov = pd.concat(
             [df_predictions_since_100_cont_country_prov, intr_since_100], axis=1
@@ -446,6 +1027,7 @@ class DELPHIDataCreator:
             past_prediction_file: str = "I://covid19orc//danger_map//predicted//Global_V2_20200720.csv",
             past_prediction_date: str = "2020-07-04",
             q: float = 0.5,
+            past_predictions_index: Union[DELPHIPastPredictionsIndex, None] = None,
     ) -> (pd.DataFrame, pd.DataFrame):
         """
         Generates the prediction datasets from the date with 100 cases and from the day of running, including columns
@@ -455,572 +1037,87 @@ class DELPHIDataCreator:
         :param past_prediction_file: past prediction file's path for CI generation
         :param past_prediction_date: past prediction's date for CI generation
         :param q: quantile used for the CIs
+        :param past_predictions_index: index of the past predictions already loaded (built with the same past
+        prediction date), if None the past prediction file is read
         :return: tuple of dataframes (since day of optimization & since 100 cases in the area) with predictions and
         confidence intervals
         """
         n_days_btw_today_since_100 = (datetime.now() - self.date_day_since100).days
-        n_days_since_today = self.x_sol_final.shape[1] - n_days_btw_today_since_100
+        n_days_since_100 = self.x_sol_final.shape[1]
+        n_days_since_today = n_days_since_100 - n_days_btw_today_since_100
         all_dates_since_today = [
             str((datetime.now() + timedelta(days=i)).date())
             for i in range(n_days_since_today)
         ]
+        all_dates_since_100 = [
+            str((self.date_day_since100 + timedelta(days=i)).date())
+            for i in range(n_days_since_100)
+        ]
         # Predictions
-        total_detected = self.x_sol_final[15, :]  # DT
-        total_detected = [int(round(x, 0)) for x in total_detected]
-        active_cases = (
-                self.x_sol_final[4, :]
-                + self.x_sol_final[5, :]
-                + self.x_sol_final[7, :]
-                + self.x_sol_final[8, :]
-        )  # DHR + DQR + DHD + DQD
-        active_cases = [int(round(x, 0)) for x in active_cases]
-        active_hospitalized = (
-                self.x_sol_final[4, :] + self.x_sol_final[7, :]
-        )  # DHR + DHD
-        active_hospitalized = [int(round(x, 0)) for x in active_hospitalized]
-        cumulative_hospitalized = self.x_sol_final[11, :]  # TH
-        cumulative_hospitalized = [int(round(x, 0)) for x in cumulative_hospitalized]
-        total_detected_deaths = self.x_sol_final[14, :]  # DD
-        total_detected_deaths = [int(round(x, 0)) for x in total_detected_deaths]
-        active_ventilated = (
-                self.x_sol_final[12, :] + self.x_sol_final[13, :]
-        )  # DVR + DVD
-        active_ventilated = [int(round(x, 0)) for x in active_ventilated]
-
-        past_predictions = pd.read_csv(past_prediction_file)
-        past_predictions = (
-            past_predictions[
-                (past_predictions["Day"] > past_prediction_date)
-                & (past_predictions["Country"] == self.country)
-                & (past_predictions["Province"] == self.province)
-                ]
-        ).sort_values("Day")
+        dict_predicted_outputs = self.get_predicted_outputs()
+
+        if past_predictions_index is None:
+            past_predictions_index = DELPHIPastPredictionsIndex.from_file(past_prediction_file, past_prediction_date)
+        past_predictions = past_predictions_index.get_past_predictions_area(
+            continent=self.continent, country=self.country, province=self.province
+        )
         if len(past_predictions) > 0:
-            known_dates_since_100 = [
-                str((self.date_day_since100 + timedelta(days=i)).date())
-                for i in range(len(cases_data_fit))
-            ]
-            cases_data_fit_past = [
-                y
-                for x, y in zip(known_dates_since_100, cases_data_fit)
-                if x > past_prediction_date
-            ]
-            deaths_data_fit_past = [
-                y
-                for x, y in zip(known_dates_since_100, deaths_data_fit)
-                if x > past_prediction_date
-            ]
-            total_detected_past = past_predictions["Total Detected"].values[
-                                  : len(cases_data_fit_past)
-                                  ]
-            total_detected_deaths_past = past_predictions[
-                                             "Total Detected Deaths"
-                                         ].values[: len(deaths_data_fit_past)]
-            residual_cases_lb = np.sqrt(
-                np.mean(
-                    [(x - y) ** 2 for x, y in zip(cases_data_fit_past, total_detected_past)]
-                )
-            ) * scipy.stats.norm.ppf(0.5 - q / 2)
-            residual_cases_ub = np.sqrt(
-                np.mean(
-                    [(x - y) ** 2 for x, y in zip(cases_data_fit_past, total_detected_past)]
-                )
-            ) * scipy.stats.norm.ppf(0.5 + q / 2)
-            residual_deaths_lb = np.sqrt(
-                np.mean(
-                    [
-                        (x - y) ** 2
-                        for x, y in zip(deaths_data_fit_past, total_detected_deaths_past)
-                    ]
-                )
-            ) * scipy.stats.norm.ppf(0.5 - q / 2)
-            residual_deaths_ub = np.sqrt(
-                np.mean(
-                    [
-                        (x - y) ** 2
-                        for x, y in zip(deaths_data_fit_past, total_detected_deaths_past)
-                    ]
-                )
-            ) * scipy.stats.norm.ppf(0.5 + q / 2)
-
-            # Generation of the dataframe since today
-            df_predictions_since_today_cont_country_prov = pd.DataFrame(
-                {
-                    "Continent": [self.continent for _ in range(n_days_since_today)],
-                    "Country": [self.country for _ in range(n_days_since_today)],
-                    "Province": [self.province for _ in range(n_days_since_today)],
-                    "Day": all_dates_since_today,
-                    "Total Detected": total_detected[n_days_btw_today_since_100:],
-                    "Active": active_cases[n_days_btw_today_since_100:],
-                    "Active Hospitalized": active_hospitalized[
-                                           n_days_btw_today_since_100:
-                                           ],
-                    "Cumulative Hospitalized": cumulative_hospitalized[
-                                               n_days_btw_today_since_100:
-                                               ],
-                    "Total Detected Deaths": total_detected_deaths[
-                                             n_days_btw_today_since_100:
-                                             ],
-                    "Active Ventilated": active_ventilated[n_days_btw_today_since_100:],
-                    "Total Detected True": [np.nan for _ in range(n_days_since_today)],
-                    "Total Detected Deaths True": [
-                        np.nan for _ in range(n_days_since_today)
-                    ],
-                    "Total Detected LB": make_increasing([
-                        max(int(round(v + residual_cases_lb * np.sqrt(c), 0)), 0)
-                        for c, v in enumerate(
-                            total_detected[n_days_btw_today_since_100:]
-                        )
-                    ]),
-#                    "Active LB": [
-#                        max(
-#                            int(round(v + residual_cases_lb * np.sqrt(c) * v / u, 0)), 0
-#                        )
-#                        for c, (v, u) in enumerate(
-#                            zip(
-#                                active_cases[n_days_btw_today_since_100:],
-#                                total_detected[n_days_btw_today_since_100:],
-#                            )
-#                        )
-#                    ],
-#                    "Active Hospitalized LB": [
-#                        max(
-#                            int(round(v + residual_cases_lb * np.sqrt(c) * v / u, 0)), 0
-#                        )
-#                        for c, (v, u) in enumerate(
-#                            zip(
-#                                active_hospitalized[n_days_btw_today_since_100:],
-#                                total_detected[n_days_btw_today_since_100:],
-#                            )
-#                        )
-#                    ],
-#                    "Cumulative Hospitalized LB": make_increasing([
-#                        max(
-#                            int(round(v + residual_cases_lb * np.sqrt(c) * v / u, 0)), 0
-#                        )
-#                        for c, (v, u) in enumerate(
-#                            zip(
-#                                cumulative_hospitalized[n_days_btw_today_since_100:],
-#                                total_detected[n_days_btw_today_since_100:],
-#                            )
-#                        )
-#                    ]),
-                    "Total Detected Deaths LB": make_increasing([
-                        max(int(round(v + residual_deaths_lb * np.sqrt(c), 0)), 0)
-                        for c, v in enumerate(
-                            total_detected_deaths[n_days_btw_today_since_100:]
-                        )
-                    ]),
-#                    "Active Ventilated LB": [
-#                        max(
-#                            int(round(v + residual_cases_lb * np.sqrt(c) * v / u, 0)), 0
-#                        )
-#                        for c, (v, u) in enumerate(
-#                            zip(
-#                                active_ventilated[n_days_btw_today_since_100:],
-#                                total_detected[n_days_btw_today_since_100:],
-#                            )
-#                        )
-#                    ],
-                    "Total Detected UB": [
-                        max(int(round(v + residual_cases_ub * np.sqrt(c), 0)), 0)
-                        for c, v in enumerate(
-                            total_detected[n_days_btw_today_since_100:]
-                        )
-                    ],
-#                    "Active UB": [
-#                        max(
-#                            int(round(v + residual_cases_ub * np.sqrt(c) * v / u, 0)), 0
-#                        )
-#                        for c, (v, u) in enumerate(
-#                            zip(
-#                                active_cases[n_days_btw_today_since_100:],
-#                                total_detected[n_days_btw_today_since_100:],
-#                            )
-#                        )
-#                    ],
-#                    "Active Hospitalized UB": [
-#                        max(
-#                            int(round(v + residual_cases_ub * np.sqrt(c) * v / u, 0)), 0
-#                        )
-#                        for c, (v, u) in enumerate(
-#                            zip(
-#                                active_hospitalized[n_days_btw_today_since_100:],
-#                                total_detected[n_days_btw_today_since_100:],
-#                            )
-#                        )
-#                    ],
-#                    "Cumulative Hospitalized UB": [
-#                        max(
-#                            int(round(v + residual_cases_ub * np.sqrt(c) * v / u, 0)), 0
-#                        )
-#                        for c, (v, u) in enumerate(
-#                            zip(
-#                                cumulative_hospitalized[n_days_btw_today_since_100:],
-#                                total_detected[n_days_btw_today_since_100:],
-#                            )
-#                        )
-#                    ],
-                    "Total Detected Deaths UB": [
-                        max(int(round(v + residual_deaths_ub * np.sqrt(c), 0)), 0)
-                        for c, v in enumerate(
-                            total_detected_deaths[n_days_btw_today_since_100:]
-                        )
-                    ],
-#                    "Active Ventilated UB": [
-#                        max(
-#                            int(round(v + residual_cases_ub * np.sqrt(c) * v / u, 0)), 0
-#                        )
-#                        for c, (v, u) in enumerate(
-#                            zip(
-#                                active_ventilated[n_days_btw_today_since_100:],
-#                                total_detected[n_days_btw_today_since_100:],
-#                            )
-#                        )
-#                    ],
-                }
-            )
-            # Generation of the dataframe from the day since 100th case
-            all_dates_since_100 = [
-                str((self.date_day_since100 + timedelta(days=i)).date())
-                for i in range(self.x_sol_final.shape[1])
-            ]
-            df_predictions_since_100_cont_country_prov = pd.DataFrame(
-                {
-                    "Continent": [
-                        self.continent for _ in range(len(all_dates_since_100))
-                    ],
-                    "Country": [self.country for _ in range(len(all_dates_since_100))],
-                    "Province": [
-                        self.province for _ in range(len(all_dates_since_100))
-                    ],
-                    "Day": all_dates_since_100,
-                    "Total Detected": total_detected,
-                    "Active": active_cases,
-                    "Active Hospitalized": active_hospitalized,
-                    "Cumulative Hospitalized": cumulative_hospitalized,
-                    "Total Detected Deaths": total_detected_deaths,
-                    "Active Ventilated": active_ventilated,
-                    "Total Detected True": cases_data_fit
-                                           + [
-                                               np.nan
-                                               for _ in range(len(all_dates_since_100) - len(cases_data_fit))
-                                           ],
-                    "Total Detected Deaths True": deaths_data_fit
-                                                  + [
-                                                      np.nan for _ in range(len(all_dates_since_100) - len(deaths_data_fit))
-                                                  ],
-                    "Total Detected LB": make_increasing([
-                        max(
-                            int(
-                                round(
-                                    v
-                                    + residual_cases_lb
-                                    * np.sqrt(max(c - n_days_btw_today_since_100, 0)),
-                                    0,
-                                    )
-                            ),
-                            0,
-                        )
-                        for c, v in enumerate(total_detected)
-                    ]),
-#                    "Active LB": [
-#                        max(
-#                            int(
-#                                round(
-#                                    v
-#                                    + residual_cases_lb
-#                                    * np.sqrt(max(c - n_days_btw_today_since_100, 0))
-#                                    * v
-#                                    / u,
-#                                    0,
-#                                    )
-#                            ),
-#                            0,
-#                        )
-#                        for c, (v, u) in enumerate(zip(active_cases, total_detected))
-#                    ],
-#                    "Active Hospitalized LB": [
-#                        max(
-#                            int(
-#                                round(
-#                                    v
-#                                    + residual_cases_lb
-#                                    * np.sqrt(max(c - n_days_btw_today_since_100, 0))
-#                                    * v
-#                                    / u,
-#                                    0,
-#                                    )
-#                            ),
-#                            0,
-#                        )
-#                        for c, (v, u) in enumerate(
-#                            zip(active_hospitalized, total_detected)
-#                        )
-#                    ],
-#                    "Cumulative Hospitalized LB": make_increasing([
-#                        max(
-#                            int(
-#                                round(
-#                                    v
-#                                    + residual_cases_lb
-#                                    * np.sqrt(max(c - n_days_btw_today_since_100, 0))
-#                                    * v
-#                                    / u,
-#                                    0,
-#                                    )
-#                            ),
-#                            0,
-#                        )
-#                        for c, (v, u) in enumerate(
-#                            zip(cumulative_hospitalized, total_detected)
-#                        )
-#                    ]),
-                    "Total Detected Deaths LB": make_increasing([
-                        max(
-                            int(
-                                round(
-                                    v
-                                    + residual_deaths_lb
-                                    * np.sqrt(max(c - n_days_btw_today_since_100, 0)),
-                                    0,
-                                    )
-                            ),
-                            0,
-                        )
-                        for c, v in enumerate(total_detected_deaths)
-                    ]),
-#                    "Active Ventilated LB": [
-#                        max(
-#                            int(
-#                                round(
-#                                    v
-#                                    + residual_cases_lb
-#                                    * np.sqrt(max(c - n_days_btw_today_since_100, 0))
-#                                    * v
-#                                    / u,
-#                                    0,
-#                                    )
-#                            ),
-#                            0,
-#                        )
-#                        for c, (v, u) in enumerate(
-#                            zip(active_ventilated, total_detected)
-#                        )
-#                    ],
-                    "Total Detected UB": [
-                        max(
-                            int(
-                                round(
-                                    v
-                                    + residual_cases_ub
-                                    * np.sqrt(max(c - n_days_btw_today_since_100, 0)),
-                                    0,
-                                    )
-                            ),
-                            0,
-                        )
-                        for c, v in enumerate(total_detected)
-                    ],
-#                    "Active UB": [
-#                        max(
-#                            int(
-#                                round(
-#                                    v
-#                                    + residual_cases_ub
-#                                    * np.sqrt(max(c - n_days_btw_today_since_100, 0))
-#                                    * v
-#                                    / u,
-#                                    0,
-#                                    )
-#                            ),
-#                            0,
-#                        )
-#                        for c, (v, u) in enumerate(zip(active_cases, total_detected))
-#                    ],
-#                    "Active Hospitalized UB": [
-#                        max(
-#                            int(
-#                                round(
-#                                    v
-#                                    + residual_cases_ub
-#                                    * np.sqrt(max(c - n_days_btw_today_since_100, 0))
-#                                    * v
-#                                    / u,
-#                                    0,
-#                                    )
-#                            ),
-#                            0,
-#                        )
-#                        for c, (v, u) in enumerate(
-#                            zip(active_hospitalized, total_detected)
-#                        )
-#                    ],
-#                    "Cumulative Hospitalized UB": [
-#                        max(
-#                            int(
-#                                round(
-#                                    v
-#                                    + residual_cases_ub
-#                                    * np.sqrt(max(c - n_days_btw_today_since_100, 0))
-#                                    * v
-#                                    / u,
-#                                    0,
-#                                    )
-#                            ),
-#                            0,
-#                        )
-#                        for c, (v, u) in enumerate(
-#                            zip(cumulative_hospitalized, total_detected)
-#                        )
-#                    ],
-                    "Total Detected Deaths UB": [
-                        max(
-                            int(
-                                round(
-                                    v
-                                    + residual_deaths_ub
-                                    * np.sqrt(max(c - n_days_btw_today_since_100, 0)),
-                                    0,
-                                    )
-                            ),
-                            0,
-                        )
-                        for c, v in enumerate(total_detected_deaths)
-                    ],
-#                    "Active Ventilated UB": [
-#                        max(
-#                            int(
-#                                round(
-#                                    v
-#                                    + residual_cases_ub
-#                                    * np.sqrt(max(c - n_days_btw_today_since_100, 0))
-#                                    * v
-#                                    / u,
-#                                    0,
-#                                    )
-#                            ),
-#                            0,
-#                        )
-#                        for c, (v, u) in enumerate(
-#                            zip(active_ventilated, total_detected)
-#                        )
-#                    ],
-                }
-            )
+            known_dates_since_100 = np.array(all_dates_since_100[: len(cases_data_fit)])
+            is_known_date_after_past_prediction = known_dates_since_100 > past_prediction_date
+            dict_residuals_rmse = {
+                "Total Detected": compute_rmse_common_days(
+                    np.array(cases_data_fit)[is_known_date_after_past_prediction],
+                    past_predictions["Total Detected"].values,
+                ),
+                "Total Detected Deaths": compute_rmse_common_days(
+                    np.array(deaths_data_fit)[is_known_date_after_past_prediction],
+                    past_predictions["Total Detected Deaths"].values,
+                ),
+            }
         else:
-            df_predictions_since_today_cont_country_prov = pd.DataFrame(
-                {
-                    "Continent": [self.continent for _ in range(n_days_since_today)],
-                    "Country": [self.country for _ in range(n_days_since_today)],
-                    "Province": [self.province for _ in range(n_days_since_today)],
-                    "Day": all_dates_since_today,
-                    "Total Detected": total_detected[n_days_btw_today_since_100:],
-                    "Active": active_cases[n_days_btw_today_since_100:],
-                    "Active Hospitalized": active_hospitalized[
-                                           n_days_btw_today_since_100:
-                                           ],
-                    "Cumulative Hospitalized": cumulative_hospitalized[
-                                               n_days_btw_today_since_100:
-                                               ],
-                    "Total Detected Deaths": total_detected_deaths[
-                                             n_days_btw_today_since_100:
-                                             ],
-                    "Active Ventilated": active_ventilated[n_days_btw_today_since_100:],
-                    "Total Detected True": [np.nan for _ in range(n_days_since_today)],
-                    "Total Detected Deaths True": [
-                        np.nan for _ in range(n_days_since_today)
-                    ],
-                    "Total Detected LB": [np.nan for _ in range(n_days_since_today)],
-#                    "Active LB": [np.nan for _ in range(n_days_since_today)],
-#                    "Active Hospitalized LB": [
-#                        np.nan for _ in range(n_days_since_today)
-#                    ],
-#                    "Cumulative Hospitalized LB": [
-#                        np.nan for _ in range(n_days_since_today)
-#                    ],
-                    "Total Detected Deaths LB": [
-                        np.nan for _ in range(n_days_since_today)
-                    ],
-#                    "Active Ventilated LB": [np.nan for _ in range(n_days_since_today)],
-                    "Total Detected UB": [np.nan for _ in range(n_days_since_today)],
-#                    "Active UB": [np.nan for _ in range(n_days_since_today)],
-#                    "Active Hospitalized UB": [
-#                        np.nan for _ in range(n_days_since_today)
-#                    ],
-#                    "Cumulative Hospitalized UB": [
-#                        np.nan for _ in range(n_days_since_today)
-#                    ],
-                    "Total Detected Deaths UB": [
-                        np.nan for _ in range(n_days_since_today)
-                    ]
-#                    "Active Ventilated UB": [np.nan for _ in range(n_days_since_today)],
-                }
-            )
-            # Generation of the dataframe from the day since 100th case
-            all_dates_since_100 = [
-                str((self.date_day_since100 + timedelta(days=i)).date())
-                for i in range(self.x_sol_final.shape[1])
-            ]
-            df_predictions_since_100_cont_country_prov = pd.DataFrame(
-                {
-                    "Continent": [
-                        self.continent for _ in range(len(all_dates_since_100))
-                    ],
-                    "Country": [self.country for _ in range(len(all_dates_since_100))],
-                    "Province": [
-                        self.province for _ in range(len(all_dates_since_100))
-                    ],
-                    "Day": all_dates_since_100,
-                    "Total Detected": total_detected,
-                    "Active": active_cases,
-                    "Active Hospitalized": active_hospitalized,
-                    "Cumulative Hospitalized": cumulative_hospitalized,
-                    "Total Detected Deaths": total_detected_deaths,
-                    "Active Ventilated": active_ventilated,
-                    "Total Detected True": cases_data_fit
-                                           + [
-                                               np.nan
-                                               for _ in range(len(all_dates_since_100) - len(cases_data_fit))
-                                           ],
-                    "Total Detected Deaths True": deaths_data_fit
-                                                  + [
-                                                      np.nan for _ in range(len(all_dates_since_100) - len(deaths_data_fit))
-                                                  ],
-                    "Total Detected LB": [
-                        np.nan for _ in range(len(all_dates_since_100))
-                    ],
-                    "Active LB": [np.nan for _ in range(len(all_dates_since_100))],
-                    "Active Hospitalized LB": [
-                        np.nan for _ in range(len(all_dates_since_100))
-                    ],
-                    "Cumulative Hospitalized LB": [
-                        np.nan for _ in range(len(all_dates_since_100))
-                    ],
-                    "Total Detected Deaths LB": [
-                        np.nan for _ in range(len(all_dates_since_100))
-                    ],
-                    "Active Ventilated LB": [
-                        np.nan for _ in range(len(all_dates_since_100))
-                    ],
-                    "Total Detected UB": [
-                        np.nan for _ in range(len(all_dates_since_100))
-                    ],
-                    "Active UB": [np.nan for _ in range(len(all_dates_since_100))],
-                    "Active Hospitalized UB": [
-                        np.nan for _ in range(len(all_dates_since_100))
-                    ],
-                    "Cumulative Hospitalized UB": [
-                        np.nan for _ in range(len(all_dates_since_100))
-                    ],
-                    "Total Detected Deaths UB": [
-                        np.nan for _ in range(len(all_dates_since_100))
-                    ],
-                    "Active Ventilated UB": [
-                        np.nan for _ in range(len(all_dates_since_100))
-                    ],
-                }
-            )
+            dict_residuals_rmse = {"Total Detected": np.nan, "Total Detected Deaths": np.nan}
+        # Bounds computed once on the whole trajectory, the bounds since today are a slice of it
+        dict_bounds = get_confidence_intervals_bounds(
+            dict_predicted_outputs=dict_predicted_outputs,
+            dict_residuals_rmse=dict_residuals_rmse,
+            n_days_btw_today_since_100=n_days_btw_today_since_100,
+            q=q,
+        )
+
+        # Generation of the dataframe since today
+        df_predictions_since_today_cont_country_prov = pd.DataFrame(
+            {
+                "Continent": [self.continent for _ in range(n_days_since_today)],
+                "Country": [self.country for _ in range(n_days_since_today)],
+                "Province": [self.province for _ in range(n_days_since_today)],
+                "Day": all_dates_since_today,
+                **{
+                    output: values[n_days_btw_today_since_100:]
+                    for output, values in dict_predicted_outputs.items()
+                },
+                "Total Detected True": [np.nan for _ in range(n_days_since_today)],
+                "Total Detected Deaths True": [np.nan for _ in range(n_days_since_today)],
+                **{
+                    bound: values_bound[n_days_btw_today_since_100:]
+                    for bound, values_bound in dict_bounds.items()
+                },
+            }
+        )
+        # Generation of the dataframe from the day since 100th case
+        df_predictions_since_100_cont_country_prov = pd.DataFrame(
+            {
+                "Continent": [self.continent for _ in range(n_days_since_100)],
+                "Country": [self.country for _ in range(n_days_since_100)],
+                "Province": [self.province for _ in range(n_days_since_100)],
+                "Day": all_dates_since_100,
+                **dict_predicted_outputs,
+                "Total Detected True": cases_data_fit
+                                       + [np.nan for _ in range(n_days_since_100 - len(cases_data_fit))],
+                "Total Detected Deaths True": deaths_data_fit
+                                              + [np.nan for _ in range(n_days_since_100 - len(deaths_data_fit))],
+                **dict_bounds,
+            }
+        )
         return (
             df_predictions_since_today_cont_country_prov,
             df_predictions_since_100_cont_country_prov,
@@ -1036,27 +1133,7 @@ class DELPHIDataCreator:
             for i in range(n_days_since_today)
         ]
         # Predictions
-        total_detected = self.x_sol_final[15, :]  # DT
-        total_detected = [int(round(x, 0)) for x in total_detected]
-        active_cases = (
-                self.x_sol_final[4, :]
-                + self.x_sol_final[5, :]
-                + self.x_sol_final[7, :]
-                + self.x_sol_final[8, :]
-        )  # DHR + DQR + DHD + DQD
-        active_cases = [int(round(x, 0)) for x in active_cases]
-        active_hospitalized = (
-                self.x_sol_final[4, :] + self.x_sol_final[7, :]
-        )  # DHR + DHD
-        active_hospitalized = [int(round(x, 0)) for x in active_hospitalized]
-        cumulative_hospitalized = self.x_sol_final[11, :]  # TH
-        cumulative_hospitalized = [int(round(x, 0)) for x in cumulative_hospitalized]
-        total_detected_deaths = self.x_sol_final[14, :]  # DD
-        total_detected_deaths = [int(round(x, 0)) for x in total_detected_deaths]
-        active_ventilated = (
-                self.x_sol_final[12, :] + self.x_sol_final[13, :]
-        )  # DVR + DVD
-        active_ventilated = [int(round(x, 0)) for x in active_ventilated]
+        dict_predicted_outputs = self.get_predicted_outputs()
         # Generation of the dataframe since today
         df_predictions_since_today_cont_country_prov = pd.DataFrame(
             {
@@ -1066,16 +1143,10 @@ class DELPHIDataCreator:
                 "Country": [self.country for _ in range(n_days_since_today)],
                 "Province": [self.province for _ in range(n_days_since_today)],
                 "Day": all_dates_since_today,
-                "Total Detected": total_detected[n_days_btw_today_since_100:],
-                "Active": active_cases[n_days_btw_today_since_100:],
-                "Active Hospitalized": active_hospitalized[n_days_btw_today_since_100:],
-                "Cumulative Hospitalized": cumulative_hospitalized[
-                                           n_days_btw_today_since_100:
-                                           ],
-                "Total Detected Deaths": total_detected_deaths[
-                                         n_days_btw_today_since_100:
-                                         ],
-                "Active Ventilated": active_ventilated[n_days_btw_today_since_100:],
+                **{
+                    output: predicted_values[n_days_btw_today_since_100:]
+                    for output, predicted_values in dict_predicted_outputs.items()
+                },
             }
         )
 
@@ -1092,12 +1163,7 @@ class DELPHIDataCreator:
                 "Country": [self.country for _ in range(len(all_dates_since_100))],
                 "Province": [self.province for _ in range(len(all_dates_since_100))],
                 "Day": all_dates_since_100,
-                "Total Detected": total_detected,
-                "Active": active_cases,
-                "Active Hospitalized": active_hospitalized,
-                "Cumulative Hospitalized": cumulative_hospitalized,
-                "Total Detected Deaths": total_detected_deaths,
-                "Active Ventilated": active_ventilated,
+                **dict_predicted_outputs,
             }
         )
         if (
@@ -1145,6 +1211,188 @@ class DELPHIDataCreator:
         )
 
 
+class DELPHIAggregationEngine:
+    """
+    Holds predictions as an (area x day x metric) array, where areas are the unique (scenario, continent, country,
+    province) keys, together with the index mapping each area to its country, continent and world aggregations. All
+    aggregation levels are computed in one pass with segment sums, and the dataframe is only emitted at the end
+    """
+    area_columns = ["Continent", "Country", "Province"]
+    aggregation_levels = ["country", "continent", "world"]
+
+    def __init__(
+            self, df_predictions: pd.DataFrame, scenario_columns: Union[list, None] = None,
+            levels: Union[list, None] = None, min_count: int = 0,
+    ):
+        """
+        :param df_predictions: predictions dataframe with one row per area (and scenario) and day, with string or compact
+        dtypes (cf. compact_dataframe), the aggregated dataframes emitted having the same kind of dtypes
+        :param scenario_columns: additional key columns identifying scenarios which are never aggregated together,
+        e.g. ["Policy", "Time"] for the policy predictions
+        :param levels: aggregation levels to compute among "country", "continent" and "world" (default all of them)
+        :param min_count: minimum number of non-NaN values required to compute an aggregated value, otherwise NaN
+        (same as in pandas' sum)
+        """
+        self.scenario_columns = list(scenario_columns) if scenario_columns is not None else []
+        self.key_columns = self.scenario_columns + self.area_columns
+        self.levels = list(levels) if levels is not None else self.aggregation_levels
+        self.min_count = min_count
+        self.columns = df_predictions.columns.tolist()
+        self.metric_columns = [x for x in self.columns if x not in self.key_columns + ["Day"]]
+        self.metric_dtypes = df_predictions[self.metric_columns].dtypes
+        self.is_compact = is_dataframe_compact(df_predictions)
+        # Indexing areas (sorted by key) and days (sorted)
+        day_codes, self.days = pd.factorize(df_predictions["Day"], sort=True)
+        list_codes, list_uniques = [], []
+        for key_column in self.key_columns:
+            codes, uniques = pd.factorize(df_predictions[key_column], sort=True)
+            list_codes.append(codes)
+            list_uniques.append(np.asarray(uniques, dtype=object))
+        area_ids, area_codes = np.unique(
+            np.ravel_multi_index(list_codes, [len(x) for x in list_uniques]), return_inverse=True
+        )
+        area_codes = area_codes.reshape(-1)
+        self.area_keys = {
+            key_column: uniques[codes]
+            for key_column, uniques, codes in zip(
+                self.key_columns, list_uniques, np.unravel_index(area_ids, [len(x) for x in list_uniques])
+            )
+        }
+        n_areas, n_days = len(area_ids), len(self.days)
+        self.values = np.full((n_areas, n_days, len(self.metric_columns)), np.nan)
+        self.values[area_codes, day_codes] = df_predictions[self.metric_columns].values.astype(float)
+        self.is_present = np.zeros((n_areas, n_days), dtype=bool)
+        self.is_present[area_codes, day_codes] = True
+        self.aggregated_keys, self.aggregated_values, self.aggregated_is_present = self.compute_aggregations()
+
+    def get_aggregation_index(self) -> (dict, np.array, np.array):
+        """
+        Computes the index mapping each area to the aggregated areas it belongs to, for all the levels
+        :return: a tuple (keys of the aggregated areas as a dictionary {key column: array}, array of area indices,
+        array of the corresponding aggregated area indices)
+        """
+        province, country = self.area_keys["Province"], self.area_keys["Country"]
+        n_areas = len(province)
+        dict_aggregated_keys = {key_column: [] for key_column in self.key_columns}
+        list_area_indices, list_aggregated_indices = [], []
+        n_aggregated_areas = 0
+        for level in self.levels:
+            if level == "country":
+                area_indices = np.flatnonzero(province != "None")
+                grouping_columns = self.scenario_columns + ["Continent", "Country"]
+            elif level == "continent":
+                area_indices = np.arange(n_areas)
+                grouping_columns = self.scenario_columns + ["Continent"]
+            elif level == "world":
+                area_indices = np.arange(n_areas)
+                grouping_columns = self.scenario_columns
+            else:
+                raise ValueError(f"Unknown aggregation level {level}, expected one of {self.aggregation_levels}")
+            if len(area_indices) == 0:
+                continue
+            if len(grouping_columns) > 0:
+                # Areas are sorted by key, so each group is made of consecutive areas
+                group_keys = np.array(
+                    [self.area_keys[x][area_indices] for x in grouping_columns], dtype=object
+                ).T
+                is_new_group = np.append(True, (group_keys[1:] != group_keys[:-1]).any(axis=1))
+                group_indices = np.cumsum(is_new_group) - 1
+                first_area_indices = area_indices[is_new_group]
+            else:
+                group_indices = np.zeros(len(area_indices), dtype=int)
+                first_area_indices = area_indices[:1]
+            for key_column in self.key_columns:
+                if key_column in grouping_columns:
+                    dict_aggregated_keys[key_column].append(self.area_keys[key_column][first_area_indices])
+                else:
+                    dict_aggregated_keys[key_column].append(
+                        np.array(["None"] * len(first_area_indices), dtype=object)
+                    )
+            list_area_indices.append(area_indices)
+            list_aggregated_indices.append(group_indices + n_aggregated_areas)
+            n_aggregated_areas += len(first_area_indices)
+        if n_aggregated_areas == 0:
+            return (
+                {key_column: np.array([], dtype=object) for key_column in self.key_columns},
+                np.array([], dtype=int),
+                np.array([], dtype=int),
+            )
+        return (
+            {key_column: np.concatenate(x) for key_column, x in dict_aggregated_keys.items()},
+            np.concatenate(list_area_indices),
+            np.concatenate(list_aggregated_indices),
+        )
+
+    def compute_aggregations(self) -> (dict, np.array, np.array):
+        """
+        Computes all aggregation levels at once as a sparse (aggregated area x area) indicator matrix product
+        :return: a tuple (keys of the aggregated areas as a dictionary {key column: array}, aggregated values as an
+        (aggregated area x day x metric) array, presence of the aggregated area on each day)
+        """
+        aggregated_keys, area_indices, aggregated_indices = self.get_aggregation_index()
+        n_areas, n_days, n_metrics = self.values.shape
+        n_aggregated_areas = len(aggregated_keys[self.key_columns[0]])
+        indicator_matrix = scipy.sparse.csr_matrix(
+            (np.ones(len(area_indices)), (aggregated_indices, area_indices)), shape=(n_aggregated_areas, n_areas)
+        )
+        is_not_nan = ~np.isnan(self.values)
+        aggregated_values = indicator_matrix.dot(
+            np.where(is_not_nan, self.values, 0).reshape(n_areas, -1)
+        ).reshape(n_aggregated_areas, n_days, n_metrics)
+        aggregated_counts = indicator_matrix.dot(
+            is_not_nan.reshape(n_areas, -1).astype(float)
+        ).reshape(n_aggregated_areas, n_days, n_metrics)
+        aggregated_values[aggregated_counts < self.min_count] = np.nan
+        aggregated_is_present = indicator_matrix.dot(self.is_present.astype(float)) > 0
+        return aggregated_keys, aggregated_values, aggregated_is_present
+
+    def to_dataframe(self, include_areas: bool = True, include_aggregations: bool = True) -> pd.DataFrame:
+        """
+        Emits the dataframe of predictions, sorted by key columns and day
+        :param include_areas: whether to include the original (non aggregated) predictions
+        :param include_aggregations: whether to include the aggregated predictions
+        :return: dataframe with the same columns as the original predictions dataframe
+        """
+        list_keys, list_values, list_is_present = [], [], []
+        if include_areas:
+            list_keys.append(self.area_keys)
+            list_values.append(self.values)
+            list_is_present.append(self.is_present)
+        if include_aggregations:
+            list_keys.append(self.aggregated_keys)
+            list_values.append(self.aggregated_values)
+            list_is_present.append(self.aggregated_is_present)
+        keys = {
+            key_column: np.concatenate([x[key_column] for x in list_keys]) for key_column in self.key_columns
+        }
+        values = np.concatenate(list_values)
+        is_present = np.concatenate(list_is_present)
+        # Sorting rows by key columns and day, the original areas coming first for equal keys
+        list_key_codes, list_n_uniques = [], []
+        for key_column in self.key_columns:
+            key_codes, key_uniques = pd.factorize(keys[key_column], sort=True)
+            list_key_codes.append(key_codes)
+            list_n_uniques.append(len(key_uniques))
+        key_ranks = np.unique(np.ravel_multi_index(list_key_codes, list_n_uniques), return_inverse=True)[1]
+        row_area_indices, row_day_indices = np.nonzero(is_present)
+        order = np.lexsort([row_area_indices, row_day_indices, key_ranks.reshape(-1)[row_area_indices]])
+        row_area_indices, row_day_indices = row_area_indices[order], row_day_indices[order]
+        df_predictions = pd.DataFrame({key_column: keys[key_column][row_area_indices] for key_column in self.key_columns})
+        df_predictions["Day"] = np.asarray(self.days)[row_day_indices]
+        row_values = values[row_area_indices, row_day_indices]
+        for i, (metric_column, metric_dtype) in enumerate(zip(self.metric_columns, self.metric_dtypes)):
+            metric_values = row_values[:, i]
+            # Aggregated sums can exceed the range of the areas' dtype (e.g. int32 in compact dataframes), so integer
+            # counts are emitted as int64 and only narrowed again by compact_dataframe after checking their range
+            if metric_dtype.kind in "iu" and not np.isnan(metric_values).any():
+                metric_values = metric_values.astype(np.int64)
+            df_predictions[metric_column] = metric_values
+        df_predictions = df_predictions[self.columns]
+        if self.is_compact:
+            df_predictions = compact_dataframe(df_predictions)
+        return df_predictions
+
+
 class DELPHIAggregations:
     @staticmethod
     def get_aggregation_per_country(df_predictions: pd.DataFrame) -> pd.DataFrame:
@@ -1153,10 +1401,8 @@ class DELPHIAggregations:
         :param df_predictions: DELPHI predictions dataframe
         :return: DELPHI predictions dataframe aggregated at the country level
         """
-        df_predictions = df_predictions[df_predictions["Province"] != "None"]
-        df_agg_country = df_predictions.groupby(["Continent", "Country", "Day"]).sum().reset_index()
-        df_agg_country["Province"] = "None"
-        df_agg_country = df_agg_country[df_predictions.columns]
+        aggregation_engine = DELPHIAggregationEngine(df_predictions, levels=["country"])
+        df_agg_country = aggregation_engine.to_dataframe(include_areas=False)
         return df_agg_country
 
     @staticmethod
@@ -1166,10 +1412,8 @@ class DELPHIAggregations:
         :param df_predictions: DELPHI predictions dataframe
         :return: DELPHI predictions dataframe aggregated at the continent level
         """
-        df_agg_continent = df_predictions.groupby(["Continent", "Day"]).sum().reset_index()
-        df_agg_continent["Country"] = "None"
-        df_agg_continent["Province"] = "None"
-        df_agg_continent = df_agg_continent[df_predictions.columns]
+        aggregation_engine = DELPHIAggregationEngine(df_predictions, levels=["continent"])
+        df_agg_continent = aggregation_engine.to_dataframe(include_areas=False)
         return df_agg_continent
 
     @staticmethod
@@ -1179,11 +1423,8 @@ class DELPHIAggregations:
         :param df_predictions: DELPHI predictions dataframe
         :return: DELPHI predictions dataframe aggregated at the world level (only one row in this dataframe)
         """
-        df_agg_world = df_predictions.groupby("Day").sum().reset_index()
-        df_agg_world["Continent"] = "None"
-        df_agg_world["Country"] = "None"
-        df_agg_world["Province"] = "None"
-        df_agg_world = df_agg_world[df_predictions.columns]
+        aggregation_engine = DELPHIAggregationEngine(df_predictions, levels=["world"])
+        df_agg_world = aggregation_engine.to_dataframe(include_areas=False)
         return df_agg_world
 
     @staticmethod
@@ -1193,30 +1434,101 @@ class DELPHIAggregations:
         :param df_predictions: dataframe with the raw predictions from DELPHI
         :return: dataframe with raw predictions from DELPHI and aggregated ones at the country, continent & world levels
         """
-        df_agg_since_today_per_country = DELPHIAggregations.get_aggregation_per_country(
-            df_predictions
+        aggregation_engine = DELPHIAggregationEngine(df_predictions)
+        df_predictions = aggregation_engine.to_dataframe()
+        return df_predictions
+
+    @staticmethod
+    def get_bounds_aggregations(
+            df_agg: pd.DataFrame, past_predictions_index: DELPHIPastPredictionsIndex, past_prediction_date: str,
+            q: float = 0.5
+    ) -> pd.DataFrame:
+        """
+        Computes the Confidence Intervals of all aggregated areas at once: the residuals of the past predictions are
+        computed per area with a groupby, and the bounds are broadcast over the days since today of each area
+        :param df_agg: aggregated predictions sorted by area and day, with the fitted data as "True" columns
+        :param past_predictions_index: index of the past predictions, built with the same past prediction date
+        :param past_prediction_date: past prediction's date for CI generation
+        :param q: quantile used for the CIs
+        :return: dataframe with the lower and upper bounds of all outputs, aligned on df_agg (NaN for areas without
+        past predictions)
+        """
+        area_columns = DELPHIAggregationEngine.area_columns
+        area_ids = df_agg.groupby(area_columns, sort=False, observed=True).ngroup().values
+        is_area_start = np.append(True, area_ids[1:] != area_ids[:-1])
+        list_areas = [tuple(x) for x in df_agg.loc[is_area_start, area_columns].values]
+        first_days = np.repeat(
+            df_agg["Day"].values[is_area_start], np.diff(np.append(np.flatnonzero(is_area_start), len(df_agg)))
         )
-        df_agg_since_today_per_continent = DELPHIAggregations.get_aggregation_per_continent(
-            df_predictions
+        n_days_btw_today_since_100 = (datetime.now() - pd.to_datetime(pd.Series(first_days))).dt.days.values
+        df_past_predictions = past_predictions_index.get_past_predictions_areas(list_areas)
+        dict_residuals_rmse = {}
+        for fitted_output in ["Total Detected", "Total Detected Deaths"]:
+            fit_data = df_agg[f"{fitted_output} True"]
+            is_fit_data_past = ((df_agg["Day"] > past_prediction_date) & fit_data.notnull()).values
+            df_fit_data_past = pd.DataFrame({
+                "Area Index": area_ids[is_fit_data_past],
+                "Fit Data": fit_data.values[is_fit_data_past].astype(float),
+            })
+            # Past predictions and fitted data are compared day by day from the past prediction date
+            df_fit_data_past["Day Rank"] = df_fit_data_past.groupby("Area Index").cumcount()
+            df_fit_data_past = df_fit_data_past.merge(
+                df_past_predictions[["Area Index", "Day Rank", fitted_output]], on=["Area Index", "Day Rank"]
+            )
+            squared_errors = (df_fit_data_past["Fit Data"] - df_fit_data_past[fitted_output]) ** 2
+            residuals_rmse_per_area = np.sqrt(
+                squared_errors.groupby(df_fit_data_past["Area Index"]).mean()
+            ).reindex(np.arange(len(list_areas)))
+            dict_residuals_rmse[fitted_output] = residuals_rmse_per_area.values[area_ids]
+        dict_bounds = get_confidence_intervals_bounds(
+            dict_predicted_outputs={output: df_agg[output].values.astype(float) for output in MAPPING_OUTPUT_TO_STATES},
+            dict_residuals_rmse=dict_residuals_rmse,
+            n_days_btw_today_since_100=n_days_btw_today_since_100,
+            q=q,
+            group_ids=area_ids,
         )
-        df_agg_since_today_world = DELPHIAggregations.get_aggregation_world(df_predictions)
-        df_predictions = pd.concat(
-            [
-                df_predictions,
-                df_agg_since_today_per_country,
-                df_agg_since_today_per_continent,
-                df_agg_since_today_world,
-            ]
+        return pd.DataFrame(dict_bounds, index=df_agg.index)
+
+    @staticmethod
+    def get_aggregations_with_cf(
+            df_predictions: pd.DataFrame,
+            levels: list,
+            past_prediction_file: str = "I://covid19orc//danger_map//predicted//Global_V2_20200720.csv",
+            past_prediction_date: str = "2020-07-04",
+            q: float = 0.5,
+            past_predictions_index: Union[DELPHIPastPredictionsIndex, None] = None,
+    ) -> pd.DataFrame:
+        """
+        Creates aggregations at the required levels as well as associated confidence intervals
+        :param df_predictions: dataframe containing the raw predictions from the DELPHI model
+        :param levels: aggregation levels among "country", "continent" and "world"
+        :param past_prediction_file: past prediction file's path for CI generation
+        :param past_prediction_date: past prediction's date for CI generation
+        :param q: quantile used for the CIs
+        :param past_predictions_index: index of the past predictions already loaded, if None the file is read
+        :return: dataframe with aggregated predictions & associated confidence intervals
+        """
+        if past_predictions_index is None:
+            past_predictions_index = DELPHIPastPredictionsIndex.from_file(past_prediction_file, past_prediction_date)
+        columns_without_bounds = [x for x in df_predictions.columns if ("LB" not in x) and ("UB" not in x)]
+        aggregation_engine = DELPHIAggregationEngine(
+            df_predictions[columns_without_bounds], levels=levels, min_count=1
         )
-        df_predictions.sort_values(["Continent", "Country", "Province", "Day"], inplace=True)
-        return df_predictions
+        df_agg = aggregation_engine.to_dataframe(include_areas=False)
+        df_bounds = DELPHIAggregations.get_bounds_aggregations(
+            df_agg=df_agg, past_predictions_index=past_predictions_index,
+            past_prediction_date=past_prediction_date, q=q,
+        )
+        df_agg = pd.concat([df_agg, df_bounds], axis=1)
+        return df_agg
 
     @staticmethod
     def get_aggregation_per_country_with_cf(
             df_predictions: pd.DataFrame,
             past_prediction_file: str = "I://covid19orc//danger_map//predicted//Global_V2_20200720.csv",
             past_prediction_date: str = "2020-07-04",
-            q: float = 0.5
+            q: float = 0.5,
+            past_predictions_index: Union[DELPHIPastPredictionsIndex, None] = None,
     ) -> pd.DataFrame:
         """
         Creates aggregations at the country level as well as associated confidence intervals
@@ -1224,82 +1536,21 @@ class DELPHIAggregations:
         :param past_prediction_file: past prediction file's path for CI generation
         :param past_prediction_date: past prediction's date for CI generation
         :param q: quantile used for the CIs
+        :param past_predictions_index: index of the past predictions already loaded, if None the file is read
         :return: dataframe with country level aggregated predictions & associated confidence intervals
         """
-        df_predictions = df_predictions[df_predictions["Province"] != "None"]
-        columns_without_bounds = [x for x in df_predictions.columns if ("LB" not in x) and ("UB" not in x)]
-        df_agg_country = df_predictions[columns_without_bounds].groupby(["Continent", "Country", "Day"]).sum(min_count = 1).reset_index()
-        df_agg_country["Province"] = "None"
-        df_agg_country = df_agg_country[columns_without_bounds]
-        aggregated_countries = set(zip(df_agg_country["Country"],df_agg_country["Province"]))
-        past_predictions = pd.read_csv(past_prediction_file)
-        list_df_aggregated_countries = []
-        for country, province in aggregated_countries:
-            past_predictions_temp = (past_predictions[(past_predictions['Day'] > past_prediction_date) & (past_predictions['Country'] == country) & (past_predictions['Province'] == province)]).sort_values("Day")
-            df_agg_country_temp = (df_agg_country[(df_agg_country['Country'] == country) & (df_agg_country['Province'] == province)]).sort_values("Day").reset_index(drop=True)
-            total_detected = df_agg_country_temp['Total Detected'] 
-            total_detected_deaths = df_agg_country_temp['Total Detected Deaths'] 
-#            active_cases = df_agg_country_temp['Active'] 
-#            active_hospitalized = df_agg_country_temp['Active Hospitalized'] 
-#            cumulative_hospitalized = df_agg_country_temp['Cumulative Hospitalized'] 
-#            active_ventilated = df_agg_country_temp['Active Ventilated'] 
-            cases_fit_data = df_agg_country_temp['Total Detected True'] 
-            deaths_fit_data = df_agg_country_temp['Total Detected Deaths True'] 
-            since_100_dates = df_agg_country_temp['Day'] 
-            n_days_btw_today_since_100 = (datetime.now() - pd.to_datetime(min(since_100_dates))).days
-            if len(past_predictions_temp) > 0:
-                cases_fit_data_past = [y for x, y in zip(since_100_dates,cases_fit_data) if ((x > past_prediction_date) and (not np.isnan(y)))]
-                deaths_fit_data_past = [y for x, y in zip(since_100_dates,deaths_fit_data) if ((x > past_prediction_date) and (not np.isnan(y)))]
-                total_detected_past = past_predictions_temp["Total Detected"].values[:len(cases_fit_data_past)]
-                total_detected_deaths_past = past_predictions_temp["Total Detected Deaths"].values[:len(deaths_fit_data_past)]
-                residual_cases_lb = np.sqrt(np.mean([(x- y) ** 2 for x,y in zip(cases_fit_data_past,total_detected_past)])) * scipy.stats.norm.ppf(0.5 - q /2)
-                residual_cases_ub = np.sqrt(np.mean([(x- y) ** 2 for x,y in zip(cases_fit_data_past,total_detected_past)])) * scipy.stats.norm.ppf(0.5 + q /2)
-                residual_deaths_lb = np.sqrt(np.mean([(x- y) ** 2 for x,y in zip(deaths_fit_data_past,total_detected_deaths_past)])) * scipy.stats.norm.ppf(0.5 - q /2)
-                residual_deaths_ub = np.sqrt(np.mean([(x- y) ** 2 for x,y in zip(deaths_fit_data_past,total_detected_deaths_past)])) *  scipy.stats.norm.ppf(0.5 + q /2)
-        
-                # Generation of the dataframe from the day since 100th case
-                df_predictions_since_100_cont_country_prov = pd.DataFrame({
-                    "Total Detected LB": make_increasing([max(int(round(v + residual_cases_lb * np.sqrt(max(c - n_days_btw_today_since_100, 0)),0)),0) for c, v in enumerate(total_detected)]),
-#                    "Active LB": [max(int(round(v + residual_cases_lb * np.sqrt(max(c - n_days_btw_today_since_100, 0)) * v / u,0)),0) for c, (v, u) in enumerate(zip(active_cases, total_detected))],
-#                    "Active Hospitalized LB": [max(int(round(v + residual_cases_lb * np.sqrt(max(c - n_days_btw_today_since_100, 0)) * v / u,0)),0) for c, (v, u) in enumerate(zip(active_hospitalized, total_detected))],
-#                    "Cumulative Hospitalized LB": make_increasing([max(int(round(v + residual_cases_lb * np.sqrt(max(c - n_days_btw_today_since_100, 0)) * v / u,0)),0) for c, (v, u) in enumerate(zip(cumulative_hospitalized, total_detected))]),
-                    "Total Detected Deaths LB": make_increasing([max(int(round(v + residual_deaths_lb * np.sqrt(max(c - n_days_btw_today_since_100, 0)),0)),0) for c, v in enumerate(total_detected_deaths)]),
-#                    "Active Ventilated LB": [max(int(round(v + residual_cases_lb * np.sqrt(max(c - n_days_btw_today_since_100, 0)) * v / u,0)),0) for c, (v, u) in enumerate(zip(active_ventilated, total_detected))],
-                    "Total Detected UB": [max(int(round(v + residual_cases_ub * np.sqrt(max(c - n_days_btw_today_since_100, 0)),0)),0) for c, v in enumerate(total_detected)],
-#                    "Active UB": [max(int(round(v + residual_cases_ub * np.sqrt(max(c - n_days_btw_today_since_100, 0)) * v / u,0)),0) for c, (v, u) in enumerate(zip(active_cases, total_detected))],
-#                    "Active Hospitalized UB": [max(int(round(v + residual_cases_ub * np.sqrt(max(c - n_days_btw_today_since_100, 0)) * v / u,0)),0) for c, (v, u) in enumerate(zip(active_hospitalized, total_detected))],
-#                    "Cumulative Hospitalized UB": [max(int(round(v + residual_cases_ub * np.sqrt(max(c - n_days_btw_today_since_100, 0)) * v / u,0)),0) for c, (v, u) in enumerate(zip(cumulative_hospitalized, total_detected))],
-                    "Total Detected Deaths UB": [max(int(round(v + residual_deaths_ub * np.sqrt(max(c - n_days_btw_today_since_100, 0)),0)),0) for c, v in enumerate(total_detected_deaths)],
-#                    "Active Ventilated UB": [max(int(round(v + residual_cases_ub * np.sqrt(max(c - n_days_btw_today_since_100, 0)) * v / u,0)),0) for c, (v, u) in enumerate(zip(active_ventilated, total_detected))],
-                })
-                df_agg_country_temp = pd.concat([df_agg_country_temp, df_predictions_since_100_cont_country_prov], axis = 1)
-            else:
-                df_predictions_since_100_cont_country_prov = pd.DataFrame({
-                    "Total Detected LB": [np.nan for _ in range(len(df_agg_country_temp))],  
-#                    "Active LB":  [np.nan for _ in range(len(df_agg_country_temp))],  
-#                    "Active Hospitalized LB":  [np.nan for _ in range(len(df_agg_country_temp))],  
-#                    "Cumulative Hospitalized LB":  [np.nan for _ in range(len(df_agg_country_temp))],  
-                    "Total Detected Deaths LB":  [np.nan for _ in range(len(df_agg_country_temp))],  
-#                    "Active Ventilated LB":  [np.nan for _ in range(len(df_agg_country_temp))],  
-                    "Total Detected UB":  [np.nan for _ in range(len(df_agg_country_temp))],  
-#                    "Active UB":  [np.nan for _ in range(len(df_agg_country_temp))],  
-#                    "Active Hospitalized UB":  [np.nan for _ in range(len(df_agg_country_temp))],  
-#                    "Cumulative Hospitalized UB":  [np.nan for _ in range(len(df_agg_country_temp))],  
-                    "Total Detected Deaths UB":  [np.nan for _ in range(len(df_agg_country_temp))],  
-#                    "Active Ventilated UB": [np.nan for _ in range(len(df_agg_country_temp))]
-                })
-                df_agg_country_temp = pd.concat([df_agg_country_temp, df_predictions_since_100_cont_country_prov], axis = 1)
-
-            list_df_aggregated_countries.append(df_agg_country_temp)
-        df_agg_country_final = pd.concat(list_df_aggregated_countries)
-        return df_agg_country_final 
+        return DELPHIAggregations.get_aggregations_with_cf(
+            df_predictions=df_predictions, levels=["country"], past_prediction_file=past_prediction_file,
+            past_prediction_date=past_prediction_date, q=q, past_predictions_index=past_predictions_index,
+        )
 
     @staticmethod
     def get_aggregation_per_continent_with_cf(
             df_predictions: pd.DataFrame,
             past_prediction_file: str = "I://covid19orc//danger_map//predicted//Global_V2_20200720.csv",
             past_prediction_date: str = "2020-07-04",
-            q: float = 0.5
+            q: float = 0.5,
+            past_predictions_index: Union[DELPHIPastPredictionsIndex, None] = None,
     ) -> pd.DataFrame:
         """
         Creates aggregations at the continent level as well as associated confidence intervals
@@ -1307,81 +1558,21 @@ class DELPHIAggregations:
         :param past_prediction_file: past prediction file's path for CI generation
         :param past_prediction_date: past prediction's date for CI generation
         :param q: quantile used for the CIs
+        :param past_predictions_index: index of the past predictions already loaded, if None the file is read
         :return: dataframe with continent level aggregated predictions & associated confidence intervals
         """
-        columns_without_bounds = [x for x in df_predictions.columns if ("LB" not in x) and ("UB" not in x)]
-        df_agg_continent = df_predictions[columns_without_bounds].groupby(["Continent", "Day"]).sum(min_count = 1).reset_index()
-        df_agg_continent["Country"] = "None"
-        df_agg_continent["Province"] = "None"
-        df_agg_continent = df_agg_continent[columns_without_bounds]
-        aggregated_continents = set(zip(df_agg_continent["Continent"], df_agg_continent["Country"],df_agg_continent["Province"]))
-        past_predictions = pd.read_csv(past_prediction_file)
-        list_df_aggregated_continents = []
-        for continent, country, province in aggregated_continents:
-            past_predictions_temp = (past_predictions[(past_predictions['Day'] > past_prediction_date) & (past_predictions['Continent'] == continent) & (past_predictions['Country'] == country) & (past_predictions['Country'] == province)]).sort_values("Day")
-            df_agg_continent_temp = (df_agg_continent[(df_agg_continent['Continent'] == continent)]).sort_values("Day").reset_index(drop=True)
-            total_detected = df_agg_continent_temp['Total Detected'] 
-            total_detected_deaths = df_agg_continent_temp['Total Detected Deaths'] 
-#            active_cases = df_agg_continent_temp['Active'] 
-#            active_hospitalized = df_agg_continent_temp['Active Hospitalized'] 
-#            cumulative_hospitalized = df_agg_continent_temp['Cumulative Hospitalized'] 
-#            active_ventilated = df_agg_continent_temp['Active Ventilated'] 
-            cases_fit_data = df_agg_continent_temp['Total Detected True'] 
-            deaths_fit_data = df_agg_continent_temp['Total Detected Deaths True'] 
-            since_100_dates = df_agg_continent_temp['Day']   
-            n_days_btw_today_since_100 = (datetime.now() - pd.to_datetime(min(since_100_dates))).days
-            if len(past_predictions_temp) > 0:
-                cases_fit_data_past = [y for x, y in zip(since_100_dates,cases_fit_data) if ((x > past_prediction_date) and (not np.isnan(y)))]
-                deaths_fit_data_past = [y for x, y in zip(since_100_dates,deaths_fit_data) if ((x > past_prediction_date) and (not np.isnan(y)))]
-                total_detected_past = past_predictions_temp["Total Detected"].values[:len(cases_fit_data_past)]
-                total_detected_deaths_past = past_predictions_temp["Total Detected Deaths"].values[:len(deaths_fit_data_past)]
-                residual_cases_lb = np.sqrt(np.mean([(x- y) ** 2 for x,y in zip(cases_fit_data_past,total_detected_past)])) * scipy.stats.norm.ppf(0.5 - q /2)
-                residual_cases_ub = np.sqrt(np.mean([(x- y) ** 2 for x,y in zip(cases_fit_data_past,total_detected_past)])) * scipy.stats.norm.ppf(0.5 + q /2)
-                residual_deaths_lb = np.sqrt(np.mean([(x- y) ** 2 for x,y in zip(deaths_fit_data_past,total_detected_deaths_past)])) * scipy.stats.norm.ppf(0.5 - q /2)
-                residual_deaths_ub = np.sqrt(np.mean([(x- y) ** 2 for x,y in zip(deaths_fit_data_past,total_detected_deaths_past)])) *  scipy.stats.norm.ppf(0.5 + q /2)
-                # Generation of the dataframe from the day since 100th case
-                df_predictions_since_100_cont_country_prov = pd.DataFrame({
-                    "Total Detected LB": make_increasing([max(int(round(v + residual_cases_lb * np.sqrt(max(c - n_days_btw_today_since_100, 0)),0)),0) for c, v in enumerate(total_detected)]),
-#                    "Active LB": [max(int(round(v + residual_cases_lb * np.sqrt(max(c - n_days_btw_today_since_100, 0)) * v / u,0)),0) for c, (v, u) in enumerate(zip(active_cases, total_detected))],
-#                    "Active Hospitalized LB": [max(int(round(v + residual_cases_lb * np.sqrt(max(c - n_days_btw_today_since_100, 0)) * v / u,0)),0) for c, (v, u) in enumerate(zip(active_hospitalized, total_detected))],
-#                    "Cumulative Hospitalized LB": make_increasing([max(int(round(v + residual_cases_lb * np.sqrt(max(c - n_days_btw_today_since_100, 0)) * v / u,0)),0) for c, (v, u) in enumerate(zip(cumulative_hospitalized, total_detected))]),
-                    "Total Detected Deaths LB": make_increasing([max(int(round(v + residual_deaths_lb * np.sqrt(max(c - n_days_btw_today_since_100, 0)),0)),0) for c, v in enumerate(total_detected_deaths)]),
-#                    "Active Ventilated LB": [max(int(round(v + residual_cases_lb * np.sqrt(max(c - n_days_btw_today_since_100, 0)) * v / u,0)),0) for c, (v, u) in enumerate(zip(active_ventilated, total_detected))],
-                    "Total Detected UB": [max(int(round(v + residual_cases_ub * np.sqrt(max(c - n_days_btw_today_since_100, 0)),0)),0) for c, v in enumerate(total_detected)],
-#                    "Active UB": [max(int(round(v + residual_cases_ub * np.sqrt(max(c - n_days_btw_today_since_100, 0)) * v / u,0)),0) for c, (v, u) in enumerate(zip(active_cases, total_detected))],
-#                    "Active Hospitalized UB": [max(int(round(v + residual_cases_ub * np.sqrt(max(c - n_days_btw_today_since_100, 0)) * v / u,0)),0) for c, (v, u) in enumerate(zip(active_hospitalized, total_detected))],
-#                    "Cumulative Hospitalized UB": [max(int(round(v + residual_cases_ub * np.sqrt(max(c - n_days_btw_today_since_100, 0)) * v / u,0)),0) for c, (v, u) in enumerate(zip(cumulative_hospitalized, total_detected))],
-                    "Total Detected Deaths UB": [max(int(round(v + residual_deaths_ub * np.sqrt(max(c - n_days_btw_today_since_100, 0)),0)),0) for c, v in enumerate(total_detected_deaths)],
-#                    "Active Ventilated UB": [max(int(round(v + residual_cases_ub * np.sqrt(max(c - n_days_btw_today_since_100, 0)) * v / u,0)),0) for c, (v, u) in enumerate(zip(active_ventilated, total_detected))],
-                })
-                df_agg_continent_temp = pd.concat([df_agg_continent_temp, df_predictions_since_100_cont_country_prov], axis = 1)
-            else:
-                df_predictions_since_100_cont_country_prov = pd.DataFrame({
-                    "Total Detected LB": [np.nan for _ in range(len(df_agg_continent_temp))],  
-#                    "Active LB":  [np.nan for _ in range(len(df_agg_continent_temp))],  
-#                    "Active Hospitalized LB":  [np.nan for _ in range(len(df_agg_continent_temp))],  
-#                    "Cumulative Hospitalized LB":  [np.nan for _ in range(len(df_agg_continent_temp))],  
-                    "Total Detected Deaths LB":  [np.nan for _ in range(len(df_agg_continent_temp))],  
-#                    "Active Ventilated LB":  [np.nan for _ in range(len(df_agg_continent_temp))],  
-                    "Total Detected UB":  [np.nan for _ in range(len(df_agg_continent_temp))],  
-#                    "Active UB":  [np.nan for _ in range(len(df_agg_continent_temp))],  
-#                    "Active Hospitalized UB":  [np.nan for _ in range(len(df_agg_continent_temp))],  
-#                    "Cumulative Hospitalized UB":  [np.nan for _ in range(len(df_agg_continent_temp))],  
-                    "Total Detected Deaths UB":  [np.nan for _ in range(len(df_agg_continent_temp))],  
-#                    "Active Ventilated UB": [np.nan for _ in range(len(df_agg_continent_temp))]
-                })
-                df_agg_continent_temp = pd.concat([df_agg_continent_temp, df_predictions_since_100_cont_country_prov], axis = 1)
-
-            list_df_aggregated_continents.append(df_agg_continent_temp)
-        df_agg_continent_final = pd.concat(list_df_aggregated_continents)
-        return df_agg_continent_final 
+        return DELPHIAggregations.get_aggregations_with_cf(
+            df_predictions=df_predictions, levels=["continent"], past_prediction_file=past_prediction_file,
+            past_prediction_date=past_prediction_date, q=q, past_predictions_index=past_predictions_index,
+        )
 
     @staticmethod
     def get_aggregation_world_with_cf(
             df_predictions: pd.DataFrame,
             past_prediction_file: str = "I://covid19orc//danger_map//predicted//Global_V2_20200720.csv",
             past_prediction_date: str = "2020-07-04",
-            q: float = 0.5
+            q: float = 0.5,
+            past_predictions_index: Union[DELPHIPastPredictionsIndex, None] = None,
     ) -> pd.DataFrame:
         """
         Creates aggregations at the world level as well as associated confidence intervals
@@ -1389,76 +1580,21 @@ class DELPHIAggregations:
         :param past_prediction_file: past prediction file's path for CI generation
         :param past_prediction_date: past prediction's date for CI generation
         :param q: quantile used for the CIs
+        :param past_predictions_index: index of the past predictions already loaded, if None the file is read
         :return: dataframe with continent world aggregated predictions & associated confidence intervals
         """
-        columns_without_bounds = [x for x in df_predictions.columns if ("LB" not in x) and ("UB" not in x)]
-        df_agg_world = df_predictions[columns_without_bounds].groupby(["Day"]).sum(min_count = 1).reset_index()
-        df_agg_world["Continent"] = "None"
-        df_agg_world["Country"] = "None"
-        df_agg_world["Province"] = "None"
-        df_agg_world = df_agg_world[columns_without_bounds]
-        past_predictions = pd.read_csv(past_prediction_file)
-        past_predictions_temp = (past_predictions[(past_predictions['Day'] > past_prediction_date) & (past_predictions['Continent'] == "None") & (past_predictions['Country'] == "None") & (past_predictions['Province'] == "None")]).sort_values("Day")
-        total_detected = df_agg_world['Total Detected'] 
-        total_detected_deaths = df_agg_world['Total Detected Deaths'] 
-#        active_cases = df_agg_world['Active'] 
-#        active_hospitalized = df_agg_world['Active Hospitalized'] 
-#        cumulative_hospitalized = df_agg_world['Cumulative Hospitalized'] 
-#        active_ventilated = df_agg_world['Active Ventilated'] 
-        cases_fit_data = df_agg_world['Total Detected True'] 
-        deaths_fit_data = df_agg_world['Total Detected Deaths True'] 
-        since_100_dates = df_agg_world['Day']   
-        n_days_btw_today_since_100 = (datetime.now() - pd.to_datetime(min(since_100_dates))).days
-        if len(past_predictions_temp) > 0:
-            cases_fit_data_past = [y for x, y in zip(since_100_dates,cases_fit_data) if ((x > past_prediction_date) and (not np.isnan(y)))]
-            deaths_fit_data_past = [y for x, y in zip(since_100_dates,deaths_fit_data) if ((x > past_prediction_date) and (not np.isnan(y)))]
-            total_detected_past = past_predictions_temp["Total Detected"].values[:len(cases_fit_data_past)]
-            total_detected_deaths_past = past_predictions_temp["Total Detected Deaths"].values[:len(deaths_fit_data_past)]
-            residual_cases_lb = np.sqrt(np.mean([(x- y) ** 2 for x,y in zip(cases_fit_data_past,total_detected_past)])) * scipy.stats.norm.ppf(0.5 - q /2)
-            residual_cases_ub = np.sqrt(np.mean([(x- y) ** 2 for x,y in zip(cases_fit_data_past,total_detected_past)])) * scipy.stats.norm.ppf(0.5 + q /2)
-            residual_deaths_lb = np.sqrt(np.mean([(x- y) ** 2 for x,y in zip(deaths_fit_data_past,total_detected_deaths_past)])) * scipy.stats.norm.ppf(0.5 - q /2)
-            residual_deaths_ub = np.sqrt(np.mean([(x- y) ** 2 for x,y in zip(deaths_fit_data_past,total_detected_deaths_past)])) *  scipy.stats.norm.ppf(0.5 + q /2)
-    
-            # Generation of the dataframe from the day since 100th case
-            df_predictions_since_100_cont_country_prov = pd.DataFrame({
-                "Total Detected LB": make_increasing([max(int(round(v + residual_cases_lb * np.sqrt(max(c - n_days_btw_today_since_100, 0)),0)),0) for c, v in enumerate(total_detected)]),
-#                "Active LB": [max(int(round(v + residual_cases_lb * np.sqrt(max(c - n_days_btw_today_since_100, 0)) * v / u,0)),0) for c, (v, u) in enumerate(zip(active_cases, total_detected))],
-#                "Active Hospitalized LB": [max(int(round(v + residual_cases_lb * np.sqrt(max(c - n_days_btw_today_since_100, 0)) * v / u,0)),0) for c, (v, u) in enumerate(zip(active_hospitalized, total_detected))],
-#                "Cumulative Hospitalized LB": make_increasing([max(int(round(v + residual_cases_lb * np.sqrt(max(c - n_days_btw_today_since_100, 0)) * v / u,0)),0) for c, (v, u) in enumerate(zip(cumulative_hospitalized, total_detected))]),
-                "Total Detected Deaths LB": make_increasing([max(int(round(v + residual_deaths_lb * np.sqrt(max(c - n_days_btw_today_since_100, 0)),0)),0) for c, v in enumerate(total_detected_deaths)]),
-#                "Active Ventilated LB": [max(int(round(v + residual_cases_lb * np.sqrt(max(c - n_days_btw_today_since_100, 0)) * v / u,0)),0) for c, (v, u) in enumerate(zip(active_ventilated, total_detected))],
-                "Total Detected UB": [max(int(round(v + residual_cases_ub * np.sqrt(max(c - n_days_btw_today_since_100, 0)),0)),0) for c, v in enumerate(total_detected)],
-#                "Active UB": [max(int(round(v + residual_cases_ub * np.sqrt(max(c - n_days_btw_today_since_100, 0)) * v / u,0)),0) for c, (v, u) in enumerate(zip(active_cases, total_detected))],
-#                "Active Hospitalized UB": [max(int(round(v + residual_cases_ub * np.sqrt(max(c - n_days_btw_today_since_100, 0)) * v / u,0)),0) for c, (v, u) in enumerate(zip(active_hospitalized, total_detected))],
-#                "Cumulative Hospitalized UB": [max(int(round(v + residual_cases_ub * np.sqrt(max(c - n_days_btw_today_since_100, 0)) * v / u,0)),0) for c, (v, u) in enumerate(zip(cumulative_hospitalized, total_detected))],
-                "Total Detected Deaths UB": [max(int(round(v + residual_deaths_ub * np.sqrt(max(c - n_days_btw_today_since_100, 0)),0)),0) for c, v in enumerate(total_detected_deaths)],
-#                "Active Ventilated UB": [max(int(round(v + residual_cases_ub * np.sqrt(max(c - n_days_btw_today_since_100, 0)) * v / u,0)),0) for c, (v, u) in enumerate(zip(active_ventilated, total_detected))],
-            })
-            df_agg_world_final = pd.concat([df_agg_world, df_predictions_since_100_cont_country_prov], axis = 1)
-        else:
-            df_predictions_since_100_cont_country_prov = pd.DataFrame({
-                "Total Detected LB": [np.nan for _ in range(len(df_agg_world))],  
-#                "Active LB":  [np.nan for _ in range(len(df_agg_world))],  
-#                "Active Hospitalized LB":  [np.nan for _ in range(len(df_agg_world))],  
-#                "Cumulative Hospitalized LB":  [np.nan for _ in range(len(df_agg_world))],  
-                "Total Detected Deaths LB":  [np.nan for _ in range(len(df_agg_world))],  
-#                "Active Ventilated LB":  [np.nan for _ in range(len(df_agg_world))],  
-                "Total Detected UB":  [np.nan for _ in range(len(df_agg_world))],  
-#                "Active UB":  [np.nan for _ in range(len(df_agg_world))],  
-#                "Active Hospitalized UB":  [np.nan for _ in range(len(df_agg_world))],  
-#                "Cumulative Hospitalized UB":  [np.nan for _ in range(len(df_agg_world))],  
-                "Total Detected Deaths UB":  [np.nan for _ in range(len(df_agg_world))],  
-#                "Active Ventilated UB": [np.nan for _ in range(len(df_agg_world))]
-            })
-            df_agg_world_final = pd.concat([df_agg_world, df_predictions_since_100_cont_country_prov], axis = 1)
-        return df_agg_world_final 
+        return DELPHIAggregations.get_aggregations_with_cf(
+            df_predictions=df_predictions, levels=["world"], past_prediction_file=past_prediction_file,
+            past_prediction_date=past_prediction_date, q=q, past_predictions_index=past_predictions_index,
+        )
 
     @staticmethod
     def append_all_aggregations_cf(
             df_predictions: pd.DataFrame,
             past_prediction_file: str = "I://covid19orc//danger_map//predicted//Global_V2_20200720.csv",
             past_prediction_date: str = "2020-07-04",
-            q: float = 0.5
+            q: float = 0.5,
+            past_predictions_index: Union[DELPHIPastPredictionsIndex, None] = None,
     ) -> pd.DataFrame:
         """
         Creates and appends all the predictions' aggregations & Confidnece Intervals at the country, continent and
@@ -1467,31 +1603,22 @@ class DELPHIAggregations:
         :param past_prediction_file: past prediction file's path for CI generation
         :param past_prediction_date: past prediction's date for CI generation
         :param q: quantile used for the CIs
+        :param past_predictions_index: index of the past predictions already loaded, if None the file is read
         :return: dataframe with predictions raw from DELPHI and aggregated ones, as well as associated confidence
         intervals at the country, continent & world levels
         """
-        df_agg_since_today_per_country = DELPHIAggregations.get_aggregation_per_country_with_cf(
-            df_predictions=df_predictions,
-            past_prediction_file=past_prediction_file,
-            past_prediction_date=past_prediction_date,
-            q=q
-        )
-        df_agg_since_today_per_continent = DELPHIAggregations.get_aggregation_per_continent_with_cf(
-            df_predictions=df_predictions,
-            past_prediction_file=past_prediction_file,
-            past_prediction_date=past_prediction_date,
-            q=q
-        )
-        df_agg_since_today_world = DELPHIAggregations.get_aggregation_world_with_cf(
+        df_agg_all_levels = DELPHIAggregations.get_aggregations_with_cf(
             df_predictions=df_predictions,
+            levels=DELPHIAggregationEngine.aggregation_levels,
             past_prediction_file=past_prediction_file,
             past_prediction_date=past_prediction_date,
-            q=q
+            q=q,
+            past_predictions_index=past_predictions_index,
         )
-        df_predictions = pd.concat([
-            df_predictions, df_agg_since_today_per_country,
-            df_agg_since_today_per_continent, df_agg_since_today_world
-            ],sort=False)
+        df_predictions = pd.concat([df_predictions, df_agg_all_levels], sort=False)
+        if is_dataframe_compact(df_predictions):
+            # Categories of the raw and aggregated predictions differ, the concatenated keys are thus strings
+            df_predictions = compact_dataframe(df_predictions)
         df_predictions.sort_values(["Continent", "Country", "Province", "Day"], inplace=True)
         df_predictions_from_today = df_predictions[df_predictions.Day >= str((pd.to_datetime(datetime.now())).date())]
         return df_predictions_from_today, df_predictions
@@ -1505,17 +1632,10 @@ class DELPHIAggregationsPolicies:
         :param df_policy_predictions: DELPHI policy predictions dataframe
         :return: DELPHI policy predictions dataframe aggregated at the country level
         """
-        df_policy_predictions = df_policy_predictions[df_policy_predictions["Province"] != "None"]
-        df_agg_country = df_policy_predictions.groupby(
-            ["Policy", "Time", "Continent", "Country", "Day"]
-        ).sum().reset_index()
-        df_agg_country["Province"] = "None"
-        df_agg_country = df_agg_country[
-            [
-                "Policy", "Time", "Continent", "Country", "Province", "Day", "Total Detected", "Active",
-                "Active Hospitalized", "Cumulative Hospitalized", "Total Detected Deaths", "Active Ventilated",
-            ]
-        ]
+        aggregation_engine = DELPHIAggregationEngine(
+            df_policy_predictions, scenario_columns=["Policy", "Time"], levels=["country"]
+        )
+        df_agg_country = aggregation_engine.to_dataframe(include_areas=False)
         return df_agg_country
 
     @staticmethod
@@ -1525,17 +1645,10 @@ class DELPHIAggregationsPolicies:
         :param df_policy_predictions: DELPHI policy predictions dataframe
         :return: DELPHI policy predictions dataframe aggregated at the continent level
         """
-        df_agg_continent = (
-            df_policy_predictions.groupby(["Policy", "Time", "Continent", "Day"]).sum().reset_index()
+        aggregation_engine = DELPHIAggregationEngine(
+            df_policy_predictions, scenario_columns=["Policy", "Time"], levels=["continent"]
         )
-        df_agg_continent["Country"] = "None"
-        df_agg_continent["Province"] = "None"
-        df_agg_continent = df_agg_continent[
-            [
-                "Policy", "Time", "Continent", "Country", "Province", "Day", "Total Detected", "Active",
-                "Active Hospitalized", "Cumulative Hospitalized", "Total Detected Deaths", "Active Ventilated",
-            ]
-        ]
+        df_agg_continent = aggregation_engine.to_dataframe(include_areas=False)
         return df_agg_continent
 
     @staticmethod
@@ -1545,41 +1658,150 @@ class DELPHIAggregationsPolicies:
         :param df_policy_predictions: DELPHI policy predictions dataframe
         :return: DELPHI policy predictions dataframe aggregated at the world level
         """
-        df_agg_world = df_policy_predictions.groupby(["Policy", "Time", "Day"]).sum().reset_index()
-        df_agg_world["Continent"] = "None"
-        df_agg_world["Country"] = "None"
-        df_agg_world["Province"] = "None"
-        df_agg_world = df_agg_world[
-            [
-                "Policy", "Time", "Continent", "Country", "Province", "Day", "Total Detected", "Active",
-                "Active Hospitalized", "Cumulative Hospitalized", "Total Detected Deaths", "Active Ventilated",
-            ]
-        ]
+        aggregation_engine = DELPHIAggregationEngine(
+            df_policy_predictions, scenario_columns=["Policy", "Time"], levels=["world"]
+        )
+        df_agg_world = aggregation_engine.to_dataframe(include_areas=False)
         return df_agg_world
 
     @staticmethod
     def append_all_aggregations(df_policy_predictions: pd.DataFrame) -> pd.DataFrame:
         """
         Creates and appends all the policy predictions' aggregations at the country, continent and world levels
-        :param df_predictions: dataframe with the raw policy predictions from DELPHI
+        :param df_policy_predictions: dataframe with the raw policy predictions from DELPHI
         :return: dataframe with raw policy predictions from DELPHI and aggregated ones at the country,
         continent & world levels
         """
-        df_agg_since_today_per_country = DELPHIAggregations.get_aggregation_per_country(df_policy_predictions)
-        df_agg_since_today_per_continent = DELPHIAggregations.get_aggregation_per_continent(df_policy_predictions)
-        df_agg_since_today_world = DELPHIAggregations.get_aggregation_world(df_policy_predictions)
-        df_policy_predictions = pd.concat(
-            [
-                df_policy_predictions,
-                df_agg_since_today_per_country,
-                df_agg_since_today_per_continent,
-                df_agg_since_today_world,
-            ]
+        aggregation_engine = DELPHIAggregationEngine(df_policy_predictions, scenario_columns=["Policy", "Time"])
+        df_policy_predictions = aggregation_engine.to_dataframe()
+        return df_policy_predictions
+
+
+class DELPHICaseStore:
+    """
+    Consolidated copy of all the processed case files Cases_{country}_{province}.csv of a folder in a single columnar
+    file sorted by date, where each area is an integer id (ordered by country & province): reads can then skip the
+    dates before a given day (predicate pushdown) instead of parsing every CSV file. The store keeps the list of case
+    files it was built from and is rebuilt whenever a case file is added, removed or modified after it; without
+    pyarrow, the case files are read directly
+    """
+    filename_case_store = "Case_Store_Global.parquet"
+    key_metadata_case_files = b"delphi_case_files"
+    columns_case_store = ["area_id", "Country", "Province", "Day", "day_since100", "case_cnt", "death_cnt"]
+
+    def __init__(self, path_to_folder_cases: str):
+        self.path_to_folder_cases = path_to_folder_cases
+        self.path_case_store = path_to_folder_cases + self.filename_case_store
+
+    def get_list_case_files(self) -> list:
+        return sorted([
+            filename for filename in os.listdir(self.path_to_folder_cases)
+            if filename.startswith("Cases_") and filename.endswith(".csv")
+        ])
+
+    def is_up_to_date(self, list_case_files: list) -> bool:
+        """
+        :param list_case_files: list of the case files currently in the folder, see get_list_case_files
+        :return: True if the store exists and was built from all the case files in their current version
+        """
+        if not os.path.exists(self.path_case_store):
+            return False
+        time_modified_store = os.path.getmtime(self.path_case_store)
+        if any([
+            os.path.getmtime(self.path_to_folder_cases + filename) > time_modified_store
+            for filename in list_case_files
+        ]):
+            return False
+        metadata_store = pyarrow.parquet.read_schema(self.path_case_store).metadata or {}
+        return json.loads(metadata_store.get(self.key_metadata_case_files, b"[]")) == list_case_files
+
+    def get_cases_from_files(self, list_case_files: list) -> pd.DataFrame:
+        """
+        Reads and concatenates the case files of all areas (files without area columns, e.g. the US states file, are
+        ignored) and numbers the areas by country & province
+        :param list_case_files: list of the case files currently in the folder, see get_list_case_files
+        :return: compact dataframe with the columns of the store, sorted by day & area id
+        """
+        list_df_cases = []
+        for filename in list_case_files:
+            df_cases_area = pd.read_csv(self.path_to_folder_cases + filename)
+            if ("country" in df_cases_area.columns) and ("province" in df_cases_area.columns):
+                list_df_cases.append(
+                    df_cases_area[["country", "province", "date", "day_since100", "case_cnt", "death_cnt"]]
+                )
+        df_cases = pd.concat(list_df_cases).rename(
+            columns={"country": "Country", "province": "Province", "date": "Day"}
         )
-        df_policy_predictions.sort_values(
-            ["Policy", "Time", "Continent", "Country", "Province", "Day"], inplace=True
+        df_cases["Province"] = df_cases["Province"].fillna("None")
+        df_areas = df_cases[["Country", "Province"]].drop_duplicates().sort_values(["Country", "Province"])
+        df_cases["area_id"] = pd.MultiIndex.from_frame(df_areas).get_indexer(
+            pd.MultiIndex.from_frame(df_cases[["Country", "Province"]])
+        )
+        df_cases["Day"] = pd.to_datetime(df_cases["Day"])
+        return compact_dataframe(
+            df_cases.sort_values(["Day", "area_id"]).reset_index(drop=True)[self.columns_case_store]
         )
-        return df_policy_predictions
+
+    def build(self, list_case_files: list) -> None:
+        """
+        Reads all the case files once and writes the store, sorted by date so that row groups can be skipped by date
+        :param list_case_files: list of the case files currently in the folder, see get_list_case_files
+        """
+        df_cases = self.get_cases_from_files(list_case_files)
+        table_cases = pyarrow.Table.from_pandas(df_cases, preserve_index=False)
+        table_cases = table_cases.replace_schema_metadata({
+            **(table_cases.schema.metadata or {}),
+            self.key_metadata_case_files: json.dumps(list_case_files).encode(),
+        })
+        path_case_store_temp = self.path_case_store + ".tmp"
+        pyarrow.parquet.write_table(
+            table_cases, path_case_store_temp, row_group_size=max(df_cases.area_id.max() + 1, 1) * 7
+        )
+        os.replace(path_case_store_temp, self.path_case_store)
+
+    def read(self, date_min: Union[str, None] = None) -> pd.DataFrame:
+        """
+        Reads the case data of all areas, building or refreshing the store first if needed
+        :param date_min: only the days after this date (included) are read, format 'YYYY-MM-DD', None for all days
+        :return: compact dataframe (cf. compact_dataframe) with the columns of the store, sorted by area id & day
+        """
+        list_case_files = self.get_list_case_files()
+        if pyarrow is None:
+            df_cases = self.get_cases_from_files(list_case_files)
+            if date_min is not None:
+                df_cases = df_cases[df_cases.Day >= pd.to_datetime(date_min)]
+        else:
+            if not self.is_up_to_date(list_case_files):
+                self.build(list_case_files)
+            df_cases = pd.read_parquet(
+                self.path_case_store,
+                filters=[("Day", ">=", pd.to_datetime(date_min))] if date_min is not None else None,
+            )
+        return compact_dataframe(df_cases.sort_values(["area_id", "Day"]).reset_index(drop=True))
+
+    def read_cases_per_area(self) -> dict:
+        """
+        Reads the case data of all areas at once and splits it per area, with the columns & dtypes of the processed
+        case files that are used to fit the model
+        :return: dictionary {(country, province): dataframe with the date (string), day_since100, case_cnt and
+        death_cnt of the area sorted by date}
+        """
+        df_cases = self.read()
+        area_starts = np.flatnonzero(np.diff(df_cases.area_id.values, prepend=-1))
+        area_ends = np.append(area_starts[1:], len(df_cases))
+        dict_columns = {"date": df_cases.Day.dt.strftime("%Y-%m-%d").values}
+        for column in ["day_since100", "case_cnt", "death_cnt"]:
+            # Counts are read back in 64 bits like in the case files
+            values = df_cases[column].values
+            dict_columns[column] = values.astype(np.int64 if values.dtype.kind in "iu" else np.float64)
+        return {
+            (str(country), str(province)): pd.DataFrame({
+                column: values[start:end] for column, values in dict_columns.items()
+            })
+            for country, province, start, end in zip(
+                df_cases.Country.values[area_starts], df_cases.Province.values[area_starts], area_starts, area_ends
+            )
+        }
 
 
 class DELPHIBacktest:
@@ -1597,34 +1819,46 @@ class DELPHIBacktest:
 
     def get_historical_data_df(self) -> pd.DataFrame:
         """
-        Generates a concatenation of all historical data available in the danger_map folder, all areas
-        starting from the prediction date given by the user, and keeping only relevant columns
-        :return: a dataframe with all relevant historical data
+        Reads the historical data of all areas available in the danger_map folder starting from the prediction date
+        given by the user from the consolidated case store (cf. DELPHICaseStore), keeping only relevant columns
+        :return: a compact dataframe with all relevant historical data, each area being identified by its integer
+        area_id in the case store
         """
-        list_historical_data_filepaths = [
-            self.historical_data_path + filename
-            for filename in os.listdir(self.historical_data_path)
-            if "Cases_" in filename
-        ]
-        df_historical = []
-        for filepath_historical in list_historical_data_filepaths:
-            df_historical.append(pd.read_csv(filepath_historical))
-
-        df_historical = pd.concat(df_historical).sort_values(
-            ["country", "province", "date"]
-        ).reset_index(drop=True)[
-            ["country", "province", "date", "day_since100", "case_cnt", "death_cnt"]
-        ]
-        df_historical["province"].fillna("None", inplace=True)
-        df_historical.rename(
-            columns={"country": "Country", "province": "Province", "date": "Day"}, inplace=True
-        )
-        df_historical["tuple"] = list(zip(df_historical.Country, df_historical.Province))
+        case_store = DELPHICaseStore(path_to_folder_cases=self.historical_data_path)
+        df_historical = case_store.read(date_min=self.prediction_date)
+        # The US as a whole is removed from the backtest (but not its states)
         df_historical = df_historical[
-            (df_historical.Day >= self.prediction_date)
+            (df_historical.Country != "US") | (df_historical.Province != "None")
         ].reset_index(drop=True)
-        df_historical = df_historical[df_historical.tuple != ("US", "None")].reset_index(drop=True)
-        return df_historical
+        return compact_dataframe(df_historical)
+
+    @staticmethod
+    def merge_prediction_historical(df_prediction: pd.DataFrame, df_historical: pd.DataFrame) -> pd.DataFrame:
+        """
+        Joins the predictions with the historical data of the same area & day: the areas of the predictions are mapped
+        to the integer area ids of the historical data once, then the rows are matched on the (area_id, Day) index of
+        the historical data instead of merging on the string keys
+        :param df_prediction: a dataframe that contains the relevant predictions on the relevant prediction date
+        :param df_historical: a dataframe with all relevant historical data, cf. get_historical_data_df
+        :return: the predictions of the areas & days with historical data (in their order in df_prediction), along
+        with their area_id and historical data
+        """
+        def get_area_keys(df: pd.DataFrame) -> list:
+            # Missing provinces (countries read from a CSV file) are the "None" provinces of the case store
+            return [df[column].astype(object).fillna("None").astype(str) for column in ["Country", "Province"]]
+
+        df_areas_historical = df_historical[["area_id", "Country", "Province"]].drop_duplicates("area_id")
+        index_areas_historical = pd.MultiIndex.from_arrays(get_area_keys(df_areas_historical))
+        area_positions = index_areas_historical.get_indexer(pd.MultiIndex.from_arrays(get_area_keys(df_prediction)))
+        df_backtest = df_prediction[area_positions >= 0].copy()
+        df_backtest["area_id"] = df_areas_historical.area_id.values[area_positions[area_positions >= 0]]
+        df_backtest["Day"] = pd.to_datetime(df_backtest.Day)
+        df_backtest = df_backtest.join(
+            df_historical.set_index(["area_id", "Day"])[["day_since100", "case_cnt", "death_cnt"]],
+            on=["area_id", "Day"],
+            how="inner",
+        )
+        return df_backtest.reset_index(drop=True)
 
     def get_prediction_data(self) -> pd.DataFrame:
         """
@@ -1634,16 +1868,17 @@ class DELPHIBacktest:
         :return: a dataframe that contains the relevant predictions on the relevant prediction date
         """
         prediction_date_filename = "".join(self.prediction_date.split("-"))
-        if os.path.exists(self.prediction_data_path + f"Global_V2_{prediction_date_filename}.csv"):
+        columns_prediction = ["Continent", "Country", "Province", "Day", "Total Detected", "Total Detected Deaths"]
+        path_prediction_file = self.prediction_data_path + f"Global_V2_{prediction_date_filename}.csv"
+        if os.path.exists(path_prediction_file) or os.path.exists(get_path_file_columnar(path_prediction_file)):
             self.logger.info("Backtesting on DELPHI V3.0 predictions because filename contains _V2")
-            df_prediction = pd.read_csv(self.prediction_data_path + f"Global_V2_{prediction_date_filename}.csv")
-        elif os.path.exists(self.prediction_data_path + f"Global_V2_{prediction_date_filename}.csv"):
-            self.logger.info("Backtesting on DELPHI V1.0 or V2.0 predictions because filename doesn't contain _V2")
-            df_prediction = pd.read_csv(self.prediction_data_path + f"Global_V2_{prediction_date_filename}.csv")
+            df_prediction = read_dataframe_prefer_columnar(
+                path_prediction_file, columns=columns_prediction, compact=True
+            )
         else:
             raise ValueError(f"The file on prediction date {self.prediction_date} has never been generated")
 
-        return df_prediction[["Continent", "Country", "Province", "Day", "Total Detected", "Total Detected Deaths"]]
+        return df_prediction[columns_prediction]
 
     def get_feasibility_flag(self, df_historical: pd.DataFrame, df_prediction: pd.DataFrame) -> bool:
         """
@@ -1697,46 +1932,220 @@ class DELPHIBacktest:
 
         return dict_df_backtest_metrics
 
-    def get_backtest_metrics_area(
-            self, df_backtest: pd.DataFrame, tuple_area: tuple, dict_df_backtest_metrics: dict,
-    ) -> dict:
+    def get_backtest_metrics_all_areas(self, df_backtest: pd.DataFrame) -> dict:
         """
-        Updates the backtest metrics dictionary with metrics values for that particular area tuple
+        Computes the backtest metrics of all the areas at once, with grouped sums over the days of the backtest instead
+        of filtering df_backtest for each area
         :param df_backtest: pre-processed dataframe containing historical and prediction data
-        :param tuple_area: tuple of the format (Continent, Country, Province)
-        :param dict_df_backtest_metrics: dictionary containing all the metrics and will be used to create final
-        backtest metrics dataframe
-        :return: updated dictionary with backtest metrics for that particular area tuple
+        :return: dictionary with the backtest metrics of each area (Continent, Country, Province), in their order of
+        appearance in df_backtest, in the format of generate_empty_metrics_dict
         """
-        df_temp = df_backtest[df_backtest.tuple_complete == tuple_area]
-        max_date_backtest = str((pd.to_datetime(self.prediction_date) + timedelta(days=self.n_days_backtest)).date())
-        df_temp = df_temp[(df_temp.Day >= self.prediction_date) & (df_temp.Day <= max_date_backtest)].sort_values(
-            ["Continent", "Country", "Province", "Day"]
-        ).reset_index(drop=True)
-        mae_cases, mape_cases = compute_mae_and_mape(
-            y_true=df_temp.case_cnt.tolist(), y_pred=df_temp["Total Detected"].tolist()
-        )
-        mae_deaths, mape_deaths = compute_mae_and_mape(
-            y_true=df_temp.death_cnt.tolist(), y_pred=df_temp["Total Detected Deaths"].tolist()
-        )
-        mse_cases = compute_mse(y_true=df_temp.case_cnt.tolist(), y_pred=df_temp["Total Detected"].tolist())
-        mse_deaths = compute_mse(y_true=df_temp.death_cnt.tolist(), y_pred=df_temp["Total Detected Deaths"].tolist())
-        dict_df_backtest_metrics["prediction_date"].append(self.prediction_date)
-        dict_df_backtest_metrics["n_days_backtest"].append(self.n_days_backtest)
-        dict_df_backtest_metrics["tuple_area"].append(tuple_area)
-        dict_df_backtest_metrics["mape_cases"].append(mape_cases)
-        dict_df_backtest_metrics["mape_deaths"].append(mape_deaths)
-        if self.get_mae:
-            dict_df_backtest_metrics["mae_cases"].append(mae_cases)
-            dict_df_backtest_metrics["mae_deaths"].append(mae_deaths)
+        area_columns = ["Continent", "Country", "Province"]
+        # Areas are numbered on the full dataframe, so that areas without any day in the backtest window get NaN metrics
+        area_codes, areas = pd.MultiIndex.from_arrays([df_backtest[column] for column in area_columns]).factorize()
+        n_areas = len(areas)
+        max_date_backtest = pd.to_datetime(self.prediction_date) + timedelta(days=self.n_days_backtest)
+        days = pd.to_datetime(df_backtest.Day)
+        is_in_backtest = ((days >= pd.to_datetime(self.prediction_date)) & (days <= max_date_backtest)).values
+        area_codes = area_codes[is_in_backtest]
+        n_days_area = np.bincount(area_codes, minlength=n_areas)
+        dict_metrics = {}
+        for metric_name, column_true, column_pred in [
+            ("cases", "case_cnt", "Total Detected"), ("deaths", "death_cnt", "Total Detected Deaths")
+        ]:
+            y_true = df_backtest[column_true].to_numpy(dtype=float)[is_in_backtest]
+            y_pred = df_backtest[column_pred].to_numpy(dtype=float)[is_in_backtest]
+            errors = y_true - y_pred
+            is_positive = y_true > 0
+            with np.errstate(divide="ignore", invalid="ignore"):
+                dict_metrics[f"mape_{metric_name}"] = np.bincount(
+                    area_codes[is_positive], weights=np.abs(errors[is_positive] / y_true[is_positive]),
+                    minlength=n_areas,
+                ) / np.bincount(area_codes[is_positive], minlength=n_areas) * 100
+                dict_metrics[f"mae_{metric_name}"] = (
+                    np.bincount(area_codes, weights=np.abs(errors), minlength=n_areas) / n_days_area
+                )
+                dict_metrics[f"mse_{metric_name}"] = (
+                    np.bincount(area_codes, weights=errors ** 2, minlength=n_areas) / n_days_area
+                )
 
-        if self.get_mse:
-            dict_df_backtest_metrics["mse_cases"].append(mse_cases)
-            dict_df_backtest_metrics["mse_deaths"].append(mse_deaths)
+        dict_df_backtest_metrics = self.generate_empty_metrics_dict()
+        dict_df_backtest_metrics["prediction_date"] = [self.prediction_date] * n_areas
+        dict_df_backtest_metrics["n_days_backtest"] = [self.n_days_backtest] * n_areas
+        dict_df_backtest_metrics["tuple_area"] = list(areas)
+        for metric in dict_df_backtest_metrics.keys():
+            if metric in dict_metrics:
+                dict_df_backtest_metrics[metric] = dict_metrics[metric].tolist()
 
         return dict_df_backtest_metrics
 
 
+def get_path_file_columnar(path_file_csv: str) -> str:
+    """
+    Gets the path of the columnar (Parquet) version of a CSV file, saved next to it
+    :param path_file_csv: path to the CSV file
+    :return: path to the columnar file
+    """
+    return os.path.splitext(path_file_csv)[0] + ".parquet"
+
+
+def save_dataframe_columnar(df: pd.DataFrame, path_file_csv: str) -> None:
+    """
+    Saves a dataframe in the typed columnar format (Parquet) next to its CSV version, with categorical area columns
+    and dates stored as integer numbers of days since 1970-01-01
+    :param df: dataframe to save, e.g. parameters or predictions
+    :param path_file_csv: path to the CSV version of the file, the extension is replaced by .parquet
+    :return: None
+    """
+    if pyarrow is None:
+        raise ImportError("The pyarrow package is required to save files in the columnar format")
+    dict_columns = {}
+    for column in df.columns:
+        if column in columns_categorical_columnar:
+            dict_columns[column] = df[column].astype("category")
+        elif column in columns_dates_columnar:
+            days = pd.to_datetime(df[column]).values.astype("datetime64[D]")
+            dict_columns[column] = pd.array(
+                np.where(np.isnat(days), None, days.astype("int64")), dtype="Int32"
+            )
+        else:
+            dict_columns[column] = df[column].values
+    pd.DataFrame(dict_columns).to_parquet(get_path_file_columnar(path_file_csv), index=False)
+
+
+def read_dataframe_prefer_columnar(
+        path_file_csv: str, columns: Union[list, None] = None, compact: bool = False
+) -> pd.DataFrame:
+    """
+    Reads a file saved by DELPHIDataSaver, from its columnar (Parquet) version if it exists and pyarrow is installed,
+    otherwise from the CSV file; the dataframe returned is the same in both cases (string areas & dates)
+    :param path_file_csv: path to the CSV version of the file
+    :param columns: list of columns to read, None for all of them
+    :param compact: boolean, whether to return the dataframe with compact dtypes (cf. compact_dataframe) instead of
+    string areas & dates
+    :return: dataframe read
+    """
+    path_file_columnar = get_path_file_columnar(path_file_csv)
+    if (pyarrow is None) or (not os.path.exists(path_file_columnar)):
+        df = pd.read_csv(path_file_csv, usecols=columns)
+        # pandas reads the "None" areas (e.g. Province of countries) as NaN, they are kept as "None" like in Parquet
+        for column in df.columns:
+            if column in columns_categorical_columnar:
+                df[column] = df[column].fillna("None")
+        return compact_dataframe(df) if compact else df
+    df = pd.read_parquet(path_file_columnar, columns=columns)
+    for column in df.columns:
+        if column in columns_categorical_columnar:
+            df[column] = df[column].astype("category") if compact else df[column].astype(object)
+        elif column in columns_dates_columnar:
+            df[column] = pd.to_datetime(df[column].astype("Int64"), unit="D")
+            if not compact:
+                df[column] = df[column].dt.strftime("%Y-%m-%d")
+    return compact_dataframe(df) if compact else df
+
+
+def compact_dataframe(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Converts a predictions (or historical data) dataframe to compact dtypes: categorical area & scenario keys,
+    datetime64 dates, int32 counts and float32 counts when all their values are whole numbers exactly represented in
+    float32 (otherwise they are kept in float64 so that no value changes); get_dataframe_as_text converts it back
+    :param df: dataframe with string keys & dates
+    :return: new dataframe with the same columns & values in compact dtypes
+    """
+    dict_columns = {}
+    for column in df.columns:
+        values = df[column]
+        if column in columns_categorical_columnar:
+            if isinstance(values.dtype, pd.CategoricalDtype):
+                values = values.cat.remove_unused_categories()
+                values = values.cat.reorder_categories(sorted(values.cat.categories))
+            else:
+                values = values.astype("category")
+        elif column in columns_dates_columnar:
+            values = pd.to_datetime(values)
+        elif (values.dtype.kind in "iu") and (len(values) > 0):
+            if (values.min() >= np.iinfo(np.int32).min) and (values.max() <= np.iinfo(np.int32).max):
+                values = values.astype(np.int32)
+        elif (values.dtype == np.float64) and (len(values) > 0):
+            finite_values = values.values[np.isfinite(values.values)]
+            if (
+                    (np.abs(finite_values) <= 2 ** 24).all() and (np.round(finite_values) == finite_values).all()
+            ):
+                values = values.astype(np.float32)
+        dict_columns[column] = values
+    return pd.DataFrame(dict_columns, index=df.index)
+
+
+def is_dataframe_compact(df: pd.DataFrame) -> bool:
+    """
+    Checks whether a dataframe has compact keys or dates (cf. compact_dataframe)
+    :param df: dataframe with string or compact keys & dates
+    :return: True if any of its key columns is categorical or any of its date columns is a datetime64
+    """
+    return any(
+        isinstance(df[column].dtype, pd.CategoricalDtype) for column in columns_categorical_columnar
+        if column in df.columns
+    ) or any(df[column].dtype.kind == "M" for column in columns_dates_columnar if column in df.columns)
+
+
+def get_dataframe_as_text(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Converts the categorical keys & datetime64 dates of a compact dataframe (cf. compact_dataframe) back to strings
+    ('YYYY-MM-DD' for dates) and its float32 counts back to float64 so that they are formatted as before, only done
+    when saving to CSV or JSON
+    :param df: dataframe with compact or string keys & dates
+    :return: the same dataframe if there is nothing to convert, otherwise a new dataframe with string keys & dates
+    """
+    columns_to_convert = [
+        column for column in df.columns
+        if isinstance(df[column].dtype, pd.CategoricalDtype) or (df[column].dtype.kind == "M")
+        or (df[column].dtype == np.float32)
+    ]
+    if len(columns_to_convert) == 0:
+        return df
+    df = df.copy()
+    for column in columns_to_convert:
+        if df[column].dtype.kind == "M":
+            df[column] = df[column].dt.strftime("%Y-%m-%d")
+        elif df[column].dtype == np.float32:
+            df[column] = df[column].astype(np.float64)
+        else:
+            df[column] = df[column].astype(object)
+    return df
+
+
+def get_output_projection_matrix(mapping_output_to_states: dict = MAPPING_OUTPUT_TO_STATES) -> np.array:
+    """
+    Creates the projection matrix from the 16 states of the DELPHI model to the reported outputs, where each reported
+    output is defined as a sum of some of the states
+    :param mapping_output_to_states: dictionary of the format {output_name: list of states summed into that output}
+    :return: a numpy array of shape (number of outputs x 16) with 1 where a state is part of an output and 0 otherwise
+    """
+    projection_matrix = np.zeros((len(mapping_output_to_states), len(DELPHI_STATES)))
+    for i, states in enumerate(mapping_output_to_states.values()):
+        projection_matrix[i, [DELPHI_STATES.index(state) for state in states]] = 1
+    return projection_matrix
+
+
+OUTPUT_PROJECTION_MATRIX = get_output_projection_matrix()
+
+
+def project_states_to_outputs(
+        x_sol: np.array, projection_matrix: np.array = OUTPUT_PROJECTION_MATRIX, rounded: bool = True,
+) -> np.array:
+    """
+    Derives the reported outputs from the trajectories of the 16 states of the DELPHI model with a single matrix product
+    :param x_sol: numpy array of shape (16 x days) for one area or of shape (areas x 16 x days) for a batch of areas
+    :param projection_matrix: numpy array of shape (number of outputs x 16), see get_output_projection_matrix
+    :param rounded: boolean, whether or not to round the outputs to the closest integers
+    :return: numpy array of shape (outputs x days) or (areas x outputs x days) depending on the shape of x_sol
+    """
+    predicted_outputs = np.matmul(projection_matrix, x_sol)
+    if rounded:
+        predicted_outputs = np.round(predicted_outputs, 0).astype(int)
+    return predicted_outputs
+
+
 def get_initial_conditions(params_fitted: tuple, global_params_fixed: tuple) -> list:
     """
     Generates the initial conditions for the DELPHI model based on global fixed parameters (mostly populations and some
@@ -1952,6 +2361,23 @@ def compute_mse(y_true: list, y_pred: list) -> float:
     return float(mse)
 
 
+def compute_rmse_common_days(y_true: list, y_pred: list) -> float:
+    """
+    Compute the Root Mean Squared Error between two lists on their common days, i.e. on the length of the shortest
+    one, as used to compare past predictions with the data fitted since then
+    :param y_true: list of true historical values
+    :param y_pred: list of predicted values
+    :return: a float, corresponding to the RMSE, or NaN if there are no common days
+    """
+    n_common_days = min(len(y_true), len(y_pred))
+    if n_common_days == 0:
+        return np.nan
+    y_true = np.array(y_true[:n_common_days], dtype=float)
+    y_pred = np.array(y_pred[:n_common_days], dtype=float)
+    rmse = np.sqrt(np.mean((y_true - y_pred) ** 2))
+    return float(rmse)
+
+
 def compute_mae_and_mape(y_true: list, y_pred: list) -> (float, float):
     """
     Compute the Mean Absolute Error (MAE) and Mean Absolute Percentage Error (MAPE) between two lists of values
@@ -9,7 +9,7 @@ import time
 from functools import partial
 from tqdm import tqdm_notebook as tqdm
 from DELPHI_utils_KIT import (
-    DELPHIDataCreator, DELPHIAggregations, DELPHIDataSaver, get_initial_conditions, mape
+    DELPHIDataCreator, DELPHIAggregations, DELPHIDataSaver, DELPHIAreaRegistry, get_initial_conditions, mape
 )
 from DELPHI_params_KIT import (
     date_MATHEMATICA, default_parameter_list, default_bounds_params,
@@ -29,14 +29,10 @@ time_beginning = time.time()
 yesterday = "".join(str(datetime.now().date() - timedelta(days=1)).split("-"))
 PATH_TO_FOLDER_DANGER_MAP = CONFIG_FILEPATHS["danger_map"][USER_RUNNING]
 PATH_TO_WEBSITE_PREDICTED = CONFIG_FILEPATHS["website"][USER_RUNNING]
-popcountries = pd.read_csv(
-    PATH_TO_FOLDER_DANGER_MAP + f"processed/Global/Population_Global.csv"
-)
-popcountries["tuple_area"] = list(zip(popcountries.Continent, popcountries.Country, popcountries.Province))
 
 past_prediction_date = "".join(str(datetime.now().date() - timedelta(days=14)).split("-"))
 def solve_and_predict_area(
-        tuple_area_: tuple, yesterday_: str, allowed_deviation_: float, pastparameters_: pd.DataFrame, past_prediction_date = past_prediction_date
+        tuple_area_: tuple, yesterday_: str, allowed_deviation_: float, area_registry_: DELPHIAreaRegistry, past_prediction_date = past_prediction_date
 ):
     time_entering = time.time()
     continent, country, province = tuple_area_
@@ -51,13 +47,9 @@ def solve_and_predict_area(
             return None
 
         print(country + ", " + province)
-        if pastparameters_ is not None:
-            parameter_list_total = pastparameters_[
-                (pastparameters_.Country == country) &
-                (pastparameters_.Province == province)
-                ].reset_index(drop=True)
-            if len(parameter_list_total) > 0:
-                parameter_list_line = parameter_list_total.iloc[-1, :].values.tolist()
+        if area_registry_.past_parameters is not None:
+            if area_registry_.has_past_parameters(country, province):
+                parameter_list_line = area_registry_.get_past_parameters_line(country, province)
                 parameter_list = parameter_list_line[5:]
                 # Allowing a 5% drift for states with past predictions, starting in the 5th position are the parameters
                 alpha, days, r_s, r_dth, p_dth, r_dthdecay, k1, k2, jump, t_jump, std_normal = parameter_list
@@ -113,9 +105,7 @@ def solve_and_predict_area(
                 ][["day_since100", "case_cnt", "death_cnt"]].reset_index(drop=True)
         # Now we start the modeling part:
         if len(validcases) > validcases_threshold:
-            PopulationT = popcountries[
-                (popcountries.Country == country) & (popcountries.Province == province)
-                ].pop2016.iloc[-1]
+            PopulationT = area_registry_.get_population(country, province)
             # We do not scale
             N = PopulationT
             PopulationI = validcases.loc[0, "case_cnt"]
@@ -321,15 +311,10 @@ def solve_and_predict_area(
     else:  # file for that tuple (country, province) doesn't exist in processed files
         return None
 if __name__ == "__main__":
-    popcountries = pd.read_csv(
-        PATH_TO_FOLDER_DANGER_MAP + f"processed/Global/Population_Global.csv"
+    area_registry = DELPHIAreaRegistry.from_files(
+        path_population_file=PATH_TO_FOLDER_DANGER_MAP + f"processed/Global/Population_Global.csv",
+        path_past_parameters_file=PATH_TO_FOLDER_DANGER_MAP + f"predicted/Parameters_Global_V2_{yesterday}.csv",
     )
-    try:
-        pastparameters = pd.read_csv(
-            PATH_TO_FOLDER_DANGER_MAP + f"predicted/Parameters_Global_V2_{yesterday}.csv"
-        )
-    except:
-        pastparameters = None
     # Initalizing lists of the different dataframes that will be concatenated in the end
     list_df_global_predictions_since_today = []
     list_df_global_predictions_since_100_cases = []
@@ -337,12 +322,11 @@ if __name__ == "__main__":
     obj_value = 0
     allowed_deviation = 0.02
     solve_and_predict_area_partial = partial(
-        solve_and_predict_area, yesterday_=yesterday, pastparameters_=pastparameters,
+        solve_and_predict_area, yesterday_=yesterday, area_registry_=area_registry,
         allowed_deviation_=allowed_deviation
     )
     n_cpu = 6
-    popcountries["tuple_area"] = list(zip(popcountries.Continent, popcountries.Country, popcountries.Province))
-    list_tuples = popcountries.tuple_area.tolist()
+    list_tuples = area_registry.get_list_tuples_areas()
     list_tuples = [x for x in list_tuples if x[1] in ["Germany","Poland"]]
     with mp.Pool(n_cpu) as pool:
         for result_area in tqdm(
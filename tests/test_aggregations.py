@@ -0,0 +1,28 @@
+import numpy as np
+import pandas as pd
+from DELPHI_utils_V3_static import DELPHIAggregations, compact_dataframe
+
+
+def get_df_predictions_large_totals() -> pd.DataFrame:
+    return pd.DataFrame({
+        "Continent": ["Asia", "Asia"],
+        "Country": ["China", "India"],
+        "Province": ["None", "None"],
+        "Day": ["2020-11-09", "2020-11-09"],
+        "Total Detected": [1_500_000_000, 1_200_000_000],
+    })
+
+
+def test_aggregations_above_int32_range_do_not_overflow():
+    df_predictions = get_df_predictions_large_totals()
+    df_compact = compact_dataframe(df_predictions)
+    assert df_compact["Total Detected"].dtype == np.int32
+    df_aggregated = DELPHIAggregations.append_all_aggregations(df_compact)
+    df_aggregated_reference = DELPHIAggregations.append_all_aggregations(df_predictions)
+    totals_asia = df_aggregated.loc[
+        (df_aggregated.Continent == "Asia") & (df_aggregated.Country == "None"), "Total Detected"
+    ]
+    totals_world = df_aggregated.loc[df_aggregated.Continent == "None", "Total Detected"]
+    assert totals_asia.tolist() == [2_700_000_000]
+    assert totals_world.tolist() == [2_700_000_000]
+    assert df_aggregated["Total Detected"].tolist() == df_aggregated_reference["Total Detected"].tolist()
@@ -0,0 +1,110 @@
+import logging
+from datetime import timedelta
+import numpy as np
+import pandas as pd
+from DELPHI_utils_V3_static import (
+    DELPHIBacktest, read_dataframe_prefer_columnar, compute_mae_and_mape, compute_mse,
+)
+
+
+def test_merge_prediction_historical_keeps_country_level_areas(tmp_path):
+    path_prediction_file = str(tmp_path / "Global_V2_20201101.csv")
+    pd.DataFrame({
+        "Continent": ["Europe", "Europe", "North America"],
+        "Country": ["France", "France", "Canada"],
+        "Province": ["None", "None", "Ontario"],
+        "Day": ["2020-11-01", "2020-11-02", "2020-11-01"],
+        "Total Detected": [100.0, 110.0, 50.0],
+        "Total Detected Deaths": [10.0, 11.0, 5.0],
+    }).to_csv(path_prediction_file, index=False)
+    df_prediction = read_dataframe_prefer_columnar(path_prediction_file, compact=True)
+    assert (df_prediction.Province.astype(str) == "None").sum() == 2
+    df_historical = pd.DataFrame({
+        "area_id": [0, 0, 1],
+        "Country": ["Canada", "Canada", "France"],
+        "Province": ["Ontario", "Ontario", "None"],
+        "Day": pd.to_datetime(["2020-11-01", "2020-11-02", "2020-11-02"]),
+        "day_since100": [200, 201, 210],
+        "case_cnt": [48, 52, 108],
+        "death_cnt": [5, 6, 12],
+    })
+    df_backtest = DELPHIBacktest.merge_prediction_historical(df_prediction, df_historical)
+    assert df_backtest[["Country", "Province"]].astype(str).values.tolist() == [
+        ["France", "None"], ["Canada", "Ontario"]
+    ]
+    assert df_backtest.case_cnt.tolist() == [108, 48]
+
+
+def get_backtest_metrics_area_baseline(
+        backtest: DELPHIBacktest, df_backtest: pd.DataFrame, tuple_area: tuple, dict_df_backtest_metrics: dict,
+) -> dict:
+    # Metrics of one area filtering df_backtest, as they were computed area by area before the grouped version
+    continent, country, province = tuple_area
+    df_temp = df_backtest[
+        (df_backtest.Continent == continent) & (df_backtest.Country == country) & (df_backtest.Province == province)
+    ]
+    max_date_backtest = pd.to_datetime(backtest.prediction_date) + timedelta(days=backtest.n_days_backtest)
+    df_temp = df_temp[(df_temp.Day >= backtest.prediction_date) & (df_temp.Day <= max_date_backtest)]
+    mae_cases, mape_cases = compute_mae_and_mape(
+        y_true=df_temp.case_cnt.tolist(), y_pred=df_temp["Total Detected"].tolist()
+    )
+    mae_deaths, mape_deaths = compute_mae_and_mape(
+        y_true=df_temp.death_cnt.tolist(), y_pred=df_temp["Total Detected Deaths"].tolist()
+    )
+    dict_df_backtest_metrics["prediction_date"].append(backtest.prediction_date)
+    dict_df_backtest_metrics["n_days_backtest"].append(backtest.n_days_backtest)
+    dict_df_backtest_metrics["tuple_area"].append(tuple_area)
+    dict_df_backtest_metrics["mape_cases"].append(mape_cases)
+    dict_df_backtest_metrics["mape_deaths"].append(mape_deaths)
+    dict_df_backtest_metrics["mae_cases"].append(mae_cases)
+    dict_df_backtest_metrics["mae_deaths"].append(mae_deaths)
+    dict_df_backtest_metrics["mse_cases"].append(
+        compute_mse(y_true=df_temp.case_cnt.tolist(), y_pred=df_temp["Total Detected"].tolist())
+    )
+    dict_df_backtest_metrics["mse_deaths"].append(
+        compute_mse(y_true=df_temp.death_cnt.tolist(), y_pred=df_temp["Total Detected Deaths"].tolist())
+    )
+    return dict_df_backtest_metrics
+
+
+def test_backtest_metrics_all_areas_match_per_area_baseline():
+    random_state = np.random.RandomState(0)
+    list_areas = [
+        ("Europe", "France", "None"), ("North America", "Canada", "Ontario"), ("North America", "US", "Texas"),
+        ("Asia", "Japan", "None"),
+    ]
+    list_df = []
+    for i, (continent, country, province) in enumerate(list_areas):
+        # Japan only has days before the backtest window, Ontario has days without any case
+        first_day = pd.Timestamp("2020-10-20") if country == "Japan" else pd.Timestamp("2020-10-30")
+        n_days = 5 if country == "Japan" else 20
+        case_cnt = np.cumsum(random_state.randint(0, 100, n_days)).astype(float)
+        if country == "Canada":
+            case_cnt[:4] = 0
+        list_df.append(pd.DataFrame({
+            "Continent": continent,
+            "Country": country,
+            "Province": province,
+            "Day": pd.date_range(first_day, periods=n_days),
+            "Total Detected": case_cnt + random_state.normal(0, 20, n_days),
+            "Total Detected Deaths": case_cnt / 50 + random_state.normal(0, 2, n_days),
+            "case_cnt": case_cnt,
+            "death_cnt": np.round(case_cnt / 50),
+        }))
+    # Rows of the areas are interleaved, as after the merge of predictions & historical data
+    df_backtest = pd.concat(list_df).sort_values("Day", kind="mergesort").reset_index(drop=True)
+    backtest = DELPHIBacktest(
+        path_to_folder_danger_map="", prediction_date="2020-11-01", n_days_backtest=10, get_mae=True, get_mse=True,
+        logger=logging.getLogger(__name__),
+    )
+    dict_metrics = backtest.get_backtest_metrics_all_areas(df_backtest)
+    dict_metrics_baseline = backtest.generate_empty_metrics_dict()
+    # Japan has no day in the backtest window, its baseline metrics are means of empty lists (NaN)
+    for tuple_area in dict.fromkeys(zip(df_backtest.Continent, df_backtest.Country, df_backtest.Province)):
+        dict_metrics_baseline = get_backtest_metrics_area_baseline(
+            backtest, df_backtest, tuple_area, dict_metrics_baseline
+        )
+    assert dict_metrics["tuple_area"] == dict_metrics_baseline["tuple_area"]
+    df_metrics = pd.DataFrame(dict_metrics)
+    assert df_metrics[df_metrics.tuple_area == ("Asia", "Japan", "None")].mape_cases.isnull().all()
+    pd.testing.assert_frame_equal(df_metrics, pd.DataFrame(dict_metrics_baseline), check_exact=False)
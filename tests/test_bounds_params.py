@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+import DELPHI_params_V3 as params
+from DELPHI_utils_V3_dynamic import get_bounds_params_from_pastparams_all_areas
+
+parameter_names = ["alpha", "days", "r_s", "r_dth", "p_dth", "r_dthdecay", "k1", "k2", "jump", "t_jump", "std_normal"]
+dict_kwargs_bounds = dict(
+    dict_default_reinit_parameters=params.dict_default_reinit_parameters,
+    percentage_drift_lower_bound=params.percentage_drift_lower_bound,
+    default_lower_bound=params.default_lower_bound,
+    dict_default_reinit_lower_bounds=params.dict_default_reinit_lower_bounds,
+    percentage_drift_upper_bound=params.percentage_drift_upper_bound,
+    default_upper_bound=params.default_upper_bound,
+    dict_default_reinit_upper_bounds=params.dict_default_reinit_upper_bounds,
+    percentage_drift_lower_bound_annealing=params.percentage_drift_lower_bound_annealing,
+    default_lower_bound_annealing=params.default_lower_bound_annealing,
+    percentage_drift_upper_bound_annealing=params.percentage_drift_upper_bound_annealing,
+    default_upper_bound_annealing=params.default_upper_bound_annealing,
+    default_lower_bound_jump=params.default_lower_bound_jump,
+    default_upper_bound_jump=params.default_upper_bound_jump,
+    default_lower_bound_std_normal=params.default_lower_bound_std_normal,
+    default_upper_bound_std_normal=params.default_upper_bound_std_normal,
+)
+
+
+def get_bounds_params_from_pastparams_baseline(optimizer: str, parameter_list: list) -> list:
+    # Bounds of a single area, computed parameter by parameter as before the vectorized version
+    def reinitialize(values: list, dict_default_reinit: dict) -> list:
+        return [
+            x if name == "days" else max(min(x, 1) if name in ["r_dth", "p_dth"] else x, dict_default_reinit[name])
+            for name, x in zip(parameter_names, values)
+        ]
+
+    if optimizer in ["tnc", "trust-constr"]:
+        parameter_list = reinitialize(parameter_list, params.dict_default_reinit_parameters)
+        param_list_lower = reinitialize(
+            [x - max(params.percentage_drift_lower_bound * abs(x), params.default_lower_bound) for x in parameter_list],
+            params.dict_default_reinit_lower_bounds,
+        )
+        param_list_upper = reinitialize(
+            [x + max(params.percentage_drift_upper_bound * abs(x), params.default_upper_bound) for x in parameter_list],
+            params.dict_default_reinit_upper_bounds,
+        )
+    else:
+        param_list_lower = [
+            x - max(params.percentage_drift_lower_bound_annealing * abs(x), params.default_lower_bound_annealing)
+            for x in parameter_list
+        ]
+        param_list_upper = [
+            x + max(params.percentage_drift_upper_bound_annealing * abs(x), params.default_upper_bound_annealing)
+            for x in parameter_list
+        ]
+        param_list_lower[8] = params.default_lower_bound_jump
+        param_list_upper[8] = params.default_upper_bound_jump
+        param_list_lower[10] = params.default_lower_bound_std_normal
+        param_list_upper[10] = params.default_upper_bound_std_normal
+    return [(lower, upper) for lower, upper in zip(param_list_lower, param_list_upper)]
+
+
+@pytest.mark.parametrize("optimizer", ["tnc", "trust-constr", "annealing"])
+def test_bounds_params_all_areas_match_per_area_baseline(optimizer):
+    random_state = np.random.RandomState(0)
+    # Past parameters around their usual values, with negative values and r_dth & p_dth above 1 to be reinitialized
+    array_parameters = np.array(params.default_parameter_list, dtype=float) * random_state.uniform(-0.5, 3, (200, 11))
+    array_parameters[:5, 3:5] = [[1.5, 2.0], [0.01, 1.2], [-0.1, 0.5], [1.0, 1.0], [0.02, 0.0]]
+    array_bounds = get_bounds_params_from_pastparams_all_areas(
+        optimizer=optimizer, array_parameters=array_parameters, **dict_kwargs_bounds
+    )
+    assert array_bounds.shape == (200, 11, 2)
+    for i, parameter_list in enumerate(array_parameters.tolist()):
+        np.testing.assert_array_equal(
+            array_bounds[i], np.array(get_bounds_params_from_pastparams_baseline(optimizer, parameter_list))
+        )
+
+
+def test_bounds_params_unknown_optimizer():
+    with pytest.raises(ValueError):
+        get_bounds_params_from_pastparams_all_areas(
+            optimizer="nelder-mead", array_parameters=np.ones((1, 11)), **dict_kwargs_bounds
+        )
@@ -0,0 +1,139 @@
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+import scipy.stats
+from DELPHI_utils_V3_static import DELPHIDataCreator, DELPHIPastPredictionsIndex
+
+past_prediction_date = "2020-10-20"
+columns_baseline = [
+    "Continent", "Country", "Province", "Day", "Total Detected", "Active", "Active Hospitalized",
+    "Cumulative Hospitalized", "Total Detected Deaths", "Active Ventilated", "Total Detected True",
+    "Total Detected Deaths True", "Total Detected LB", "Total Detected Deaths LB", "Total Detected UB",
+    "Total Detected Deaths UB",
+]
+
+
+def make_increasing(sequence: list) -> list:
+    for i in range(len(sequence)):
+        sequence[i] = max(sequence[i], sequence[max(i - 1, 0)])
+    return sequence
+
+
+def create_datasets_with_confidence_intervals_baseline(
+        data_creator: DELPHIDataCreator, cases_data_fit: list, deaths_data_fit: list, past_prediction_file: str,
+        q: float = 0.5,
+) -> (pd.DataFrame, pd.DataFrame):
+    # Each worker used to read the past prediction file and compute the Confidence Intervals of its own area
+    x_sol_final = data_creator.x_sol_final
+    n_days_btw_today_since_100 = (datetime.now() - data_creator.date_day_since100).days
+    n_days_since_100 = x_sol_final.shape[1]
+    outputs = {
+        "Total Detected": x_sol_final[15, :],
+        "Active": x_sol_final[4, :] + x_sol_final[5, :] + x_sol_final[7, :] + x_sol_final[8, :],
+        "Active Hospitalized": x_sol_final[4, :] + x_sol_final[7, :],
+        "Cumulative Hospitalized": x_sol_final[11, :],
+        "Total Detected Deaths": x_sol_final[14, :],
+        "Active Ventilated": x_sol_final[12, :] + x_sol_final[13, :],
+    }
+    outputs = {output: [int(round(x, 0)) for x in values] for output, values in outputs.items()}
+    # The "None" provinces were read as strings by the pandas versions used at the time
+    past_predictions = pd.read_csv(past_prediction_file, keep_default_na=False)
+    past_predictions = past_predictions[
+        (past_predictions["Day"] > past_prediction_date)
+        & (past_predictions["Country"] == data_creator.country)
+        & (past_predictions["Province"] == data_creator.province)
+    ].sort_values("Day")
+    all_dates_since_100 = [
+        str((data_creator.date_day_since100 + timedelta(days=i)).date()) for i in range(n_days_since_100)
+    ]
+    all_dates_since_today = [
+        str((datetime.now() + timedelta(days=i)).date()) for i in range(n_days_since_100 - n_days_btw_today_since_100)
+    ]
+    dict_bounds_since_100, dict_bounds_since_today = {}, {}
+    for output, data_fit in [("Total Detected", cases_data_fit), ("Total Detected Deaths", deaths_data_fit)]:
+        if len(past_predictions) == 0:
+            for bound in ["LB", "UB"]:
+                dict_bounds_since_100[f"{output} {bound}"] = [np.nan for _ in all_dates_since_100]
+                dict_bounds_since_today[f"{output} {bound}"] = [np.nan for _ in all_dates_since_today]
+            continue
+        data_fit_past = [y for x, y in zip(all_dates_since_100, data_fit) if x > past_prediction_date]
+        output_past = past_predictions[output].values[: len(data_fit_past)]
+        rmse = np.sqrt(np.mean([(x - y) ** 2 for x, y in zip(data_fit_past, output_past)]))
+        for bound, quantile in [("LB", 0.5 - q / 2), ("UB", 0.5 + q / 2)]:
+            residual = rmse * scipy.stats.norm.ppf(quantile)
+            dict_bounds_since_100[f"{output} {bound}"] = [
+                max(int(round(v + residual * np.sqrt(max(c - n_days_btw_today_since_100, 0)), 0)), 0)
+                for c, v in enumerate(outputs[output])
+            ]
+            dict_bounds_since_today[f"{output} {bound}"] = [
+                max(int(round(v + residual * np.sqrt(c), 0)), 0)
+                for c, v in enumerate(outputs[output][n_days_btw_today_since_100:])
+            ]
+            if bound == "LB":
+                for dict_bounds in [dict_bounds_since_100, dict_bounds_since_today]:
+                    dict_bounds[f"{output} LB"] = make_increasing(dict_bounds[f"{output} LB"])
+    df_predictions_since_today = pd.DataFrame({
+        "Continent": data_creator.continent,
+        "Country": data_creator.country,
+        "Province": data_creator.province,
+        "Day": all_dates_since_today,
+        **{output: values[n_days_btw_today_since_100:] for output, values in outputs.items()},
+        "Total Detected True": np.nan,
+        "Total Detected Deaths True": np.nan,
+        **dict_bounds_since_today,
+    })
+    df_predictions_since_100 = pd.DataFrame({
+        "Continent": data_creator.continent,
+        "Country": data_creator.country,
+        "Province": data_creator.province,
+        "Day": all_dates_since_100,
+        **outputs,
+        "Total Detected True": cases_data_fit + [np.nan for _ in range(n_days_since_100 - len(cases_data_fit))],
+        "Total Detected Deaths True": deaths_data_fit + [
+            np.nan for _ in range(n_days_since_100 - len(deaths_data_fit))
+        ],
+        **dict_bounds_since_100,
+    })
+    return df_predictions_since_today[columns_baseline], df_predictions_since_100[columns_baseline]
+
+
+def test_parent_confidence_intervals_match_baseline_per_area(tmp_path):
+    random_state = np.random.RandomState(0)
+    past_prediction_file = str(tmp_path / "Global_V2_20201020.csv")
+    list_areas = [("Europe", "France", "None"), ("North America", "Canada", "Ontario"), ("Asia", "Japan", "None")]
+    n_days_fit, n_days_trajectory = 40, 70
+    date_day_since100 = datetime.now() - timedelta(days=n_days_fit)
+    # Past predictions of France & Ontario only, before and after the past prediction date, in a shuffled file
+    df_past_predictions = pd.concat([
+        pd.DataFrame({
+            "Continent": continent,
+            "Country": country,
+            "Province": province,
+            "Day": [str((datetime(2020, 10, 10) + timedelta(days=i)).date()) for i in range(60)],
+            "Total Detected": np.cumsum(random_state.randint(50, 150, 60)).astype(float),
+            "Total Detected Deaths": np.cumsum(random_state.randint(0, 10, 60)).astype(float),
+        })
+        for continent, country, province in list_areas[:2]
+    ]).sample(frac=1, random_state=0)
+    df_past_predictions.to_csv(past_prediction_file, index=False)
+    past_predictions_index = DELPHIPastPredictionsIndex.from_file(past_prediction_file, past_prediction_date)
+    for continent, country, province in list_areas:
+        x_sol_final = np.cumsum(random_state.uniform(0, 100, (16, n_days_trajectory)), axis=1)
+        data_creator = DELPHIDataCreator(
+            x_sol_final=x_sol_final, date_day_since100=date_day_since100, best_params=np.ones(11),
+            continent=continent, country=country, province=province,
+        )
+        cases_data_fit = np.round(x_sol_final[15, :n_days_fit] + random_state.normal(0, 50, n_days_fit)).tolist()
+        deaths_data_fit = np.round(x_sol_final[14, :n_days_fit] + random_state.normal(0, 5, n_days_fit)).tolist()
+        list_df_predictions = data_creator.create_datasets_with_confidence_intervals(
+            cases_data_fit, deaths_data_fit, past_prediction_file=past_prediction_file,
+            past_prediction_date=past_prediction_date, past_predictions_index=past_predictions_index,
+        )
+        list_df_predictions_baseline = create_datasets_with_confidence_intervals_baseline(
+            data_creator, cases_data_fit, deaths_data_fit, past_prediction_file=past_prediction_file,
+        )
+        for df_predictions, df_predictions_baseline in zip(list_df_predictions, list_df_predictions_baseline):
+            pd.testing.assert_frame_equal(
+                df_predictions[columns_baseline].reset_index(drop=True), df_predictions_baseline, check_dtype=False,
+            )
+        assert list_df_predictions[1]["Total Detected LB"].isnull().all() == (country == "Japan")
@@ -0,0 +1,247 @@
+import os
+from copy import deepcopy
+from itertools import compress
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import DELPHI_utils_V3_dynamic
+from DELPHI_params_V3 import future_policies
+from DELPHI_utils_V3_dynamic import (
+    read_oxford_international_policy_data, read_policy_data_us_only, gamma_t, get_gamma_t_array,
+    get_current_policy_per_area, get_normalized_policy_shifts_and_current_policy_us_only,
+)
+
+
+def make_oxford_policy_data_raw() -> pd.DataFrame:
+    random_state = np.random.RandomState(0)
+    n_days = 12
+    list_df = []
+    for country, code in [("France", "FRA"), ("United States", "USA"), ("South Korea", "KOR")]:
+        df_country = pd.DataFrame({
+            "CountryName": country,
+            "CountryCode": code,
+            "Date": [int((datetime(2020, 10, 25) + pd.Timedelta(days=i)).strftime("%Y%m%d")) for i in range(n_days)],
+        })
+        for col, max_level in [
+            ("C1_School closing", 3), ("C2_Workplace closing", 3), ("C3_Cancel public events", 2),
+            ("C4_Restrictions on gatherings", 4), ("C5_Close public transport", 2),
+            ("C6_Stay at home requirements", 3), ("C7_Restrictions on internal movement", 2),
+            ("C8_International travel controls", 4), ("H1_Public information campaigns", 2),
+        ]:
+            df_country[col] = random_state.randint(0, max_level + 1, n_days).astype(float)
+        for column_flag in ["C1_Flag", "C2_Flag", "C3_Flag", "C4_Flag", "C5_Flag", "C6_Flag", "C7_Flag", "H1_Flag"]:
+            df_country[column_flag] = random_state.randint(0, 2, n_days).astype(float)
+        df_country["ConfirmedCases"] = np.arange(n_days) * 100.0
+        df_country["ConfirmedDeaths"] = np.arange(n_days) * 10.0
+        list_df.append(df_country)
+    df = pd.concat(list_df).reset_index(drop=True)
+    # Missing values in a flag, a measure and the first cases of a country, as in the raw Oxford data
+    df.loc[3, "C2_Flag"] = np.nan
+    df.loc[5, "C6_Flag"] = np.nan
+    df.loc[14, "C8_International travel controls"] = np.nan
+    df.loc[n_days * 2, "ConfirmedCases"] = np.nan
+    df.loc[n_days * 2 + 4, "ConfirmedDeaths"] = np.nan
+    return df
+
+
+def read_oxford_international_policy_data_baseline(measures: pd.DataFrame, yesterday: str) -> pd.DataFrame:
+    # Row by row processing of the raw Oxford data before it was vectorized
+    msr = [
+        "C1_School closing", "C2_Workplace closing", "C3_Cancel public events", "C4_Restrictions on gatherings",
+        "C5_Close public transport", "C6_Stay at home requirements", "C7_Restrictions on internal movement",
+        "C8_International travel controls", "H1_Public information campaigns",
+    ]
+    thresholds = [2, 2, 2, 1, 2, 2, 2, 3, 1]
+    flags = ["C" + str(i) + "_Flag" for i in range(1, 8)] + ["H1_Flag"]
+    measures = measures.copy()
+    measures["Date"] = measures["Date"].apply(lambda x: datetime.strptime(str(x), "%Y%m%d"))
+    for col in ["ConfirmedCases", "ConfirmedDeaths"]:
+        measures[col] = measures.groupby("CountryName")[col].ffill()
+    for col, column_flag in zip(msr[:7] + msr[8:], flags):
+        measures[column_flag] = [0 if x <= 0 else y for (x, y) in zip(measures[col], measures[column_flag])]
+    for col, threshold, column_flag in zip(msr[:7] + msr[8:], thresholds[:7] + thresholds[8:], flags):
+        measures[col] = [int(a and b) for a, b in zip(measures[col] >= threshold, measures[column_flag] == 1)]
+    measures["C8_International travel controls"] = [
+        int(a) for a in (measures["C8_International travel controls"] >= 3)
+    ]
+    measures = measures.dropna()
+    for col in msr:
+        measures[col] = measures[col].apply(lambda x: int(x > 0))
+    measures = measures[["CountryName", "Date"] + list(sorted(msr))]
+    measures["CountryName"] = measures.CountryName.replace({"United States": "US", "South Korea": "Korea, South"})
+    measures["Restrict_Mass_Gatherings"] = [
+        int(a or b or c) for a, b, c in zip(
+            measures["C3_Cancel public events"], measures["C4_Restrictions on gatherings"],
+            measures["C5_Close public transport"],
+        )
+    ]
+    measures["Others"] = [
+        int(a or b or c) for a, b, c in zip(
+            measures["C2_Workplace closing"], measures["C7_Restrictions on internal movement"],
+            measures["C8_International travel controls"],
+        )
+    ]
+    for col in [msr[1], msr[2], msr[3], msr[4], msr[6], msr[7]]:
+        del measures[col]
+    n_measures = measures.iloc[:, 2:].sum(axis=1)
+    rmg = measures["Restrict_Mass_Gatherings"]
+    school = measures["C1_School closing"]
+    stay = measures["C6_Stay at home requirements"]
+    output = deepcopy(measures)
+    output[future_policies[0]] = (n_measures == 0).astype(int)
+    output[future_policies[1]] = ((n_measures == 1) & (rmg == 1)).astype(int)
+    output[future_policies[2]] = ((n_measures > 0) & (rmg == 0) & (stay == 0)).astype(int)
+    output[future_policies[3]] = ((n_measures == 2) & (school == 1) & (rmg == 1)).astype(int)
+    output[future_policies[4]] = ((n_measures > 1) & (school == 0) & (rmg == 1) & (stay == 0)).astype(int)
+    output[future_policies[5]] = ((n_measures > 2) & (school == 1) & (rmg == 1) & (stay == 0)).astype(int)
+    output[future_policies[6]] = (stay == 1).astype(int)
+    output.rename(columns={"CountryName": "country", "Date": "date"}, inplace=True)
+    output["province"] = "None"
+    output = output.loc[:, ["country", "province", "date"] + future_policies]
+    return output[output.date <= yesterday].reset_index(drop=True)
+
+
+def test_read_oxford_international_policy_data_matches_baseline(tmp_path):
+    df_raw = make_oxford_policy_data_raw()
+    path_to_data_sandbox = str(tmp_path) + "/"
+    (tmp_path / "OxCGRT_snapshots").mkdir()
+    df_raw.to_csv(tmp_path / "OxCGRT_snapshots" / "OxCGRT_20201103.csv", index=False)
+    df_policies = read_oxford_international_policy_data(
+        yesterday="20201103", path_to_data_sandbox=path_to_data_sandbox, offline=True
+    )
+    df_policies_baseline = read_oxford_international_policy_data_baseline(df_raw, yesterday="20201103")
+    assert len(df_policies) > 0
+    pd.testing.assert_frame_equal(
+        df_policies.astype({"country": str, "province": str}),
+        df_policies_baseline.astype({"country": str, "province": str}),
+        check_dtype=False,
+    )
+
+
+def test_oxford_policy_data_falls_back_to_latest_snapshot_when_download_fails(tmp_path, monkeypatch):
+    df_raw = make_oxford_policy_data_raw()
+    path_to_data_sandbox = str(tmp_path) + "/"
+    (tmp_path / "OxCGRT_snapshots").mkdir()
+    df_raw.to_csv(tmp_path / "OxCGRT_snapshots" / "OxCGRT_20201101.csv", index=False)
+    df_raw.head(1).to_csv(tmp_path / "OxCGRT_snapshots" / "OxCGRT_20201110.csv", index=False)
+    monkeypatch.setattr(DELPHI_utils_V3_dynamic, "url_oxford_policy_data", str(tmp_path / "unreachable.csv"))
+    df_measures = DELPHI_utils_V3_dynamic.get_oxford_policy_data_raw(
+        yesterday="20201103", path_to_data_sandbox=path_to_data_sandbox
+    )
+    assert len(df_measures) == len(df_raw)
+    assert not (tmp_path / "OxCGRT_snapshots" / "OxCGRT_20201103.csv").exists()
+
+
+def test_us_policy_data_cache_is_keyed_on_the_raw_file_only(tmp_path):
+    path_to_data_sandbox = str(tmp_path) + "/"
+    df_raw = pd.DataFrame({"location_name": ["New York", "Texas", "Ontario"]})
+    for i, policy in enumerate([
+        "travel_limit", "stay_home", "educational_fac", "any_gathering_restrict", "any_business",
+        "all_non-ess_business",
+    ]):
+        df_raw[f"{policy}_start_date"] = ["2020-03-1" + str(i), None, "2020-03-20"]
+        df_raw[f"{policy}_end_date"] = ["2020-05-0" + str(i + 1), None, None]
+    df_raw.to_csv(tmp_path / "12062020_raw_policy_data_us_only.csv", index=False)
+    df_policies = read_policy_data_us_only(path_to_data_sandbox)
+    list_files_cache = os.listdir(tmp_path / "US_policy_data_cache")
+    assert len(list_files_cache) == 1
+    path_cache = str(tmp_path / "US_policy_data_cache" / list_files_cache[0])
+    with np.load(path_cache) as cache:
+        assert str(cache["first_date"]) == "20200301"
+        assert cache["array_mece_policies_us"].shape[1] > df_policies.date.nunique()
+    df_policies_cached = read_policy_data_us_only(path_to_data_sandbox)
+    pd.testing.assert_frame_equal(df_policies_cached, df_policies)
+    assert sorted(df_policies.province.unique()) == ["New York", "Texas"]
+    assert df_policies.date.max() == pd.Timestamp(datetime.now().date())
+    # A cache which doesn't cover the dates needed is computed again in place
+    with open(path_cache, "wb") as cache_file:
+        np.savez(cache_file, states=np.array(["Texas"]), first_date="20200301",
+                 array_mece_policies_us=np.zeros((1, 10, len(future_policies)), dtype=bool))
+    pd.testing.assert_frame_equal(read_policy_data_us_only(path_to_data_sandbox), df_policies)
+    assert len(os.listdir(tmp_path / "US_policy_data_cache")) == 1
+
+
+def make_policy_data_us_and_past_parameters() -> (pd.DataFrame, pd.DataFrame):
+    random_state = np.random.RandomState(1)
+    states = ["New York", "Texas", "District of Columbia"]
+    dates = pd.date_range("2020-03-01", periods=30)
+    index_policies = random_state.randint(0, len(future_policies), (len(states), len(dates)))
+    policy_data = pd.DataFrame({
+        "country": "US",
+        "province": np.repeat(states, len(dates)),
+        "date": np.tile(dates.values, len(states)),
+        **{policy: (index_policies.flatten() == i).astype(int) for i, policy in enumerate(future_policies)},
+    })
+    past_parameters = pd.DataFrame({
+        "Continent": "North America",
+        "Country": "US",
+        "Province": ["New York", "Texas", "District of Columbia", "Texas"],
+        "Data Start Date": ["2020-03-05", "2020-02-20", "2020-03-10", "2020-01-01"],
+        "Median Day of Action": [10.0, -5.0, 30.0, 0.0],
+        "Rate of Action": [2.5, 0.8, 4.0, 1.0],
+    })
+    return policy_data, past_parameters
+
+
+def test_gamma_t_array_matches_gamma_t():
+    policy_data, past_parameters = make_policy_data_us_and_past_parameters()
+    params_states = past_parameters.drop_duplicates("Province").set_index("Province")[
+        ["Data Start Date", "Median Day of Action", "Rate of Action"]
+    ]
+    params_dict = {state: tuple(params_state) for state, params_state in params_states.iterrows()}
+    gamma_baseline = [gamma_t(day, state, params_dict) for day, state in zip(policy_data.date, policy_data.province)]
+    params_rows = params_states.loc[policy_data.province]
+    gamma = get_gamma_t_array(
+        days=policy_data.date.values,
+        data_start_dates=pd.to_datetime(params_rows["Data Start Date"]).values,
+        median_day_of_action=params_rows["Median Day of Action"].values,
+        rate_of_action=params_rows["Rate of Action"].values,
+    )
+    np.testing.assert_allclose(gamma, gamma_baseline, rtol=1e-12)
+
+
+def test_current_policy_per_area_matches_baseline():
+    policy_data, _ = make_policy_data_us_and_past_parameters()
+    # Two rows on the last date of Texas with different policies, the first one being used
+    row_duplicate = policy_data[(policy_data.province == "Texas") & (policy_data.date == policy_data.date.max())]
+    row_duplicate = row_duplicate.assign(**{policy: int(policy == future_policies[-1]) for policy in future_policies})
+    policy_data = pd.concat([policy_data, row_duplicate]).reset_index(drop=True)
+    dict_current_policy_baseline = {
+        state: list(compress(
+            future_policies,
+            (policy_data[(policy_data.province == state) & (policy_data.date == policy_data.date.max())][
+                future_policies
+            ] == 1).values.flatten().tolist(),
+        ))[0]
+        for state in set(policy_data.province)
+    }
+    assert get_current_policy_per_area(policy_data, column_area="province") == dict_current_policy_baseline
+
+
+def test_normalized_policy_shifts_us_match_row_by_row_baseline():
+    policy_data, past_parameters = make_policy_data_us_and_past_parameters()
+    dict_normalized_policy_gamma, dict_current_policy = get_normalized_policy_shifts_and_current_policy_us_only(
+        policy_data_us_only=policy_data, past_parameters=past_parameters
+    )
+    # The first parameters of each state are used, as with .query(...).iloc[0] in the row by row version
+    params_dict = {
+        state.lower(): tuple(params_state)
+        for state, params_state in past_parameters.drop_duplicates("Province").set_index("Province")[
+            ["Data Start Date", "Median Day of Action", "Rate of Action"]
+        ].iterrows()
+    }
+    gamma = np.array([
+        gamma_t(day, state.lower(), params_dict) for day, state in zip(policy_data.date, policy_data.province)
+    ])
+    mean_gamma = {policy: gamma[policy_data[policy].values == 1].mean() for policy in future_policies}
+    for policy in future_policies:
+        assert np.isclose(
+            dict_normalized_policy_gamma[policy], mean_gamma[policy] / mean_gamma[future_policies[0]], rtol=1e-12
+        )
+    is_last_date = policy_data.date == policy_data.date.max()
+    assert dict_current_policy == {
+        ("US", state): list(compress(future_policies, policy_data[is_last_date & (policy_data.province == state)][
+            future_policies
+        ].values.flatten() == 1))[0]
+        for state in set(policy_data.province)
+    }
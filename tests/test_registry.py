@@ -0,0 +1,56 @@
+import pandas as pd
+from DELPHI_utils_V3_registry import DELPHIAreaRegistry
+from DELPHI_utils_V3_static import DELPHICaseStore
+
+
+def write_case_file(path_to_folder_cases: str, country: str, province: str, day_since100_start: int) -> None:
+    days = pd.date_range("2020-11-01", periods=10)
+    pd.DataFrame({
+        "country": country,
+        "province": province if province != "None" else None,
+        "date": days.strftime("%Y-%m-%d"),
+        "day_since100": range(day_since100_start, day_since100_start + 10),
+        "case_cnt": range(100, 110),
+        "death_cnt": range(10, 20),
+    }).to_csv(path_to_folder_cases + f"Cases_{country}_{province.replace(' ', '_')}.csv", index=False)
+
+
+def test_areas_eligibility_from_case_store(tmp_path):
+    path_to_folder_cases = str(tmp_path) + "/"
+    write_case_file(path_to_folder_cases, "France", "None", 0)
+    write_case_file(path_to_folder_cases, "Canada", "Nova Scotia", -20)
+    dict_cases_areas = DELPHICaseStore(path_to_folder_cases=path_to_folder_cases).read_cases_per_area()
+    assert dict_cases_areas[("France", "None")].date.tolist()[0] == "2020-11-01"
+    assert dict_cases_areas[("France", "None")].case_cnt.dtype == "int64"
+    area_registry = DELPHIAreaRegistry(popcountries=pd.DataFrame({
+        "Continent": ["Europe", "North America", "Asia"],
+        "Country": ["France", "Canada", "Japan"],
+        "Province": ["None", "Nova Scotia", "None"],
+        "pop2016": [6.7e7, 9.2e5, 1.3e8],
+    }))
+    df_eligibility = area_registry.get_areas_eligibility(
+        dict_cases_areas=dict_cases_areas, yesterday="20201108", validcases_threshold=7
+    )
+    assert df_eligibility.Eligible.tolist() == [True, False, False]
+    assert df_eligibility["Number Valid Days"].tolist() == [9, 0, 0]
+    assert df_eligibility["Skip Reason"].tolist()[1:] == ["Not enough cases (less than 100)", "No processed case file"]
+
+
+def test_registry_from_files_finds_country_level_areas(tmp_path):
+    path_population_file = str(tmp_path / "Population_Global.csv")
+    path_past_parameters_file = str(tmp_path / "Parameters_Global_V2_20201108.csv")
+    with open(path_population_file, "w") as handle:
+        handle.write(
+            "Continent,Country,Province,pop2016\nEurope,France,None,67000000\nNorth America,Canada,Ontario,14000000\n"
+        )
+    with open(path_past_parameters_file, "w") as handle:
+        handle.write("Continent,Country,Province,Data Start Date,MAPE\nEurope,France,None,2020-03-01,1.5\n")
+    area_registry = DELPHIAreaRegistry.from_files(
+        path_population_file=path_population_file, path_past_parameters_file=path_past_parameters_file
+    )
+    assert area_registry.get_list_tuples_areas() == [
+        ("Europe", "France", "None"), ("North America", "Canada", "Ontario")
+    ]
+    assert area_registry.get_population("France", "None") == 67000000
+    assert area_registry.has_past_parameters("France", "None")
+    assert area_registry.get_past_parameters_line("France", "None")[3] == "2020-03-01"
@@ -0,0 +1,23 @@
+import os
+import pytest
+from DELPHI_utils_V3_static import DELPHIScenarioStreamWriter
+
+
+def test_scenario_stream_writer_removes_truncated_files_on_error(tmp_path):
+    path_file_since_today = str(tmp_path / "Scenarios.csv")
+    path_file_since_100 = str(tmp_path / "Scenarios_since100.csv")
+    with pytest.raises(RuntimeError):
+        with DELPHIScenarioStreamWriter(path_file_since_today, path_file_since_100) as scenario_stream_writer:
+            assert os.path.exists(path_file_since_today)
+            raise RuntimeError("Area failed")
+    assert scenario_stream_writer.handle_since_today.closed and scenario_stream_writer.handle_fragments.closed
+    assert not os.path.exists(path_file_since_today) and not os.path.exists(path_file_since_100)
+
+
+def test_scenario_stream_writer_keeps_files_on_success(tmp_path):
+    path_file_since_today = str(tmp_path / "Scenarios.csv")
+    path_file_since_100 = str(tmp_path / "Scenarios_since100.csv")
+    with DELPHIScenarioStreamWriter(path_file_since_today, path_file_since_100) as scenario_stream_writer:
+        pass
+    assert scenario_stream_writer.handle_since_100.closed
+    assert os.path.exists(path_file_since_today) and os.path.exists(path_file_since_100)
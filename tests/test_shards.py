@@ -0,0 +1,30 @@
+import json
+import os
+import pandas as pd
+from DELPHI_utils_V3_static import DELPHIAggregations, DELPHIDataSaver
+
+
+def test_aggregations_are_saved_in_named_shards(tmp_path):
+    df_predictions = pd.DataFrame({
+        "Continent": ["Europe", "Europe", "North America"],
+        "Country": ["France", "Italy", "Canada"],
+        "Province": ["None", "None", "Ontario"],
+        "Day": ["2020-11-09", "2020-11-09", "2020-11-09"],
+        "Total Detected": [100, 200, 50],
+    })
+    df_predictions = DELPHIAggregations.append_all_aggregations(df_predictions)
+    dict_shards = DELPHIDataSaver.create_dict_shards_from_predictions(df_predictions)
+    path_to_folder = str(tmp_path)
+    dict_manifest = DELPHIDataSaver.write_shards_per_country(dict_shards, path_to_folder=path_to_folder)
+    list_files = sorted(
+        os.path.relpath(os.path.join(folder, filename), path_to_folder)
+        for folder, _, filenames in os.walk(path_to_folder) for filename in filenames
+    )
+    assert not any(os.path.basename(x) == "None.json" or x.startswith("None") for x in list_files)
+    assert dict_manifest["aggregates"]["World"]["path"] == "aggregates/World.json"
+    assert dict_manifest["aggregates"]["North America"]["path"] == "aggregates/North_America.json"
+    assert sorted(dict_manifest["shards"]["North America"]) == ["Canada"]
+    with open(os.path.join(path_to_folder, "aggregates", "World.json")) as handle:
+        assert json.load(handle)["None"]["Total Detected"] == [350]
+    with open(os.path.join(path_to_folder, "aggregates", "Europe.json")) as handle:
+        assert json.load(handle)["None"]["Total Detected"] == [300]
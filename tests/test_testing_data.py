@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+from DELPHI_utils_V3_dynamic import (
+    get_testing_data_arrays_us, get_testing_data_array_area, get_testing_daily_value,
+)
+
+
+def get_df_testing_us() -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    list_df_testing = []
+    for province, n_days in [("New York", 40), ("Texas", 30)]:
+        list_df_testing.append(pd.DataFrame({
+            "continent": "North America",
+            "country": "US",
+            "province": province,
+            "date": pd.date_range("2020-04-01", periods=n_days),
+            "testing_cnt_daily": rng.integers(0, 10000, n_days).astype(float),
+        }))
+    return pd.concat(list_df_testing).reset_index(drop=True)
+
+
+def test_testing_daily_value_matches_dict_lookup():
+    df_testing_us = get_df_testing_us()
+    dict_testing_data_arrays = get_testing_data_arrays_us(df_testing_us)
+    date_day_since100 = pd.to_datetime("2020-04-05")
+    for province in ["New York", "Texas"]:
+        # Dictionary {t: daily tests} built per area by the testing-aware model
+        testing_data_province = df_testing_us[
+            (df_testing_us.province == province) & (df_testing_us.date >= date_day_since100)
+        ]
+        dict_testing_data_province = {
+            t: daily_test for t, daily_test in enumerate(testing_data_province.testing_cnt_daily.tolist())
+        }
+        testing_cnt_daily = get_testing_data_array_area(dict_testing_data_arrays, province, date_day_since100)
+        assert testing_cnt_daily.flags["C_CONTIGUOUS"]
+        for t in np.arange(0, len(dict_testing_data_province) - 1, 0.37):
+            assert get_testing_daily_value(t, testing_cnt_daily) == dict_testing_data_province[int(t)]
+        assert get_testing_daily_value(-2.5, testing_cnt_daily) == dict_testing_data_province[0]
+        assert get_testing_daily_value(1000, testing_cnt_daily) == dict_testing_data_province[
+            len(dict_testing_data_province) - 1
+        ]
+
+
+def test_testing_data_arrays_fill_gaps_with_zero():
+    df_testing_us = pd.DataFrame({
+        "continent": "North America",
+        "country": "US",
+        "province": "Ohio",
+        "date": pd.to_datetime(["2020-04-01", "2020-04-02", "2020-04-05"]),
+        "testing_cnt_daily": [100.0, 50.0, 90.0],
+    })
+    date_first, testing_cnt_daily = get_testing_data_arrays_us(df_testing_us)["Ohio"]
+    assert date_first == pd.to_datetime("2020-04-01")
+    assert testing_cnt_daily.tolist() == [100.0, 50.0, 0.0, 0.0, 90.0]
+    # The tests of the days missing are counted once, on the next day with data
+    assert testing_cnt_daily.sum() == df_testing_us.testing_cnt_daily.sum()